@@ -8,9 +8,12 @@ import os
 import tuf.formats
 import tuf.repository_tool as rt
 import tuf.conf
+import uptane.binary_rpc
+import uptane.connection_pool
 import random, string # To generate random strings for Secondary directory names
 
 from six.moves import range
+from six.moves import xmlrpc_client
 
 # Values to plug in below as needed.
 LOCAL = 'localhost'
@@ -54,6 +57,19 @@ PRIMARY_SERVER_DEFAULT_PORT = 30701
 PRIMARY_SERVER_AVAILABLE_PORTS = [
     30701, 30702, 30703, 30704, 30705, 30706, 30707, 30708, 30709, 30710, 30711]
 
+# The Primary serves images and metadata to Secondaries over HTTP on one of
+# these ports; Secondaries ask the Primary (via XMLRPC) which.
+PRIMARY_DISTRIBUTION_AVAILABLE_PORTS = [
+    30801, 30802, 30803, 30804, 30805, 30806, 30807, 30808, 30809, 30810, 30811]
+
+# The protocol over which the demo's Primaries and Secondaries call the
+# Director, Image Repository, Timeserver and Primary services: 'binary' (see
+# uptane/binary_rpc.py) or 'xmlrpc'. Each service listens for both, for
+# binary RPC on its XML-RPC port plus BINARY_RPC_PORT_OFFSET. (The demo web
+# frontend uses XML-RPC.)
+RPC_TRANSPORT = 'binary'
+BINARY_RPC_PORT_OFFSET = 1000
+
 
 
 
@@ -106,3 +122,29 @@ def get_random_string(length):
       random.choice(string.ascii_uppercase + string.ascii_lowercase +
       string.digits) for i in range(length))
 
+
+
+
+
+def create_rpc_proxy(host, port, pool=None):
+  """
+  Returns a proxy through which to call the functions of the demo service
+  with the given host and XML-RPC port, over RPC_TRANSPORT: a
+  uptane.binary_rpc.ServerProxy for the service's binary RPC port, or an
+  xmlrpc_client.ServerProxy, making its calls through the given
+  uptane.connection_pool.ConnectionPool, if any. Either way, binary data
+  arrives wrapped in xmlrpc_client.Binary, and a call that fails on the
+  server raises xmlrpc_client.Fault.
+  """
+  if RPC_TRANSPORT == 'binary':
+    return uptane.binary_rpc.ServerProxy(
+        (str(host), port + BINARY_RPC_PORT_OFFSET))
+
+  elif RPC_TRANSPORT != 'xmlrpc':
+    raise uptane.Error('Unknown RPC transport: ' + repr(RPC_TRANSPORT))
+
+  url = 'http://' + str(host) + ':' + str(port)
+  if pool is None:
+    return xmlrpc_client.ServerProxy(url, allow_none=True)
+  return xmlrpc_client.ServerProxy(url, allow_none=True,
+      transport=uptane.connection_pool.PooledTransport(pool))
@@ -0,0 +1,235 @@
+"""
+change_notifier.py
+
+Demonstration code that lets clients (e.g. Primaries) wait for the metadata
+a repository hosts to change, rather than polling the repository for it (a
+"long poll"). The repository keeps a version for each of a set of keys (e.g.
+a VIN, for the Director's per-vehicle repositories), which changes whenever
+the metadata it hosts for that key does (e.g. in write_to_live()). A client
+passes the version it last saw to wait_for_change(), which returns as soon as
+the version is different, or when a timeout expires.
+
+Versions are opaque strings, and are not the versions of any metadata: they
+start over, differently, each time the notifier is created (e.g. when a
+repository server restarts), so clients should treat any difference from the
+version they last saw as a change. A notification is only a hint to look for
+new metadata, which is validated as usual; it cannot make a client accept
+anything, so it need not be authenticated.
+
+A client watching several repositories keeps one long poll open to each
+with a ChangeWatcher, whose threads are started once and reused for as long
+as the watcher lives, however often the client waits.
+
+Use:
+  notifier = change_notifier.ChangeNotifier()
+  # Repository:
+  notifier.notify_change(vin)
+  # Client, via RPC:
+  version = notifier.wait_for_change(vin, None)  # Returns at once.
+  version = notifier.wait_for_change(vin, version, timeout=20)
+
+  # Client watching several repositories:
+  watcher = change_notifier.ChangeWatcher({
+      'director': lambda version, timeout:
+          director_proxy.wait_for_director_change(vin, version, timeout),
+      'imagerepo': image_repo_proxy.wait_for_image_repo_change})
+  versions = watcher.wait_for_change(None)  # Once every version is known.
+  versions = watcher.wait_for_change(versions, timeout=60)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import binascii
+import os
+import threading
+import time
+
+# The longest that a single wait_for_change() call blocks, whatever timeout is
+# requested. This is kept well below the time within which XML-RPC requests
+# must be completed (demo.rpc_server.DEFAULT_REQUEST_TIMEOUT).
+DEFAULT_MAX_WAIT = 20
+
+# The time, in seconds, that a ChangeWatcher waits after a long poll fails
+# before reporting the failure and trying again.
+DEFAULT_RETRY_INTERVAL = 1
+
+
+
+class ChangeNotifier(object):
+  """
+  Keeps a version for each of a set of keys, changed by notify_change(key),
+  for which wait_for_change() waits. Safe to use from several threads.
+  """
+  def __init__(self, max_wait=DEFAULT_MAX_WAIT):
+    self.max_wait = max_wait
+
+    # Distinguishes the versions produced by this notifier from those produced
+    # by any other, e.g. before a restart.
+    self._epoch = binascii.hexlify(os.urandom(4)).decode('ascii')
+    self._counts = {}
+    self._condition = threading.Condition()
+
+
+
+  def get_version(self, key=None):
+    """Returns the current version for the given key."""
+    with self._condition:
+      return self._epoch + '.' + str(self._counts.get(key, 0))
+
+
+
+  def notify_change(self, key=None):
+    """
+    Changes the version for the given key, waking the clients waiting for it.
+    """
+    with self._condition:
+      self._counts[key] = self._counts.get(key, 0) + 1
+      self._condition.notify_all()
+
+
+
+  def wait_for_change(self, key, known_version, timeout=DEFAULT_MAX_WAIT):
+    """
+    <Purpose>
+      Waits until the version for the given key is different from
+      known_version, or until timeout seconds (no more than self.max_wait)
+      have passed, and returns the version for the key then. If known_version
+      is None, returns the current version at once.
+
+    <Arguments>
+      key
+        e.g. a VIN, or None for a repository that has just one version
+
+      known_version
+        the version last returned to the client, or None
+
+      timeout (optional)
+        the number of seconds for which to wait for a change
+
+    <Returns>
+      The version for the key, which is known_version if nothing changed in
+      time.
+    """
+    deadline = time.time() + max(0, min(timeout, self.max_wait))
+
+    with self._condition:
+      while True:
+        version = self.get_version(key)
+        remaining = deadline - time.time()
+        if version != known_version or remaining <= 0:
+          return version
+        self._condition.wait(remaining)
+
+
+
+
+
+class ChangeWatcher(object):
+  """
+  The client side of the long polls: keeps one long poll open to each of
+  several repositories, each in a thread of its own, started the first time
+  the watcher is waited on and reused for as long as the watcher lives, and
+  lets the client wait until any of them reports a change.
+
+  long_polls maps a name for each repository to a function taking the version
+  last seen (or None) and a timeout, which waits for the version to change and
+  returns it, e.g. a proxy's method that calls
+  ChangeNotifier.wait_for_change() over RPC. Safe to use from several
+  threads.
+  """
+  def __init__(self, long_polls, max_wait=DEFAULT_MAX_WAIT,
+      retry_interval=DEFAULT_RETRY_INTERVAL):
+    self.long_polls = dict(long_polls)
+    self.max_wait = max_wait
+    self.retry_interval = retry_interval
+
+    # The latest version reported by each repository (None until it has
+    # answered), and the number of long polls that have failed, so that a
+    # waiting client learns of a failure.
+    self._versions = dict((name, None) for name in self.long_polls)
+    self._failures = 0
+    self._condition = threading.Condition()
+    self._threads = None
+
+
+
+  def wait_for_change(self, known_versions, timeout=DEFAULT_MAX_WAIT):
+    """
+    <Purpose>
+      Waits until any repository reports a version other than the one given
+      for it in known_versions, or a long poll fails (so that the client can
+      look for changes itself), or timeout seconds have passed, and returns
+      the versions reported by then. If known_versions is None, waits only
+      until every repository has reported a version, or a long poll fails.
+
+    <Arguments>
+      known_versions
+        a dictionary mapping each repository's name to the version last
+        returned to the client, or None
+
+      timeout (optional)
+        the number of seconds for which to wait for a change
+
+    <Returns>
+      A dictionary mapping each repository's name to the latest version it
+      reported, or None if it has not yet reported one.
+    """
+    deadline = time.time() + max(0, timeout)
+
+    with self._condition:
+      if self._threads is None:
+        self._start()
+
+      failures = self._failures
+
+      while self._failures == failures:
+        if known_versions is None:
+          if None not in self._versions.values():
+            break
+
+        elif any(version is not None and version != known_versions.get(name)
+            for name, version in self._versions.items()):
+          break
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self._condition.wait(remaining)
+
+      return dict(self._versions)
+
+
+
+  def _start(self):
+    self._threads = []
+    for name in sorted(self.long_polls):
+      thread = threading.Thread(target=self._long_poll, args=(name,))
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+
+
+  def _long_poll(self, name):
+    """
+    Runs in a thread of its own: asks the given repository, again and again,
+    to report when its version changes from the latest one it reported.
+    """
+    while True:
+      with self._condition:
+        version = self._versions[name]
+
+      try:
+        version = self.long_polls[name](version, self.max_wait)
+
+      except Exception: # Whatever the failure, keep watching.
+        time.sleep(self.retry_interval)
+        with self._condition:
+          self._failures += 1
+          self._condition.notify_all()
+        continue
+
+      with self._condition:
+        if version != self._versions[name]:
+          self._versions[name] = version
+          self._condition.notify_all()
@@ -20,6 +20,9 @@
   XMLRPC interface presented TO PRIMARIES:
     register_ecu_serial(ecu_serial, ecu_public_key, vin, is_primary=False)
     submit_vehicle_manifest(vin, ecu_serial, signed_ecu_manifest)
+    wait_for_director_change(vin, known_version, timeout) <--- long poll; see
+        demo/change_notifier.py
+    get_metadata_bundle(vin, known_versions) <--- all new role files at once
 
   XMLRPC interface presented TO THE DEMO WEBSITE:
     add_new_vehicle(vin)
@@ -29,6 +32,10 @@
     get_last_ecu_manifest(ecu_serial)
     register_ecu_serial(ecu_serial, ecu_key, vin, is_primary=False)
 
+  XMLRPC interface presented TO ANALYTICS / OFFLINE TOOLS:
+    export_manifests(manifest_type, keys=None, cursor=None, encoding='json',
+        limit=EXPORT_PAGE_SIZE)
+
 """
 from __future__ import print_function
 from __future__ import unicode_literals
@@ -40,18 +47,23 @@ import uptane.services.inventorydb as inventory
 import tuf.formats
 
 import uptane.encoding.asn1_codec as asn1_codec
+import uptane.encoding.metadata_bundle as metadata_bundle
 
 import threading # for the director services interface
 import os # For paths and symlink
 import shutil # For copying directory trees
-import sys, subprocess, time # For hosting
 import tuf.repository_tool as rt
-import demo.demo_image_repo as demo_image_repo # for the Image repo directory /:
-from uptane import GREEN, RED, YELLOW, ENDCOLORS
+import demo.demo_image_repo as demo_image_repo # for hash-prefixed target names
+import demo.rpc_server as rpc_server # to serve long polls concurrently
+import demo.change_notifier as change_notifier # to notify Primaries of changes
+import demo.repo_server as repo_server # to host the repositories over HTTP
+import demo.publisher as publisher # to publish metadata atomically
+from uptane import GREEN, RED, ENDCOLORS
 
-from six.moves import xmlrpc_server # for the director services interface
+from six.moves import xmlrpc_client # for Binary() wrapping of exports
+import io # for building pages of exported manifests
 
-import atexit # to kill server process on exit()
+import atexit # to stop the repository server on exit()
 
 
 # Tell the reference implementation that we're in demo mode.
@@ -65,11 +77,21 @@ LOG_PREFIX = uptane.TEAL_BG + 'Director:' + ENDCOLORS + ' '
 
 KNOWN_VINS = ['111', '112', '113', 'democar']
 
+# Maximum number of manifests returned by a single call to export_manifests
+# over XMLRPC. Callers page through the full inventory using the returned
+# cursor.
+EXPORT_PAGE_SIZE = 500
+
 # Dynamic global objects
 #repo = None
-repo_server_process = None
+repo_http_server = None
 director_service_instance = None
 director_service_thread = None
+director_binary_service_thread = None
+
+# Tracks changes to the live metadata of each vehicle's repository, so that
+# Primaries can wait for them (wait_for_director_change) instead of polling.
+change_notifier_instance = change_notifier.ChangeNotifier()
 
 
 def clean_slate(use_new_keys=False):
@@ -159,7 +181,7 @@ def write_to_live(vin_to_update=None):
 
   # For each vehicle repository:
   #   - write metadata.staged
-  #   - copy metadata.staged to the live metadata directory
+  #   - publish metadata.staged as the live metadata directory
   for vin in director_service_instance.vehicle_repositories:
     if vin_to_update is not None and vin != vin_to_update:
       continue
@@ -167,35 +189,22 @@ def write_to_live(vin_to_update=None):
     repo_dir = repo._repository_directory
 
     repo.mark_dirty(['timestamp', 'snapshot'])
-    repo.write() # will be writeall() in most recent TUF branch
+    # Writes consistent snapshots (version- and hash-prefixed files, which
+    # never change and so can be cached indefinitely); see the Director class.
+    director_service_instance.write_vehicle_repository(vin)
 
     assert(os.path.exists(os.path.join(repo_dir, 'metadata.staged'))), \
         'Programming error: a repository write just occurred; why is ' + \
         'there no metadata.staged directory where it is expected?'
 
-    # This shouldn't exist, but just in case something was interrupted,
-    # warn and remove it.
-    if os.path.exists(os.path.join(repo_dir, 'metadata.livetemp')):
-      print(LOG_PREFIX + YELLOW + 'Warning: metadata.livetemp existed already. '
-          'Some previous process was interrupted, or there is a programming '
-          'error.' + ENDCOLORS)
-      shutil.rmtree(os.path.join(repo_dir, 'metadata.livetemp'))
-
-    # Copy the staged metadata to a temp directory we'll move into place
-    # atomically in a moment.
-    shutil.copytree(
+    # Atomically switch the live metadata to a new version (see
+    # demo/publisher.py), sharing the files that did not change with the last.
+    publisher.publish_directory(
         os.path.join(repo_dir, 'metadata.staged'),
-        os.path.join(repo_dir, 'metadata.livetemp'))
-
-    # Empty the existing (old) live metadata directory (relatively fast).
-    if os.path.exists(os.path.join(repo_dir, 'metadata')):
-      shutil.rmtree(os.path.join(repo_dir, 'metadata'))
-
-    # Atomically move the new metadata into place.
-    os.rename(
-        os.path.join(repo_dir, 'metadata.livetemp'),
         os.path.join(repo_dir, 'metadata'))
 
+    _live_metadata_changed(vin)
+
 
 
 
@@ -207,7 +216,8 @@ def backup_repositories(vin=None):
     directories in each repository).
 
     Metadata is copied from '{repo_dir}/metadata.staged' to
-    '{repo_dir}/metadata.backup'.
+    '{repo_dir}/metadata.backup', hard-linking the files that are the same as
+    the live metadata (see demo/publisher.py) rather than copying them.
 
   <Arguments>
     vin (optional)
@@ -240,8 +250,10 @@ def backup_repositories(vin=None):
 
     print(LOG_PREFIX + ' Backing up ' +
         os.path.join(repo_dir, 'metadata.staged'))
-    shutil.copytree(os.path.join(repo_dir, 'metadata.staged'),
-        os.path.join(repo_dir, 'metadata.backup'))
+    live_dir = publisher.get_published_dir(os.path.join(repo_dir, 'metadata'))
+    publisher.snapshot_directory(os.path.join(repo_dir, 'metadata.staged'),
+        os.path.join(repo_dir, 'metadata.backup'),
+        [live_dir] if live_dir is not None else [])
 
 
 
@@ -253,7 +265,8 @@ def restore_repositories(vin=None):
     Restore the last backup of each Director repository.
 
     Metadata is copied from '{repo_dir}/metadata.backup' to
-    '{repo_dir}/metadata.staged' and '{repo_dir}/metadata'
+    '{repo_dir}/metadata.staged', and published (hard-linked) from the backup
+    as the live metadata, '{repo_dir}/metadata'. The backup is then removed.
 
   <Arguments>
     vin (optional)
@@ -288,15 +301,13 @@ def restore_repositories(vin=None):
       raise uptane.Error('Unable to restore backup of ' + repr(repo_dir) +
           '; no backup exists.')
 
-    # Empty the existing (old) live metadata directory (relatively fast).
-    print(LOG_PREFIX + 'Deleting ' + os.path.join(repo_dir, 'metadata.staged'))
+    # Replace the staged metadata with a copy of the backup. (This is a copy
+    # rather than links, since staged metadata may be written to.)
+    print(LOG_PREFIX + 'Copying backup to ' +
+        os.path.join(repo_dir, 'metadata.staged'))
     if os.path.exists(os.path.join(repo_dir, 'metadata.staged')):
       shutil.rmtree(os.path.join(repo_dir, 'metadata.staged'))
-
-    # Atomically move the new metadata into place.
-    print(LOG_PREFIX + 'Moving backup to ' +
-        os.path.join(repo_dir, 'metadata.staged'))
-    os.rename(os.path.join(repo_dir, 'metadata.backup'),
+    publisher.snapshot_directory(os.path.join(repo_dir, 'metadata.backup'),
         os.path.join(repo_dir, 'metadata.staged'))
 
     # Re-load the repository from the restored metadata.stated directory.
@@ -312,20 +323,16 @@ def restore_repositories(vin=None):
     director_service_instance.vehicle_repositories[vin].root.load_signing_key(
         valid_root_private_key)
 
-    # Copy the staged metadata to a temp directory, which we'll move into place
-    # atomically in a moment.
-    shutil.copytree(os.path.join(repo_dir, 'metadata.staged'),
-        os.path.join(repo_dir, 'metadata.livetemp'))
-
-    # Empty the existing (old) live metadata directory (relatively fast).
-    print(LOG_PREFIX + 'Deleting live hosted dir:' +
+    # Atomically switch the live metadata to the backup, whose files are
+    # never written to and so can be linked rather than copied.
+    print(LOG_PREFIX + 'Publishing backup as live metadata: ' +
         os.path.join(repo_dir, 'metadata'))
-    if os.path.exists(os.path.join(repo_dir, 'metadata')):
-      shutil.rmtree(os.path.join(repo_dir, 'metadata'))
+    publisher.publish_directory(os.path.join(repo_dir, 'metadata.backup'),
+        os.path.join(repo_dir, 'metadata'),
+        [os.path.join(repo_dir, 'metadata.backup')])
+    shutil.rmtree(os.path.join(repo_dir, 'metadata.backup'))
 
-    # Atomically move the new metadata into place in the hosted directory.
-    os.rename(os.path.join(repo_dir, 'metadata.livetemp'),
-        os.path.join(repo_dir, 'metadata'))
+    _live_metadata_changed(vin)
     print(LOG_PREFIX + 'Repository ' + repo_dir + ' restored and hosted.')
 
 
@@ -507,21 +514,14 @@ def sign_with_compromised_keys_attack(vin=None):
     # Metadata must be partially written, otherwise write() will throw
     # a UnsignedMetadata exception due to the invalid signing keys (i.e.,
     # we are using the old signing keys, which have since been revoked.
-    repository.write(write_partial=True)
-
-    # Copy the staged metadata to a temp directory we'll move into place
-    # atomically in a moment.
-    shutil.copytree(os.path.join(repo_dir, 'metadata.staged'),
-        os.path.join(repo_dir, 'metadata.livetemp'))
-
-    # Empty the existing (old) live metadata directory (relatively fast).
-    if os.path.exists(os.path.join(repo_dir, 'metadata')):
-      shutil.rmtree(os.path.join(repo_dir, 'metadata'))
+    director_service_instance.write_vehicle_repository(vin, write_partial=True)
 
-    # Atomically move the new metadata into place.
-    os.rename(os.path.join(repo_dir, 'metadata.livetemp'),
+    # Atomically switch the live metadata to the new version.
+    publisher.publish_directory(os.path.join(repo_dir, 'metadata.staged'),
         os.path.join(repo_dir, 'metadata'))
 
+    _live_metadata_changed(vin)
+
   print(LOG_PREFIX + 'COMPLETED ATTACK')
 
 
@@ -648,63 +648,57 @@ def add_target_to_director(target_fname, filepath_in_repo, vin, ecu_serial):
 
 def host():
   """
-  Hosts the Director repository (http serving metadata files) as a separate
-  process. Should be stopped with kill_server().
+  Hosts the Director repositories (http serving metadata and image files) in
+  this process, in a background thread. Should be stopped with kill_server().
+  See demo/repo_server.py.
 
   Note that you must also run listen() to start the Director services (run on
   xmlrpc).
 
-  If this module already started a server process to host the repo, nothing will
-  be done.
+  If this module already started a server to host the repo, nothing will be
+  done.
   """
 
+  global repo_http_server
 
-  global repo_server_process
-
-  if repo_server_process is not None:
-    print(LOG_PREFIX + 'Sorry: there is already a server process running.')
+  if repo_http_server is not None:
+    print(LOG_PREFIX + 'Sorry: there is already a server running.')
     return
 
-  # Prepare to host the director repo contents.
+  # Begin hosting the director's repositories.
+  repo_http_server = repo_server.RepositoryServer(
+      (demo.DIRECTOR_REPO_HOST, demo.DIRECTOR_REPO_PORT),
+      demo.DIRECTOR_REPO_DIR)
+  repo_http_server.start()
 
-  os.chdir(demo.DIRECTOR_REPO_DIR)
-
-  command = []
-  if sys.version_info.major < 3: # Python 2 compatibility
-    command = ['python', '-m', 'SimpleHTTPServer', str(demo.DIRECTOR_REPO_PORT)]
-  else:
-    command = ['python3', '-m', 'http.server', str(demo.DIRECTOR_REPO_PORT)]
+  print(LOG_PREFIX + 'Director repo server started, serving on port ' +
+      str(demo.DIRECTOR_REPO_PORT) + '. Director repo URL is: ' +
+      demo.DIRECTOR_REPO_HOST + ':' + str(demo.DIRECTOR_REPO_PORT) + '/')
 
+  # Stop the server after calling exit().
+  atexit.register(kill_server)
 
-  # Begin hosting the director's repository.
 
-  repo_server_process = subprocess.Popen(command, stderr=subprocess.PIPE)
 
-  os.chdir(uptane.WORKING_DIR)
 
-  print(LOG_PREFIX + 'Director repo server process started, with pid ' +
-      str(repo_server_process.pid) + ', serving on port ' +
-      str(demo.DIRECTOR_REPO_PORT) + '. Director repo URL is: ' +
-      demo.DIRECTOR_REPO_HOST + ':' + str(demo.DIRECTOR_REPO_PORT) + '/')
 
-  # Kill server process after calling exit().
-  atexit.register(kill_server)
+def _live_metadata_changed(vin):
+  """
+  To be called whenever the live metadata of the given vehicle's repository
+  changes: discards the repository server's cached copy of the old metadata,
+  then wakes any Primaries waiting for the change.
+  """
+  if repo_http_server is not None:
+    repo_http_server.invalidate_metadata()
 
-  # Wait / allow any exceptions to kill the server.
-  # try:
-  #   time.sleep(1000000) # Stop hosting after a while.
-  # except:
-  #   print('Exception caught')
-  #   pass
-  # finally:
-  #   if repo_server_process.returncode is None:
-  #     print('Terminating Director repo server process ' + str(repo_server_process.pid))
-  #     repo_server_process.kill()
+  change_notifier_instance.notify_change(vin)
 
 
 # Restrict director requests to a particular path.
 # Must specify RPC2 here for the XML-RPC interface to work.
-class RequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
+# Keep connections open between requests, so that Primaries calling repeatedly
+# (e.g. with long polls) can reuse them.
+class RequestHandler(rpc_server.KeepAliveRequestHandler):
   rpc_paths = ('/RPC2',)
 
 
@@ -743,17 +737,85 @@ def register_vehicle_manifest_wrapper(
 
 
 
+def export_manifests_wrapper(manifest_type, keys=None, cursor=None,
+    encoding=inventory.EXPORT_ENCODING_JSON, limit=EXPORT_PAGE_SIZE):
+  """
+  Returns one page (at most limit records, capped at EXPORT_PAGE_SIZE) of the
+  streaming manifest export provided by inventorydb.export_manifests, so that
+  the full inventory can be pulled with a handful of calls instead of one
+  get_last_*_manifest call per VIN or ECU.
+
+  Returns a dictionary:
+    'records': XMLRPC Binary() containing newline-delimited canonical JSON
+        or concatenated DER records
+    'index': XMLRPC Binary() containing the DER index (empty for JSON)
+    'cursor': cursor to pass back to obtain the next page
+    'done': True if there are no further records after this page
+  """
+  limit = min(limit, EXPORT_PAGE_SIZE)
+
+  records = io.BytesIO()
+  index = io.BytesIO()
+
+  new_cursor = inventory.export_manifests(records, manifest_type, keys=keys,
+      cursor=cursor, encoding=encoding, index_fobj=index, limit=limit)
+
+  # Peek past the end of this page to learn whether another page follows.
+  done = True
+  for _ in inventory.iter_manifests(manifest_type, keys, new_cursor):
+    done = False
+    break
+
+  return {
+      'records': xmlrpc_client.Binary(records.getvalue()),
+      'index': xmlrpc_client.Binary(index.getvalue()),
+      'cursor': new_cursor,
+      'done': done}
+
+
+
+
+
+def get_metadata_bundle(vin, known_versions):
+  """
+  Returns, as an XMLRPC Binary object, a metadata bundle (see
+  uptane/encoding/metadata_bundle.py) of the role files in the given vehicle's
+  repository that are newer than the versions the Primary has (a dictionary
+  mapping role name to version number), so that the Primary can obtain them
+  all in one request instead of one request per role file.
+  """
+  if vin not in director_service_instance.vehicle_repositories:
+    raise uptane.UnknownVehicle('Unknown VIN: ' + repr(vin))
+
+  bundle = io.BytesIO()
+  metadata_bundle.write_metadata_bundle(bundle,
+      metadata_bundle.get_role_files_newer_than(demo.DIRECTOR_REPO_NAME,
+      os.path.join(demo.DIRECTOR_REPO_DIR, vin, 'metadata'), known_versions))
+
+  return xmlrpc_client.Binary(bundle.getvalue())
+
+
+
+
+
 def listen():
   """
-  Listens on DIRECTOR_SERVER_PORT for xml-rpc calls to functions:
+  Listens on DIRECTOR_SERVER_PORT for xml-rpc calls, and on that port plus
+  BINARY_RPC_PORT_OFFSET for binary RPC calls, to functions:
     - submit_vehicle_manifest
     - register_ecu_serial
+    - wait_for_director_change
+    - get_metadata_bundle
+
+  Calls to wait_for_director_change, which may block for a while, are handled
+  concurrently with other calls; all other calls are handled one at a time.
 
   Note that you must also run host() in order to serve the metadata files via
   http.
   """
 
   global director_service_thread
+  global director_binary_service_thread
 
   if director_service_thread is not None:
     print(LOG_PREFIX + 'Sorry: there is already a Director service thread '
@@ -761,9 +823,10 @@ def listen():
     return
 
   # Create server
-  server = xmlrpc_server.SimpleXMLRPCServer(
+  server = rpc_server.ThreadedXMLRPCServer(
       (demo.DIRECTOR_SERVER_HOST, demo.DIRECTOR_SERVER_PORT),
-      requestHandler=RequestHandler, allow_none=True)
+      requestHandler=RequestHandler, allow_none=True,
+      concurrent_methods=['wait_for_director_change'])
 
   # Register function that can be called via XML-RPC, allowing a Primary to
   # submit a vehicle version manifest.
@@ -775,6 +838,14 @@ def listen():
   server.register_function(
       director_service_instance.register_ecu_serial, 'register_ecu_serial')
 
+  # Allow a Primary to wait for its vehicle's repository to change, rather
+  # than poll it.
+  server.register_function(
+      change_notifier_instance.wait_for_change, 'wait_for_director_change')
+
+  # Allow a Primary to obtain all of its vehicle's new role files at once.
+  server.register_function(get_metadata_bundle, 'get_metadata_bundle')
+
 
   # Interface available for the demo website frontend.
   server.register_function(
@@ -794,6 +865,9 @@ def listen():
   server.register_function(
       inventory.get_last_ecu_manifest, 'get_last_ecu_manifest')
 
+  # Paged streaming export of all manifests for analytics.
+  server.register_function(export_manifests_wrapper, 'export_manifests')
+
   server.register_function(
       director_service_instance.register_ecu_serial, 'register_ecu_serial')
 
@@ -829,11 +903,22 @@ def listen():
   server.register_function(undo_sign_with_compromised_keys_attack,
       'undo_sign_with_compromised_keys_attack')
 
+  # Provide the same functions over binary RPC (see uptane/binary_rpc.py),
+  # which carries DER manifests and metadata bundles without base64 and XML.
+  binary_port = demo.DIRECTOR_SERVER_PORT + demo.BINARY_RPC_PORT_OFFSET
+  binary_server = rpc_server.ThreadedBinaryRPCServer(
+      (demo.DIRECTOR_SERVER_HOST, binary_port), server)
+
   print(LOG_PREFIX + 'Starting Director Services Thread: will now listen on '
-      'port ' + str(demo.DIRECTOR_SERVER_PORT))
+      'port ' + str(demo.DIRECTOR_SERVER_PORT) + ' (XML-RPC) and port ' +
+      str(binary_port) + ' (binary RPC)')
   director_service_thread = threading.Thread(target=server.serve_forever)
   director_service_thread.setDaemon(True)
   director_service_thread.start()
+  director_binary_service_thread = threading.Thread(
+      target=binary_server.serve_forever)
+  director_binary_service_thread.setDaemon(True)
+  director_binary_service_thread.start()
 
 
 
@@ -874,19 +959,38 @@ def mitm_arbitrary_package_attack(vin, target_filepath):
 
   # If the image file already exists on the Director repository (not
   # necessary), then back it up.
+  original_data = None
   if os.path.exists(full_target_filepath):
     shutil.copy(full_target_filepath, backup_target_filepath)
+    with open(full_target_filepath, 'rb') as fobj:
+      original_data = fobj.read()
 
   # Hide the image file on the image repository so that the client doesn't just
-  # grab an intact file from there, making the attack moot.
+  # grab an intact file from there, making the attack moot. Clients fetch it by
+  # the names prefixed with its hashes, so hide the files of those names, too.
   if os.path.exists(image_repo_full_target_filepath):
-    os.rename(image_repo_full_target_filepath,
-        image_repo_backup_full_target_filepath)
+    with open(image_repo_full_target_filepath, 'rb') as fobj:
+      image_repo_data = fobj.read()
+    for fname in [image_repo_full_target_filepath] + \
+        demo_image_repo.get_consistent_target_fnames(
+        image_repo_full_target_filepath, image_repo_data):
+      if os.path.exists(fname):
+        os.rename(fname, _get_backup_fname(fname))
+
+  # Remove the file first, as it may be a hard link to a hash-prefixed copy.
+  if os.path.exists(full_target_filepath):
+    os.remove(full_target_filepath)
 
   with open(full_target_filepath, 'w') as file_object:
     file_object.write('EVIL UPDATE: ARBITRARY PACKAGE ATTACK TO BE'
         ' DELIVERED FROM MITM (no keys compromised).')
 
+  # Serve the evil file under the names prefixed with the original's hashes,
+  # too, as clients fetch it by those.
+  if original_data is not None:
+    demo_image_repo.replace_consistent_target_copies(
+        full_target_filepath, original_data)
+
   print(LOG_PREFIX + 'COMPLETED ATTACK')
 
 
@@ -920,24 +1024,47 @@ def undo_mitm_arbitrary_package_attack(vin, target_filepath):
         'broken the expected state.')
 
   # In the case of the Director repository, we expect there to be a malicious
-  # image file, so we restore the backup over it.
+  # image file, so we restore the backup over it, and over its hash-prefixed
+  # copies.
   os.rename(backup_full_target_filepath, full_target_filepath)
 
+  with open(full_target_filepath, 'rb') as fobj:
+    demo_image_repo.replace_consistent_target_copies(
+        full_target_filepath, fobj.read())
+
   # If the file existed on the image repository, was backed up and hidden by
   # the attack, and hasn't since been replaced (by some other attack or manual
-  # manipulation), restore that file to its place. Either way, delete the
-  # backup so that it's not there the next time to potentially confuse this.
-  if os.path.exists(image_repo_backup_full_target_filepath) and not os.path.exists(image_repo_full_target_filepath):
-    os.rename(image_repo_backup_full_target_filepath, image_repo_full_target_filepath)
-
-  elif os.path.exists(image_repo_backup_full_target_filepath):
-    os.remove(image_repo_backup_full_target_filepath)
+  # manipulation), restore that file and its hash-prefixed copies to their
+  # places. Either way, delete the backups so that they're not there the next
+  # time to potentially confuse this.
+  if os.path.exists(image_repo_backup_full_target_filepath):
+    with open(image_repo_backup_full_target_filepath, 'rb') as fobj:
+      image_repo_data = fobj.read()
+
+    for fname in [image_repo_full_target_filepath] + \
+        demo_image_repo.get_consistent_target_fnames(
+        image_repo_full_target_filepath, image_repo_data):
+      backup_fname = _get_backup_fname(fname)
+      if os.path.exists(backup_fname) and not os.path.exists(fname):
+        os.rename(backup_fname, fname)
+
+      elif os.path.exists(backup_fname):
+        os.remove(backup_fname)
 
   print(LOG_PREFIX + 'COMPLETED UNDO ATTACK')
 
 
 
 
+def _get_backup_fname(fname):
+  """Returns the name under which attacks hide the given file."""
+  return os.path.join(
+      os.path.dirname(fname), 'backup_' + os.path.basename(fname))
+
+
+
+
+
 """
 Simulating a replay attack can be done with instructions in README.md,
 using the functions below.
@@ -968,9 +1095,10 @@ def backup_timestamp(vin):
 
 def replay_timestamp(vin):
   """
-  Move 'backup_timestamp.der' to 'timestamp.der', effectively rolling back
-  timestamp to a previous version.  'backup_timestamp.der' must already exist
-  at the expected path (can be created via backup_timestamp(vin)).
+  Publish 'backup_timestamp.der' as the live 'timestamp.der', effectively
+  rolling back timestamp to a previous version.  'backup_timestamp.der' must
+  already exist at the expected path (can be created via
+  backup_timestamp(vin)).
   Prior to rolling back timestamp.der, the current timestamp is saved to
   'current_timestamp.der'.
 
@@ -996,9 +1124,14 @@ def replay_timestamp(vin):
     current_timestamp_backup = os.path.join(demo.DIRECTOR_REPO_DIR, vin,
         'current_' + timestamp_filename)
 
-    # First backup the current timestamp.
-    shutil.move(timestamp_path, current_timestamp_backup)
-    shutil.move(backup_timestamp_path, timestamp_path)
+    # First back up the current timestamp, then publish the old one in its
+    # place (see demo/publisher.py). Published versions are never written to,
+    # as requests may still be reading them.
+    shutil.copyfile(timestamp_path, current_timestamp_backup)
+    _publish_with_timestamp(vin, backup_timestamp_path)
+    os.remove(backup_timestamp_path)
+
+    _live_metadata_changed(vin)
 
 
 
@@ -1007,7 +1140,7 @@ def replay_timestamp(vin):
 
 def restore_timestamp(vin):
   """
-  # restore timestamp.der (first move current_timestamp.der to timestamp.der).
+  # restore timestamp.der (publish current_timestamp.der as timestamp.der).
 
   Example:
   >>> import demo.demo_director as dd
@@ -1026,9 +1159,38 @@ def restore_timestamp(vin):
         ' could not be found.  Missing: ' + repr(current_timestamp_backup))
 
   else:
-    timestamp_path = os.path.join(demo.DIRECTOR_REPO_DIR, vin, 'metadata',
-        timestamp_filename)
-    shutil.move(current_timestamp_backup, timestamp_path)
+    _publish_with_timestamp(vin, current_timestamp_backup)
+    os.remove(current_timestamp_backup)
+
+    _live_metadata_changed(vin)
+
+
+
+
+
+def _publish_with_timestamp(vin, timestamp_fname):
+  """
+  Publishes (see demo/publisher.py) a new version of the live metadata of the
+  given vehicle's Director repository: the same files as the current version,
+  linked rather than copied, but with a copy of the given file as its
+  Timestamp metadata.
+  """
+  repo_dir = os.path.join(demo.DIRECTOR_REPO_DIR, vin)
+  live_path = os.path.join(repo_dir, 'metadata')
+  edit_dir = os.path.join(repo_dir, 'metadata.edit')
+
+  if os.path.exists(edit_dir):
+    shutil.rmtree(edit_dir)
+  publisher.snapshot_directory(live_path, edit_dir, [live_path])
+
+  # Remove the link to the published file before writing the new one.
+  edited_timestamp_fname = os.path.join(
+      edit_dir, 'timestamp.' + tuf.conf.METADATA_FORMAT)
+  os.remove(edited_timestamp_fname)
+  shutil.copyfile(timestamp_fname, edited_timestamp_fname)
+
+  publisher.publish_directory(edit_dir, live_path)
+  shutil.rmtree(edit_dir)
 
 
 
@@ -1216,21 +1378,20 @@ def add_target_and_write_to_live(filename, file_content, vin, ecu_serial):
 
 def kill_server():
   """
-  Kills the forked process that is hosting the Director repositories via
-  Python's simple HTTP server. This does not affect the Director service
-  (which handles manifests and responds to requests from Primaries), nor does
-  it affect the metadata in the repositories or the state of the repositories
-  at all. host() can be run afterwards to begin hosting again.
+  Stops the server hosting the Director repositories. This does not affect the
+  Director service (which handles manifests and responds to requests from
+  Primaries), nor does it affect the metadata in the repositories or the state
+  of the repositories at all. host() can be run afterwards to begin hosting
+  again.
   """
 
-  global repo_server_process
+  global repo_http_server
 
-  if repo_server_process is None:
-    print(LOG_PREFIX + 'No repository hosting process to stop.')
+  if repo_http_server is None:
+    print(LOG_PREFIX + 'No repository server to stop.')
     return
 
   else:
-    print(LOG_PREFIX + 'Killing repository hosting process with pid: ' +
-        str(repo_server_process.pid))
-    repo_server_process.kill()
-    repo_server_process = None
+    print(LOG_PREFIX + 'Stopping repository server.')
+    repo_http_server.stop()
+    repo_http_server = None
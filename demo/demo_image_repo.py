@@ -18,26 +18,39 @@ Demonstration code handling an Image Repository.
     add_target_to_image_repo(target_filepath, filepath_in_repo)  <--- add to staged image repository
     write_image_repo() <--- move staged to live / add newly added targets to live repo
 
+  XMLRPC interface presented TO PRIMARIES:
+    wait_for_image_repo_change(known_version, timeout) <--- long poll; see
+        demo/change_notifier.py
+    get_image_repo_metadata_bundle(known_versions) <--- all new role files at
+        once
 
 """
 from __future__ import print_function
 from __future__ import unicode_literals
 
 import demo
+import demo.rpc_server as rpc_server # to serve long polls concurrently
+import demo.change_notifier as change_notifier # to notify Primaries of changes
+import demo.repo_server as repo_server # to host the repository over HTTP
+import demo.publisher as publisher # to publish metadata atomically
 import uptane # Import before TUF modules; may change tuf.conf values.
 import uptane.formats
+import uptane.delta
+import uptane.encoding.metadata_bundle as metadata_bundle
 import tuf.formats
+import tuf.conf
 
 import threading # for the interface for the demo website
 import os
-import sys, subprocess, time # For hosting and arguments
 import tuf.repository_tool as rt
 import shutil # for rmtree
+import hashlib # to name deltas
+import io # to build metadata bundles
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 
-from six.moves import xmlrpc_server # for the director services interface
+from six.moves import xmlrpc_client # for Binary() wrapping of bundles
 
-import atexit # to kill server process on exit()
+import atexit # to stop the repository server on exit()
 
 
 # Tell the reference implementation that we're in demo mode.
@@ -49,15 +62,55 @@ uptane.DEMO_MODE = True
 
 LOG_PREFIX = uptane.PLUM_BG + 'ImageRepo:' + ENDCOLORS + ' '
 
+# The hash algorithms for which TUF writes hash-prefixed copies of each target
+# file in consistent snapshots (tuf.conf.REPOSITORY_HASH_ALGORITHMS).
+CONSISTENT_TARGET_HASH_ALGORITHMS = ['sha256', 'sha512']
+
+# The number of hashed bins (a power of 2) among which the targets role
+# delegates the images, so that clients need fetch only the bin(s) listing
+# the images they are interested in, rather than a list of every image ever
+# added. Bins are used only with JSON metadata, as ASN.1 conversion does not
+# yet support delegations; see get_number_of_hashed_bins().
+NUMBER_OF_HASHED_BINS = 16
+
 repo = None
-server_process = None
+repo_http_server = None
 xmlrpc_service_thread = None
+binary_rpc_service_thread = None
+
+# Tracks changes to the live metadata, so that Primaries can wait for them
+# (wait_for_image_repo_change) instead of polling.
+change_notifier_instance = change_notifier.ChangeNotifier()
 
 
-def clean_slate(use_new_keys=False):
+def get_number_of_hashed_bins():
+  """
+  Returns the number of hashed bins among which clean_slate() delegates the
+  images by default: NUMBER_OF_HASHED_BINS with JSON metadata, or 0 (every
+  image listed in the targets role itself) with DER metadata, whose ASN.1
+  conversion does not yet support delegations. This depends on the metadata
+  format set when the repository is created, not when this module is
+  imported.
+  """
+  if tuf.conf.METADATA_FORMAT == 'json':
+    return NUMBER_OF_HASHED_BINS
+  return 0
+
+
+
+
+
+def clean_slate(use_new_keys=False, number_of_hashed_bins=None):
 
   global repo
 
+  if number_of_hashed_bins is None:
+    number_of_hashed_bins = get_number_of_hashed_bins()
+
+  elif number_of_hashed_bins and tuf.conf.METADATA_FORMAT == 'der':
+    raise uptane.Error('Hashed bins are not supported with DER metadata, as '
+        'ASN.1 conversion does not yet support delegations.')
+
   print(LOG_PREFIX + 'Initializing repository')
 
   # Create target files: file1.txt and infotainment_firmware.txt
@@ -129,6 +182,10 @@ def clean_slate(use_new_keys=False):
   # Add delegated role keys to repo
   # repo.targets('role1').load_signing_key(key_role1_pri)
 
+  # Delegate the images, which are added below, among hashed bins.
+  if number_of_hashed_bins:
+    delegate_to_hashed_bins(key_role1_pub, key_role1_pri, number_of_hashed_bins)
+
 
   # Add some starting image files, primarily for use with the web frontend.
   add_target_to_imagerepo('demo/images/INFO1.0.txt', 'INFO1.0.txt')
@@ -139,6 +196,17 @@ def clean_slate(use_new_keys=False):
   add_target_to_imagerepo('demo/images/BCU1.1.txt', 'BCU1.1.txt')
   add_target_to_imagerepo('demo/images/BCU1.2.txt', 'BCU1.2.txt')
 
+  # Precompute deltas between images that ECUs commonly move between, for
+  # Primaries that fetch deltas in place of full images.
+  deltas_dir = os.path.join(demo.IMAGE_REPO_DIR, uptane.delta.DELTAS_DIRNAME)
+  if os.path.exists(deltas_dir):
+    shutil.rmtree(deltas_dir)
+
+  add_delta_to_imagerepo('TCU1.0.txt', 'TCU1.1.txt')
+  add_delta_to_imagerepo('TCU1.1.txt', 'TCU1.2.txt')
+  add_delta_to_imagerepo('BCU1.0.txt', 'BCU1.1.txt')
+  add_delta_to_imagerepo('BCU1.1.txt', 'BCU1.2.txt')
+
 
   print(LOG_PREFIX + 'Signing and hosting initial repository metadata')
 
@@ -157,16 +225,84 @@ def write_to_live():
 
   # Write the metadata files out to the Image Repository's 'metadata.staged'
   repo.mark_dirty(['timestamp', 'snapshot'])
-  repo.write() # will be writeall() in most recent TUF branch
+  # Write consistent snapshots: every role file but timestamp's also under a
+  # name prefixed with its version, and every target file also under names
+  # prefixed with its hashes. Files under those names never change, so they
+  # can be cached indefinitely, and clients fetch them once the root metadata
+  # says the repository publishes consistent snapshots.
+  repo.write(consistent_snapshot=True)
+
+  # Atomically switch the live metadata to the staged metadata (from the write
+  # above), sharing the files that did not change with the last version. See
+  # demo/publisher.py.
+  publisher.publish_directory(
+      os.path.join(demo.IMAGE_REPO_DIR, 'metadata.staged'),
+      os.path.join(demo.IMAGE_REPO_DIR, 'metadata'))
 
-  # Move staged metadata (from the write above) to live metadata directory.
+  # Serve the new metadata rather than the cached copy of the old, then wake
+  # any Primaries waiting for the change.
+  if repo_http_server is not None:
+    repo_http_server.invalidate_metadata()
+  change_notifier_instance.notify_change()
 
-  if os.path.exists(os.path.join(demo.IMAGE_REPO_DIR, 'metadata')):
-    shutil.rmtree(os.path.join(demo.IMAGE_REPO_DIR, 'metadata'))
 
-  shutil.copytree(
-      os.path.join(demo.IMAGE_REPO_DIR, 'metadata.staged'),
-      os.path.join(demo.IMAGE_REPO_DIR, 'metadata'))
+
+
+
+def wait_for_image_repo_change(known_version, timeout):
+  """
+  Waits for the live metadata to change from the given version, for up to the
+  given number of seconds, and returns the version then.
+  See demo/change_notifier.py.
+  """
+  return change_notifier_instance.wait_for_change(
+      None, known_version, timeout)
+
+
+
+
+
+def get_image_repo_metadata_bundle(known_versions):
+  """
+  Returns, as an XMLRPC Binary object, a metadata bundle (see
+  uptane/encoding/metadata_bundle.py) of the live role files that are newer
+  than the versions the Primary has (a dictionary mapping role name to
+  version number), so that the Primary can obtain them all in one request
+  instead of one request per role file.
+  """
+  bundle = io.BytesIO()
+  metadata_bundle.write_metadata_bundle(bundle,
+      metadata_bundle.get_role_files_newer_than(demo.IMAGE_REPO_NAME,
+      os.path.join(demo.IMAGE_REPO_DIR, 'metadata'), known_versions))
+
+  return xmlrpc_client.Binary(bundle.getvalue())
+
+
+
+
+
+def delegate_to_hashed_bins(bin_public_key, bin_private_key,
+    number_of_bins=NUMBER_OF_HASHED_BINS):
+  """
+  Has the Image Repository's targets role delegate all target files among
+  number_of_bins hashed bin roles (e.g. '0' to 'f' for 16 bins, or '00-07' to
+  'f8-ff' for 32), each trusted for the target files whose path hashes start
+  with its prefix(es), and signed with the given key. Target files added
+  afterwards with add_target_to_imagerepo() are listed in their bins. JSON
+  metadata only; see get_number_of_hashed_bins().
+
+  A client looking for a target file (tuf.client.updater.Updater.target())
+  fetches only the bin whose prefixes match its path hash, so the metadata it
+  needs grows with the number of images it is interested in, not with the
+  number the repository hosts.
+  """
+  repo.targets.delegate_hashed_bins([], [bin_public_key], number_of_bins)
+
+  for bin_role in repo.targets.delegations:
+    bin_role.load_signing_key(bin_private_key)
+
+  print(LOG_PREFIX + 'Delegated target files among ' +
+      str(number_of_bins) + ' hashed bins')
 
 
 
@@ -179,7 +315,9 @@ def add_target_to_imagerepo(target_fname, filepath_in_repo):
   Given a filename pointing to a file in the targets directory, adds that file
   as a target file (calculating its cryptographic hash and length)
 
-  This doesn't employ delegations, which would have to be done manually.
+  If the targets role delegates to hashed bins (see delegate_to_hashed_bins()),
+  the file is listed in the bin for its path hash. This doesn't employ other
+  delegations, which would have to be done manually.
 
   <Arguments>
     target_fname
@@ -203,56 +341,78 @@ def add_target_to_imagerepo(target_fname, filepath_in_repo):
 
   shutil.copy(target_fname, destination_filepath)
 
-  repo.targets.add_target(destination_filepath)
+  if repo.targets.delegations:
+    repo.targets.add_target_to_bin(destination_filepath)
+  else:
+    repo.targets.add_target(destination_filepath)
 
 
 
 
 
-def host():
+def add_delta_to_imagerepo(base_filepath_in_repo, target_filepath_in_repo):
+  """
+  Given the filepaths of two target files already in the repository (see
+  add_target_to_imagerepo()), computes a delta from the first to the second
+  (see uptane/delta.py), and hosts it in the repository's deltas directory,
+  named for the SHA-256 hashes of the two files.
 
-  global server_process
+  Deltas are not listed in the repository's metadata: clients validate the
+  image they produce from a delta against the target info for the full image.
+  """
+  tuf.formats.RELPATH_SCHEMA.check_match(base_filepath_in_repo)
+  tuf.formats.RELPATH_SCHEMA.check_match(target_filepath_in_repo)
 
-  if server_process is not None:
-    print(LOG_PREFIX + 'Sorry: there is already a server process running.')
-    return
+  targets_dir = os.path.join(repo._repository_directory, 'targets')
 
-  # Prepare to host the main repo contents
+  with open(os.path.join(targets_dir, base_filepath_in_repo), 'rb') as fobj:
+    base_data = fobj.read()
+  with open(os.path.join(targets_dir, target_filepath_in_repo), 'rb') as fobj:
+    target_data = fobj.read()
 
-  os.chdir(demo.IMAGE_REPO_DIR)
+  deltas_dir = os.path.join(demo.IMAGE_REPO_DIR, uptane.delta.DELTAS_DIRNAME)
+  if not os.path.exists(deltas_dir):
+    os.makedirs(deltas_dir)
+
+  delta_fname = os.path.join(deltas_dir, uptane.delta.get_delta_fname(
+      hashlib.sha256(base_data).hexdigest(),
+      hashlib.sha256(target_data).hexdigest()))
+
+  with open(delta_fname, 'wb') as fobj:
+    fobj.write(uptane.delta.create_delta(base_data, target_data))
+
+  print(LOG_PREFIX + 'Hosting delta from ' + repr(base_filepath_in_repo) +
+      ' to ' + repr(target_filepath_in_repo))
 
-  command = []
-  if sys.version_info.major < 3:  # Python 2 compatibility
-    command = ['python', '-m', 'SimpleHTTPServer', str(demo.IMAGE_REPO_PORT)]
-  else:
-    command = ['python3', '-m', 'http.server', str(demo.IMAGE_REPO_PORT)]
 
 
-  # Begin hosting Image Repository.
 
-  server_process = subprocess.Popen(command, stderr=subprocess.PIPE)
 
-  os.chdir(uptane.WORKING_DIR)
+def host():
+  """
+  Hosts the Image Repository (http serving metadata and image files) in this
+  process, in a background thread. Should be stopped with kill_server(). See
+  demo/repo_server.py.
+  """
+
+  global repo_http_server
+
+  if repo_http_server is not None:
+    print(LOG_PREFIX + 'Sorry: there is already a server running.')
+    return
+
+  # Begin hosting Image Repository.
+  repo_http_server = repo_server.RepositoryServer(
+      (demo.IMAGE_REPO_HOST, demo.IMAGE_REPO_PORT), demo.IMAGE_REPO_DIR)
+  repo_http_server.start()
 
-  print(LOG_PREFIX + 'Main Repo server process started, with pid ' +
-      str(server_process.pid) + '; Main Repo serving on port: ' +
+  print(LOG_PREFIX + 'Main Repo server started; Main Repo serving on port: ' +
       str(demo.IMAGE_REPO_PORT) + '; Main repo URL is ' +
       demo.IMAGE_REPO_HOST + ':' + str(demo.IMAGE_REPO_PORT) + '/')
 
-  # Kill server process after calling exit().
+  # Stop the server after calling exit().
   atexit.register(kill_server)
 
-  # Wait / allow any exceptions to kill the server.
-  #try:
-  #  time.sleep(1000000) # Stop hosting after a while.
-  #except:
-  #  print('Exception caught')
-  #  pass
-  #finally:
-  #  if server_process.returncode is None:
-  #    print('Terminating Main Repo server process ' + str(server_process.pid))
-  #    server_process.kill()
-
 
 
 
@@ -260,23 +420,34 @@ def host():
 # Restrict xmlrpc requests - to the interface provided for the website's use -
 # to a particular path.
 # Must specify RPC2 here for the XML-RPC interface to work.
-class RequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
+# Keep connections open between requests, so that Primaries calling repeatedly
+# (e.g. with long polls) can reuse them.
+class RequestHandler(rpc_server.KeepAliveRequestHandler):
   rpc_paths = ('/RPC2',)
 
 
 def listen():
   """
-  This is exclusively for the use of the demo website frontend.
+  This is for the use of the demo website frontend, and of Primaries waiting
+  for changes or fetching metadata bundles.
 
-  Listens on IMAGE_REPO_SERVICE_PORT for xml-rpc calls to functions:
+  Listens on IMAGE_REPO_SERVICE_PORT for xml-rpc calls, and on that port plus
+  BINARY_RPC_PORT_OFFSET for binary RPC calls, to functions:
     - add_target_to_image_repo
     - write_image_repo
+    - wait_for_image_repo_change
+    - get_image_repo_metadata_bundle
+
+  Calls to wait_for_image_repo_change, which may block for a while, are
+  handled concurrently with other calls; all other calls are handled one at a
+  time.
 
   Note that you must also run host() in order to serve the metadata files via
   http.
   """
 
   global xmlrpc_service_thread
+  global binary_rpc_service_thread
 
   if xmlrpc_service_thread is not None:
     print(LOG_PREFIX + 'Sorry: there is already a listening Image Repository '
@@ -284,9 +455,10 @@ def listen():
     return
 
   # Create server
-  server = xmlrpc_server.SimpleXMLRPCServer(
+  server = rpc_server.ThreadedXMLRPCServer(
       (demo.IMAGE_REPO_SERVICE_HOST, demo.IMAGE_REPO_SERVICE_PORT),
-      requestHandler=RequestHandler, allow_none=True)
+      requestHandler=RequestHandler, allow_none=True,
+      concurrent_methods=['wait_for_image_repo_change'])
 
   # Register functions that can be called via XML-RPC, allowing users to add
   # target files to the image repository or to simulate attacks from a web
@@ -295,6 +467,14 @@ def listen():
       'add_target_to_image_repo')
   server.register_function(write_to_live, 'write_image_repo')
 
+  # Allow Primaries to wait for the repository to change, rather than poll it.
+  server.register_function(
+      wait_for_image_repo_change, 'wait_for_image_repo_change')
+
+  # Allow Primaries to obtain all new role files at once.
+  server.register_function(
+      get_image_repo_metadata_bundle, 'get_image_repo_metadata_bundle')
+
   # Attack 1: Arbitrary Package Attack on Image Repository without
   # Compromised Keys.
   # README.md section 3.2
@@ -314,11 +494,22 @@ def listen():
   server.register_function(undo_keyed_arbitrary_package_attack,
       'undo_keyed_arbitrary_package_attack')
 
+  # Provide the same functions over binary RPC (see uptane/binary_rpc.py),
+  # which carries metadata bundles without base64 and XML.
+  binary_port = demo.IMAGE_REPO_SERVICE_PORT + demo.BINARY_RPC_PORT_OFFSET
+  binary_server = rpc_server.ThreadedBinaryRPCServer(
+      (demo.IMAGE_REPO_SERVICE_HOST, binary_port), server)
+
   print(LOG_PREFIX + 'Starting Image Repo Services Thread: will now listen on '
-      'port ' + str(demo.IMAGE_REPO_SERVICE_PORT))
+      'port ' + str(demo.IMAGE_REPO_SERVICE_PORT) + ' (XML-RPC) and port ' +
+      str(binary_port) + ' (binary RPC)')
   xmlrpc_service_thread = threading.Thread(target=server.serve_forever)
   xmlrpc_service_thread.setDaemon(True)
   xmlrpc_service_thread.start()
+  binary_rpc_service_thread = threading.Thread(
+      target=binary_server.serve_forever)
+  binary_rpc_service_thread.setDaemon(True)
+  binary_rpc_service_thread.start()
 
 
 
@@ -353,10 +544,17 @@ def mitm_arbitrary_package_attack(target_filepath):
   if os.path.exists(full_target_filepath):
     shutil.copy(full_target_filepath, backup_target_filepath)
 
+  with open(full_target_filepath, 'rb') as fobj:
+    original_data = fobj.read()
+
   with open(full_target_filepath, 'w') as fobj:
     fobj.write('EVIL UPDATE: ARBITRARY PACKAGE ATTACK TO BE DELIVERED FROM '
         'MITM / bad mirror (no keys compromised).')
 
+  # Clients fetch the target by the names prefixed with the original's hashes
+  # (see write_to_live()), so serve the evil file under those names, too.
+  replace_consistent_target_copies(full_target_filepath, original_data)
+
   # Delete the arbitrary image file from any of the Director repositories, if
   # it exists.  If the evil file is found in the Director repo by the
   # secondary, a banner is not printed because the evil file provided by the
@@ -366,8 +564,11 @@ def mitm_arbitrary_package_attack(target_filepath):
       repo_directory = os.path.join(root_directory, subdirectory)
       evil_file_in_director_repo = os.path.join(repo_directory, target_filepath)
 
-      if os.path.exists(evil_file_in_director_repo):
-        os.remove(evil_file_in_director_repo)
+      for fname in [evil_file_in_director_repo] + \
+          get_consistent_target_fnames(
+          evil_file_in_director_repo, original_data):
+        if os.path.exists(fname):
+          os.remove(fname)
 
 
 
@@ -398,12 +599,45 @@ def undo_mitm_arbitrary_package_attack(target_filepath):
   # so we restore the backup over it.
   os.rename(backup_target_filepath, full_target_filepath)
 
+  with open(full_target_filepath, 'rb') as fobj:
+    replace_consistent_target_copies(full_target_filepath, fobj.read())
+
   print(LOG_PREFIX + 'COMPLETED UNDO ATTACK')
 
 
 
 
 
+def get_consistent_target_fnames(target_fname, data):
+  """
+  Returns the names of the hash-prefixed copies of the target file with the
+  given name and contents (bytes) that are written for consistent snapshots.
+  """
+  dirname, basename = os.path.split(target_fname)
+  return [os.path.join(dirname,
+      hashlib.new(algorithm, data).hexdigest() + '.' + basename)
+      for algorithm in CONSISTENT_TARGET_HASH_ALGORITHMS]
+
+
+
+
+
+def replace_consistent_target_copies(target_fname, original_data):
+  """
+  Replaces each existing hash-prefixed copy of the target file with the given
+  name, named for the given original contents, with a copy of what is now at
+  target_fname. (Each copy is removed first, as it may be a hard link to a
+  file that must not change.)
+  """
+  for fname in get_consistent_target_fnames(target_fname, original_data):
+    if os.path.exists(fname):
+      os.remove(fname)
+      shutil.copyfile(target_fname, fname)
+
+
+
+
+
 def keyed_arbitrary_package_attack(target_filepath):
   """
   Add a new, malicious target to the Image Repository and sign malicious
@@ -581,17 +815,16 @@ def revoke_compromised_keys():
 
 def kill_server():
   """
-  Kills the forked process that is hosting the Image Repository via
-  Python's simple HTTP server. This does not affect anything in the repository
-  at all. host() can be run afterwards to begin hosting again.
+  Stops the server hosting the Image Repository. This does not affect anything
+  in the repository at all. host() can be run afterwards to begin hosting
+  again.
   """
-  global server_process
-  if server_process is None:
-    print(LOG_PREFIX + 'No repository hosting process to stop.')
+  global repo_http_server
+  if repo_http_server is None:
+    print(LOG_PREFIX + 'No repository server to stop.')
     return
 
   else:
-    print(LOG_PREFIX + 'Killing repository hosting process with pid: ' +
-        str(server_process.pid))
-    server_process.kill()
-    server_process = None
+    print(LOG_PREFIX + 'Stopping repository server.')
+    repo_http_server.stop()
+    repo_http_server = None
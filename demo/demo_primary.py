@@ -22,8 +22,16 @@ from io import open
 import demo
 import uptane # Import before TUF modules; may change tuf.conf values.
 import uptane.common # for canonical key construction and signing
+import uptane.formats
 import uptane.clients.primary as primary
 import uptane.encoding.asn1_codec as asn1_codec
+import uptane.encoding.image_block_asn1_coder as image_block_asn1_coder
+import uptane.connection_pool as connection_pool # to reuse HTTP connections
+import uptane.mirror_scores as mirror_scores # to try the fastest mirrors first
+import demo.file_server as file_server # to distribute images and metadata
+import demo.rpc_server as rpc_server # to serve Secondaries concurrently
+import demo.stages as stages # to overlap the stages of the update cycle
+import demo.change_notifier as change_notifier # to wait for new metadata
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 from demo.uptane_banners import *
 import tuf.keys
@@ -63,16 +71,85 @@ CLIENT_DIRECTORY = None
 #_client_directory_name = 'temp_primary' # name for this Primary's directory
 _vin = 'democar'
 _ecu_serial = 'INFOdemocar'
+
+# If True, request batched time attestations from the Timeserver, which must
+# then be running in batched mode (demo_timeserver.listen(batched=True)).
+USE_BATCHED_TIME_ATTESTATIONS = False
+
+# How many images the Primary downloads at once, and how many of those it may
+# download from any one server (the host and port of a mirror) at once.
+MAX_PARALLEL_DOWNLOADS = primary.DEFAULT_MAX_PARALLEL_DOWNLOADS
+MAX_DOWNLOADS_PER_MIRROR = primary.DEFAULT_MAX_DOWNLOADS_PER_MIRROR
+
+# If True, refresh the Image Repository's metadata at the same time as the
+# Director's, rather than after it.
+CONCURRENT_METADATA_REFRESH = True
+
+# The form in which to package metadata for Full Verification Secondaries:
+# primary.METADATA_ARCHIVE_BUNDLE (an indexed bundle that can be read in
+# place) or primary.METADATA_ARCHIVE_ZIP (a zip archive).
+METADATA_ARCHIVE_FORMAT = primary.METADATA_ARCHIVE_BUNDLE
+
+# The size of the blocks in which images are provided to Secondaries that
+# fetch them a block at a time (see request_image_block_wrapper()).
+IMAGE_BLOCK_SIZE = primary.DEFAULT_IMAGE_BLOCK_SIZE
+
+# If True, fetch deltas from the images Secondaries have installed to the
+# images assigned to them, where the Image Repository provides them, for
+# Secondaries to use in place of full images.
+FETCH_IMAGE_DELTAS = True
+
+# The number of seconds within which each XML-RPC request from a Secondary
+# must be completed. Requests are handled concurrently, so this limits how
+# long a slow or stalled Secondary can hold on to the resources serving it.
+RPC_REQUEST_TIMEOUT = rpc_server.DEFAULT_REQUEST_TIMEOUT
+
+# If True, fetch all new role files from each repository in a single request
+# (a metadata bundle) at the start of each update cycle, rather than have TUF
+# request each role file separately. See get_metadata_bundles().
+USE_METADATA_BUNDLES = True
+
+# The longest time, in seconds, that looping_update() waits between update
+# cycles for the Director or Image Repository to report that the metadata it
+# hosts has changed (see wait_for_repository_changes()).
+MAX_UPDATE_INTERVAL = 60
+
+# The number of idle connections the Primary keeps open to each server (each
+# repository, the Director, and the Timeserver), from one request, and one
+# update cycle, to the next, so that it need not connect anew for every file
+# and call. 0 uses a new connection for each.
+CONNECTION_POOL_SIZE = connection_pool.DEFAULT_MAX_IDLE_CONNECTIONS
+
+# If True, keep rolling statistics of the latency and failures of each
+# repository mirror, saved in MIRROR_SCORES_FNAME so that they outlast a
+# restart, and try the mirrors of each repository fastest first, rather than
+# in the order listed in pinned.json.
+USE_MIRROR_SCORES = True
+MIRROR_SCORES_FNAME = os.path.join(
+    uptane.WORKING_DIR, 'primary_mirror_scores.json')
+
+# If not None, before downloading an image at least this many bytes long,
+# race the two best mirrors of each repository providing it for its first
+# bytes. (This only matters when pinned.json lists several mirrors.)
+MIRROR_RACE_THRESHOLD = 1024 * 1024
 # firmware_filename = 'infotainment_firmware.txt'
 
 
 
 # Dynamic globals
+last_update_cycle_timings = None
 current_firmware_fileinfo = {}
 primary_ecu = None
 ecu_key = None
+connection_pool_instance = None
+mirror_scores_instance = None
 director_proxy = None
+image_repo_proxy = None
+timeserver_proxy = None
+repository_watcher = None
 listener_thread = None
+distribution_thread = None
+distribution_port = None
 most_recent_signed_vehicle_manifest = None
 
 
@@ -88,6 +165,7 @@ def clean_slate(
   global _vin
   global _ecu_serial
   global listener_thread
+  global distribution_thread
   _vin = vin
   _ecu_serial = ecu_serial
 
@@ -129,6 +207,14 @@ def clean_slate(
   # metadata it has collected from each repository, in subdirectories).
   tuf.conf.repository_directory = CLIENT_DIRECTORY
 
+  # Reuse connections to the repositories and servers across requests, and
+  # time the responses of the repositories' mirrors.
+  global mirror_scores_instance
+  mirror_scores_instance = None
+  if USE_MIRROR_SCORES:
+    mirror_scores_instance = mirror_scores.MirrorScores(MIRROR_SCORES_FNAME)
+  create_connection_pool()
+
 
 
   # Initialize a Primary ECU, making a client directory and copying the root
@@ -140,13 +226,25 @@ def clean_slate(
       ecu_serial=_ecu_serial,
       primary_key=ecu_key,
       time=clock,
-      timeserver_public_key=key_timeserver_pub)
+      timeserver_public_key=key_timeserver_pub,
+      max_parallel_downloads=MAX_PARALLEL_DOWNLOADS,
+      max_downloads_per_mirror=MAX_DOWNLOADS_PER_MIRROR,
+      concurrent_metadata_refresh=CONCURRENT_METADATA_REFRESH,
+      metadata_archive_format=METADATA_ARCHIVE_FORMAT,
+      fetch_image_deltas=FETCH_IMAGE_DELTAS,
+      mirror_scores=mirror_scores_instance,
+      mirror_race_threshold=MIRROR_RACE_THRESHOLD,
+      connection_pool=connection_pool_instance)
 
 
   if listener_thread is None:
     listener_thread = threading.Thread(target=listen)
     listener_thread.setDaemon(True)
     listener_thread.start()
+  if distribution_thread is None:
+    distribution_thread = threading.Thread(target=listen_for_distribution)
+    distribution_thread.setDaemon(True)
+    distribution_thread.start()
   print('\n' + GREEN + 'Primary is now listening for messages from ' +
       'Secondaries.' + ENDCOLORS)
 
@@ -171,6 +269,40 @@ def clean_slate(
 
 
 
+def create_connection_pool():
+  """
+  Creates the pool of connections (see uptane/connection_pool.py) through
+  which the Primary makes all of its requests of the repositories (through
+  TUF, once the pool is given to the Primary), and the proxies through which
+  it calls the Director, the Image Repository and the Timeserver (over
+  demo.RPC_TRANSPORT; over XML-RPC, through the pool), closing any previous
+  pool. The latency of each repository request is recorded in the mirror
+  scores, if any.
+  """
+  global connection_pool_instance
+  global director_proxy
+  global image_repo_proxy
+  global timeserver_proxy
+
+  if connection_pool_instance is not None:
+    connection_pool_instance.close()
+
+  connection_pool_instance = connection_pool.ConnectionPool(
+      max_idle_connections=CONNECTION_POOL_SIZE,
+      observer=mirror_scores_instance.record
+      if mirror_scores_instance is not None else None)
+
+  director_proxy = demo.create_rpc_proxy(demo.DIRECTOR_SERVER_HOST,
+      demo.DIRECTOR_SERVER_PORT, connection_pool_instance)
+  image_repo_proxy = demo.create_rpc_proxy(demo.IMAGE_REPO_SERVICE_HOST,
+      demo.IMAGE_REPO_SERVICE_PORT, connection_pool_instance)
+  timeserver_proxy = demo.create_rpc_proxy(demo.TIMESERVER_HOST,
+      demo.TIMESERVER_PORT, connection_pool_instance)
+
+
+
+
+
 def create_primary_pinning_file():
   """
   Load the template pinned.json file and save a filled in version that, for the
@@ -225,19 +357,53 @@ def load_or_generate_key(use_new_keys=False):
 
 def update_cycle():
   """
+  Runs one update cycle for the Primary, as a dependency graph of stages (see
+  stages.py), so that stages that do not depend on each other overlap:
+
+    get signed time -> validate time -> refresh metadata and download images
+    generate vehicle manifest -> submit vehicle manifest
+
+  The time must be validated before metadata is refreshed, since the
+  metadata's expiration is checked against it. The Vehicle Manifest, built
+  from the ECU Manifests Secondaries have sent, depends on neither, and is
+  submitted to the Director while the Primary fetches the time and updates.
+
+  The time each stage takes is printed at the end of the cycle, and kept in
+  last_update_cycle_timings.
   """
+  global last_update_cycle_timings
+
+  last_update_cycle_timings = stages.run_stages([
+      stages.Stage('get signed time', get_signed_time),
+      stages.Stage('validate time', validate_time,
+          depends_on=['get signed time']),
+      stages.Stage('refresh and download', refresh_metadata_and_download_images,
+          depends_on=['validate time']),
+      stages.Stage('generate vehicle manifest',
+          generate_signed_vehicle_manifest),
+      stages.Stage('submit vehicle manifest',
+          submit_vehicle_manifest_to_director,
+          depends_on=['generate vehicle manifest'])])
 
-  #
-  # FIRST: TIME
-  #
+  print('Update cycle stages: ' +
+      stages.format_timings(last_update_cycle_timings))
 
-  # First, we'll send the Timeserver a request for a signed time, with the
-  # nonces Secondaries have sent us since last time. (This also saves these
+
+
+
+
+def get_signed_time():
+  """
+  Requests a signed time from the Timeserver, including the nonces
+  Secondaries have sent us since last time, and returns the (unvalidated)
+  time attestation.
+  """
+  # Send the Timeserver a request for a signed time, with the nonces
+  # Secondaries have sent us since last time. (This also saves these
   # nonces as "sent" and empties the Primary's list of nonces to send.)
   nonces_to_send = primary_ecu.get_nonces_to_send_and_rotate()
 
-  tserver = xmlrpc_client.ServerProxy(
-      'http://' + str(demo.TIMESERVER_HOST) + ':' + str(demo.TIMESERVER_PORT))
+  tserver = timeserver_proxy # reusing pooled connections to the Timeserver
   #if not server.system.listMethods():
   #  raise Exception('Unable to connect to server.')
 
@@ -245,14 +411,31 @@ def update_cycle():
 
 
   if tuf.conf.METADATA_FORMAT == 'der': # TODO: Should check setting in Uptane.
-    time_attestation = tserver.get_signed_time_der(nonces_to_send).data
+    if USE_BATCHED_TIME_ATTESTATIONS:
+      time_attestation = tserver.get_signed_time_batched_der(
+          nonces_to_send).data
+    else:
+      time_attestation = tserver.get_signed_time_der(nonces_to_send).data
+
+  elif USE_BATCHED_TIME_ATTESTATIONS:
+    time_attestation = tserver.get_signed_time_batched(nonces_to_send)
 
   else:
     time_attestation = tserver.get_signed_time(nonces_to_send)
 
   # At this point, time_attestation might be a simple Python dictionary or
   # a DER-encoded ASN.1 representation of one.
+  return time_attestation
 
+
+
+
+
+def validate_time(time_attestation):
+  """
+  Validates the given time attestation from the Timeserver and, if it is
+  valid, registers the time in it.
+  """
   # This validates the attestation and also saves the time therein (if the
   # attestation was valid), causing this client to use that time for future
   # metadata expiration checks. Secondaries can request this from the Primary
@@ -263,10 +446,14 @@ def update_cycle():
 
 
 
-  #
-  # SECOND: DOWNLOAD METADATA AND IMAGES
-  #
 
+
+def refresh_metadata_and_download_images():
+  """
+  Updates the Primary's metadata from the Director and Image Repositories and
+  downloads the images assigned to Secondaries, printing a banner if the
+  Director's Timestamp metadata is rejected.
+  """
   # Starting with just the root.json files for the Director and Image Repos, and
   # pinned.json, the client will now use TUF to connect to each repository and
   # download/update top-level metadata. This call updates metadata from both
@@ -278,11 +465,16 @@ def update_cycle():
 
 
 
+  metadata_bundles = get_metadata_bundles() if USE_METADATA_BUNDLES else None
+
   # This will update the Primary's metadata and download images from the
   # Director and Image Repositories, and create a mapping of assignments from
   # each Secondary ECU to its Director-intended target.
   try:
-    primary_ecu.primary_update_cycle()
+    changed = primary_ecu.primary_update_cycle(metadata_bundles)
+    if not changed:
+      print('No new metadata from the Director or Image Repository since the '
+          'last update cycle; no images to validate or download.')
 
   # Print a REPLAY or DEFENDED banner if ReplayedMetadataError or
   # BadSignatureError is raised by primary_update_cycle().  These banners are
@@ -307,16 +499,49 @@ def update_cycle():
         else:
           raise
 
+  finally:
+    # Keep the mirror statistics gathered, for the next cycle or restart.
+    if mirror_scores_instance is not None:
+      mirror_scores_instance.save()
+
   # All targets have now been downloaded.
 
 
-  # Generate and submit vehicle manifest.
-  generate_signed_vehicle_manifest()
-  submit_vehicle_manifest_to_director()
 
 
 
 
+def get_metadata_bundles():
+  """
+  Requests from the Director and the Image Repository, in one request each,
+  metadata bundles of the role files newer than those the Primary has, and
+  returns them as primary_update_cycle() takes them. A repository that cannot
+  provide a bundle is left out, and its role files are fetched one by one.
+  """
+  def get_director_bundle(proxy, versions):
+    return proxy.get_metadata_bundle(_vin, versions)
+
+  def get_image_repo_bundle(proxy, versions):
+    return proxy.get_image_repo_metadata_bundle(versions)
+
+  # For each repository, the proxy for its service and the request.
+  requests = {
+      demo.DIRECTOR_REPO_NAME: (director_proxy, get_director_bundle),
+      demo.IMAGE_REPO_NAME: (image_repo_proxy, get_image_repo_bundle)}
+
+  metadata_bundles = {}
+  for repo_name, (proxy, get_bundle) in requests.items():
+    try:
+      metadata_bundles[repo_name] = get_bundle(
+          proxy, primary_ecu.get_metadata_versions(repo_name)).data
+    except (socket.error, xmlrpc_client.Error, uptane.BadRPCMessage) as e:
+      print(YELLOW + 'Unable to obtain a metadata bundle from ' + repo_name +
+          ': ' + repr(e) + ENDCOLORS)
+
+  return metadata_bundles
+
+
+
 
 
 def generate_signed_vehicle_manifest():
@@ -328,6 +553,8 @@ def generate_signed_vehicle_manifest():
   most_recent_signed_vehicle_manifest = \
       primary_ecu.generate_signed_vehicle_manifest()
 
+  return most_recent_signed_vehicle_manifest
+
 
 
 
@@ -351,13 +578,9 @@ def submit_vehicle_manifest_to_director(signed_vehicle_manifest=None):
         signed_vehicle_manifest)
 
 
-  server = xmlrpc_client.ServerProxy(
-      'http://' + str(demo.DIRECTOR_SERVER_HOST) + ':' +
-      str(demo.DIRECTOR_SERVER_PORT))
-
   print("Submitting the Primary's manifest to the Director.")
 
-  server.submit_vehicle_manifest(
+  director_proxy.submit_vehicle_manifest(
       primary_ecu.vin,
       primary_ecu.ecu_serial,
       signed_vehicle_manifest)
@@ -373,13 +596,8 @@ def register_self_with_director():
   """
   Send the Director a message to register our ECU serial number and Public Key.
   """
-  # Connect to the Director
-  server = xmlrpc_client.ServerProxy(
-    'http://' + str(demo.DIRECTOR_SERVER_HOST) + ':' +
-    str(demo.DIRECTOR_SERVER_PORT))
-
   print('Registering Primary ECU Serial and Key with Director.')
-  server.register_ecu_serial(
+  director_proxy.register_ecu_serial(
       primary_ecu.ecu_serial,
       uptane.common.public_key_from_canonical(primary_ecu.primary_key),
       _vin, True)
@@ -512,7 +730,15 @@ def get_metadata_for_ecu(ecu_serial, force_partial_verification=False):
 
   print('Distributing metadata file ' + fname + ' to ECU ' + repr(ecu_serial))
 
-  binary_data = xmlrpc_client.Binary(open(fname, 'rb').read())
+  if force_partial_verification:
+    with open(fname, 'rb') as fobj:
+      data = fobj.read()
+  else:
+    # The Primary keeps the full metadata archive memory-mapped, and provides
+    # a view of it; it is copied here only because XML-RPC needs bytes.
+    data = primary_ecu.get_full_metadata_archive_data().tobytes()
+
+  binary_data = xmlrpc_client.Binary(data)
 
   return binary_data
 
@@ -539,6 +765,57 @@ def get_time_attestation_for_ecu(ecu_serial):
 
 
 
+def request_image_block_wrapper(ecu_serial, image_request):
+  """
+  Intended to be called via XMLRPC by a Secondary that fetches its image a
+  block at a time, which it can resume if interrupted.
+
+  Given an ImageRequest (see uptane.formats.IMAGE_REQUEST_SCHEMA) with no
+  block number, returns an ImageFile describing the image for the requesting
+  ECU (primary.Primary::get_image_file_info()), or None if there is none.
+  Given an ImageRequest with a block number, returns that ImageBlock of the
+  image (primary.Primary::get_image_block()).
+
+  When running in ASN.1/DER mode, the request and response are DER-encoded and
+  wrapped in xmlrpc Binary objects; otherwise, they are dictionaries, with the
+  block itself wrapped in an xmlrpc Binary object.
+  """
+  if tuf.conf.METADATA_FORMAT == 'der':
+    image_request = image_block_asn1_coder.decode_image_request(
+        image_request.data)
+
+  uptane.formats.IMAGE_REQUEST_SCHEMA.check_match(image_request)
+
+  if 'block_number' not in image_request:
+    image_file = primary_ecu.get_image_file_info(ecu_serial, IMAGE_BLOCK_SIZE)
+
+    if image_file is None:
+      return None
+
+    print('Distributing image ' + repr(image_file['filename']) + ' to ECU ' +
+        repr(ecu_serial) + ' in ' + repr(image_file['number_of_blocks']) +
+        ' blocks')
+
+    if tuf.conf.METADATA_FORMAT == 'der':
+      return xmlrpc_client.Binary(
+          image_block_asn1_coder.encode_image_file(image_file))
+    return image_file
+
+  image_block = primary_ecu.get_image_block(ecu_serial,
+      image_request['filename'], image_request['block_number'],
+      IMAGE_BLOCK_SIZE)
+
+  if tuf.conf.METADATA_FORMAT == 'der':
+    return xmlrpc_client.Binary(
+        image_block_asn1_coder.encode_image_block(image_block))
+
+  image_block['block'] = xmlrpc_client.Binary(image_block['block'])
+  return image_block
+
+
+
+
+
 # Restrict Primary requests to a particular path.
 # Must specify RPC2 here for the XML-RPC interface to work.
 class RequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
@@ -571,7 +848,13 @@ def register_ecu_manifest_wrapper(vin, ecu_serial, nonce, signed_ecu_manifest):
 def listen():
   """
   Listens on an available port from list PRIMARY_SERVER_AVAILABLE_PORTS, for
-  XML-RPC calls from demo Secondaries for Primary interface calls.
+  XML-RPC calls from demo Secondaries for Primary interface calls, and on
+  that port plus BINARY_RPC_PORT_OFFSET for the same calls over binary RPC.
+
+  Each call is handled in its own thread (see rpc_server.py), so that many
+  Secondaries are served at once, and a large transfer to one Secondary does
+  not hold up the others' ECU Manifests and time requests. Each call must
+  complete within RPC_REQUEST_TIMEOUT seconds.
   """
 
   # Create server to listen for messages from Secondaries. In this
@@ -583,16 +866,28 @@ def listen():
   # The server code employed should be hardened against buffer overflows and
   # the like.
   server = None
+  binary_server = None
   successful_port = None
   last_error = None
   for port in demo.PRIMARY_SERVER_AVAILABLE_PORTS:
     try:
-      server = xmlrpc_server.SimpleXMLRPCServer(
+      server = rpc_server.ThreadedXMLRPCServer(
           (demo.PRIMARY_SERVER_HOST, port),
-          requestHandler=RequestHandler, allow_none=True)
+          requestHandler=RequestHandler, allow_none=True,
+          request_timeout=RPC_REQUEST_TIMEOUT)
+      # The same functions are provided over binary RPC (see
+      # uptane/binary_rpc.py), which carries DER manifests, attestations and
+      # images without base64 and XML.
+      binary_server = rpc_server.ThreadedBinaryRPCServer(
+          (demo.PRIMARY_SERVER_HOST, port + demo.BINARY_RPC_PORT_OFFSET),
+          server, request_timeout=RPC_REQUEST_TIMEOUT)
     except socket.error as e:
-      print('Failed to bind Primary XMLRPC Listener to port ' + repr(port) +
+      print('Failed to bind Primary XMLRPC and binary RPC Listeners to port ' +
+          repr(port) + ' and ' + repr(port + demo.BINARY_RPC_PORT_OFFSET) +
           '. Trying next port.')
+      if server is not None:
+        server.server_close()
+        server = None
       last_error = e
 
     else:
@@ -639,8 +934,22 @@ def listen():
   # Deployment Considerations document.
   server.register_function(get_image_for_ecu, 'get_image')
 
+  # Images can also be fetched a block at a time, so that a Secondary need not
+  # receive a whole image at once and can resume an interrupted transfer.
+  server.register_function(request_image_block_wrapper, 'request_image')
+
   server.register_function(get_metadata_for_ecu, 'get_metadata')
 
+  # Images and metadata are better fetched over HTTP from the distribution
+  # server (see listen_for_distribution()); this tells Secondaries where it is.
+  server.register_function(get_distribution_port, 'get_distribution_port')
+
+  # Image deltas are unsigned and may come from anywhere; a Secondary that
+  # cannot use one tells the Primary to discard it, and receives the full
+  # image instead.
+  server.register_function(
+      primary_ecu.discard_image_delta, 'discard_image_delta')
+
   # This again is for convenience in the demo. While I don't see an obvious
   # security issue, it should be considered whether or not checking such a bit
   # before trying to update foils reporting or otherwise creates a security
@@ -652,13 +961,103 @@ def listen():
   #     'compromise_primary_and_deliver_arbitrary')
 
 
-  print('Primary will now listen on port ' + str(successful_port))
+  binary_thread = threading.Thread(target=binary_server.serve_forever)
+  binary_thread.setDaemon(True)
+  binary_thread.start()
+
+  print('Primary will now listen on port ' + str(successful_port) +
+      ' (XML-RPC) and port ' +
+      str(successful_port + demo.BINARY_RPC_PORT_OFFSET) + ' (binary RPC)')
   server.serve_forever()
 
 
 
 
 
+class DistributionRequestHandler(file_server.FileRequestHandler):
+  """
+  Serves Secondaries, over HTTP, without reading files into memory:
+    /images/sha256/<hash>   the image with the given verified SHA-256 hash
+    /images/delta/<from>/<to>
+                            the delta (unverified) from the image with the
+                            first SHA-256 hash to the image with the second
+    /metadata/full          the full metadata archive (or bundle)
+    /metadata/partial       the Director's targets metadata
+  Range requests are supported, so that interrupted downloads can resume.
+  """
+  def get_file_for_path(self, path):
+    parts = path.strip('/').split('/')
+
+    if len(parts) == 3 and parts[:2] == ['images', 'sha256']:
+      try:
+        return primary_ecu.get_image_fname_for_hash(parts[2])
+      except tuf.FormatError:
+        return None
+
+    elif len(parts) == 4 and parts[:2] == ['images', 'delta']:
+      try:
+        return primary_ecu.get_image_delta_fname(parts[2], parts[3])
+      except tuf.FormatError:
+        return None
+
+    elif parts == ['metadata', 'full']:
+      return primary_ecu.get_full_metadata_archive_fname()
+
+    elif parts == ['metadata', 'partial']:
+      return primary_ecu.get_partial_metadata_fname()
+
+    return None
+
+
+
+
+
+def listen_for_distribution():
+  """
+  Listens on an available port from list PRIMARY_DISTRIBUTION_AVAILABLE_PORTS
+  for HTTP requests from demo Secondaries for images and metadata. See
+  DistributionRequestHandler.
+  """
+  global distribution_port
+
+  server = None
+  last_error = None
+  for port in demo.PRIMARY_DISTRIBUTION_AVAILABLE_PORTS:
+    try:
+      server = file_server.ThreadedHTTPServer(
+          (demo.PRIMARY_SERVER_HOST, port), DistributionRequestHandler)
+    except socket.error as e:
+      print('Failed to bind Primary distribution server to port ' +
+          repr(port) + '. Trying next port.')
+      last_error = e
+
+    else:
+      distribution_port = port
+      break
+
+  if server is None: # All ports failed.
+    assert last_error is not None, 'Programming error'
+    raise last_error
+
+  print('Primary will now distribute images and metadata on port ' +
+      str(distribution_port))
+  server.serve_forever()
+
+
+
+
+
+def get_distribution_port():
+  """
+  Returns the port on which this Primary serves images and metadata over HTTP,
+  or None if it is not doing so.
+  """
+  return distribution_port
+
+
+
+
+
 def clean_up_temp_file(filename):
   """
   Deletes the pinned file and temp directory created by the demo
@@ -688,10 +1087,50 @@ def try_banners():
 
 
 
+def wait_for_repository_changes(known_versions=None, max_interval=None):
+  """
+  Waits until the Director (for this vehicle) or the Image Repository reports
+  that the metadata it hosts has changed from the versions given, or until
+  max_interval seconds (by default, MAX_UPDATE_INTERVAL) have passed, and
+  returns the versions reported, to be given to the next call. If
+  known_versions is None, returns the current versions as soon as they are
+  known.
+
+  The repositories are asked to notify us of changes with long polls (see
+  demo/change_notifier.py), so that update cycles run only when there may be
+  something new, rather than every second. The long polls are made by one
+  ChangeWatcher, whose threads are started on the first call and reused by
+  every later one. If a repository cannot be asked, this returns after a
+  second, so that an update cycle runs anyway.
+  """
+  global repository_watcher
+
+  if max_interval is None:
+    max_interval = MAX_UPDATE_INTERVAL
+
+  if repository_watcher is None:
+    # The proxies are looked up for each long poll, since
+    # create_connection_pool() may replace them.
+    repository_watcher = change_notifier.ChangeWatcher({
+        'director': lambda version, timeout:
+            director_proxy.wait_for_director_change(_vin, version, timeout),
+        'imagerepo': lambda version, timeout:
+            image_repo_proxy.wait_for_image_repo_change(version, timeout)})
+
+  return repository_watcher.wait_for_change(known_versions, max_interval)
+
+
+
+
+
 def looping_update():
+  repository_versions = None
   while True:
+    repository_versions = wait_for_repository_changes(repository_versions)
     try:
       update_cycle()
     except Exception as e:
       print(repr(e))
-    time.sleep(1)
+      # Try again shortly, whether or not anything changes.
+      repository_versions = None
+      time.sleep(1)
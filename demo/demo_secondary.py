@@ -28,6 +28,7 @@ import demo
 import uptane # Import before TUF modules; may change tuf.conf values.
 import uptane.common # for canonical key construction and signing
 import uptane.clients.secondary as secondary
+import uptane.encoding.image_block_asn1_coder as image_block_asn1_coder
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 from demo.uptane_banners import *
 import tuf.keys
@@ -36,6 +37,7 @@ import atexit
 #import tuf.client.updater
 
 import os # For paths and makedirs
+import socket # For errors from the Primary
 import shutil # For copyfile
 import time
 import copy # for copying manifests before corrupting them during attacks
@@ -43,6 +45,8 @@ import json # for customizing the Secondary's pinnings file.
 import canonicaljson
 
 from six.moves import xmlrpc_client
+from six.moves.urllib.request import urlopen, Request # to fetch from Primary
+from six.moves.urllib.error import URLError, HTTPError
 
 # Allow tab completion in the interactive Python shell.
 import readline, rlcompleter
@@ -64,6 +68,21 @@ _ecu_serial = 'TCUdemocar'
 _primary_host = demo.PRIMARY_SERVER_HOST
 _primary_port = demo.PRIMARY_SERVER_DEFAULT_PORT
 firmware_filename = 'secondary_firmware.txt'
+
+# Images and metadata are fetched from the Primary's HTTP distribution server
+# in chunks of this size, and no metadata archive larger than the given
+# maximum is accepted.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_METADATA_ARCHIVE_LENGTH = 16 * 1024 * 1024
+
+# If True, fetch the image from the Primary a block at a time over XMLRPC (see
+# receive_image_in_blocks()) rather than from its HTTP distribution server.
+USE_BLOCK_TRANSFER = False
+
+# If True, first try to produce the image from a delta from the installed
+# image, if the Primary has one (see receive_image_delta()), before fetching
+# the full image from its HTTP distribution server.
+USE_IMAGE_DELTAS = True
 current_firmware_fileinfo = {}
 secondary_ecu = None
 ecu_key = None
@@ -229,7 +248,8 @@ def submit_ecu_manifest_to_primary(signed_ecu_manifest=None):
     # TODO: Consider validation of DER manifests as well here. (Harder)
 
     # If we're using ASN.1/DER data, then we have to transmit this slightly
-    # differently via XMLRPC, wrapped in a Binary object.
+    # differently, wrapped in a Binary object. (Over binary RPC, it is then
+    # sent as is; over XML-RPC, base64-encoded.)
     signed_ecu_manifest = xmlrpc_client.Binary(signed_ecu_manifest)
 
   else:
@@ -239,8 +259,7 @@ def submit_ecu_manifest_to_primary(signed_ecu_manifest=None):
         signed_ecu_manifest)
 
 
-  server = xmlrpc_client.ServerProxy(
-      'http://' + str(_primary_host) + ':' + str(_primary_port))
+  server = demo.create_rpc_proxy(_primary_host, _primary_port)
   #if not server.system.listMethods():
   #  raise Exception('Unable to connect to server.')
 
@@ -259,6 +278,246 @@ def submit_ecu_manifest_to_primary(signed_ecu_manifest=None):
 
 
 
+def download_from_primary(distribution_port, path, fname, max_length):
+  """
+  Downloads the file at the given path from the Primary's HTTP distribution
+  server to fname, a chunk at a time, so that it is never held in memory
+  whole.
+
+  No more than max_length + 1 bytes are written: a file that is too long is
+  truncated there, so that the length check in validation fails rather than
+  the download continuing endlessly.
+
+  Raises URLError (or HTTPError, a subclass) if the file cannot be retrieved.
+  """
+  response, offset = _open_from_primary(distribution_port, path)
+
+  try:
+    with open(fname, 'wb') as fobj:
+      for chunk in _read_chunks(response, max_length + 1):
+        fobj.write(chunk)
+
+  finally:
+    response.close()
+
+
+
+
+
+def stream_image_from_primary(distribution_port, image_fname, sha256_hash):
+  """
+  Streams the image with the given filename and SHA-256 hash from the
+  Primary's HTTP distribution server into the Secondary reference
+  implementation code (see secondary.Secondary::begin_image_stream()), which
+  validates each chunk as it arrives and writes it to disk. The image is
+  requested by hash, so the name it is stored under is the one in our own
+  validated metadata, not one provided by the Primary. An interrupted
+  download is resumed next time from where it stopped.
+
+  On return, the image is in the unverified targets directory, fully
+  validated.
+
+  Raises URLError (or HTTPError, a subclass) if the image cannot be
+  retrieved, or tuf.DownloadLengthMismatchError or tuf.BadHashError if it
+  does not match the validated target info for it. (An image that is too
+  long is rejected as soon as it is.)
+  """
+  path = '/images/sha256/' + sha256_hash
+
+  offset = secondary_ecu.begin_image_stream(image_fname, resume=True)
+  response, served_offset = _open_from_primary(distribution_port, path, offset)
+
+  try:
+    if served_offset != offset: # The Primary is sending the whole image.
+      secondary_ecu.begin_image_stream(image_fname)
+
+    for chunk in _read_chunks(response):
+      secondary_ecu.receive_image_chunk(chunk)
+
+  finally:
+    response.close()
+
+  secondary_ecu.finish_image_stream()
+
+
+
+
+
+def receive_image_delta(
+    pserver, distribution_port, image_fname, expected_target_info):
+  """
+  Tries to produce the image with the given filename and validated target
+  info from the image currently installed, by applying a delta fetched from
+  the Primary's HTTP distribution server (see
+  secondary.Secondary::apply_image_delta()). The delta is applied as it
+  arrives, and the image produced is validated as it is produced, exactly as
+  a full image would be.
+
+  Returns True if the image is now in the unverified targets directory, fully
+  validated, or False if no delta is available or it could not be used, in
+  which case the full image should be fetched instead. Since deltas are not
+  signed and may come from anywhere, a delta that could not be used (even
+  one producing an image that does not validate) is not an attack by the
+  Primary: the Primary is told to discard it (see
+  primary.Primary::discard_image_delta()), so that it is not offered again.
+  """
+  installed_image_fname = os.path.join(CLIENT_DIRECTORY,
+      secondary_ecu.firmware_fileinfo['filepath'].lstrip('/'))
+
+  installed_hashes = secondary_ecu.firmware_fileinfo['fileinfo']['hashes']
+  expected_hashes = expected_target_info['fileinfo']['hashes']
+
+  if not os.path.exists(installed_image_fname) or \
+      'sha256' not in installed_hashes or 'sha256' not in expected_hashes or \
+      installed_hashes['sha256'] == expected_hashes['sha256']:
+    return False
+
+  try:
+    response, offset = _open_from_primary(distribution_port, '/images/delta/' +
+        installed_hashes['sha256'] + '/' + expected_hashes['sha256'])
+  except URLError:
+    return False
+
+  try:
+    secondary_ecu.apply_image_delta(
+        image_fname, installed_image_fname, response)
+  except (uptane.Error, tuf.DownloadLengthMismatchError,
+      tuf.BadHashError) as e:
+    print(YELLOW + 'Unable to use image delta from Primary (' + str(e) +
+        '). Fetching full image.' + ENDCOLORS)
+    try:
+      pserver.discard_image_delta(
+          installed_hashes['sha256'], expected_hashes['sha256'])
+    except (xmlrpc_client.Fault, socket.error):
+      pass # The Primary will offer the delta again, and we will refuse it.
+    return False
+  finally:
+    response.close()
+
+  print(GREEN + 'Produced image ' + repr(image_fname) + ' from delta.' +
+      ENDCOLORS)
+  return True
+
+
+
+
+
+def _open_from_primary(distribution_port, path, offset=0):
+  """
+  Requests the file at the given path from the Primary's HTTP distribution
+  server, starting at the given offset. Returns the response and the offset
+  in the file at which it actually starts, which is 0 if the Primary sends
+  the whole file instead (e.g. because what we have is not the start of the
+  file it has).
+  """
+  request = Request('http://' + str(_primary_host) + ':' +
+      str(distribution_port) + path)
+  if offset:
+    request.add_header('Range', 'bytes=' + str(offset) + '-')
+
+  try:
+    response = urlopen(request)
+  except HTTPError as e:
+    if e.code != 416 or not offset:
+      raise
+    return _open_from_primary(distribution_port, path)
+
+  if response.getcode() != 206:
+    offset = 0
+
+  return response, offset
+
+
+
+
+
+def _read_chunks(response, max_length=None):
+  """
+  Yields the body of the given HTTP response in chunks of no more than
+  DOWNLOAD_CHUNK_SIZE bytes, stopping after max_length bytes if given.
+  """
+  remaining = max_length
+  while remaining is None or remaining > 0:
+    size = DOWNLOAD_CHUNK_SIZE
+    if remaining is not None:
+      size = min(size, remaining)
+
+    chunk = response.read(size)
+    if not chunk:
+      break
+
+    if remaining is not None:
+      remaining -= len(chunk)
+    yield chunk
+
+
+
+
+
+def receive_image_in_blocks(pserver, image_fname):
+  """
+  Fetches the image for this ECU from the Primary a block at a time, over
+  XMLRPC, using ImageRequest, ImageFile, and ImageBlock messages (DER-encoded
+  when running in ASN.1/DER mode). Each block is handed to the Secondary
+  reference implementation code, which hashes it and writes it to disk as it
+  arrives, and validates the image once the last block arrives. If the
+  transfer is interrupted, it resumes next time after the last whole block
+  received.
+
+  Returns False if the Primary has no image for this ECU, else True, once the
+  image is in the unverified targets directory, fully validated.
+
+  Raises tuf.DownloadLengthMismatchError or tuf.BadHashError if the image does
+  not match the validated target info for it.
+  """
+  image_file = _request_image({'filename': image_fname}, pserver)
+
+  if image_file is None:
+    return False
+
+  if tuf.conf.METADATA_FORMAT == 'der':
+    image_file = image_block_asn1_coder.decode_image_file(image_file)
+
+  block_number = secondary_ecu.begin_image_block_transfer(image_file)
+
+  while block_number is not None:
+    image_block = _request_image({'filename': image_file['filename'],
+        'block_number': block_number}, pserver)
+
+    if tuf.conf.METADATA_FORMAT == 'der':
+      image_block = image_block_asn1_coder.decode_image_block(image_block)
+
+    if secondary_ecu.receive_image_block(image_block):
+      block_number = None
+    else:
+      block_number += 1
+
+  return True
+
+
+
+
+
+def _request_image(image_request, pserver):
+  """
+  Sends the given ImageRequest to the Primary and returns its response: None,
+  or DER (in ASN.1/DER mode), or a dictionary, with binary data extracted from
+  the xmlrpc Binary objects it arrives in.
+  """
+  if tuf.conf.METADATA_FORMAT == 'der':
+    response = pserver.request_image(_ecu_serial, xmlrpc_client.Binary(
+        image_block_asn1_coder.encode_image_request(image_request)))
+    return None if response is None else response.data
+
+  response = pserver.request_image(_ecu_serial, image_request)
+  if response is not None and 'block' in response:
+    response['block'] = response['block'].data
+  return response
+
+
+
+
+
 def load_or_generate_key(use_new_keys=False):
   """Load or generate an ECU's private key."""
 
@@ -286,9 +545,8 @@ def update_cycle():
   global current_firmware_fileinfo
   global attacks_detected
 
-  # Connect to the Primary
-  pserver = xmlrpc_client.ServerProxy(
-    'http://' + str(_primary_host) + ':' + str(_primary_port))
+  # Connect to the Primary (over demo.RPC_TRANSPORT)
+  pserver = demo.create_rpc_proxy(_primary_host, _primary_port)
 
   # Download the time attestation from the Primary.
   time_attestation = pserver.get_time_attestation_for_ecu(_ecu_serial)
@@ -300,9 +558,9 @@ def update_cycle():
     # from it like so:
     time_attestation = time_attestation.data
 
-  # Download the metadata from the Primary in the form of an archive. This
-  # returns the binary data that we need to write to file.
-  metadata_archive = pserver.get_metadata(secondary_ecu.ecu_serial)
+  # Images and metadata are fetched over HTTP from the Primary's distribution
+  # server; XMLRPC tells us where it is.
+  distribution_port = pserver.get_distribution_port()
 
   # Verify the time attestation and internalize the time (if verified, the time
   # will be used in place of system time to perform future metadata expiration
@@ -321,12 +579,15 @@ def update_cycle():
   #else:
   #  print(GREEN + 'Official time has been updated successfully.' + ENDCOLORS)
 
-  # Dump the archive file to disk.
+  # Download the metadata from the Primary in the form of an archive, straight
+  # to disk. (This may be a zip archive or a metadata bundle, depending on the
+  # Primary's configuration. The Secondary determines which when processing
+  # it.)
   archive_fname = os.path.join(
-      secondary_ecu.full_client_dir, 'metadata_archive.zip')
+      secondary_ecu.full_client_dir, 'metadata_archive')
 
-  with open(archive_fname, 'wb') as fobj:
-    fobj.write(metadata_archive.data)
+  download_from_primary(distribution_port, '/metadata/full', archive_fname,
+      MAX_METADATA_ARCHIVE_LENGTH)
 
   # Now tell the Secondary reference implementation code where the archive file
   # is and let it expand and validate the metadata.
@@ -376,60 +637,31 @@ def update_cycle():
     print_banner(BANNER_NO_UPDATE, color=WHITE+BLACK_BG,
         text='Primary reports that there is no update for this ECU.')
     # print(YELLOW + 'Primary reports that there is no update for this ECU.')
-    (image_fname, image) = pserver.get_image(secondary_ecu.ecu_serial)
-    generate_signed_ecu_manifest()
-    submit_ecu_manifest_to_primary()
-    return
-
-  # Download the image for this ECU from the Primary.
-  (image_fname, image) = pserver.get_image(secondary_ecu.ecu_serial)
-
-  if image is None:
-    print(YELLOW + 'Requested image from Primary but received none. Update '
-        'terminated.' + ENDCOLORS)
-    attacks_detected += 'Requested image from Primary but received none.\n'
-    generate_signed_ecu_manifest()
-    submit_ecu_manifest_to_primary()
-    return
-
-  elif not secondary_ecu.validated_targets_for_this_ecu:
-    print(RED + 'Requested and received image from Primary, but metadata '
-        'indicates no valid targets from the Director intended for this ECU. '
-        'Update terminated.' + ENDCOLORS)
-    # TODO: Determine if something should be added to attacks_detected here.
     generate_signed_ecu_manifest()
     submit_ecu_manifest_to_primary()
     return
 
-  elif image_fname != expected_image_fname:
-    # Make sure that the image name provided by the Primary actually matches
-    # the name of a validated target for this ECU, otherwise we don't need it.
-    print(RED + 'Requested and received image from Primary, but this '
-        'Secondary has not validated any target info that matches the given ' +
-        'filename. Expected: ' + repr(expected_image_fname) + '; received: ' +
-        repr(image_fname) + '; aborting "install".' + ENDCOLORS)
-    # print_banner(
-    #     BANNER_DEFENDED, color=WHITE+DARK_BLUE_BG,
-    #     text='Image from Primary is not listed in trusted metadata. Possible '
-    #     'attack from Primary averted. Image: ' +
-    #     repr(image_fname))#, sound=TADA)
-    attacks_detected += 'Received unexpected image from Primary with ' + \
-        'unexpected filename.\n'
-    generate_signed_ecu_manifest()
-    submit_ecu_manifest_to_primary()
-    return
+  # Download the image for this ECU from the Primary, validating it against
+  # the metadata as it arrives (so that it is read only once), and writing it
+  # straight to disk.
+  image_fname = expected_image_fname
+  try:
+    if USE_BLOCK_TRANSFER:
+      received_image = receive_image_in_blocks(pserver, image_fname)
 
-  # Write the downloaded image binary data to disk.
-  unverified_targets_dir = os.path.join(CLIENT_DIRECTORY, 'unverified_targets')
-  if not os.path.exists(unverified_targets_dir):
-    os.mkdir(unverified_targets_dir)
-  with open(os.path.join(unverified_targets_dir, image_fname), 'wb') as fobj:
-    fobj.write(image.data)
+    elif USE_IMAGE_DELTAS and receive_image_delta(
+        pserver, distribution_port, image_fname, expected_target_info):
+      received_image = True
 
+    else:
+      try:
+        stream_image_from_primary(distribution_port, image_fname,
+            expected_target_info['fileinfo']['hashes']['sha256'])
+      except URLError:
+        received_image = False
+      else:
+        received_image = True
 
-  # Validate the image against the metadata.
-  try:
-    secondary_ecu.validate_image(image_fname)
   except tuf.DownloadLengthMismatchError:
     print_banner(
         BANNER_DEFENDED, color=WHITE+DARK_BLUE_BG,
@@ -453,6 +685,14 @@ def update_cycle():
     submit_ecu_manifest_to_primary()
     return
 
+  if not received_image:
+    print(YELLOW + 'Requested image from Primary but received none. Update '
+        'terminated.' + ENDCOLORS)
+    attacks_detected += 'Requested image from Primary but received none.\n'
+    generate_signed_ecu_manifest()
+    submit_ecu_manifest_to_primary()
+    return
+
 
 
   if secondary_ecu.firmware_fileinfo == expected_target_info:
@@ -579,9 +819,8 @@ def register_self_with_director():
   themselves.
   """
   # Connect to the Director
-  server = xmlrpc_client.ServerProxy(
-    'http://' + str(demo.DIRECTOR_SERVER_HOST) + ':' +
-    str(demo.DIRECTOR_SERVER_PORT))
+  server = demo.create_rpc_proxy(
+      demo.DIRECTOR_SERVER_HOST, demo.DIRECTOR_SERVER_PORT)
 
   print('Registering Secondary ECU Serial and Key with Director.')
   server.register_ecu_serial(
@@ -601,8 +840,7 @@ def register_self_with_primary():
   into the vehicle during assembly, not by the Secondary itself.
   """
   # Connect to the Primary
-  server = xmlrpc_client.ServerProxy(
-    'http://' + str(_primary_host) + ':' + str(_primary_port))
+  server = demo.create_rpc_proxy(_primary_host, _primary_port)
 
   print('Registering Secondary ECU Serial and Key with Primary.')
   server.register_new_secondary(secondary_ecu.ecu_serial)
@@ -7,6 +7,15 @@
    -Listens for requests from vehicles over XML-RPC.
    -Receives a list of nonces and responds with a signed time attestation
     that lists those nonces.
+   -In batched mode (listen(batched=True)), also serves batched time
+    attestations, signing once per batch window rather than once per request.
+
+  For high request volumes (e.g. a whole fleet waking at once), use
+  listen_concurrent() instead of listen(). It handles connections in
+  separate threads, signs on a pool of worker threads, and can run as
+  several processes sharing the port via SO_REUSEPORT. It reports requests
+  per second and latency percentiles. load_test() exercises such a server
+  from local client threads.
 
   Currently, this module contains both core and demo code.
 
@@ -23,10 +32,17 @@ from __future__ import unicode_literals
 import demo
 import uptane
 import uptane.common
+import uptane.binary_rpc as binary_rpc
 import tuf.formats
+import demo.rpc_server as rpc_server # for concurrent, keep-alive servers
 
 import threading
-from six.moves import xmlrpc_server
+import multiprocessing
+import multiprocessing.pool # for the signing worker pool
+import os
+import socket # for SO_REUSEPORT
+import time
+from six.moves import range
 from six.moves import xmlrpc_client # for Binary data encapsulation
 import uptane.services.timeserver as timeserver
 
@@ -46,16 +62,90 @@ uptane.DEMO_MODE = True
 LOG_PREFIX = uptane.WHITE + 'Timeserver:' + uptane.ENDCOLORS + ' '
 
 timeserver_listener_thread = None
-
-# Restrict director requests to a particular path.
-# Must specify RPC2 here for the XML-RPC interface to work.
-class RequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
+timeserver_binary_listener_thread = None
+
+# Used by listen_concurrent().
+timeserver_processes = []
+signing_pool = None
+request_stats = None
+
+# Restrict requests to a particular path. (Must specify RPC2 here for the
+# XML-RPC interface to work.) Keep connections open between requests from the
+# same client, so that a Primary making repeated requests does not pay for a
+# new connection each time.
+class KeepAliveRequestHandler(rpc_server.KeepAliveRequestHandler):
   rpc_paths = ('/RPC2',)
 
 
 
 
 
+class RequestStats(object):
+  """
+  Thread-safe count of requests served and record of their latencies (the most
+  recent max_samples of them), for reporting throughput and latency
+  percentiles.
+  """
+  def __init__(self, max_samples=100000):
+    self.max_samples = max_samples
+    self.start_time = time.time()
+    self.n_requests = 0
+    self.latencies = []
+    self._lock = threading.Lock()
+
+
+
+  def record(self, latency):
+    with self._lock:
+      self.n_requests += 1
+      if len(self.latencies) >= self.max_samples:
+        # Keep the most recent half of the samples.
+        del self.latencies[:self.max_samples // 2]
+      self.latencies.append(latency)
+
+
+
+  def summary(self, percentiles=(50, 90, 99)):
+    """
+    Returns a dictionary with the process ID, the number of requests served,
+    the elapsed time in seconds, the average requests per second, and the
+    given latency percentiles, in milliseconds, keyed by percentile (as a
+    string, for XMLRPC).
+    """
+    with self._lock:
+      n_requests = self.n_requests
+      latencies = sorted(self.latencies)
+    elapsed = time.time() - self.start_time
+
+    return {
+        'pid': os.getpid(),
+        'requests': n_requests,
+        'elapsed': elapsed,
+        'requests_per_second': n_requests / elapsed if elapsed else 0.0,
+        'latency_ms': latency_percentiles(latencies, percentiles)}
+
+
+
+
+
+def latency_percentiles(sorted_latencies, percentiles=(50, 90, 99)):
+  """
+  Given a sorted list of latencies in seconds, returns a dictionary mapping
+  each given percentile (as a string) to the latency in milliseconds at that
+  percentile (nearest-rank), or an empty dictionary if there are no latencies.
+  """
+  if not sorted_latencies:
+    return {}
+  result = {}
+  for percentile in percentiles:
+    rank = int(round(percentile / 100.0 * (len(sorted_latencies) - 1)))
+    result[str(percentile)] = sorted_latencies[rank] * 1000
+  return result
+
+
+
+
+
 def load_timeserver_key(use_new_keys=False):
   if use_new_keys:
     demo.generate_key('timeserver')
@@ -86,13 +176,31 @@ def get_signed_time_der_wrapper(nonces):
 
 
 
-def listen(use_new_keys=False):
+def get_signed_time_batched_der_wrapper(nonces):
+  """
+  Batched-mode equivalent of get_signed_time_der_wrapper.
   """
-  Listens on TIMESERVER_PORT for xml-rpc calls to functions:
+  return xmlrpc_client.Binary(timeserver.get_signed_time_batched_der(nonces))
+
+
+
+
+
+def listen(use_new_keys=False, batched=False):
+  """
+  Listens on TIMESERVER_PORT for xml-rpc calls, and on that port plus
+  BINARY_RPC_PORT_OFFSET for binary RPC calls, to functions:
    - get_signed_time(nonces)
+   - get_signed_time_der(nonces)
+
+  Requests are handled concurrently, on connections kept open between them.
+  If batched is True, these are also provided:
+   - get_signed_time_batched(nonces)
+   - get_signed_time_batched_der(nonces)
   """
 
   global timeserver_listener_thread
+  global timeserver_binary_listener_thread
 
   # Set the timeserver's signing key.
   print(LOG_PREFIX + 'Loading timeserver signing key.')
@@ -104,10 +212,12 @@ def listen(use_new_keys=False):
   test_demo_timeserver()
 
 
-  # Create server
-  server = xmlrpc_server.SimpleXMLRPCServer(
+  # Create server. Requests are handled concurrently (each connection in its
+  # own thread), so that Primaries can keep their connections open between
+  # requests without holding up others.
+  server = rpc_server.ThreadedXMLRPCServer(
       (demo.TIMESERVER_HOST, demo.TIMESERVER_PORT),
-      requestHandler=RequestHandler)#, allow_none=True)
+      requestHandler=KeepAliveRequestHandler)#, allow_none=True)
   #server.register_introspection_functions()
 
 
@@ -118,13 +228,242 @@ def listen(use_new_keys=False):
   server.register_function(
       get_signed_time_der_wrapper, 'get_signed_time_der')
 
+  if batched:
+    server.register_function(
+        timeserver.get_signed_time_batched, 'get_signed_time_batched')
+    server.register_function(
+        get_signed_time_batched_der_wrapper, 'get_signed_time_batched_der')
+
+
+  # Provide the same functions over binary RPC (see uptane/binary_rpc.py),
+  # which carries DER attestations without base64 and XML.
+  binary_port = demo.TIMESERVER_PORT + demo.BINARY_RPC_PORT_OFFSET
+  binary_server = rpc_server.ThreadedBinaryRPCServer(
+      (demo.TIMESERVER_HOST, binary_port), server)
+
 
   print(LOG_PREFIX + 'Timeserver will now listen on port ' +
-      str(demo.TIMESERVER_PORT))
+      str(demo.TIMESERVER_PORT) + ' (XML-RPC) and port ' + str(binary_port) +
+      ' (binary RPC)')
 
   timeserver_listener_thread = threading.Thread(target=server.serve_forever)
   timeserver_listener_thread.setDaemon(True)
   timeserver_listener_thread.start()
+  timeserver_binary_listener_thread = threading.Thread(
+      target=binary_server.serve_forever)
+  timeserver_binary_listener_thread.setDaemon(True)
+  timeserver_binary_listener_thread.start()
+
+
+
+
+
+def _served_by_signing_pool(func):
+  """
+  Returns a version of func that runs func on the signing worker pool,
+  recording its latency (including any time spent waiting for a worker).
+  """
+  def wrapper(*args):
+    start = time.time()
+    try:
+      return signing_pool.apply(func, args)
+    finally:
+      request_stats.record(time.time() - start)
+  return wrapper
+
+
+
+
+
+def get_stats():
+  """
+  Returns the request statistics of the Timeserver process that handles this
+  call. (With several processes, each call may be answered by a different
+  one.)
+  """
+  return request_stats.summary()
+
+
+
+
+
+def _serve_concurrent(host, port, n_signing_workers, reuse_port,
+    report_interval):
+  """
+  Runs a concurrent Timeserver in this process, forever. The Timeserver key
+  must already be set (timeserver.set_timeserver_key).
+  """
+  global signing_pool
+  global request_stats
+
+  signing_pool = multiprocessing.pool.ThreadPool(n_signing_workers)
+  request_stats = RequestStats()
+
+  server = rpc_server.ThreadedXMLRPCServer((host, port),
+      requestHandler=KeepAliveRequestHandler, logRequests=False,
+      reuse_port=reuse_port)
+
+  server.register_function(
+      _served_by_signing_pool(timeserver.get_signed_time), 'get_signed_time')
+  server.register_function(
+      _served_by_signing_pool(get_signed_time_der_wrapper),
+      'get_signed_time_der')
+  server.register_function(get_stats, 'get_stats')
+
+  # The same functions, over binary RPC (see uptane/binary_rpc.py).
+  binary_server = rpc_server.ThreadedBinaryRPCServer(
+      (host, port + demo.BINARY_RPC_PORT_OFFSET), server,
+      reuse_port=reuse_port)
+  binary_thread = threading.Thread(target=binary_server.serve_forever)
+  binary_thread.setDaemon(True)
+  binary_thread.start()
+
+  def report():
+    while True:
+      time.sleep(report_interval)
+      stats = request_stats.summary()
+      print(LOG_PREFIX + '[pid ' + str(stats['pid']) + '] ' +
+          str(stats['requests']) + ' requests, ' +
+          '{0:.1f}'.format(stats['requests_per_second']) + ' requests/s, ' +
+          'latency (ms) percentiles: ' + repr(stats['latency_ms']))
+
+  if report_interval:
+    reporter = threading.Thread(target=report)
+    reporter.setDaemon(True)
+    reporter.start()
+
+  server.serve_forever()
+
+
+
+
+
+def listen_concurrent(use_new_keys=False, n_processes=1, n_signing_workers=4,
+    host=demo.TIMESERVER_HOST, port=demo.TIMESERVER_PORT, report_interval=10):
+  """
+  Like listen(), but for high request volumes: each connection is handled in
+  its own thread, signing is done on a pool of n_signing_workers threads per
+  process, and, if n_processes is greater than 1, that many processes listen
+  on the same port using SO_REUSEPORT. The Timeserver key is loaded once, in
+  this process, before the others are started, and is inherited by them.
+
+  Each process prints its request rate and latency percentiles every
+  report_interval seconds (0 to disable); these are also available over XMLRPC
+  via get_stats().
+
+  Provides get_signed_time(nonces), get_signed_time_der(nonces), and
+  get_stats(), over XML-RPC on the given port, and over binary RPC on that
+  port plus BINARY_RPC_PORT_OFFSET.
+  """
+  global timeserver_listener_thread
+
+  if n_processes > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+    raise uptane.Error('Running several Timeserver processes requires '
+        'SO_REUSEPORT, which this platform does not support.')
+
+  print(LOG_PREFIX + 'Loading timeserver signing key.')
+  timeserver.set_timeserver_key(load_timeserver_key(use_new_keys))
+  print(LOG_PREFIX + 'Timeserver signing key loaded.')
+
+  test_demo_timeserver()
+
+  if n_processes == 1:
+    timeserver_listener_thread = threading.Thread(target=_serve_concurrent,
+        args=(host, port, n_signing_workers, False, report_interval))
+    timeserver_listener_thread.setDaemon(True)
+    timeserver_listener_thread.start()
+
+  else:
+    for i in range(n_processes):
+      process = multiprocessing.Process(target=_serve_concurrent,
+          args=(host, port, n_signing_workers, True, report_interval))
+      process.daemon = True
+      process.start()
+      timeserver_processes.append(process)
+
+  print(LOG_PREFIX + 'Concurrent Timeserver (' + str(n_processes) +
+      ' process(es), ' + str(n_signing_workers) + ' signing workers each) '
+      'will now listen on port ' + str(port))
+
+
+
+
+
+def kill_concurrent_servers():
+  """Terminates any Timeserver processes started by listen_concurrent()."""
+  for process in timeserver_processes:
+    process.terminate()
+    process.join()
+  del timeserver_processes[:]
+
+
+
+
+
+def load_test(n_clients=16, requests_per_client=100, der=True,
+    host='localhost', port=demo.TIMESERVER_PORT, transport=None):
+  """
+  Sends requests for signed time attestations to the Timeserver from
+  n_clients threads concurrently, each using its own connection and sending
+  requests_per_client requests, one after another, over the given transport
+  ('xmlrpc', or 'binary' to the binary RPC port for the given XML-RPC port;
+  by default, demo.RPC_TRANSPORT).
+
+  Returns a dictionary with the total number of requests, the number that
+  failed, the elapsed time in seconds, the overall requests per second, and
+  latency percentiles in milliseconds as seen by the clients.
+  """
+  latencies = []
+  failures = [0]
+  lock = threading.Lock()
+
+  if transport is None:
+    transport = demo.RPC_TRANSPORT
+
+  def client(client_number):
+    if transport == 'binary':
+      proxy = binary_rpc.ServerProxy(
+          (host, port + demo.BINARY_RPC_PORT_OFFSET), max_idle_connections=1)
+    else:
+      proxy = xmlrpc_client.ServerProxy(
+          'http://' + str(host) + ':' + str(port))
+    my_latencies = []
+    my_failures = 0
+    for i in range(requests_per_client):
+      nonces = [client_number, i]
+      start = time.time()
+      try:
+        if der:
+          proxy.get_signed_time_der(nonces)
+        else:
+          proxy.get_signed_time(nonces)
+      except Exception:
+        my_failures += 1
+      else:
+        my_latencies.append(time.time() - start)
+    with lock:
+      latencies.extend(my_latencies)
+      failures[0] += my_failures
+
+  threads = [threading.Thread(target=client, args=(i,))
+      for i in range(n_clients)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.time() - start
+
+  results = {
+      'requests': n_clients * requests_per_client,
+      'failures': failures[0],
+      'elapsed': elapsed,
+      'requests_per_second': len(latencies) / elapsed,
+      'latency_ms': latency_percentiles(sorted(latencies))}
+
+  print(LOG_PREFIX + 'Load test: ' + repr(results))
+
+  return results
 
 
 
@@ -182,6 +521,19 @@ def test_demo_timeserver():
 
 
 
+  # Fetch a batched time attestation in each format and validate its
+  # signature and inclusion proof.
+  uptane.common.verify_batched_time_attestation(
+      timeserver.get_signed_time_batched([3, 4]), timeserver_key_pub,
+      metadata_format='json')
+
+  uptane.common.verify_batched_time_attestation(
+      asn1_codec.convert_signed_der_time_attestation_to_dersigned_json(
+      timeserver.get_signed_time_batched_der([5])), timeserver_key_pub,
+      metadata_format='der')
+
+
+
 
 
 if __name__ == '__main__':
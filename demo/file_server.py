@@ -0,0 +1,324 @@
+"""
+file_server.py
+
+Demonstration code providing a small threaded HTTP server for distributing
+files (images and metadata) without reading them into memory: file contents
+are sent with sendfile where the platform provides it (or from a memory map
+otherwise), and single-range HTTP Range requests are supported, so that an
+interrupted transfer can be resumed. Connections are kept alive between
+requests (HTTP/1.1), and each response carries a strong entity tag (ETag), so
+that a client can revalidate what it already has (If-None-Match) or resume a
+transfer only if the file has not changed (If-Range). Subclasses may also
+serve some paths from memory (see get_data_for_path()).
+
+Use:
+  class MyHandler(file_server.FileRequestHandler):
+    def get_file_for_path(self, path):
+      return <filename to serve for this URL path, or None>
+
+  server = file_server.ThreadedHTTPServer((host, port), MyHandler)
+  server.serve_forever()
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import re
+import mmap
+import errno
+import select
+import socket
+import hashlib
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+# How much of a file to send at once when not using sendfile.
+CHUNK_SIZE = 64 * 1024
+
+# The number of seconds for which an idle kept-alive connection (or a stalled
+# read or write) is kept open.
+KEEP_ALIVE_TIMEOUT = 30
+
+# Matches a single byte range, e.g. 'bytes=100-199', 'bytes=100-', 'bytes=-50'.
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+
+class ThreadedHTTPServer(
+    socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+
+
+
+class FileRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves GET and HEAD requests for the files named by get_file_for_path(),
+  which subclasses must override, or for the data returned by
+  get_data_for_path(). Responds 404 for paths for which there is neither.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  timeout = KEEP_ALIVE_TIMEOUT
+
+  content_type = 'application/octet-stream'
+
+
+
+  def get_file_for_path(self, path):
+    """
+    Returns the filename of the file to serve for the given URL path (without
+    any query string), or None if there is none.
+    """
+    raise NotImplementedError
+
+
+
+  def get_data_for_path(self, path):
+    """
+    Returns a tuple (data, etag) of the bytes to serve from memory for the
+    given URL path (without any query string) and their entity tag (see
+    make_etag()), or None to serve the file named by get_file_for_path()
+    instead. By default, returns None.
+    """
+    return None
+
+
+
+  def get_cache_control(self, path):
+    """
+    Returns the value of the Cache-Control header to send with responses for
+    the given URL path (without any query string), or None to send none. By
+    default, returns None.
+    """
+    return None
+
+
+
+  def log_message(self, format, *args):
+    pass
+
+
+
+  def do_HEAD(self):
+    self._serve(send_body=False)
+
+
+
+  def do_GET(self):
+    self._serve(send_body=True)
+
+
+
+  def _serve(self, send_body):
+    path = self.path.split('?', 1)[0]
+
+    in_memory = self.get_data_for_path(path)
+    if in_memory is not None:
+      data, etag = in_memory
+
+      def send_data_range(start, end):
+        self.wfile.write(data[start:end])
+
+      self._send_entity(send_body, len(data), etag, send_data_range)
+      return
+
+    fname = self.get_file_for_path(path)
+
+    if fname is None or not os.path.isfile(fname):
+      self.send_error(404, 'Not found')
+      return
+
+    with open(fname, 'rb') as fobj:
+      stat = os.fstat(fobj.fileno())
+
+      def send_fobj_range(start, end):
+        self.wfile.flush()
+        send_file_range(self.connection, fobj, start, end)
+
+      self._send_entity(
+          send_body, stat.st_size, get_file_etag(stat), send_fobj_range)
+
+
+
+  def _send_entity(self, send_body, size, etag, send_range):
+    """
+    Responds to the request with the given entity (or the requested range of
+    it), of the given size and entity tag, whose bytes [start, end) are sent
+    by send_range(start, end).
+    """
+    cache_control = self.get_cache_control(self.path.split('?', 1)[0])
+
+    if etag_matches(self.headers.get('If-None-Match'), etag):
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      if cache_control is not None:
+        self.send_header('Cache-Control', cache_control)
+      self.end_headers()
+      return
+
+    range_header = self.headers.get('Range')
+    if_range = self.headers.get('If-Range')
+    if if_range is not None and if_range.strip() != etag:
+      range_header = None # The client's partial copy is out of date.
+
+    byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+      self.send_response(416)
+      self.send_header('Content-Range', 'bytes */' + str(size))
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+
+    if byte_range is None:
+      start, end = 0, size
+      self.send_response(200)
+    else:
+      start, end = byte_range
+      self.send_response(206)
+      self.send_header('Content-Range',
+          'bytes ' + str(start) + '-' + str(end - 1) + '/' + str(size))
+
+    self.send_header('Content-Type', self.content_type)
+    self.send_header('Content-Length', str(end - start))
+    self.send_header('Accept-Ranges', 'bytes')
+    self.send_header('ETag', etag)
+    if cache_control is not None:
+      self.send_header('Cache-Control', cache_control)
+    self.end_headers()
+
+    if send_body and end > start:
+      send_range(start, end)
+
+
+
+
+def make_etag(data):
+  """
+  Returns a strong entity tag for the given bytes: a quoted hash of them.
+  """
+  return '"' + hashlib.sha256(data).hexdigest() + '"'
+
+
+
+
+
+def get_file_etag(stat):
+  """
+  Returns a strong entity tag for the file with the given os.stat() result,
+  derived from its inode, size, and modification time (to the nanosecond,
+  where available), so that the file need not be read to produce it. Files
+  are expected to be replaced, or written to, rather than modified in place
+  within the same nanosecond.
+  """
+  mtime = getattr(stat, 'st_mtime_ns', None)
+  if mtime is None:
+    mtime = int(stat.st_mtime * 1000000000)
+  return '"' + '-'.join(
+      '%x' % value for value in (stat.st_ino, stat.st_size, mtime)) + '"'
+
+
+
+
+
+def etag_matches(if_none_match_header, etag):
+  """
+  Returns True if the value of an HTTP If-None-Match header (a list of entity
+  tags, or '*') matches the given entity tag, meaning that the client already
+  has the entity. Weak comparison is used, as for GET and HEAD requests.
+  """
+  if not if_none_match_header:
+    return False
+
+  for candidate in if_none_match_header.split(','):
+    candidate = candidate.strip()
+    if candidate.startswith('W/'):
+      candidate = candidate[2:]
+    if candidate == '*' or candidate == etag:
+      return True
+
+  return False
+
+
+
+
+
+def parse_range(range_header, size):
+  """
+  Interprets the value of an HTTP Range header for a file of the given size.
+
+  Returns None if the whole file should be sent (no header, or a header this
+  server does not handle, like multiple ranges), False if the range cannot be
+  satisfied, or else (start, end) of the range to send, end exclusive.
+  """
+  if not range_header:
+    return None
+
+  match = _RANGE_PATTERN.match(range_header.strip())
+  if match is None:
+    return None
+
+  first, last = match.groups()
+
+  if not first and not last:
+    return None
+
+  elif not first: # Suffix range: the last N bytes.
+    length = int(last)
+    if length == 0:
+      return False
+    return max(0, size - length), size
+
+  start = int(first)
+  end = size if not last else min(int(last) + 1, size)
+
+  if start >= size or end <= start:
+    return False
+
+  return start, end
+
+
+
+
+
+def send_file_range(sock, fobj, start, end):
+  """
+  Sends bytes [start, end) of the given file over the given socket, using
+  sendfile if available so that the data is not copied through this process,
+  or else from a memory map of the file.
+
+  A socket with a timeout (like those of FileRequestHandler) is non-blocking
+  underneath, so sendfile stops whenever the socket's send buffer is full;
+  the socket is then waited on, for at most its timeout, until it can be
+  written to again.
+  """
+  if hasattr(sock, 'sendfile'): # Python 3.5 and later wait by themselves.
+    sock.sendfile(fobj, start, end - start)
+    return
+
+  if hasattr(os, 'sendfile'):
+    offset = start
+    while offset < end:
+      try:
+        sent = os.sendfile(sock.fileno(), fobj.fileno(), offset, end - offset)
+      except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+          raise
+        if not select.select([], [sock], [], sock.gettimeout())[1]:
+          raise socket.timeout('timed out')
+        continue
+      if sent == 0:
+        break
+      offset += sent
+    return
+
+  mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    for offset in range(start, end, CHUNK_SIZE):
+      sock.sendall(mapped[offset:min(offset + CHUNK_SIZE, end)])
+  finally:
+    mapped.close()
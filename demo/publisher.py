@@ -0,0 +1,220 @@
+"""
+publisher.py
+
+Demonstration code for publishing a repository's metadata (e.g. from its
+metadata.staged directory to its live metadata directory) atomically, without
+copying files that have not changed.
+
+Each publication is a new, numbered directory in '<live path>.versions' (e.g.
+'metadata.versions/7'), and the live path itself (e.g. 'metadata') is a
+symbolic link, which is replaced in a single rename, to the newest of them.
+Clients therefore always find a complete set of metadata: never a mix of old
+and new, and never none at all (as when the live directory was deleted and
+copied anew). Files that are the same as in the version being replaced are
+hard links to it rather than copies, as published versions are never written
+to. Versions that have been replaced for longer than a grace period (so that
+no request can still be reading them) are removed when the next is published.
+
+snapshot_directory() makes the same kind of hard-linked copy of a directory,
+e.g. to back up staged metadata.
+
+Use:
+  publisher.publish_directory(
+      os.path.join(repo_dir, 'metadata.staged'),
+      os.path.join(repo_dir, 'metadata'))
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import time
+import shutil
+
+# The suffix of the directory, next to the live path, holding the published
+# versions.
+VERSIONS_SUFFIX = '.versions'
+
+# The number of seconds for which a version is kept after being replaced.
+DEFAULT_GRACE_PERIOD = 60
+
+
+
+def publish_directory(source_dir, live_path, immutable_dirs=(),
+    grace_period=DEFAULT_GRACE_PERIOD):
+  """
+  <Purpose>
+    Publishes a snapshot (see snapshot_directory()) of the files in source_dir
+    as a new version, and atomically makes live_path a symbolic link to it.
+    Files the same as in the version being replaced (or in one of the given
+    immutable_dirs) are hard-linked from it. Then removes the versions
+    replaced more than grace_period seconds ago.
+
+    If live_path is a directory rather than a link (e.g. it was published by
+    copying), it is first moved in with the versions, as the oldest.
+
+  <Arguments>
+    source_dir
+      the directory whose files to publish, e.g. a metadata.staged directory
+
+    live_path
+      the path at which the files are to be found once published
+
+    immutable_dirs (optional)
+      directories whose files will never be written to again, from which
+      files may also be hard-linked
+
+    grace_period (optional)
+      the number of seconds to keep replaced versions
+
+  <Returns>
+    The directory of the new version.
+  """
+  versions_dir = live_path + VERSIONS_SUFFIX
+  if not os.path.isdir(versions_dir):
+    os.makedirs(versions_dir)
+
+  if os.path.isdir(live_path) and not os.path.islink(live_path):
+    os.rename(live_path, os.path.join(
+        versions_dir, str(_get_next_version(versions_dir))))
+
+  current_dir = get_published_dir(live_path)
+  if current_dir is not None:
+    immutable_dirs = [current_dir] + list(immutable_dirs)
+
+  version = _get_next_version(versions_dir)
+  version_dir = os.path.join(versions_dir, str(version))
+  snapshot_directory(source_dir, version_dir, immutable_dirs)
+
+  # Replace the link in one step: make the new link beside it, then rename it
+  # over the old one.
+  new_link = live_path + '.newlink'
+  if os.path.lexists(new_link):
+    os.remove(new_link)
+  os.symlink(os.path.join(os.path.basename(versions_dir), str(version)),
+      new_link)
+  os.rename(new_link, live_path)
+
+  collect_garbage(live_path, grace_period)
+
+  return version_dir
+
+
+
+
+
+def get_published_dir(live_path):
+  """
+  Returns the directory of the version published at live_path, or None if
+  nothing has been published there.
+  """
+  if not os.path.islink(live_path):
+    return None
+
+  return os.path.join(os.path.dirname(live_path), os.readlink(live_path))
+
+
+
+
+
+def collect_garbage(live_path, grace_period=DEFAULT_GRACE_PERIOD):
+  """
+  Removes the versions of live_path (see publish_directory()) that were
+  replaced by a later version more than grace_period seconds ago, taking the
+  time a version was replaced to be the time the next one was written.
+  """
+  versions_dir = live_path + VERSIONS_SUFFIX
+  current_dir = get_published_dir(live_path)
+  if current_dir is None or not os.path.isdir(versions_dir):
+    return
+
+  current_version = int(os.path.basename(current_dir))
+  versions = _get_versions(versions_dir)
+  now = time.time()
+
+  for version, next_version in zip(versions, versions[1:]):
+    if version >= current_version:
+      break
+
+    replaced_time = os.path.getmtime(
+        os.path.join(versions_dir, str(next_version)))
+
+    if now - replaced_time > grace_period:
+      shutil.rmtree(os.path.join(versions_dir, str(version)))
+
+
+
+
+
+def snapshot_directory(source_dir, dest_dir, immutable_dirs=()):
+  """
+  <Purpose>
+    Creates dest_dir holding the files (and subdirectories) in source_dir,
+    each a hard link to the file with the same relative path and contents in
+    the first of the given immutable_dirs that has one, or else a copy.
+
+    Files in the immutable_dirs must never be written to (they may be removed
+    or replaced), since they may now also be files in dest_dir, and files in
+    dest_dir must likewise never be written to if any of them are links.
+
+  <Arguments>
+    source_dir
+      the directory to snapshot
+
+    dest_dir
+      the directory to create, which must not exist
+
+    immutable_dirs (optional)
+      directories from which files may be hard-linked
+
+  <Returns>
+    None
+  """
+  os.makedirs(dest_dir)
+
+  for root, subdirs, fnames in os.walk(source_dir):
+    relative_root = os.path.relpath(root, source_dir)
+
+    for subdir in subdirs:
+      os.makedirs(os.path.join(dest_dir, relative_root, subdir))
+
+    for fname in fnames:
+      source_fname = os.path.join(root, fname)
+      dest_fname = os.path.join(dest_dir, relative_root, fname)
+
+      for immutable_dir in immutable_dirs:
+        candidate = os.path.join(immutable_dir, relative_root, fname)
+        if os.path.isfile(candidate) and \
+            _have_same_contents(source_fname, candidate):
+          os.link(candidate, dest_fname)
+          break
+
+      else:
+        shutil.copyfile(source_fname, dest_fname)
+
+
+
+
+
+def _have_same_contents(fname1, fname2):
+  if os.path.getsize(fname1) != os.path.getsize(fname2):
+    return False
+
+  with open(fname1, 'rb') as fobj1:
+    with open(fname2, 'rb') as fobj2:
+      return fobj1.read() == fobj2.read()
+
+
+
+
+
+def _get_versions(versions_dir):
+  return sorted(int(name) for name in os.listdir(versions_dir)
+      if name.isdigit())
+
+
+
+
+
+def _get_next_version(versions_dir):
+  versions = _get_versions(versions_dir)
+  return versions[-1] + 1 if versions else 1
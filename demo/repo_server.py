@@ -0,0 +1,225 @@
+"""
+repo_server.py
+
+Demonstration code providing an in-process HTTP server for the files of a
+repository (the Image Repository, or the Director's vehicle repositories),
+in place of a separate "python -m http.server" process. Built on
+demo/file_server.py, it handles requests concurrently, keeps connections
+alive, supports range requests (e.g. to resume image downloads), and sends
+entity tags so that clients can revalidate files cheaply.
+
+Files whose names are prefixed with a version or hash, as written for
+consistent snapshots (e.g. '3.snapshot.der', or '<sha256 hash>.image.img'),
+never change, so responses for them may be cached indefinitely by clients and
+intermediate caches. Responses for all other files (e.g. 'timestamp.der')
+must be revalidated before a cached copy is used.
+
+Live metadata files (those in a directory named 'metadata') are served from
+an in-memory cache, since every client asks for them on every update cycle.
+The cache must be invalidated, with invalidate_metadata(), whenever the live
+metadata changes (e.g. in write_to_live()); a file read from disk while the
+cache was being invalidated is not cached.
+
+Use:
+  server = repo_server.RepositoryServer((host, port), repo_dir)
+  server.start()
+  ...
+  server.invalidate_metadata() # after changing the live metadata
+  ...
+  server.stop()
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import demo.file_server as file_server
+
+import os
+import re
+import threading
+import posixpath
+
+from six.moves.urllib.parse import unquote
+
+# Files in directories with this name are live metadata, served from memory.
+METADATA_DIRNAME = 'metadata'
+
+# The Cache-Control header values for files that never change, and for all
+# other files.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MUTABLE_CACHE_CONTROL = 'no-cache'
+
+# Matches the name of a role file prefixed with its version (but not that of
+# a hashed bin role named with hexadecimal digits, like '3.der'), or of a
+# target file prefixed with its SHA-256 or SHA-512 hash, as written for
+# consistent snapshots.
+_VERSIONED_ROLE_FNAME_PATTERN = re.compile(r'^[0-9]+\.[^.]+\.')
+_HASHED_TARGET_FNAME_PATTERN = re.compile(r'^([0-9a-f]{64}|[0-9a-f]{128})\.')
+
+
+
+class MetadataCache(object):
+  """
+  Holds the contents and entity tags of files read from disk, until
+  invalidate() is called. Safe to use from several threads.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._generation = 0
+    self._entries = {}
+
+
+
+  def get(self, fname):
+    """
+    Returns a tuple (data, etag) for the given file, reading and caching it if
+    it is not already cached, or None if it cannot be read.
+    """
+    with self._lock:
+      entry = self._entries.get(fname)
+      generation = self._generation
+
+    if entry is not None:
+      return entry
+
+    try:
+      with open(fname, 'rb') as fobj:
+        data = fobj.read()
+    except (IOError, OSError):
+      return None
+
+    entry = (data, file_server.make_etag(data))
+
+    with self._lock:
+      # If the cache was invalidated while the file was read, what was read
+      # may already be out of date, so it is served this once but not kept.
+      if self._generation == generation:
+        self._entries[fname] = entry
+
+    return entry
+
+
+
+  def invalidate(self):
+    """Discards everything cached, at once."""
+    with self._lock:
+      self._generation += 1
+      self._entries = {}
+
+
+
+
+
+class RepositoryRequestHandler(file_server.FileRequestHandler):
+  """
+  Serves the files under the server's directory, at the URL paths relative to
+  it, serving live metadata from the server's metadata cache.
+  """
+  def get_file_for_path(self, path):
+    return get_fname_for_url_path(self.server.directory, path)
+
+
+
+  def get_data_for_path(self, path):
+    fname = self.get_file_for_path(path)
+
+    if fname is None or METADATA_DIRNAME not in \
+        os.path.relpath(fname, self.server.directory).split(os.sep)[:-1]:
+      return None
+
+    return self.server.metadata_cache.get(fname)
+
+
+
+  def get_cache_control(self, path):
+    fname = self.get_file_for_path(path)
+    if fname is None:
+      return None
+
+    parts = os.path.relpath(fname, self.server.directory).split(os.sep)
+    if METADATA_DIRNAME in parts[:-1]:
+      pattern = _VERSIONED_ROLE_FNAME_PATTERN
+    else:
+      pattern = _HASHED_TARGET_FNAME_PATTERN
+
+    if pattern.match(parts[-1]):
+      return IMMUTABLE_CACHE_CONTROL
+    return MUTABLE_CACHE_CONTROL
+
+
+
+
+
+class RepositoryHTTPServer(file_server.ThreadedHTTPServer):
+  """
+  A ThreadedHTTPServer serving the files under the given directory, with a
+  cache of its live metadata.
+  """
+  def __init__(self, server_address, directory):
+    self.directory = os.path.abspath(directory)
+    self.metadata_cache = MetadataCache()
+    file_server.ThreadedHTTPServer.__init__(
+        self, server_address, RepositoryRequestHandler)
+
+
+
+
+
+class RepositoryServer(object):
+  """
+  Runs a RepositoryHTTPServer for the given directory in a background thread.
+  """
+  def __init__(self, server_address, directory):
+    self.server_address = server_address
+    self.directory = directory
+    self._server = None
+    self._thread = None
+
+
+
+  def start(self):
+    """Binds the server's port and begins serving in a background thread."""
+    self._server = RepositoryHTTPServer(self.server_address, self.directory)
+    self._thread = threading.Thread(target=self._server.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+
+
+
+  def stop(self):
+    """Stops serving, waits for the serving thread, and closes the port."""
+    if self._server is None:
+      return
+    self._server.shutdown()
+    self._thread.join()
+    self._server.server_close()
+    self._server = None
+    self._thread = None
+
+
+
+  def invalidate_metadata(self):
+    """
+    Discards the cached live metadata, so that the files now on disk are
+    served. Call after changing the live metadata.
+    """
+    if self._server is not None:
+      self._server.metadata_cache.invalidate()
+
+
+
+
+
+def get_fname_for_url_path(directory, path):
+  """
+  Returns the name of the file under the given directory at the given URL
+  path (without any query string), or None if the path is not one of a file
+  under the directory (e.g. it contains '..').
+  """
+  parts = [part for part in posixpath.normpath(unquote(path)).split('/')
+      if part and part != '.']
+
+  if not parts or any(part == '..' or os.sep in part or
+      (os.altsep and os.altsep in part) for part in parts):
+    return None
+
+  return os.path.join(directory, *parts)
@@ -0,0 +1,363 @@
+"""
+rpc_server.py
+
+Demonstration code providing a threaded XML-RPC server, so that a slow or
+large request from one client (e.g. a Secondary fetching an image) does not
+hold up the requests of others (e.g. other Secondaries submitting ECU
+Manifests), with a deadline on each request, so that a client that sends or
+receives data too slowly (a slow retrieval attack, or a stalled ECU) cannot
+tie up the server indefinitely.
+
+Functions registered with the server may be called concurrently, from
+different threads, and must be safe to call that way, unless the server is
+given a list of concurrent_methods: then only those are called concurrently,
+and all other functions one at a time, as by a single-threaded server (e.g.
+to allow long-poll functions that block for a while to be added to a service
+whose functions were not written to be called concurrently).
+
+With KeepAliveRequestHandler as the base of the request handler, connections
+are kept open between requests (HTTP/1.1), so that clients making repeated
+requests (e.g. a Primary using uptane.connection_pool) need not connect
+anew each time. The deadline then applies to each request on a connection,
+and to the wait for it, rather than to the connection as a whole.
+
+The functions registered with an XML-RPC server can also be provided over
+the binary RPC protocol of uptane/binary_rpc.py, which carries binary data
+(e.g. DER) without base64 and XML, by a ThreadedBinaryRPCServer (TCP) or a
+UnixBinaryRPCServer (a Unix domain socket) given the XML-RPC server as its
+dispatcher. Each connection is handled in its own thread and kept open
+between calls, each of which (and the wait for it) must complete within the
+server's request_timeout seconds. The XML-RPC server need not itself be
+serving.
+
+The deadlines of all requests, of all servers, are kept by one thread (see
+_ConnectionDeadlines), which shuts down each connection whose request is not
+completed in time, rather than by a timer thread started for each request.
+
+Use:
+  server = rpc_server.ThreadedXMLRPCServer((host, port),
+      requestHandler=MyRequestHandler, allow_none=True, request_timeout=30)
+  server.register_function(...)
+  server.serve_forever()
+
+  binary_server = rpc_server.ThreadedBinaryRPCServer(
+      (host, binary_port), server, request_timeout=30)
+  binary_server.serve_forever()
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import uptane.binary_rpc as binary_rpc
+
+import sys
+import time
+import socket
+import threading
+
+from six.moves import socketserver
+from six.moves import xmlrpc_server
+
+# The default number of seconds within which each request must be received,
+# handled, and responded to.
+DEFAULT_REQUEST_TIMEOUT = 30
+
+
+
+class KeepAliveRequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
+  """
+  A SimpleXMLRPCRequestHandler that keeps connections open between requests,
+  closing the connection of any request not completed, or not received,
+  within the server's request_timeout seconds (DEFAULT_REQUEST_TIMEOUT if the
+  server has none).
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def handle_one_request(self):
+    _deadlines.set(self.request,
+        getattr(self.server, 'request_timeout', DEFAULT_REQUEST_TIMEOUT))
+
+    try:
+      xmlrpc_server.SimpleXMLRPCRequestHandler.handle_one_request(self)
+    finally:
+      _deadlines.clear(self.request)
+
+
+
+
+
+class ThreadedXMLRPCServer(
+    socketserver.ThreadingMixIn, xmlrpc_server.SimpleXMLRPCServer):
+  """
+  A SimpleXMLRPCServer that handles each connection in its own thread, and
+  closes the connection of any request not completed within request_timeout
+  seconds: with a KeepAliveRequestHandler, each request on the connection,
+  and otherwise the connection's one request. If concurrent_methods (a
+  collection of method names) is given, no other methods are called
+  concurrently with each other. If reuse_port is True, several processes may
+  listen on the same port, with the kernel distributing connections between
+  them.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+
+  def __init__(self, *args, **kwargs):
+    self.request_timeout = kwargs.pop(
+        'request_timeout', DEFAULT_REQUEST_TIMEOUT)
+    self.concurrent_methods = kwargs.pop('concurrent_methods', None)
+    self.reuse_port = kwargs.pop('reuse_port', False)
+    self.dispatch_lock = threading.Lock()
+    xmlrpc_server.SimpleXMLRPCServer.__init__(self, *args, **kwargs)
+
+
+
+  def server_bind(self):
+    if self.reuse_port:
+      self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    xmlrpc_server.SimpleXMLRPCServer.server_bind(self)
+
+
+
+  def process_request_thread(self, request, client_address):
+    # No single read or write may take longer than the whole request may, and
+    # the whole request, however it trickles in or out, is cut off at its
+    # deadline (set by the request handler, if it keeps connections alive).
+    request.settimeout(self.request_timeout)
+    if issubclass(self.RequestHandlerClass, KeepAliveRequestHandler):
+      socketserver.ThreadingMixIn.process_request_thread(
+          self, request, client_address)
+      return
+
+    _deadlines.set(request, self.request_timeout)
+
+    try:
+      socketserver.ThreadingMixIn.process_request_thread(
+          self, request, client_address)
+    finally:
+      _deadlines.clear(request)
+
+
+
+  def _dispatch(self, method, params):
+    if self.concurrent_methods is None or method in self.concurrent_methods:
+      return xmlrpc_server.SimpleXMLRPCServer._dispatch(self, method, params)
+
+    with self.dispatch_lock:
+      return xmlrpc_server.SimpleXMLRPCServer._dispatch(self, method, params)
+
+
+
+  def handle_error(self, request, client_address):
+    # A connection cut off at its deadline, or dropped by the client, is not
+    # worth a traceback.
+    if isinstance(sys.exc_info()[1], socket.error):
+      return
+    xmlrpc_server.SimpleXMLRPCServer.handle_error(self, request, client_address)
+
+
+
+
+
+class BinaryRPCRequestHandler(socketserver.BaseRequestHandler):
+  """
+  Handles the binary RPC calls (see uptane/binary_rpc.py) made on one
+  connection, one after another, until the client closes it, closing it
+  instead if a call is not received and answered within the server's
+  request_timeout seconds, or is not properly framed.
+  """
+  def handle(self):
+    while True:
+      _deadlines.set(self.request, self.server.request_timeout)
+
+      try:
+        message = binary_rpc.read_message(self.request)
+        if message is None: # The client closed the connection.
+          return
+
+        binary_rpc.write_message(self.request, binary_rpc.handle_request(
+            self.server.dispatcher._dispatch, message))
+
+      except uptane.BadRPCMessage:
+        return
+
+      finally:
+        _deadlines.clear(self.request)
+
+
+
+
+
+class _BinaryRPCServerMixIn(socketserver.ThreadingMixIn):
+  """
+  The parts of ThreadedBinaryRPCServer and UnixBinaryRPCServer that do not
+  depend on the kind of socket.
+  """
+  daemon_threads = True
+
+  def _set_up(self, dispatcher, request_timeout):
+    self.dispatcher = dispatcher
+    self.request_timeout = request_timeout
+
+
+
+  def process_request_thread(self, request, client_address):
+    request.settimeout(self.request_timeout)
+    socketserver.ThreadingMixIn.process_request_thread(
+        self, request, client_address)
+
+
+
+  def handle_error(self, request, client_address):
+    # A connection cut off at its deadline, or dropped by the client, is not
+    # worth a traceback.
+    if isinstance(sys.exc_info()[1], socket.error):
+      return
+    socketserver.BaseServer.handle_error(self, request, client_address)
+
+
+
+
+
+class ThreadedBinaryRPCServer(_BinaryRPCServerMixIn, socketserver.TCPServer):
+  """
+  <Purpose>
+    Provides, over binary RPC (see uptane/binary_rpc.py) on TCP, the
+    functions registered with the given dispatcher.
+
+  <Arguments>
+    server_address
+      the (host, port) to listen on
+
+    dispatcher
+      an xmlrpc_server.SimpleXMLRPCDispatcher (e.g. a ThreadedXMLRPCServer,
+      whose concurrent_methods then apply to these calls too) with which the
+      functions to provide are registered
+
+    request_timeout (optional)
+      the number of seconds within which each call must be received, handled
+      and answered
+
+    reuse_port (optional)
+      if True, allow several processes to listen on the same port, with the
+      kernel distributing connections between them
+  """
+  allow_reuse_address = True
+
+  def __init__(self, server_address, dispatcher,
+      request_timeout=DEFAULT_REQUEST_TIMEOUT, reuse_port=False):
+    self._set_up(dispatcher, request_timeout)
+    self.reuse_port = reuse_port
+    socketserver.TCPServer.__init__(
+        self, server_address, BinaryRPCRequestHandler)
+
+
+
+  def server_bind(self):
+    if self.reuse_port:
+      self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    socketserver.TCPServer.server_bind(self)
+
+
+
+  def process_request_thread(self, request, client_address):
+    # Each response is written whole; don't hold back its last packet.
+    request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    _BinaryRPCServerMixIn.process_request_thread(
+        self, request, client_address)
+
+
+
+
+
+if hasattr(socket, 'AF_UNIX'):
+  class UnixBinaryRPCServer(
+      _BinaryRPCServerMixIn, socketserver.UnixStreamServer):
+    """
+    Provides, over binary RPC (see uptane/binary_rpc.py) on the Unix domain
+    socket with the given filename (which must not yet exist), the functions
+    registered with the given dispatcher, as ThreadedBinaryRPCServer does.
+    """
+    def __init__(self, socket_fname, dispatcher,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT):
+      self._set_up(dispatcher, request_timeout)
+      socketserver.UnixStreamServer.__init__(
+          self, socket_fname, BinaryRPCRequestHandler)
+
+
+
+
+
+class _ConnectionDeadlines(object):
+  """
+  The deadlines of the requests being handled, each for one connection, kept
+  by a single thread (started when first needed), which shuts down the
+  connection of any request whose deadline passes before it is cleared.
+  """
+  def __init__(self):
+    # Maps each connection (socket) to the time by which its request must be
+    # completed.
+    self._deadlines = {}
+    self._condition = threading.Condition()
+    self._thread = None
+
+
+
+  def set(self, request, timeout):
+    """
+    Sets the deadline of the request on the given connection to timeout
+    seconds from now.
+    """
+    with self._condition:
+      self._deadlines[request] = time.time() + timeout
+
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._shut_down_overdue)
+        self._thread.daemon = True
+        self._thread.start()
+
+      # The new deadline may be sooner than those the thread is waiting for.
+      self._condition.notify()
+
+
+
+  def clear(self, request):
+    """
+    Clears the deadline of the request on the given connection, which,
+    once this returns, will not be shut down for it.
+    """
+    with self._condition:
+      self._deadlines.pop(request, None)
+
+
+
+  def _shut_down_overdue(self):
+    with self._condition:
+      while True:
+        now = time.time()
+        for request, deadline in list(self._deadlines.items()):
+          if deadline <= now:
+            del self._deadlines[request]
+            _shut_down_connection(request)
+
+        if self._deadlines:
+          self._condition.wait(min(self._deadlines.values()) - now)
+        else:
+          self._condition.wait()
+
+
+
+
+
+_deadlines = _ConnectionDeadlines()
+
+
+
+
+
+def _shut_down_connection(request):
+  try:
+    request.shutdown(socket.SHUT_RDWR)
+  except socket.error:
+    pass # Already closed.
@@ -0,0 +1,139 @@
+"""
+stages.py
+
+Demonstration code for running the stages of a process (e.g. the Primary's
+update cycle) as a dependency graph: each stage runs, in its own thread, as
+soon as every stage it depends on has completed, so that stages that do not
+depend on each other overlap, and the process takes about as long as its
+longest chain of dependent stages rather than the sum of all of them. The
+time each stage takes is recorded.
+
+Use:
+  timings = stages.run_stages([
+      stages.Stage('a', get_a),
+      stages.Stage('b', get_b),
+      stages.Stage('c', combine, depends_on=['a', 'b'])]) # combine(a, b)
+  print(stages.format_timings(timings))
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+
+import sys
+import time
+import threading
+
+import six
+
+
+
+class Stage(object):
+  """
+  A stage of a process: a function to call, and the names of the stages that
+  must complete before it is called. The function is called with the results
+  of those stages, in the order they are listed.
+  """
+  def __init__(self, name, function, depends_on=()):
+    self.name = name
+    self.function = function
+    self.depends_on = list(depends_on)
+
+
+
+
+
+def run_stages(stages):
+  """
+  <Purpose>
+    Runs the given stages, each as soon as the stages it depends on have
+    completed, and waits for all of them.
+
+    If a stage raises an exception, the stages that depend on it (directly or
+    not) are not run, while the others run to completion; then the exception
+    raised by the first failed stage, in the order given, is raised again.
+
+  <Arguments>
+    stages
+      a list of Stage objects with distinct names, each listed after all of
+      the stages it depends on
+
+  <Exceptions>
+    uptane.Error
+      if stages are not listed after the stages they depend on, or two have
+      the same name
+
+  <Returns>
+    A dictionary mapping the name of each stage that ran to a dictionary with
+    keys 'result' (what its function returned), 'start', and 'end' (times in
+    seconds since run_stages() was called).
+  """
+  names_seen = set()
+  for stage in stages:
+    if stage.name in names_seen:
+      raise uptane.Error('Two stages are named ' + repr(stage.name))
+    for dependency in stage.depends_on:
+      if dependency not in names_seen:
+        raise uptane.Error('Stage ' + repr(stage.name) + ' depends on ' +
+            repr(dependency) + ', which is not listed before it.')
+    names_seen.add(stage.name)
+
+  start_time = time.time()
+  done = dict((stage.name, threading.Event()) for stage in stages)
+  timings = {}
+  errors = {}
+
+  def run(stage):
+    try:
+      for dependency in stage.depends_on:
+        done[dependency].wait()
+        if dependency not in timings:
+          return # Failed or skipped.
+
+      stage_start = time.time() - start_time
+      try:
+        result = stage.function(*[
+            timings[dependency]['result'] for dependency in stage.depends_on])
+      except Exception:
+        errors[stage.name] = sys.exc_info()
+        return
+
+      timings[stage.name] = {'result': result, 'start': stage_start,
+          'end': time.time() - start_time}
+
+    finally:
+      done[stage.name].set()
+
+  threads = [threading.Thread(target=run, args=(stage,)) for stage in stages]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  for stage in stages:
+    if stage.name in errors:
+      six.reraise(*errors[stage.name])
+
+  return timings
+
+
+
+
+
+def format_timings(timings):
+  """
+  Returns a line describing, in order of starting time, when each stage of a
+  run (see run_stages()) started and how long it took, and the total time.
+  """
+  if not timings:
+    return 'No stages ran.'
+
+  parts = []
+  for name in sorted(timings, key=lambda name: timings[name]['start']):
+    parts.append(name + ' ' + '%.2fs' % (
+        timings[name]['end'] - timings[name]['start']) +
+        ' (from %.2fs)' % timings[name]['start'])
+
+  return '; '.join(parts) + '. Total: %.2fs' % max(
+      timing['end'] for timing in timings.values())
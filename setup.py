@@ -93,6 +93,7 @@ setup(
     'Topic :: Software Development'
   ],
   install_requires = ['iso8601', 'tuf', 'six', 'canonicaljson'],
+  extras_require = {'analytics': ['numpy']},
   test_suite="tests.runtests",
   packages = find_packages(exclude=['tests']),
   scripts = []
@@ -0,0 +1,388 @@
+"""
+<Program Name>
+  test_binary_rpc.py
+
+<Purpose>
+  Unit testing for uptane/binary_rpc.py, and the binary RPC servers in
+  demo/rpc_server.py.
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import tuf
+
+import uptane.binary_rpc as binary_rpc
+import demo.rpc_server as rpc_server
+
+from six.moves import xmlrpc_client
+
+# Stands in for a DER-encoded ECU Manifest.
+DER_DATA = bytes(bytearray(range(256))) * 8
+
+SAMPLE_VALUES = [None, True, False, 0, -1, 2 ** 40, -2 ** 63, 1.5, '',
+    'ECU1é', [], [1, 'two', [None]], {}, {'ecu_serial': 'ECU1',
+    'nonces': [5, 6], 'attestation': {'signed': {'time': 1.25}}}]
+
+
+
+class TestBinaryRPCEncoding(unittest.TestCase):
+  """
+  "unittest"-style test class for the encoding of values and messages in
+  the binary_rpc module in the reference implementation
+  """
+
+  def test_encode_and_decode_values(self):
+    for value in SAMPLE_VALUES:
+      self.assertEqual(value,
+          binary_rpc.decode_value(binary_rpc.encode_value(value)))
+
+    # Tuples are sent as lists, as over XML-RPC.
+    self.assertEqual([1, 2],
+        binary_rpc.decode_value(binary_rpc.encode_value((1, 2))))
+
+    # Binary data, however given, arrives wrapped in a Binary.
+    for data in [DER_DATA, xmlrpc_client.Binary(DER_DATA)]:
+      decoded = binary_rpc.decode_value(binary_rpc.encode_value(data))
+      self.assertIsInstance(decoded, xmlrpc_client.Binary)
+      self.assertEqual(DER_DATA, decoded.data)
+
+    decoded = binary_rpc.decode_value(binary_rpc.encode_value(
+        {'manifest': xmlrpc_client.Binary(DER_DATA)}))
+    self.assertEqual(DER_DATA, decoded['manifest'].data)
+
+    # Binary data is carried as is: 5 bytes of overhead.
+    self.assertEqual(len(DER_DATA) + 5,
+        len(binary_rpc.encode_value(xmlrpc_client.Binary(DER_DATA))))
+
+
+
+  def test_smaller_than_xmlrpc(self):
+    params = ('democar', 'TCUdemocar', 12345, xmlrpc_client.Binary(DER_DATA))
+    binary_request = binary_rpc.encode_request('submit_ecu_manifest', params)
+    xmlrpc_request = xmlrpc_client.dumps(params, 'submit_ecu_manifest')
+
+    self.assertTrue(len(binary_request) < len(DER_DATA) + 128)
+    self.assertTrue(len(xmlrpc_request) > len(DER_DATA) * 4 / 3)
+
+
+
+  def test_unencodable_values(self):
+    for value in [2 ** 63, -2 ** 63 - 1, {1: 'not a string key'}, object(),
+        set([1])]:
+      with self.assertRaises(uptane.BadRPCMessage):
+        binary_rpc.encode_value(value)
+
+    nested = []
+    for i in range(binary_rpc.MAX_DEPTH + 1):
+      nested = [nested]
+    with self.assertRaises(uptane.BadRPCMessage):
+      binary_rpc.encode_value(nested)
+
+
+
+  def test_bad_data(self):
+    encoded = binary_rpc.encode_value(
+        {'ecu_serial': 'ECU1', 'manifest': DER_DATA})
+
+    for bad_data in [b'', b'X', b'i\x00\x00', encoded[:-1], encoded + b'N',
+        b's\x00\x00\x00\x02\xff\xfe', b'l\xff\xff\xff\xff',
+        b'm\x00\x00\x00\x01\x00\x00\x00\x01']:
+      with self.assertRaises(uptane.BadRPCMessage):
+        binary_rpc.decode_value(bad_data)
+
+    with self.assertRaises(uptane.BadRPCMessage):
+      binary_rpc.decode_value(b'l\x00\x00\x00\x01' * (binary_rpc.MAX_DEPTH + 1)
+          + b'N')
+
+
+
+  def test_requests_and_responses(self):
+    message = binary_rpc.encode_request('get_signed_time_der', ([1, 2],))
+    self.assertEqual(('get_signed_time_der', [[1, 2]]),
+        binary_rpc.decode_request(message))
+
+    self.assertEqual({'time': 1}, binary_rpc.decode_response(
+        binary_rpc.encode_response({'time': 1})))
+
+    with self.assertRaises(xmlrpc_client.Fault) as context:
+      binary_rpc.decode_response(binary_rpc.encode_fault(3, 'Unknown ECU'))
+    self.assertEqual(3, context.exception.faultCode)
+    self.assertEqual('Unknown ECU', context.exception.faultString)
+
+    # A message of another version, or a response where a request should be.
+    for bad_message in [b'', b'\x02' + message[1:],
+        binary_rpc.encode_response(None)]:
+      with self.assertRaises(uptane.BadRPCMessage):
+        binary_rpc.decode_request(bad_message)
+
+    with self.assertRaises(uptane.BadRPCMessage):
+      binary_rpc.decode_response(message)
+
+
+
+  def test_handle_request(self):
+    def dispatch(method, params):
+      if method == 'add':
+        return params[0] + params[1]
+      elif method == 'fault':
+        raise xmlrpc_client.Fault(7, 'Deliberate')
+      elif method == 'unencodable':
+        return object()
+      raise uptane.UnknownECU('Unknown ECU: ' + repr(params[0]))
+
+    def call(method, *params):
+      return binary_rpc.decode_response(binary_rpc.handle_request(
+          dispatch, binary_rpc.encode_request(method, params)))
+
+    self.assertEqual(5, call('add', 2, 3))
+
+    for method, fault_code in [('fault', 7), ('unknown', 1),
+        ('unencodable', 1)]:
+      with self.assertRaises(xmlrpc_client.Fault) as context:
+        call(method, 'ECU1')
+      self.assertEqual(fault_code, context.exception.faultCode)
+
+    with self.assertRaises(xmlrpc_client.Fault) as context:
+      binary_rpc.decode_response(
+          binary_rpc.handle_request(dispatch, b'\x01garbage'))
+    self.assertEqual(
+        binary_rpc.PARSE_ERROR_FAULT_CODE, context.exception.faultCode)
+
+
+
+
+
+class TestBinaryRPCServer(unittest.TestCase):
+  """
+  "unittest"-style test class for binary_rpc.ServerProxy and the binary RPC
+  servers of demo/rpc_server.py, against local servers
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.temp_dir = tempfile.mkdtemp()
+    cls.connections = [0]
+
+    # The functions are registered with an XML-RPC server, never started,
+    # as in the demo.
+    cls.xmlrpc_server = rpc_server.ThreadedXMLRPCServer(('localhost', 0),
+        allow_none=True, logRequests=False)
+    cls.xmlrpc_server.register_function(lambda value: value, 'echo')
+    cls.xmlrpc_server.register_function(
+        lambda data: xmlrpc_client.Binary(data.data[::-1]), 'reverse')
+
+    def fail(ecu_serial):
+      raise uptane.UnknownECU('Unknown ECU: ' + repr(ecu_serial))
+    cls.xmlrpc_server.register_function(fail, 'fail')
+
+    # Count the connections made to the servers.
+    def verify_request(request, client_address):
+      cls.connections[0] += 1
+      return True
+
+    cls.servers = [rpc_server.ThreadedBinaryRPCServer(
+        ('localhost', 0), cls.xmlrpc_server, request_timeout=5)]
+    cls.addresses = [('localhost', cls.servers[0].server_address[1])]
+
+    if hasattr(rpc_server, 'UnixBinaryRPCServer'):
+      socket_fname = os.path.join(cls.temp_dir, 'primary.sock')
+      cls.servers.append(rpc_server.UnixBinaryRPCServer(
+          socket_fname, cls.xmlrpc_server, request_timeout=5))
+      cls.addresses.append(socket_fname)
+
+    for server in cls.servers:
+      server.verify_request = verify_request
+      thread = threading.Thread(target=server.serve_forever)
+      thread.daemon = True
+      thread.start()
+
+
+
+  @classmethod
+  def tearDownClass(cls):
+    for server in cls.servers:
+      server.shutdown()
+      server.server_close()
+    cls.xmlrpc_server.server_close()
+    shutil.rmtree(cls.temp_dir)
+
+
+
+  def test_init(self):
+    for bad_arguments in [{'address': 42},
+        {'address': ('localhost', 'port')},
+        {'address': ('localhost', 1, 2)},
+        {'address': ('localhost', 1), 'timeout': None},
+        {'address': ('localhost', 1), 'max_idle_connections': -1}]:
+      with self.assertRaises(tuf.FormatError):
+        binary_rpc.ServerProxy(**bad_arguments)
+
+
+
+  def test_calls(self):
+    for address in self.addresses:
+      proxy = binary_rpc.ServerProxy(address)
+      connections = self.connections[0]
+
+      for value in SAMPLE_VALUES:
+        self.assertEqual(value, proxy.echo(value))
+
+      self.assertEqual(DER_DATA[::-1],
+          proxy.reverse(xmlrpc_client.Binary(DER_DATA)).data)
+
+      with self.assertRaises(xmlrpc_client.Fault) as context:
+        proxy.fail('ECU1')
+      self.assertIn('UnknownECU', context.exception.faultString)
+
+      with self.assertRaises(xmlrpc_client.Fault):
+        proxy.no_such_function()
+
+      # All calls, including those that failed, used one connection.
+      self.assertEqual(connections + 1, self.connections[0])
+
+      # A parameter that cannot be sent does not break the connection.
+      with self.assertRaises(uptane.BadRPCMessage):
+        proxy.echo(object())
+      self.assertEqual('ECU1', proxy.echo('ECU1'))
+      self.assertEqual(connections + 1, self.connections[0])
+
+      proxy.close()
+
+
+
+  def test_concurrent_calls(self):
+    proxy = binary_rpc.ServerProxy(self.addresses[0])
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(
+        proxy.echo(i))) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(list(range(4)), sorted(results))
+    proxy.close()
+
+
+
+  def test_retry_on_closed_connection(self):
+    proxy = binary_rpc.ServerProxy(self.addresses[0])
+    self.assertEqual(1, proxy.echo(1))
+
+    # Break the idle connection, as if the server had closed it.
+    for sock, idle_since in proxy._idle:
+      sock.close()
+
+    self.assertEqual(2, proxy.echo(2))
+    proxy.close()
+
+
+
+  def test_reuse_after_server_closes_connection(self):
+    server = rpc_server.ThreadedBinaryRPCServer(
+        ('localhost', 0), self.xmlrpc_server, request_timeout=0.5)
+    connections = [0]
+    def verify_request(request, client_address):
+      connections[0] += 1
+      return True
+    server.verify_request = verify_request
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    proxy = binary_rpc.ServerProxy(('localhost', server.server_address[1]))
+    try:
+      self.assertEqual(1, proxy.echo(1))
+
+      # The server closes the idle connection at the deadline for the next
+      # call; the proxy sees that before reusing it, and connects anew.
+      time.sleep(1)
+      self.assertEqual(2, proxy.echo(2))
+      self.assertEqual(2, connections[0])
+
+      # A client too slow to send its call is cut off at the deadline.
+      sock = socket.create_connection(('localhost', server.server_address[1]))
+      try:
+        sock.sendall(b'\x00')
+        start = time.time()
+        self.assertIsNone(binary_rpc.read_message(sock))
+        self.assertLess(time.time() - start, 5)
+      finally:
+        sock.close()
+
+    finally:
+      proxy.close()
+      server.shutdown()
+      server.server_close()
+
+
+
+  def test_no_resend_after_call_sent(self):
+    # A server that answers the first call on a connection, and closes the
+    # connection on receiving the second, without answering.
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(5)
+    received = []
+
+    def serve():
+      sock = listener.accept()[0]
+      try:
+        for i in range(2):
+          received.append(binary_rpc.read_message(sock))
+          if i == 0:
+            binary_rpc.write_message(sock, binary_rpc.encode_response(1))
+      finally:
+        sock.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    proxy = binary_rpc.ServerProxy(listener.getsockname(), timeout=5)
+    try:
+      self.assertEqual(1, proxy.echo(1))
+
+      # The server may have handled the call before closing the connection,
+      # so it is not sent again.
+      with self.assertRaises(socket.error):
+        proxy.echo(2)
+      thread.join(5)
+      self.assertEqual(2, len(received))
+
+      # No new connection was made to send it again.
+      listener.settimeout(0)
+      with self.assertRaises(socket.error):
+        listener.accept()
+
+    finally:
+      proxy.close()
+      listener.close()
+
+
+
+  def test_bad_frame_closes_connection(self):
+    sock = socket.create_connection(self.addresses[0])
+    try:
+      sock.sendall(struct.pack('>I', binary_rpc.MAX_MESSAGE_LENGTH + 1))
+      self.assertIsNone(binary_rpc.read_message(sock))
+
+    finally:
+      sock.close()
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,140 @@
+"""
+<Program Name>
+  test_change_notifier.py
+
+<Purpose>
+  Unit testing for demo/change_notifier.py
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import threading
+import time
+
+import demo.change_notifier as change_notifier
+
+
+
+class TestChangeNotifier(unittest.TestCase):
+  """
+  "unittest"-style test class for ChangeNotifier and ChangeWatcher in the
+  change_notifier module of the demo
+  """
+
+  def test_versions(self):
+    notifier = change_notifier.ChangeNotifier()
+    version = notifier.get_version('democar')
+
+    self.assertEqual(version, notifier.get_version('democar'))
+    self.assertEqual(version, notifier.get_version('othercar'))
+
+    notifier.notify_change('democar')
+    self.assertNotEqual(version, notifier.get_version('democar'))
+    self.assertEqual(version, notifier.get_version('othercar'))
+
+    # Another notifier (e.g. after a restart) never repeats these versions.
+    self.assertNotEqual(
+        version, change_notifier.ChangeNotifier().get_version('democar'))
+
+
+
+  def test_wait_for_change(self):
+    notifier = change_notifier.ChangeNotifier()
+
+    version = notifier.wait_for_change('democar', None, timeout=10)
+    self.assertEqual(notifier.get_version('democar'), version)
+
+    # Nothing changes: the wait ends with the timeout.
+    start = time.time()
+    self.assertEqual(
+        version, notifier.wait_for_change('democar', version, timeout=0.1))
+    self.assertTrue(time.time() - start >= 0.1)
+
+    # The wait ends as soon as the version changes, not at the timeout.
+    timer = threading.Timer(0.1, notifier.notify_change, ('democar',))
+    timer.start()
+    start = time.time()
+    new_version = notifier.wait_for_change('democar', version, timeout=10)
+    timer.join()
+    self.assertNotEqual(version, new_version)
+    self.assertEqual(notifier.get_version('democar'), new_version)
+    self.assertTrue(time.time() - start < 5)
+
+    # A change made before the wait is reported at once.
+    notifier.notify_change('democar')
+    self.assertNotEqual(new_version,
+        notifier.wait_for_change('democar', new_version, timeout=10))
+
+    # No wait is longer than max_wait.
+    notifier = change_notifier.ChangeNotifier(max_wait=0.1)
+    start = time.time()
+    notifier.wait_for_change('democar', notifier.get_version('democar'),
+        timeout=10)
+    self.assertTrue(time.time() - start < 5)
+
+
+
+  def test_change_watcher(self):
+    notifiers = {
+        'director': change_notifier.ChangeNotifier(max_wait=0.5),
+        'imagerepo': change_notifier.ChangeNotifier(max_wait=0.5)}
+    watcher = change_notifier.ChangeWatcher(dict(
+        (name, lambda version, timeout, notifier=notifier:
+        notifier.wait_for_change(None, version, timeout))
+        for name, notifier in notifiers.items()), max_wait=0.5)
+
+    versions = watcher.wait_for_change(None, timeout=10)
+    self.assertEqual(dict((name, notifier.get_version())
+        for name, notifier in notifiers.items()), versions)
+
+    # One thread is started for each repository, on the first wait only.
+    threads = list(watcher._threads)
+    self.assertEqual(2, len(threads))
+    self.assertTrue(all(thread.is_alive() for thread in threads))
+
+    # Nothing changes: the wait ends with the timeout.
+    self.assertEqual(versions, watcher.wait_for_change(versions, timeout=0.1))
+
+    for name in ['imagerepo', 'director']:
+      timer = threading.Timer(0.1, notifiers[name].notify_change)
+      timer.start()
+      new_versions = watcher.wait_for_change(versions, timeout=10)
+      timer.join()
+
+      self.assertEqual(notifiers[name].get_version(), new_versions[name])
+      self.assertNotEqual(versions[name], new_versions[name])
+      versions = new_versions
+
+    self.assertEqual(threads, watcher._threads)
+
+
+
+  def test_change_watcher_failure(self):
+    def fail(version, timeout):
+      raise IOError('Repository unreachable')
+
+    notifier = change_notifier.ChangeNotifier(max_wait=0.5)
+    watcher = change_notifier.ChangeWatcher({
+        'director': lambda version, timeout:
+        notifier.wait_for_change(None, version, timeout),
+        'imagerepo': fail}, max_wait=0.5, retry_interval=0.1)
+
+    # A repository that cannot be asked ends the wait, so that the client can
+    # look for changes itself, and is asked again after retry_interval.
+    for i in range(2):
+      start = time.time()
+      versions = watcher.wait_for_change(
+          {'director': notifier.get_version(), 'imagerepo': None},
+          timeout=10)
+      self.assertTrue(time.time() - start < 5)
+      self.assertIsNone(versions['imagerepo'])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
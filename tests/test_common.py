@@ -17,12 +17,16 @@ import os.path
 import shutil # for rmtree
 import copy
 import json
+import hashlib
+import time
+import threading
 
 import tuf
 import tuf.formats
 import tuf.conf
 
 import uptane.common as common
+import uptane.formats
 import uptane.encoding.asn1_codec as asn1_codec
 
 from uptane.encoding.asn1_codec import DATATYPE_TIME_ATTESTATION
@@ -507,6 +511,120 @@ class TestCommon(unittest.TestCase):
 
 
 
+
+  def test_merkle_tree(self):
+    """
+    Tests compute_merkle_tree and verify_merkle_inclusion, used for batched
+    time attestations.
+    """
+    with self.assertRaises(uptane.Error):
+      common.compute_merkle_tree([])
+
+    # Try trees of several sizes, including odd sizes where a node must be
+    # promoted unpaired.
+    for n_leaves in [1, 2, 3, 5, 8, 13]:
+      leaves = [('leaf' + str(i)).encode('utf-8') for i in range(n_leaves)]
+      root, proofs = common.compute_merkle_tree(leaves)
+
+      tuf.formats.HASH_SCHEMA.check_match(root)
+      self.assertEqual(n_leaves, len(proofs))
+
+      for i, leaf in enumerate(leaves):
+        uptane.formats.MERKLE_PROOF_SCHEMA.check_match(proofs[i])
+        self.assertEqual(i, proofs[i]['leaf_index'])
+        self.assertTrue(common.verify_merkle_inclusion(leaf, proofs[i], root))
+
+        # The proof must not work for other data, or with another leaf's
+        # proof.
+        self.assertFalse(
+            common.verify_merkle_inclusion(b'not a leaf', proofs[i], root))
+        if n_leaves > 1:
+          self.assertFalse(common.verify_merkle_inclusion(
+              leaf, proofs[(i + 1) % n_leaves], root))
+
+    # A single leaf's root is the leaf hash itself, and its proof is empty.
+    root, proofs = common.compute_merkle_tree([b'a'])
+    self.assertEqual([], proofs[0]['siblings'])
+    self.assertEqual(hashlib.sha256(b'\x00a').hexdigest(), root)
+
+
+
+
+
+
+  def test_refresh_repositories(self):
+    repo_names = ['director', 'imagerepo']
+
+    # Sequential refresh: the Director first, then the rest, taking the sum
+    # of the refresh times.
+    updater = SlowUpdater(repo_names)
+    start = time.time()
+    common.refresh_repositories(updater, 'director')
+    self.assertGreaterEqual(
+        time.time() - start, 2 * SlowUpdater.REFRESH_TIME)
+    self.assertEqual(repo_names, updater.refreshed)
+
+    # Concurrent refresh: all repositories are refreshed, in about the time
+    # one takes.
+    updater = SlowUpdater(repo_names)
+    start = time.time()
+    common.refresh_repositories(updater, 'director', concurrent=True)
+    self.assertLess(time.time() - start, 2 * SlowUpdater.REFRESH_TIME)
+    self.assertEqual(sorted(repo_names), sorted(updater.refreshed))
+
+    # In sequential mode, a failure to refresh the Director stops the refresh.
+    updater = SlowUpdater(
+        repo_names, errors={'director': tuf.NoWorkingMirrorError({})})
+    with self.assertRaises(tuf.NoWorkingMirrorError):
+      common.refresh_repositories(updater, 'director')
+    self.assertEqual(['director'], updater.refreshed)
+
+    # In concurrent mode, the Director's error takes precedence over others.
+    updater = SlowUpdater(repo_names, errors={
+        'director': tuf.NoWorkingMirrorError({}),
+        'imagerepo': tuf.ExpiredMetadataError('expired')})
+    with self.assertRaises(tuf.NoWorkingMirrorError):
+      common.refresh_repositories(updater, 'director', concurrent=True)
+
+    # Otherwise, another repository's error is raised once all are done.
+    updater = SlowUpdater(
+        repo_names, errors={'imagerepo': tuf.ExpiredMetadataError('expired')})
+    with self.assertRaises(tuf.ExpiredMetadataError):
+      common.refresh_repositories(updater, 'director', concurrent=True)
+    self.assertEqual(sorted(repo_names), sorted(updater.refreshed))
+
+    with self.assertRaises(tuf.FormatError):
+      common.refresh_repositories(updater, 5)
+
+
+
+
+
+class SlowUpdater(object):
+  """
+  Stands in for a TAP-4 tuf.client.updater.Updater in
+  test_refresh_repositories: each refresh takes REFRESH_TIME seconds, and
+  fails with the given error if one is listed for that repository.
+  """
+  REFRESH_TIME = 0.5
+
+  def __init__(self, repo_names, errors=None):
+    self.repositories = dict((repo_name, None) for repo_name in repo_names)
+    self.errors = errors or {}
+    self.refreshed = []
+    self.lock = threading.Lock()
+
+  def refresh(self, repo_name):
+    time.sleep(self.REFRESH_TIME)
+    with self.lock:
+      self.refreshed.append(repo_name)
+    if repo_name in self.errors:
+      raise self.errors[repo_name]
+
+
+
+
+
 # Run unit test.
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,318 @@
+"""
+<Program Name>
+  test_connection_pool.py
+
+<Purpose>
+  Unit testing for uptane/connection_pool.py, against local HTTP and XML-RPC
+  servers that keep connections alive.
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import tuf
+import tuf.download
+
+import uptane.connection_pool as connection_pool
+import demo.repo_server as repo_server
+import demo.rpc_server as rpc_server
+
+from six.moves import xmlrpc_client
+from six.moves.urllib.error import HTTPError
+
+IMAGE_DATA = b'Contents of an image. ' * 1000
+
+
+
+class CountingHTTPServer(repo_server.RepositoryHTTPServer):
+  """A RepositoryHTTPServer that counts the connections made to it."""
+  connections = 0
+
+  def process_request(self, request, client_address):
+    self.connections += 1
+    repo_server.RepositoryHTTPServer.process_request(
+        self, request, client_address)
+
+
+
+class KeepAliveRequestHandler(rpc_server.KeepAliveRequestHandler):
+  rpc_paths = ('/RPC2',)
+
+
+
+class CountingXMLRPCServer(rpc_server.ThreadedXMLRPCServer):
+  """A ThreadedXMLRPCServer that counts the connections made to it."""
+  connections = 0
+
+  def process_request(self, request, client_address):
+    self.connections += 1
+    rpc_server.ThreadedXMLRPCServer.process_request(
+        self, request, client_address)
+
+
+
+
+
+def start_server(server):
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return 'localhost:' + str(server.server_address[1])
+
+
+
+
+
+class TestConnectionPool(unittest.TestCase):
+  """
+  "unittest"-style test class for the connection_pool module in the
+  reference implementation
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.temp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(cls.temp_dir, 'targets'))
+    with open(os.path.join(cls.temp_dir, 'targets', 'image.img'), 'wb') as fobj:
+      fobj.write(IMAGE_DATA)
+
+    cls.http_server = CountingHTTPServer(('localhost', 0), cls.temp_dir)
+    cls.http_netloc = start_server(cls.http_server)
+    cls.image_url = 'http://' + cls.http_netloc + '/targets/image.img'
+
+    cls.rpc_server = CountingXMLRPCServer(('localhost', 0),
+        requestHandler=KeepAliveRequestHandler, allow_none=True,
+        logRequests=False)
+    cls.rpc_server.register_function(lambda value: value, 'echo')
+    cls.rpc_netloc = start_server(cls.rpc_server)
+
+
+
+  @classmethod
+  def tearDownClass(cls):
+    for server in [cls.http_server, cls.rpc_server]:
+      server.shutdown()
+      server.server_close()
+    shutil.rmtree(cls.temp_dir)
+
+
+
+  def fetch(self, pool, url=None):
+    response = pool.urlopen(url or self.image_url)
+    try:
+      return response.read()
+    finally:
+      response.close()
+
+
+
+  def test_init(self):
+    pool = connection_pool.ConnectionPool()
+    self.assertEqual(
+        connection_pool.DEFAULT_MAX_IDLE_CONNECTIONS, pool.max_idle_connections)
+
+    for bad_arguments in [{'max_idle_connections': -1},
+        {'max_idle_time': 'ten'}, {'timeout': None}]:
+      with self.assertRaises(tuf.FormatError):
+        connection_pool.ConnectionPool(**bad_arguments)
+
+
+
+  def test_urlopen_reuses_connections(self):
+    pool = connection_pool.ConnectionPool()
+    connections = self.http_server.connections
+
+    for i in range(3):
+      self.assertEqual(IMAGE_DATA, self.fetch(pool))
+
+    self.assertEqual(connections + 1, self.http_server.connections)
+
+    with self.assertRaises(HTTPError):
+      pool.urlopen('http://' + self.http_netloc + '/targets/missing.img')
+
+    # The server closes the connection after an error; a new one is made.
+    self.assertEqual(IMAGE_DATA, self.fetch(pool))
+
+    with self.assertRaises(ValueError):
+      pool.urlopen('file:///etc/passwd')
+
+    pool.close()
+
+
+
+  def test_partly_read_response_closes_connection(self):
+    pool = connection_pool.ConnectionPool()
+    connections = self.http_server.connections
+
+    response = pool.urlopen(self.image_url)
+    self.assertEqual(IMAGE_DATA[:10], response.read(10))
+    self.assertEqual(
+        str(len(IMAGE_DATA)), response.info().get('Content-Length'))
+    response.close()
+
+    self.assertEqual(IMAGE_DATA, self.fetch(pool))
+    self.assertEqual(connections + 2, self.http_server.connections)
+
+
+
+  def test_limits(self):
+    # Keeping no idle connections makes every request use a new one.
+    pool = connection_pool.ConnectionPool(max_idle_connections=0)
+    connections = self.http_server.connections
+    for i in range(3):
+      self.assertEqual(IMAGE_DATA, self.fetch(pool))
+    self.assertEqual(connections + 3, self.http_server.connections)
+
+    # A connection idle for too long is not reused.
+    pool = connection_pool.ConnectionPool(max_idle_time=0)
+    connections = self.http_server.connections
+    self.fetch(pool)
+    time.sleep(0.05)
+    self.fetch(pool)
+    self.assertEqual(connections + 2, self.http_server.connections)
+
+
+
+  def test_retry_on_closed_connection(self):
+    pool = connection_pool.ConnectionPool()
+    self.fetch(pool)
+
+    # Break the idle connection, as if the server had closed it.
+    for idle in pool._idle.values():
+      for connection, idle_since in idle:
+        connection.sock.close()
+
+    self.assertEqual(IMAGE_DATA, self.fetch(pool))
+
+
+
+  def test_observer(self):
+    outcomes = []
+    pool = connection_pool.ConnectionPool(
+        observer=lambda url, latency: outcomes.append((url, latency)))
+
+    self.fetch(pool)
+    with self.assertRaises(HTTPError):
+      pool.urlopen('http://' + self.http_netloc + '/targets/missing.img')
+
+    # A missing file is not the server's failure.
+    self.assertEqual(2, len(outcomes))
+    for url, latency in outcomes:
+      self.assertTrue(url.startswith('http://' + self.http_netloc + '/'))
+      self.assertTrue(latency >= 0)
+
+    pool.close()
+
+
+
+  def test_pooled_transport(self):
+    pool = connection_pool.ConnectionPool()
+    proxy = xmlrpc_client.ServerProxy('http://' + self.rpc_netloc,
+        transport=connection_pool.PooledTransport(pool), allow_none=True)
+    connections = self.rpc_server.connections
+
+    for value in ['one', 2, None, {'three': [3]}]:
+      self.assertEqual(value, proxy.echo(value))
+
+    self.assertEqual(connections + 1, self.rpc_server.connections)
+
+    # The transport can be used from several threads at once.
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(
+        proxy.echo(i))) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(list(range(4)), sorted(results))
+    self.assertTrue(self.rpc_server.connections <= connections + 4)
+
+    bad_proxy = xmlrpc_client.ServerProxy('http://' + self.rpc_netloc +
+        '/wrong', transport=connection_pool.PooledTransport(pool))
+    with self.assertRaises(xmlrpc_client.ProtocolError):
+      bad_proxy.echo(1)
+
+    pool.close()
+
+
+
+  def test_use_for_tuf_downloads(self):
+    original = tuf.download._open_connection
+    pool = connection_pool.ConnectionPool()
+    connections = self.http_server.connections
+
+    connection_pool.use_for_tuf_downloads(pool)
+    try:
+      self.assertIsNot(original, tuf.download._open_connection)
+      for i in range(2):
+        response = tuf.download._open_connection(self.image_url)
+        self.assertEqual(IMAGE_DATA, response.read(len(IMAGE_DATA)))
+        response.close()
+      self.assertEqual(connections + 1, self.http_server.connections)
+
+    finally:
+      connection_pool.use_for_tuf_downloads(None)
+
+    self.assertIs(original, tuf.download._open_connection)
+
+
+
+  def test_max_downloads_per_server(self):
+    pool = connection_pool.ConnectionPool()
+
+    for bad_limit in [0, 'two']:
+      with self.assertRaises(tuf.FormatError):
+        connection_pool.use_for_tuf_downloads(pool, bad_limit)
+
+    connection_pool.use_for_tuf_downloads(pool, 1)
+    try:
+      first = tuf.download._open_connection(self.image_url)
+
+      # A second download from the same server waits for the first.
+      opened = threading.Event()
+      def open_second():
+        second = tuf.download._open_connection(self.image_url)
+        opened.set()
+        second.read(len(IMAGE_DATA))
+        second.close()
+      thread = threading.Thread(target=open_second)
+      thread.daemon = True
+      thread.start()
+
+      self.assertFalse(opened.wait(0.2))
+
+      # A download from another server (as far as URLs go) does not.
+      other = tuf.download._open_connection(
+          self.image_url.replace('localhost', '127.0.0.1'))
+      self.assertEqual(IMAGE_DATA, other.read(len(IMAGE_DATA)))
+      other.close()
+
+      first.read(len(IMAGE_DATA))
+      first.close()
+      self.assertTrue(opened.wait(5))
+      thread.join(5)
+
+      # A failed download frees its slot.
+      for i in range(2):
+        with self.assertRaises(HTTPError):
+          tuf.download._open_connection(
+              'http://' + self.http_netloc + '/targets/missing.img')
+
+    finally:
+      connection_pool.use_for_tuf_downloads(None)
+      pool.close()
+
+
+
+if __name__ == '__main__':
+  unittest.main()
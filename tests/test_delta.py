@@ -0,0 +1,165 @@
+"""
+<Program Name>
+  test_delta.py
+
+<Purpose>
+  Unit testing for uptane/delta.py
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+import io
+import shutil
+import struct
+import hashlib
+import tempfile
+
+import tuf
+
+import uptane.delta as delta
+
+
+BASE_IMAGE = b''.join(
+    b'Line ' + str(i).encode('ascii') + b' of the base image.\n'
+    for i in range(500))
+
+# The base image with a few lines changed, one removed, and some data added.
+TARGET_IMAGE = BASE_IMAGE.replace(b'Line 7 ', b'Line seven ').replace(
+    b'Line 300 of the base image.\n', b'') + b'Some new data at the end.\n'
+
+
+
+class TestDelta(unittest.TestCase):
+  """
+  "unittest"-style test class for the delta module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.base_fname = os.path.join(self.temp_dir, 'base.img')
+    with open(self.base_fname, 'wb') as fobj:
+      fobj.write(BASE_IMAGE)
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+  def apply(self, delta_data):
+    chunks = []
+    delta.apply_delta(self.base_fname, io.BytesIO(delta_data), chunks.append)
+    return b''.join(chunks)
+
+
+
+  def test_create_and_apply(self):
+    delta_data = delta.create_delta(BASE_IMAGE, TARGET_IMAGE)
+
+    # Most of the target image is copied from the base image.
+    self.assertLess(len(delta_data), len(TARGET_IMAGE) // 10)
+    self.assertEqual(TARGET_IMAGE, self.apply(delta_data))
+
+    # Images with nothing in common, and empty images, work too.
+    for target_image in [b'', b'x', os.urandom(5000)]:
+      self.assertEqual(target_image,
+          self.apply(delta.create_delta(BASE_IMAGE, target_image)))
+
+    open(self.base_fname, 'wb').close()
+    self.assertEqual(TARGET_IMAGE,
+        self.apply(delta.create_delta(b'', TARGET_IMAGE)))
+
+    with self.assertRaises(tuf.FormatError):
+      delta.create_delta(BASE_IMAGE, TARGET_IMAGE, block_size=0)
+
+
+
+  def test_wrong_base(self):
+    delta_data = delta.create_delta(TARGET_IMAGE, BASE_IMAGE)
+
+    with self.assertRaises(uptane.Error):
+      self.apply(delta_data)
+
+
+
+  def test_malformed_delta(self):
+    delta_data = delta.create_delta(BASE_IMAGE, TARGET_IMAGE)
+
+    for bad_delta in [
+        b'', b'not a delta at all', delta_data[:-1],
+        delta_data + b'A\x00\x00\x00\x01x', # Produces too much.
+        delta_data + b'X']: # Unrecognized instruction.
+      with self.assertRaises(uptane.Error):
+        self.apply(bad_delta)
+
+
+
+  def test_oversized_add(self):
+    # A delta declaring a 4 GiB image made by a single ADD of nearly 4 GiB,
+    # of which it has only a little data: the data is read a chunk at a time,
+    # not all at once, before the delta is found to be truncated.
+    bad_delta = delta.DELTA_MAGIC + \
+        struct.pack('>Q32s', len(BASE_IMAGE),
+        hashlib.sha256(BASE_IMAGE).digest()) + \
+        struct.pack('>Q32s', 2**32, b'\x00' * 32) + \
+        b'A' + struct.pack('>I', 2**32 - 1) + b'x' * 100000
+
+    chunks = []
+    with self.assertRaises(uptane.Error):
+      delta.apply_delta(self.base_fname, io.BytesIO(bad_delta), chunks.append)
+    self.assertTrue(all(len(chunk) <= 64 * 1024 for chunk in chunks))
+
+
+
+  def test_header_and_target_fileinfo(self):
+    delta_data = delta.create_delta(BASE_IMAGE, TARGET_IMAGE)
+    base_sha256 = hashlib.sha256(BASE_IMAGE).hexdigest()
+    target_sha256 = hashlib.sha256(TARGET_IMAGE).hexdigest()
+
+    self.assertEqual(
+        (len(BASE_IMAGE), base_sha256, len(TARGET_IMAGE), target_sha256),
+        delta.read_delta_header(io.BytesIO(delta_data)))
+
+    with self.assertRaises(uptane.Error):
+      delta.read_delta_header(io.BytesIO(b'not a delta at all'))
+
+    # A delta that produces the expected image is applied...
+    chunks = []
+    delta.apply_delta(self.base_fname, io.BytesIO(delta_data), chunks.append,
+        {'length': len(TARGET_IMAGE), 'hashes': {'sha256': target_sha256}})
+    self.assertEqual(TARGET_IMAGE, b''.join(chunks))
+
+    # ...and one that declares it produces any other image is rejected before
+    # anything is produced.
+    for fileinfo in [
+        {'length': len(TARGET_IMAGE) + 1, 'hashes': {'sha256': target_sha256}},
+        {'length': len(TARGET_IMAGE), 'hashes': {'sha256': base_sha256}}]:
+      chunks = []
+      with self.assertRaises(uptane.Error):
+        delta.apply_delta(self.base_fname, io.BytesIO(delta_data),
+            chunks.append, fileinfo)
+      self.assertEqual([], chunks)
+
+
+
+  def test_get_delta_fname(self):
+    self.assertEqual('ab12-cd34.delta', delta.get_delta_fname('ab12', 'cd34'))
+
+    with self.assertRaises(tuf.FormatError):
+      delta.get_delta_fname('../ab12', 'cd34')
+
+
+
+
+
+# Run unit tests.
+if __name__ == '__main__':
+  unittest.main()
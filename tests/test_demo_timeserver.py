@@ -0,0 +1,85 @@
+"""
+<Program Name>
+  test_demo_timeserver.py
+
+<Purpose>
+  Unit testing for the request statistics kept by demo/demo_timeserver.py
+  (RequestStats and latency_percentiles).
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+
+import demo.demo_timeserver as demo_timeserver
+
+# 0 ms to 100 ms, in steps of 10 ms, in seconds.
+LATENCIES = [i / 100.0 for i in range(11)]
+
+
+
+class TestDemoTimeserverStats(unittest.TestCase):
+  """
+  "unittest"-style test class for the request statistics of the demo
+  Timeserver
+  """
+
+  def test_latency_percentiles(self):
+    percentiles = demo_timeserver.latency_percentiles(
+        LATENCIES, percentiles=(0, 50, 90, 99, 100))
+
+    self.assertEqual(['0', '100', '50', '90', '99'], sorted(percentiles))
+    for percentile, expected_ms in [
+        ('0', 0), ('50', 50), ('90', 90), ('99', 100), ('100', 100)]:
+      self.assertAlmostEqual(expected_ms, percentiles[percentile])
+
+    # Every percentile of a single latency is that latency.
+    self.assertEqual({'50': 250.0, '99': 250.0},
+        demo_timeserver.latency_percentiles([0.25], percentiles=(50, 99)))
+
+    self.assertEqual({}, demo_timeserver.latency_percentiles([]))
+
+
+
+  def test_request_stats(self):
+    stats = demo_timeserver.RequestStats()
+
+    summary = stats.summary()
+    self.assertEqual(0, summary['requests'])
+    self.assertEqual({}, summary['latency_ms'])
+    self.assertEqual(os.getpid(), summary['pid'])
+
+    # Latencies may be recorded in any order.
+    for latency in reversed(LATENCIES):
+      stats.record(latency)
+
+    summary = stats.summary(percentiles=(50, 90))
+    self.assertEqual(len(LATENCIES), summary['requests'])
+    self.assertTrue(summary['elapsed'] >= 0)
+    self.assertTrue(summary['requests_per_second'] >= 0)
+    self.assertAlmostEqual(50, summary['latency_ms']['50'])
+    self.assertAlmostEqual(90, summary['latency_ms']['90'])
+
+
+
+  def test_request_stats_sample_limit(self):
+    stats = demo_timeserver.RequestStats(max_samples=4)
+
+    for latency in [0.01, 0.02, 0.03, 0.04, 0.05]:
+      stats.record(latency)
+
+    # Every request is counted, but only the most recent latencies kept.
+    self.assertEqual(5, stats.n_requests)
+    self.assertEqual([0.03, 0.04, 0.05], stats.latencies)
+    self.assertAlmostEqual(
+        30, stats.summary(percentiles=(0,))['latency_ms']['0'])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
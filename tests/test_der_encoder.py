@@ -19,6 +19,7 @@ import uptane.common
 import uptane.encoding.asn1_codec as asn1_codec
 import uptane.encoding.timeserver_asn1_coder as timeserver_asn1_coder
 import uptane.encoding.ecu_manifest_asn1_coder as ecu_manifest_asn1_coder
+import uptane.encoding.image_block_asn1_coder as image_block_asn1_coder
 import uptane.encoding.asn1_definitions as asn1_spec
 import pyasn1.codec.der.encoder as p_der_encoder
 import pyasn1.codec.der.decoder as p_der_decoder
@@ -504,6 +505,97 @@ class TestASN1(unittest.TestCase):
 
 
 
+  def test_21_vehicle_manifest_der_splicing(self):
+    """
+    Tests reading ECU Manifest fields directly from DER, and building a
+    DER Vehicle Manifest from DER ECU Manifests without decoding them.
+    """
+    attack_ecu_manifest = copy.deepcopy(SAMPLE_ECU_MANIFEST_SIGNABLE)
+    attack_ecu_manifest['signed']['attacks_detected'] = 'Some attack.'
+
+    der_ecu_manifests = []
+    for ecu_manifest in [SAMPLE_ECU_MANIFEST_SIGNABLE, attack_ecu_manifest]:
+      der_ecu_manifest = asn1_codec.convert_signed_metadata_to_der(
+          ecu_manifest, DATATYPE_ECU_MANIFEST)
+      der_ecu_manifests.append(der_ecu_manifest)
+
+      header = ecu_manifest_asn1_coder.get_json_header_from_der(
+          der_ecu_manifest, include_installed_image=True)
+      for field in ['ecu_serial', 'attacks_detected', 'installed_image']:
+        self.assertEqual(ecu_manifest['signed'][field], header[field])
+
+      # Anything but a single, whole ECU Manifest is rejected.
+      for bad_der in [der_ecu_manifest[:-1], der_ecu_manifest + b'\x00',
+          der_ecu_manifest[:3], b'\x31' + der_ecu_manifest[1:]]:
+        with self.assertRaises(uptane.FailedToDecodeASN1DER):
+          ecu_manifest_asn1_coder.get_json_header_from_der(bad_der)
+
+    # The spliced Vehicle Manifest is exactly what encoding the whole Vehicle
+    # Manifest produces.
+    pydict_vehicle_manifest = {
+        'signed': {
+            'vin': 'democar',
+            'primary_ecu_serial': '11111',
+            'ecu_version_manifests': {'22222': [
+                SAMPLE_ECU_MANIFEST_SIGNABLE, attack_ecu_manifest]}},
+        'signatures': []}
+
+    der_vehicle_manifest = asn1_codec.make_signed_der_vehicle_manifest(
+        'democar', '11111', der_ecu_manifests, test_signing_key)
+
+    self.assertEqual(der_vehicle_manifest,
+        asn1_codec.convert_signed_metadata_to_der(
+        pydict_vehicle_manifest, DATATYPE_VEHICLE_MANIFEST,
+        private_key=test_signing_key, resign=True))
+
+    vehicle_manifest = asn1_codec.convert_signed_der_to_dersigned_json(
+        der_vehicle_manifest, DATATYPE_VEHICLE_MANIFEST)
+    self.assertEqual(
+        pydict_vehicle_manifest['signed'], vehicle_manifest['signed'])
+    self.assertTrue(uptane.common.verify_signature_over_metadata(
+        test_signing_key, vehicle_manifest['signatures'][0],
+        vehicle_manifest['signed'], DATATYPE_VEHICLE_MANIFEST))
+
+
+
+
+
+  def test_30_image_block_der_conversion(self):
+    image_requests = [
+        {'filename': 'TCU1.1.txt'},
+        {'filename': 'TCU1.1.txt', 'block_number': 2}]
+    image_file = {
+        'filename': 'TCU1.1.txt', 'number_of_blocks': 5, 'block_size': 4}
+    image_block = {
+        'filename': 'TCU1.1.txt', 'block_number': 2, 'block': b'\x00\xffab'}
+
+    for image_request in image_requests:
+      der_request = image_block_asn1_coder.encode_image_request(image_request)
+      self.assertEqual(image_request,
+          image_block_asn1_coder.decode_image_request(der_request))
+
+    der_file = image_block_asn1_coder.encode_image_file(image_file)
+    self.assertEqual(
+        image_file, image_block_asn1_coder.decode_image_file(der_file))
+
+    der_block = image_block_asn1_coder.encode_image_block(image_block)
+    self.assertEqual(
+        image_block, image_block_asn1_coder.decode_image_block(der_block))
+
+    # Data of the wrong type, or followed by anything else, is rejected.
+    with self.assertRaises(uptane.FailedToDecodeASN1DER):
+      image_block_asn1_coder.decode_image_file(der_block)
+    with self.assertRaises(uptane.FailedToDecodeASN1DER):
+      image_block_asn1_coder.decode_image_block(der_block + b'\x00')
+
+    with self.assertRaises(tuf.FormatError):
+      image_block_asn1_coder.encode_image_block(
+          {'filename': 'TCU1.1.txt', 'block_number': 0, 'block': b'ab'})
+
+
+
+
+
 
 def conversion_tester(signable_pydict, datatype, cls): # cls: clunky
   """
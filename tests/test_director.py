@@ -17,6 +17,7 @@ import os.path
 import shutil
 import copy
 import json
+import io
 
 import tuf
 import tuf.formats
@@ -168,6 +169,9 @@ class TestDirector(unittest.TestCase):
     self.assertEqual(keys_pri['targets'], TestDirector.instance.key_dirtarg_pri)
     self.assertEqual(keys_pub['targets'], TestDirector.instance.key_dirtarg_pub)
 
+    # Vehicle repositories are written as consistent snapshots by default.
+    self.assertTrue(TestDirector.instance.consistent_snapshot)
+
     # Check values not copied from parameters.
     self.assertEqual({}, TestDirector.instance.vehicle_repositories)
 
@@ -752,6 +756,34 @@ class TestDirector(unittest.TestCase):
 
 
 
+  def test_45_write_vehicle_repository(self):
+
+    with self.assertRaises(uptane.UnknownVehicle):
+      TestDirector.instance.write_vehicle_repository('unknown_vin')
+
+    with self.assertRaises(tuf.FormatError):
+      TestDirector.instance.write_vehicle_repository('democar', 'yes')
+
+    TestDirector.instance.write_vehicle_repository('democar')
+
+    repo = TestDirector.instance.vehicle_repositories['democar']
+    staged_fnames = os.listdir(
+        os.path.join(repo._repository_directory, 'metadata.staged'))
+    extension = '.' + tuf.conf.METADATA_FORMAT
+
+    # Every role file is written under its plain name, and, as the repository
+    # publishes consistent snapshots, all but timestamp's also under a name
+    # prefixed with its version.
+    for role in ['root', 'snapshot', 'targets', 'timestamp']:
+      self.assertIn(role + extension, staged_fnames)
+    for role in ['root', 'snapshot', 'targets']:
+      self.assertIn('1.' + role + extension, staged_fnames)
+    self.assertNotIn('1.timestamp' + extension, staged_fnames)
+
+
+
+
+
   def test_60_register_vehicle(self):
     """Tests inventorydb.register_vehicle(), along with check_vin_registered()
     and helper function _check_registration_is_sane()."""
@@ -804,6 +836,97 @@ class TestDirector(unittest.TestCase):
 
 
 
+  def test_70_export_manifests(self):
+    """Tests inventorydb.iter_manifests() and export_manifests(), which
+    stream stored manifests out for offline analysis."""
+
+    # test_15 saved several Vehicle Manifests for 'democar'.
+    all_vms = list(inventory.iter_manifests(inventory.MANIFEST_TYPE_VEHICLE))
+    n_democar_vms = len(inventory.get_vehicle_manifests('democar'))
+    self.assertTrue(n_democar_vms > 1)
+    self.assertEqual(
+        n_democar_vms, len([r for r in all_vms if r[1] == 'democar']))
+
+    # Filtering by VIN, and skipping unknown VINs.
+    democar_vms = list(inventory.iter_manifests(
+        inventory.MANIFEST_TYPE_VEHICLE, keys=['democar', 'unknown_vin']))
+    self.assertEqual(n_democar_vms, len(democar_vms))
+    for cursor, key, index, manifest in democar_vms:
+      self.assertEqual('democar', key)
+      self.assertEqual(inventory.get_vehicle_manifests('democar')[index],
+          manifest)
+
+    # Resuming from a cursor yields exactly the remaining manifests.
+    resumed = list(inventory.iter_manifests(inventory.MANIFEST_TYPE_VEHICLE,
+        keys=['democar'], cursor=democar_vms[0][0]))
+    self.assertEqual(democar_vms[1:], resumed)
+
+
+    # Export as newline-delimited JSON, one page at a time.
+    output = io.BytesIO()
+    cursor = inventory.export_manifests(output,
+        inventory.MANIFEST_TYPE_VEHICLE, keys=['democar'], limit=1)
+    self.assertEqual(democar_vms[0][0], cursor)
+    cursor = inventory.export_manifests(output,
+        inventory.MANIFEST_TYPE_VEHICLE, keys=['democar'], cursor=cursor)
+    self.assertEqual(democar_vms[-1][0], cursor)
+
+    lines = output.getvalue().decode('utf-8').splitlines()
+    self.assertEqual(n_democar_vms, len(lines))
+    for line, (cursor, key, index, manifest) in zip(lines, democar_vms):
+      record = json.loads(line)
+      self.assertEqual(cursor, record['cursor'])
+      self.assertEqual(index, record['index'])
+      self.assertEqual(manifest, record['manifest'])
+
+    # Nothing further to export: the cursor is returned unchanged.
+    self.assertEqual(cursor, inventory.export_manifests(io.BytesIO(),
+        inventory.MANIFEST_TYPE_VEHICLE, keys=['democar'], cursor=cursor))
+
+
+    # Export ECU Manifests as concatenated DER with an index, to an output
+    # that cannot seek or tell, as a pipe cannot.
+    if asn1_codec.PYASN1_EXISTS:
+      output = io.BytesIO()
+      index_fobj = io.BytesIO()
+
+      class WriteOnly(object):
+        def write(self, data):
+          return output.write(data)
+
+      inventory.export_manifests(WriteOnly(), inventory.MANIFEST_TYPE_ECU,
+          keys=['TCUdemocar'], encoding=inventory.EXPORT_ENCODING_DER,
+          index_fobj=index_fobj)
+
+      ecu_manifests = inventory.get_ecu_manifests('TCUdemocar')
+      index_lines = index_fobj.getvalue().decode('utf-8').splitlines()
+      self.assertEqual(len(ecu_manifests), len(index_lines))
+
+      for line in index_lines:
+        entry = json.loads(line)
+        der = output.getvalue()[
+            entry['offset']:entry['offset'] + entry['length']]
+        self.assertEqual(ecu_manifests[entry['index']],
+            asn1_codec.convert_signed_der_to_dersigned_json(
+            der, DATATYPE_ECU_MANIFEST))
+
+
+    # Invalid arguments.
+    with self.assertRaises(uptane.Error):
+      list(inventory.iter_manifests('not a manifest type'))
+    with self.assertRaises(tuf.FormatError):
+      list(inventory.iter_manifests(
+          inventory.MANIFEST_TYPE_VEHICLE, cursor='not a cursor'))
+    with self.assertRaises(tuf.FormatError):
+      list(inventory.iter_manifests(inventory.MANIFEST_TYPE_VEHICLE, keys=5))
+    with self.assertRaises(uptane.Error):
+      inventory.export_manifests(io.BytesIO(),
+          inventory.MANIFEST_TYPE_VEHICLE, encoding='xml')
+
+
+
+
+
 # Run unit test.
 if __name__ == '__main__':
   unittest.main()
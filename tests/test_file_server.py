@@ -0,0 +1,151 @@
+"""
+<Program Name>
+  test_file_server.py
+
+<Purpose>
+  Unit testing for demo/file_server.py and demo/repo_server.py
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+import time
+
+from six.moves import http_client
+
+import demo.file_server as file_server
+import demo.repo_server as repo_server
+
+# Large enough to fill the kernel's socket buffers many times over.
+LARGE_FILE_SIZE = 20 * 1024 * 1024
+
+
+
+class TestFileServer(unittest.TestCase):
+  """
+  "unittest"-style test class for the file_server and repo_server modules of
+  the demo, against a local repository server
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.temp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(cls.temp_dir, 'targets'))
+
+    cls.large_data = os.urandom(LARGE_FILE_SIZE)
+    with open(os.path.join(cls.temp_dir, 'targets', 'large.img'), 'wb') as fobj:
+      fobj.write(cls.large_data)
+
+    cls.server = repo_server.RepositoryHTTPServer(
+        ('localhost', 0), cls.temp_dir)
+    thread = threading.Thread(target=cls.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+    shutil.rmtree(cls.temp_dir)
+
+
+
+  def get(self, path, headers=None):
+    """Returns (response, body) for a GET request for the given path."""
+    connection = http_client.HTTPConnection(
+        'localhost', self.server.server_address[1], timeout=30)
+    try:
+      connection.request('GET', path, headers=headers or {})
+      response = connection.getresponse()
+      return response, response.read()
+    finally:
+      connection.close()
+
+
+
+  def test_large_file(self):
+    response, body = self.get('/targets/large.img')
+
+    self.assertEqual(200, response.status)
+    self.assertEqual(LARGE_FILE_SIZE, len(body))
+    self.assertEqual(hashlib.sha256(self.large_data).hexdigest(),
+        hashlib.sha256(body).hexdigest())
+
+
+
+  def test_ranges_and_etags(self):
+    response, body = self.get('/targets/large.img',
+        {'Range': 'bytes=1000000-'})
+    self.assertEqual(206, response.status)
+    self.assertEqual(self.large_data[1000000:], body)
+
+    etag = response.getheader('ETag')
+    response, body = self.get('/targets/large.img', {'If-None-Match': etag})
+    self.assertEqual(304, response.status)
+    self.assertEqual(b'', body)
+
+    response, body = self.get('/targets/large.img',
+        {'Range': 'bytes=' + str(LARGE_FILE_SIZE) + '-'})
+    self.assertEqual(416, response.status)
+
+    response, body = self.get('/targets/missing.img')
+    self.assertEqual(404, response.status)
+
+
+
+  def test_send_file_range_with_os_sendfile(self):
+    # Python 3.5 and later send with socket.sendfile(); this covers the
+    # os.sendfile() loop used without it, on a socket with a timeout.
+    if not hasattr(os, 'sendfile'):
+      self.skipTest('os.sendfile is not available')
+
+    class SocketWithoutSendfile(object):
+      def __init__(self, sock):
+        self.fileno = sock.fileno
+        self.gettimeout = sock.gettimeout
+
+    sender, receiver = socket.socketpair()
+    sender.settimeout(30)
+    received = []
+
+    def receive():
+      time.sleep(0.2) # Let the sender fill the socket's buffers first.
+      while True:
+        data = receiver.recv(1024 * 1024)
+        if not data:
+          return
+        received.append(data)
+
+    thread = threading.Thread(target=receive)
+    thread.daemon = True
+    thread.start()
+
+    try:
+      with open(os.path.join(self.temp_dir, 'targets', 'large.img'),
+          'rb') as fobj:
+        file_server.send_file_range(
+            SocketWithoutSendfile(sender), fobj, 100, LARGE_FILE_SIZE)
+      sender.shutdown(socket.SHUT_WR)
+      thread.join(30)
+      self.assertEqual(self.large_data[100:], b''.join(received))
+
+    finally:
+      sender.close()
+      receiver.close()
+
+
+
+if __name__ == '__main__':
+  unittest.main()
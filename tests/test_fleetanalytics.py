@@ -0,0 +1,147 @@
+"""
+<Program Name>
+  test_fleetanalytics.py
+
+<Purpose>
+  Unit testing for uptane/services/fleetanalytics.py
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+
+import tuf
+
+import uptane.services.inventorydb as inventory
+import uptane.services.fleetanalytics as fleetanalytics
+
+import demo # for import_public_key
+
+
+# Time used as "now" in the tests, and the corresponding timeserver time that
+# is 100 seconds earlier.
+NOW = 1500000100
+TIMESERVER_TIME = '2017-07-14T02:40:00Z'  # 1500000000
+
+# The global registries of inventorydb, replaced by empty ones for each test,
+# so that the test sees only what it registers, whatever other tests run in
+# the same process have registered.
+INVENTORY_GLOBALS = ['vehicle_manifests', 'ecu_manifests',
+    'primary_ecus_by_vin', 'ecus_by_vin', 'ecu_public_keys']
+
+
+
+def make_ecu_manifest(ecu_serial, image_fname, sha256, attack=''):
+  """Returns a minimal signable ECU Manifest, as stored by inventorydb."""
+  return {
+      'signed': {
+          'ecu_serial': ecu_serial,
+          'installed_image': {
+              'filepath': image_fname,
+              'fileinfo': {'length': 10, 'hashes': {'sha256': sha256}}},
+          'timeserver_time': TIMESERVER_TIME,
+          'previous_timeserver_time': TIMESERVER_TIME,
+          'attacks_detected': attack},
+      'signatures': []}
+
+
+
+
+
+@unittest.skipUnless(fleetanalytics.NUMPY_EXISTS, 'numpy is not installed')
+class TestFleetAnalytics(unittest.TestCase):
+  """
+  "unittest"-style test class for the fleetanalytics module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    """
+    Register two vehicles with three ECUs between them in a fresh, empty
+    inventory.
+    """
+    for name in INVENTORY_GLOBALS:
+      # Restored even if the rest of setUp fails.
+      self.addCleanup(setattr, inventory, name, getattr(inventory, name))
+      setattr(inventory, name, {})
+
+    key = demo.import_public_key('secondary')
+
+    for vin, ecu_serials in [('fa_vin1', ['fa_ecu1', 'fa_ecu2']),
+        ('fa_vin2', ['fa_ecu3'])]:
+      inventory.register_vehicle(vin, ecu_serials[0])
+      for ecu_serial in ecu_serials:
+        inventory.register_ecu(
+            ecu_serial == ecu_serials[0], vin, ecu_serial, key)
+
+
+
+
+
+  def test_snapshot(self):
+
+    snapshot = fleetanalytics.FleetSnapshot(
+        ecu_types={'fa_ecu1': 'tcu', 'fa_ecu2': 'bcu', 'fa_ecu3': 'tcu'})
+
+    # Nothing reported yet, but every registered ECU gets a row.
+    self.assertEqual(3, snapshot.refresh(now=NOW))
+    self.assertEqual(3, snapshot.n_rows)
+    self.assertEqual({}, snapshot.image_distribution())
+    self.assertEqual(0, len(snapshot.report_ages(NOW)))
+
+    # Report from two ECUs.
+    inventory.ecu_manifests['fa_ecu1'].append(
+        make_ecu_manifest('fa_ecu1', 'firmware_a', 'aa'))
+    inventory.ecu_manifests['fa_ecu3'].append(
+        make_ecu_manifest('fa_ecu3', 'firmware_a', 'aa', attack='some attack'))
+
+    # Only the two ECUs that reported are re-read.
+    self.assertEqual(2, snapshot.refresh(now=NOW))
+    self.assertEqual(0, snapshot.refresh(now=NOW + 50))
+
+    self.assertEqual({'tcu': {'aa': 2}}, snapshot.image_distribution())
+    self.assertEqual({'tcu': 0.5}, snapshot.attack_report_rates())
+    self.assertEqual([50, 50], snapshot.report_ages(NOW + 50).tolist())
+    self.assertEqual([100, 100], snapshot.timeserver_lags().tolist())
+
+    # A newer manifest replaces the ECU's previous state.
+    inventory.ecu_manifests['fa_ecu3'].append(
+        make_ecu_manifest('fa_ecu3', 'firmware_b', 'bb'))
+    self.assertEqual(1, snapshot.refresh(now=NOW))
+    self.assertEqual(
+        {'tcu': {'aa': 1, 'bb': 1}}, snapshot.image_distribution())
+    self.assertEqual({'tcu': 0.0}, snapshot.attack_report_rates())
+
+    summary = snapshot.summary(now=NOW, percentiles=[50])
+    self.assertEqual(2, summary['n_reporting_ecus'])
+    self.assertEqual({50: 0}, summary['report_age'])
+    self.assertEqual({50: 100}, summary['timeserver_lag'])
+
+    # Columns are exposed read-only.
+    with self.assertRaises(ValueError):
+      snapshot.image_ids[0] = 5
+
+    # Changing an ECU's type takes effect immediately.
+    snapshot.set_ecu_type('fa_ecu3', 'gateway')
+    self.assertEqual({'tcu': {'aa': 1}, 'gateway': {'bb': 1}},
+        snapshot.image_distribution())
+
+    with self.assertRaises(tuf.FormatError):
+      snapshot.start_periodic_refresh(0)
+
+    snapshot.start_periodic_refresh(1)
+    with self.assertRaises(uptane.Error):
+      snapshot.start_periodic_refresh(1)
+    snapshot.stop_periodic_refresh()
+
+
+
+
+
+# Run unit tests.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,291 @@
+"""
+<Program Name>
+  test_metadata_bundle.py
+
+<Purpose>
+  Unit testing for uptane/encoding/metadata_bundle.py
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+import shutil
+import zipfile
+import hashlib
+import tempfile
+
+import tuf
+import tuf.conf
+import tuf.formats
+
+import uptane.formats
+import uptane.encoding.metadata_bundle as metadata_bundle
+
+
+ROLE_FILES = [
+    ('director', 'root.der', b'director root'),
+    ('director', 'targets.der', b'director targets metadata'),
+    ('imagerepo', 'root.der', b'image repository root'),
+    ('imagerepo', 'snapshot.der', b'')] # An empty file is permitted.
+
+# The Director's metadata after it has assigned an update: root version 1, and
+# version 2 of the rest.
+SAMPLE_METADATA_DIR = os.path.join(uptane.WORKING_DIR, 'samples',
+    'metadata_samples_long_expiry', 'update_to_one_ecu',
+    'full_metadata_archive', 'director', 'metadata')
+
+
+
+class TestMetadataBundle(unittest.TestCase):
+  """
+  "unittest"-style test class for the metadata_bundle module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.bundle_fname = os.path.join(self.temp_dir, 'metadata.bundle')
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+  def write_bundle(self, role_files=ROLE_FILES):
+    with open(self.bundle_fname, 'wb') as fobj:
+      return metadata_bundle.write_metadata_bundle(fobj, role_files)
+
+
+
+  def test_write_and_read(self):
+    index = self.write_bundle()
+
+    uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA.check_match(index)
+    self.assertEqual(len(ROLE_FILES), len(index['roles']))
+    for entry, (repository, role, data) in zip(index['roles'], ROLE_FILES):
+      self.assertEqual(repository, entry['repository'])
+      self.assertEqual(role, entry['role'])
+      self.assertEqual(len(data), entry['length'])
+      self.assertEqual(hashlib.sha256(data).hexdigest(), entry['hash'])
+
+    self.assertEqual(
+        index, metadata_bundle.build_metadata_bundle_index(ROLE_FILES))
+
+    # Hashes the caller already has are used as given, not computed again.
+    index_with_hash = metadata_bundle.build_metadata_bundle_index(
+        ROLE_FILES, {('director', 'root.der'): 'ab' * 32})
+    self.assertEqual('ab' * 32, index_with_hash['roles'][0]['hash'])
+    self.assertEqual(index['roles'][1:], index_with_hash['roles'][1:])
+
+    # An index already built can be given when writing, but must fit.
+    with open(self.bundle_fname, 'wb') as fobj:
+      self.assertEqual(index,
+          metadata_bundle.write_metadata_bundle(fobj, ROLE_FILES, index))
+    with open(self.bundle_fname, 'wb') as fobj:
+      with self.assertRaises(tuf.FormatError):
+        metadata_bundle.write_metadata_bundle(fobj, ROLE_FILES[1:], index)
+    self.write_bundle()
+
+    self.assertTrue(metadata_bundle.is_metadata_bundle(self.bundle_fname))
+
+    with metadata_bundle.MetadataBundle(self.bundle_fname) as bundle:
+      self.assertEqual(index, bundle.index)
+      self.assertEqual(
+          [(repository, role) for repository, role, data in ROLE_FILES],
+          bundle.roles())
+      for repository, role, data in ROLE_FILES:
+        self.assertEqual(data, bundle.get_role(repository, role))
+
+      with self.assertRaises(uptane.Error):
+        bundle.get_role('director', 'snapshot.der')
+
+
+
+  def test_zip_is_not_bundle(self):
+    zip_fname = os.path.join(self.temp_dir, 'metadata.zip')
+    with zipfile.ZipFile(zip_fname, 'w') as archive:
+      archive.writestr('director/metadata/root.der', b'director root')
+
+    self.assertFalse(metadata_bundle.is_metadata_bundle(zip_fname))
+
+    with self.assertRaises(uptane.Error):
+      metadata_bundle.MetadataBundle(zip_fname)
+
+
+
+  def test_bad_names(self):
+    for repository, role in [
+        ('director', '../root.der'), ('..', 'root.der'),
+        ('director', 'metadata/root.der'), ('director', '')]:
+      with self.assertRaises(tuf.FormatError):
+        self.write_bundle([(repository, role, b'data')])
+
+    with self.assertRaises(tuf.FormatError):
+      self.write_bundle([('director', 'root.der', 'not bytes')])
+
+
+
+  def test_corrupted_bundle(self):
+    self.write_bundle()
+
+    with open(self.bundle_fname, 'rb') as fobj:
+      contents = fobj.read()
+
+    # Alter the last byte of the last non-empty role file.
+    with open(self.bundle_fname, 'wb') as fobj:
+      fobj.write(contents[:-1] + b'X')
+
+    with metadata_bundle.MetadataBundle(self.bundle_fname) as bundle:
+      self.assertEqual(
+          b'director root', bundle.get_role('director', 'root.der'))
+      with self.assertRaises(tuf.BadHashError):
+        bundle.get_role('imagerepo', 'root.der')
+
+    # Truncate the bundle.
+    with open(self.bundle_fname, 'wb') as fobj:
+      fobj.write(contents[:-5])
+
+    with self.assertRaises(uptane.Error):
+      metadata_bundle.MetadataBundle(self.bundle_fname)
+
+    # Too short to contain a header.
+    with open(self.bundle_fname, 'wb') as fobj:
+      fobj.write(metadata_bundle.BUNDLE_MAGIC)
+
+    with self.assertRaises(uptane.Error):
+      metadata_bundle.MetadataBundle(self.bundle_fname)
+
+
+
+
+
+  def test_role_files_newer_than(self):
+    extension = '.' + tuf.conf.METADATA_FORMAT
+
+    def get_newer_roles(known_versions):
+      role_files = metadata_bundle.get_role_files_newer_than(
+          'director', SAMPLE_METADATA_DIR, known_versions)
+      for repository, role_fname, data in role_files:
+        self.assertEqual('director', repository)
+        with open(os.path.join(SAMPLE_METADATA_DIR, role_fname), 'rb') as fobj:
+          self.assertEqual(fobj.read(), data)
+      return sorted(role_fname[:-len(extension)]
+          for repository, role_fname, data in role_files)
+
+    # A client with no metadata needs all of it.
+    self.assertEqual(['root', 'snapshot', 'targets', 'timestamp'],
+        get_newer_roles({}))
+
+    # Timestamp metadata is always provided.
+    self.assertEqual(['timestamp'], get_newer_roles(
+        {'root': 1, 'snapshot': 2, 'targets': 2, 'timestamp': 2}))
+
+    self.assertEqual(['snapshot', 'targets', 'timestamp'], get_newer_roles(
+        {'root': 1, 'snapshot': 1, 'targets': 1, 'timestamp': 1}))
+
+    with self.assertRaises(tuf.FormatError):
+      get_newer_roles({'root': 'one'})
+
+    with self.assertRaises(tuf.FormatError):
+      metadata_bundle.get_role_files_newer_than(
+          '../director', SAMPLE_METADATA_DIR, {})
+
+    # Build a bundle from the role files and read it back.
+    self.write_bundle(metadata_bundle.get_role_files_newer_than(
+        'director', SAMPLE_METADATA_DIR, {}))
+    with metadata_bundle.MetadataBundle(self.bundle_fname) as bundle:
+      self.assertEqual(4, len(bundle.roles()))
+
+
+
+  def test_add_versioned_role_fnames(self):
+    extension = '.' + tuf.conf.METADATA_FORMAT
+    metadata_dir = os.path.join(self.temp_dir, 'metadata')
+    shutil.copytree(SAMPLE_METADATA_DIR, metadata_dir)
+
+    metadata_bundle.add_versioned_role_fnames(metadata_dir)
+
+    # Every role file but timestamp's now also has a version-prefixed name.
+    for role, version in [('root', 1), ('snapshot', 2), ('targets', 2)]:
+      with open(os.path.join(metadata_dir, role + extension), 'rb') as fobj:
+        data = fobj.read()
+      with open(os.path.join(metadata_dir,
+          str(version) + '.' + role + extension), 'rb') as fobj:
+        self.assertEqual(data, fobj.read())
+
+    self.assertFalse(os.path.exists(
+        os.path.join(metadata_dir, '2.timestamp' + extension)))
+
+    # Doing it again changes nothing.
+    fnames = sorted(os.listdir(metadata_dir))
+    metadata_bundle.add_versioned_role_fnames(metadata_dir)
+    self.assertEqual(fnames, sorted(os.listdir(metadata_dir)))
+
+    # Version-prefixed role files are not put in bundles.
+    self.assertEqual(
+        sorted(role + extension
+        for role in ['root', 'snapshot', 'targets', 'timestamp']),
+        sorted(role_fname for repository, role_fname, data in
+        metadata_bundle.get_role_files_newer_than(
+        'director', metadata_dir, {})))
+
+    with self.assertRaises(tuf.FormatError):
+      metadata_bundle.add_versioned_role_fnames(42)
+
+
+
+  def test_delegated_role_files(self):
+    extension = '.' + tuf.conf.METADATA_FORMAT
+    metadata_dir = os.path.join(self.temp_dir, 'metadata')
+    shutil.copytree(SAMPLE_METADATA_DIR, metadata_dir)
+
+    # Stand-ins for two hashed bin roles, '3' and '00-07' (version 2).
+    for bin_role in ['3', '00-07']:
+      shutil.copyfile(os.path.join(metadata_dir, 'targets' + extension),
+          os.path.join(metadata_dir, bin_role + extension))
+
+    metadata_bundle.add_versioned_role_fnames(metadata_dir)
+    self.assertTrue(os.path.exists(
+        os.path.join(metadata_dir, '2.3' + extension)))
+
+    def get_newer_roles(known_versions):
+      return sorted(role_fname[:-len(extension)]
+          for repository, role_fname, data in
+          metadata_bundle.get_role_files_newer_than(
+          'imagerepo', metadata_dir, known_versions))
+
+    # A client is not sent delegated roles it has not fetched itself...
+    self.assertEqual(['root', 'snapshot', 'targets', 'timestamp'],
+        get_newer_roles({}))
+
+    # ...but is sent newer versions of those it has.
+    self.assertEqual(['3', 'timestamp'], get_newer_roles(
+        {'root': 1, 'snapshot': 2, 'targets': 2, 'timestamp': 2, '3': 1,
+        '00-07': 2}))
+
+
+
+  def test_get_role_version(self):
+    for role, version in [('root', 1), ('targets', 2), ('timestamp', 2)]:
+      with open(os.path.join(SAMPLE_METADATA_DIR,
+          role + '.' + tuf.conf.METADATA_FORMAT), 'rb') as fobj:
+        self.assertEqual(version, metadata_bundle.get_role_version(fobj.read()))
+
+    for role_data in [b'', b'not metadata', b'\x30\x00']:
+      with self.assertRaises(uptane.Error):
+        metadata_bundle.get_role_version(role_data)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,182 @@
+"""
+<Program Name>
+  test_mirror_scores.py
+
+<Purpose>
+  Unit testing for uptane/mirror_scores.py
+
+<Copyright>
+  See LICENSE for licensing information.
+"""
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+
+import unittest
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+import tuf
+
+import uptane.mirror_scores as mirror_scores
+import demo.repo_server as repo_server
+
+FAST = 'http://fast.example.com:30301'
+SLOW = 'http://slow.example.com:30301'
+FLAKY = 'http://flaky.example.com'
+NEW = 'http://new.example.com'
+
+
+
+class TestMirrorScores(unittest.TestCase):
+  """
+  "unittest"-style test class for the mirror_scores module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+  def test_init(self):
+    scores = mirror_scores.MirrorScores()
+    self.assertIsNone(scores.fname)
+    self.assertIsNone(scores.get_score(FAST))
+
+    for bad_arguments in [{'fname': 42}, {'smoothing': 0},
+        {'smoothing': 1.5}, {'failure_penalty': -1}]:
+      with self.assertRaises(tuf.FormatError):
+        mirror_scores.MirrorScores(**bad_arguments)
+
+
+
+  def test_get_server(self):
+    self.assertEqual('http://localhost:30301',
+        mirror_scores.get_server('http://localhost:30301/targets/a.img'))
+    self.assertEqual('https://example.com', mirror_scores.get_server(
+        'https://example.com/democar/metadata/root.der'))
+
+
+
+  def test_sort_mirrors(self):
+    scores = mirror_scores.MirrorScores(smoothing=0.5, failure_penalty=10)
+
+    scores.record(SLOW + '/metadata/timestamp.der', 2.0)
+    scores.record(FAST + '/metadata/timestamp.der', 0.1)
+    scores.record(FLAKY + '/metadata/timestamp.der', 0.05)
+    scores.record(FLAKY + '/metadata/timestamp.der', None)
+
+    self.assertAlmostEqual(2.0, scores.get_score(SLOW))
+    self.assertAlmostEqual(0.1, scores.get_score(FAST))
+    # The latency of failures is not counted, but the failure rate is.
+    self.assertAlmostEqual(0.05 + 0.5 * 10, scores.get_score(FLAKY))
+
+    # Mirrors not yet scored come first, then the rest by score.
+    self.assertEqual([NEW, FAST, SLOW, FLAKY],
+        scores.sort_mirrors([SLOW, FLAKY, NEW, FAST]))
+
+    # Scores are moving averages: a mirror that slows down falls behind.
+    for i in range(5):
+      scores.record(FAST + '/targets/a.img', 4.0)
+    self.assertEqual([SLOW, FAST], scores.sort_mirrors([FAST, SLOW]))
+
+    # Mirrors that score the same keep their given order.
+    self.assertEqual([FLAKY + '/a', FLAKY + '/b'],
+        scores.sort_mirrors([FLAKY + '/a', FLAKY + '/b']))
+
+
+
+  def test_is_stale(self):
+    scores = mirror_scores.MirrorScores()
+
+    # A mirror never measured is stale, however long is allowed.
+    self.assertTrue(scores.is_stale(FAST, 3600))
+
+    scores.record(FAST + '/metadata/timestamp.der', 0.1)
+    self.assertFalse(scores.is_stale(FAST, 3600))
+    self.assertFalse(scores.is_stale(FAST + '/targets/a.img', 3600))
+    self.assertTrue(scores.is_stale(FAST, -1))
+
+    # Failures count as measurements, too.
+    scores.record(SLOW, None)
+    self.assertFalse(scores.is_stale(SLOW, 3600))
+
+
+
+  def test_save_and_load(self):
+    fname = os.path.join(self.temp_dir, 'mirror_scores.json')
+    scores = mirror_scores.MirrorScores(fname)
+    scores.record(FAST, 0.25)
+    scores.record(SLOW, None)
+    scores.save()
+
+    loaded = mirror_scores.MirrorScores(fname)
+    self.assertAlmostEqual(0.25, loaded.get_score(FAST))
+    self.assertEqual(scores.get_score(SLOW), loaded.get_score(SLOW))
+    self.assertEqual([FAST, SLOW], loaded.sort_mirrors([SLOW, FAST]))
+    self.assertFalse(loaded.is_stale(FAST, 3600))
+
+    # Scores saved without the time of their last measurement are stale.
+    with open(fname, 'w') as fobj:
+      fobj.write('{"http://fast.example.com:30301": {"latency": 0.25, '
+          '"failure_rate": 0, "samples": 1}}')
+    loaded = mirror_scores.MirrorScores(fname)
+    self.assertAlmostEqual(0.25, loaded.get_score(FAST))
+    self.assertTrue(loaded.is_stale(FAST, 3600))
+
+    # A damaged file is ignored.
+    with open(fname, 'w') as fobj:
+      fobj.write('{"http://fast.example.com:30301": {"latency": "fast"}}')
+    self.assertIsNone(mirror_scores.MirrorScores(fname).get_score(FAST))
+
+    # Without a file name, nothing is saved.
+    mirror_scores.MirrorScores().save()
+
+
+
+  def test_race(self):
+    os.makedirs(os.path.join(self.temp_dir, 'targets'))
+    with open(os.path.join(self.temp_dir, 'targets', 'a.img'), 'wb') as fobj:
+      fobj.write(b'image data' * 10000)
+
+    server = repo_server.RepositoryHTTPServer(('localhost', 0), self.temp_dir)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    # A port on which nothing is listening.
+    closed_socket = socket.socket()
+    closed_socket.bind(('localhost', 0))
+    closed_port = closed_socket.getsockname()[1]
+    closed_socket.close()
+
+    try:
+      live = 'http://localhost:' + str(server.server_address[1])
+      dead = 'http://localhost:' + str(closed_port)
+      scores = mirror_scores.MirrorScores()
+
+      self.assertEqual(live + '/targets/a.img', scores.race(
+          [dead + '/targets/a.img', live + '/targets/a.img'], timeout=5))
+
+      self.assertIsNotNone(scores.get_score(live))
+      self.assertEqual([live, dead], scores.sort_mirrors([dead, live]))
+
+      self.assertIsNone(scores.race([dead + '/targets/a.img'], timeout=5))
+
+    finally:
+      server.shutdown()
+      server.server_close()
+
+
+
+if __name__ == '__main__':
+  unittest.main()
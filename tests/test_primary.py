@@ -14,23 +14,34 @@ import uptane # Import before TUF modules; may change tuf.conf values.
 
 import unittest
 import os.path
+import io
 import time
 import copy
 import shutil
+import struct
 import hashlib
 import iso8601
+import threading
 
 from six.moves.urllib.error import URLError
+from six.moves import BaseHTTPServer
+from six.moves import SimpleHTTPServer
+from six.moves import socketserver
 
 import tuf
 import tuf.formats
 import tuf.conf
 import tuf.client.updater # to test one of the fields in the Primary object
+import tuf.repository_tool as rt # to write a repository with hashed bins
 
 import uptane.formats
 import uptane.clients.primary as primary
 import uptane.common # verify sigs, create client dir structure, convert key
 import uptane.encoding.asn1_codec as asn1_codec
+import uptane.encoding.metadata_bundle as metadata_bundle
+import uptane.delta
+import uptane.mirror_scores as mirror_scores
+import uptane.connection_pool as connection_pool
 
 from uptane.encoding.asn1_codec import DATATYPE_TIME_ATTESTATION
 from uptane.encoding.asn1_codec import DATATYPE_ECU_MANIFEST
@@ -66,6 +77,42 @@ NONCE = 5
 VIN = 'democar'
 PRIMARY_ECU_SERIAL = '00000'
 
+# Port on localhost at which test_57 serves the test repositories over HTTP,
+# and the time (in seconds) the server takes to deliver each image there.
+TEST_HTTP_PORT = 30799
+IMAGE_DOWNLOAD_DELAYS = {
+    'TCU1.0.txt': 1.0, 'TCU1.1.txt': 0.5, 'BCU1.0.txt': 0.5, 'INFO1.0.txt': 0.5}
+
+
+
+class SlowRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+  """
+  Serves files from TEMP_CLIENT_DIR, delaying the delivery of each image in
+  IMAGE_DOWNLOAD_DELAYS by the given time, to simulate a slow download.
+  """
+  def translate_path(self, path):
+    fname = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(
+        self, path)
+    return os.path.join(
+        TEMP_CLIENT_DIR, os.path.relpath(fname, os.getcwd()))
+
+  def do_GET(self):
+    if os.path.exists(self.translate_path(self.path)):
+      time.sleep(IMAGE_DOWNLOAD_DELAYS.get(os.path.basename(self.path), 0))
+    SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+  def log_message(self, format, *args):
+    pass
+
+
+
+class ThreadedHTTPServer(
+    socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+
 
 
 def destroy_temp_dir():
@@ -429,11 +476,12 @@ class TestPrimary(unittest.TestCase):
         signed_ecu_manifest=manifest1)
 
     # Make sure the provided manifest is now in the Primary's ecu manifests
-    # dictionary. Note that the Primary holds manifests as JSON-compatible
-    # Python dictionaries regardless of the format it receives them in.
+    # dictionary. Note that in DER mode, the Primary holds manifests as the
+    # DER it receives (converting any it receives as Python dictionaries), so
+    # that it can splice them into the Vehicle Manifest as they are.
     self.assertIn('TCUdemocar', TestPrimary.instance.ecu_manifests)
     self.assertIn(
-        manifest1_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest1, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
     # Make sure the nonce provided was noted in the right place.
     self.assertIn(10, TestPrimary.instance.nonces_to_send)
@@ -466,7 +514,7 @@ class TestPrimary(unittest.TestCase):
     # Case 2: We won't save the ECU Manifest from an unknown ECU Serial.
     self.assertNotIn('unknown_ecu', TestPrimary.instance.ecu_manifests)
     self.assertNotIn(
-        manifest2_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest2, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
     with self.assertRaises(uptane.UnknownECU):
       TestPrimary.instance.register_ecu_manifest(
@@ -479,7 +527,7 @@ class TestPrimary(unittest.TestCase):
 
     self.assertNotIn('unknown_ecu', TestPrimary.instance.ecu_manifests)
     self.assertNotIn( # Make sure it's not in the wrong list of ECU Manifests
-        manifest2_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest2, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
 
     # Case 3: ECU Manifest signed with the wrong key: we save it anyway and
@@ -487,7 +535,7 @@ class TestPrimary(unittest.TestCase):
     #         the signatures on ECU Manifests: they can't be expected to know
     #         the right public or symmetric keys.
     self.assertNotIn(
-        manifest3_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest3, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
     TestPrimary.instance.register_ecu_manifest(
         'democar', 'TCUdemocar', nonce=12, signed_ecu_manifest=manifest3)
@@ -497,13 +545,13 @@ class TestPrimary(unittest.TestCase):
         force_pydict=True)
 
     self.assertIn(
-        manifest3_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest3, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
 
     # Case 4: ECU Manifest containing an attack report. Make sure it doesn't
     #         fail to be registered.
     self.assertNotIn(
-        manifest4_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest4, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
     TestPrimary.instance.register_ecu_manifest(
         'democar', 'TCUdemocar', nonce=14, signed_ecu_manifest=manifest4)
@@ -513,7 +561,7 @@ class TestPrimary(unittest.TestCase):
         force_pydict=True)
 
     self.assertIn(
-        manifest4_json, TestPrimary.instance.ecu_manifests['TCUdemocar'])
+        manifest4, TestPrimary.instance.ecu_manifests['TCUdemocar'])
 
 
 
@@ -742,6 +790,78 @@ class TestPrimary(unittest.TestCase):
 
 
 
+  def test_31_refresh_toplevel_metadata_from_bundles(self):
+    """
+    Refreshes metadata from role files provided in metadata bundles, first
+    with the repositories' mirrors unavailable, and then with bundles that
+    are damaged, which TUF must reject in favor of the mirrors.
+    """
+    instance = TestPrimary.instance
+
+    def get_bundles(known_versions=None):
+      bundles = {}
+      for repo_name in ['director', 'imagerepo']:
+        if known_versions is None:
+          versions = instance.get_metadata_versions(repo_name)
+        else:
+          versions = known_versions
+        bundle = io.BytesIO()
+        metadata_bundle.write_metadata_bundle(bundle,
+            metadata_bundle.get_role_files_newer_than(repo_name,
+            os.path.join(TEMP_CLIENT_DIR, repo_name, 'metadata'), versions))
+        bundles[repo_name] = bundle.getvalue()
+      return bundles
+
+    self.assertEqual(['root', 'snapshot', 'targets', 'timestamp'],
+        sorted(instance.get_metadata_versions('director')))
+
+    with self.assertRaises(uptane.Error):
+      instance.get_metadata_versions('unknown_repository')
+
+    original_mirrors = {}
+    for repo_name in ['director', 'imagerepo']:
+      original_mirrors[repo_name] = \
+          instance.updater.repositories[repo_name].mirrors
+      instance.updater.repositories[repo_name].mirrors = \
+          ['file://' + TEMP_CLIENT_DIR + '/nonexistent_mirror']
+
+    try:
+      # Everything needed comes from the bundles: only the timestamp
+      # metadata, when nothing has changed, or every role file.
+      instance.refresh_toplevel_metadata(get_bundles())
+      instance.refresh_toplevel_metadata(get_bundles(known_versions={}))
+
+      # The mirrors are restored after the refresh.
+      self.assertEqual(['file://' + TEMP_CLIENT_DIR + '/nonexistent_mirror'],
+          instance.updater.repositories['director'].mirrors)
+
+      with self.assertRaises(tuf.NoWorkingMirrorError):
+        instance.refresh_toplevel_metadata()
+
+    finally:
+      for repo_name in original_mirrors:
+        instance.updater.repositories[repo_name].mirrors = \
+            original_mirrors[repo_name]
+
+    # Altered role files are rejected, as are unreadable bundles, and the
+    # mirrors provide the metadata instead.
+    role_files = metadata_bundle.get_role_files_newer_than('director',
+        os.path.join(TEMP_CLIENT_DIR, 'director', 'metadata'), {})
+    altered_bundle = io.BytesIO()
+    metadata_bundle.write_metadata_bundle(altered_bundle,
+        [(repository, role_fname, data[:-1] + b'X')
+        for repository, role_fname, data in role_files])
+    instance.refresh_toplevel_metadata({
+        'director': altered_bundle.getvalue(),
+        'imagerepo': b'not a metadata bundle'})
+
+    with self.assertRaises(uptane.Error):
+      instance.refresh_toplevel_metadata({'unknown_repository': b''})
+
+
+
+
+
   def test_35_get_target_list_from_director(self):
     # TODO: Write this in a way that draws on saved sample Director metadata.
     #       Don't expect an actual server to be running.
@@ -810,7 +930,7 @@ class TestPrimary(unittest.TestCase):
     # repositories sit in a local folder accessed by file://).
     # This also processes the data acquired to populate fields accessed by
     # Secondaries below.
-    TestPrimary.instance.primary_update_cycle()
+    self.assertTrue(TestPrimary.instance.primary_update_cycle())
 
     # Try to find out if updates exist for an unknown ECU.
     with self.assertRaises(uptane.UnknownECU):
@@ -827,9 +947,344 @@ class TestPrimary(unittest.TestCase):
         normal_secondary))
 
 
-    # Run the update cycle again to test file/archive replacement when an
-    # update cycle has already occurred.
-    TestPrimary.instance.primary_update_cycle()
+    # Run the update cycle again. Nothing has changed in the repositories, so
+    # expect it to report no change and leave the distributable metadata
+    # archive alone.
+    archive_fname = TestPrimary.instance.get_full_metadata_archive_fname()
+    archive_mtime = os.path.getmtime(archive_fname)
+    self.assertFalse(TestPrimary.instance.primary_update_cycle())
+    self.assertEqual(archive_mtime, os.path.getmtime(archive_fname))
+
+    # Registering a new Secondary is a change, even if no metadata changed.
+    TestPrimary.instance.register_new_secondary('new_secondary')
+    self.assertTrue(TestPrimary.instance.primary_update_cycle())
+    self.assertFalse(TestPrimary.instance.primary_update_cycle())
+
+    # Run the update cycle again, forcing it to do all of its work, to test
+    # file/archive replacement when an update cycle has already occurred.
+    TestPrimary.instance.last_update_cycle_state = None
+    self.assertTrue(TestPrimary.instance.primary_update_cycle())
+
+
+
+
+
+  def test_56_fetch_image_deltas(self):
+    """
+    Fetches an image delta from the Image Repository's mirror for a
+    Secondary that has reported an image other than the one assigned to it,
+    even when nothing else has changed since the last update cycle, keeping
+    only a delta whose header matches both images. Checks that a delta a
+    Secondary could not use is discarded and not fetched again, and that
+    deltas that no Secondary needs any longer are removed.
+    """
+    instance = TestPrimary.instance
+    ecu_serial = 'delta_test_secondary'
+    base_sha256 = hashlib.sha256(b'base image').hexdigest()
+    target_sha256 = hashlib.sha256(b'target image').hexdigest()
+    delta_basename = uptane.delta.get_delta_fname(base_sha256, target_sha256)
+
+    def make_delta(target_length):
+      return uptane.delta.DELTA_MAGIC + \
+          struct.pack('>Q32s', 10, hashlib.sha256(b'base image').digest()) + \
+          struct.pack('>Q32s', target_length,
+          hashlib.sha256(b'target image').digest())
+
+    delta_data = make_delta(1000)
+
+    deltas_dir = os.path.join(TEMP_CLIENT_DIR, uptane.delta.DELTAS_DIRNAME)
+    mirror_deltas_dir = os.path.join(
+        TEMP_CLIENT_DIR, 'imagerepo', uptane.delta.DELTAS_DIRNAME)
+    mirror_delta_fname = os.path.join(mirror_deltas_dir, delta_basename)
+    for directory in [deltas_dir, mirror_deltas_dir]:
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+      self.addCleanup(shutil.rmtree, directory)
+
+    with open(os.path.join(deltas_dir, 'stale_delta'), 'wb') as fobj:
+      fobj.write(b'a delta no Secondary needs')
+
+    self.addCleanup(instance.assigned_targets.pop, ecu_serial, None)
+    self.addCleanup(instance.installed_images.pop, ecu_serial, None)
+    instance.installed_images[ecu_serial] = {'filepath': 'base.img',
+        'fileinfo': {'length': 10, 'hashes': {'sha256': base_sha256}}}
+    instance.assigned_targets[ecu_serial] = {'filepath': 'target.img',
+        'fileinfo': {'length': 1000, 'hashes': {'sha256': target_sha256}}}
+
+    # A delta for some other image, or that is not a delta, is not kept.
+    for bad_delta in [make_delta(999), b'not a delta']:
+      with open(mirror_delta_fname, 'wb') as fobj:
+        fobj.write(bad_delta)
+      instance._fetch_image_deltas()
+      self.assertEqual([], os.listdir(deltas_dir))
+
+    with open(mirror_delta_fname, 'wb') as fobj:
+      fobj.write(delta_data)
+
+    # The Secondary's report is not a change to the update cycle's state,
+    # but the delta is fetched all the same.
+    instance.fetch_image_deltas = True
+    try:
+      self.assertFalse(instance.primary_update_cycle())
+    finally:
+      instance.fetch_image_deltas = False
+
+    self.assertEqual([delta_basename], os.listdir(deltas_dir))
+    with open(os.path.join(deltas_dir, delta_basename), 'rb') as fobj:
+      self.assertEqual(delta_data, fobj.read())
+    self.assertEqual(os.path.join(deltas_dir, delta_basename),
+        instance.get_image_delta_fname(base_sha256, target_sha256))
+
+    # A delta a Secondary could not use is removed, and not fetched again.
+    instance.discard_image_delta(base_sha256, target_sha256)
+    self.assertEqual([], os.listdir(deltas_dir))
+    instance._fetch_image_deltas()
+    self.assertEqual([], os.listdir(deltas_dir))
+
+    with self.assertRaises(tuf.FormatError):
+      instance.discard_image_delta('../' + base_sha256, target_sha256)
+
+    # Once the Secondary has installed the image, the delta is no longer
+    # needed, and would be removed; it is forgotten that it was discarded.
+    instance.installed_images[ecu_serial] = \
+        instance.assigned_targets[ecu_serial]
+    instance._fetch_image_deltas()
+    self.assertEqual([], os.listdir(deltas_dir))
+    self.assertEqual(set(), instance.discarded_image_deltas)
+
+
+
+
+
+  def test_57_download_targets_in_parallel(self):
+    """
+    Downloads several images from a local HTTP server that delivers each
+    slowly, and checks that the time taken follows the slowest image rather
+    than the sum of them all, and that the per-server limit is respected
+    where TUF downloads through a connection pool, however many repositories
+    and mirrors the server provides.
+    """
+    instance = TestPrimary.instance
+
+    # Serve the test repositories over HTTP rather than file://.
+    server = ThreadedHTTPServer(
+        ('localhost', TEST_HTTP_PORT), SlowRequestHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.setDaemon(True)
+    server_thread.start()
+
+    repository_urls = instance.updater.pinned_metadata['repositories']
+    original_mirrors = {}
+    for repository in ['imagerepo', 'director']:
+      mirror = ['http://localhost:' + str(TEST_HTTP_PORT) + '/' + repository]
+      original_mirrors[repository] = repository_urls[repository]['mirrors']
+      repository_urls[repository]['mirrors'] = mirror
+      instance.updater.repositories[repository].mirrors = mirror
+
+    try:
+      # Fetch verified target info for the images from the Image Repository.
+      targets = [target for target in
+          instance.updater.repositories['imagerepo'].targets_of_role('targets')
+          if os.path.basename(target['filepath']) in IMAGE_DOWNLOAD_DELAYS]
+      self.assertEqual(len(IMAGE_DOWNLOAD_DELAYS), len(targets))
+
+      slowest = max(IMAGE_DOWNLOAD_DELAYS.values())
+      total = sum(IMAGE_DOWNLOAD_DELAYS.values())
+
+      # Enough workers to download everything at once. Without a connection
+      # pool, the default limit per server does not apply.
+      destination = os.path.join(TEMP_CLIENT_DIR, 'parallel_targets')
+      instance.max_parallel_downloads = len(targets)
+
+      start = time.time()
+      errors = instance._download_targets(targets, destination)
+      elapsed = time.time() - start
+
+      self.assertEqual([None] * len(targets), errors)
+      for target in targets:
+        self.assertTrue(os.path.exists(
+            os.path.join(destination, target['filepath'].lstrip('/'))))
+      self.assertGreaterEqual(elapsed, slowest)
+      self.assertLess(elapsed, total)
+
+      # Through a connection pool allowing one download at a time from each
+      # server, the images arrive one after another.
+      destination = os.path.join(TEMP_CLIENT_DIR, 'serial_targets')
+      connection_pool.use_for_tuf_downloads(connection_pool.ConnectionPool(), 1)
+
+      start = time.time()
+      errors = instance._download_targets(targets, destination)
+      elapsed = time.time() - start
+
+      self.assertEqual([None] * len(targets), errors)
+      self.assertGreaterEqual(elapsed, total)
+
+    finally:
+      connection_pool.use_for_tuf_downloads(None)
+      server.shutdown()
+      server.server_close()
+      for repository in original_mirrors:
+        repository_urls[repository]['mirrors'] = original_mirrors[repository]
+        instance.updater.repositories[repository].mirrors = \
+            original_mirrors[repository]
+      instance.max_parallel_downloads = primary.DEFAULT_MAX_PARALLEL_DOWNLOADS
+
+
+
+
+
+  def test_58_obtain_targets_once(self):
+    """
+    Checks that each distinct image is downloaded only once, however many
+    targets share it, and not at all once it is in the image cache.
+    """
+    instance = TestPrimary.instance
+
+    # Record the targets actually downloaded.
+    downloaded = []
+    original_download_targets = instance._download_targets
+    def download_targets(targets, destination_directory):
+      downloaded.extend(target['filepath'] for target in targets)
+      return original_download_targets(targets, destination_directory)
+    instance._download_targets = download_targets
+
+    cache_dir = os.path.join(TEMP_CLIENT_DIR, primary.IMAGE_CACHE_DIRNAME)
+    if os.path.exists(cache_dir):
+      shutil.rmtree(cache_dir)
+
+    try:
+      all_targets = instance.updater.repositories['imagerepo'].targets_of_role(
+          'targets')
+      first_target, second_target = all_targets[:2]
+
+      # The same image under another name, e.g. as listed for another ECU.
+      renamed_target = copy.deepcopy(first_target)
+      renamed_target['filepath'] = '/renamed.img'
+
+      def obtain(targets, destination):
+        del downloaded[:]
+        errors = instance._obtain_targets(
+            targets, os.path.join(TEMP_CLIENT_DIR, destination))
+        self.assertEqual([None] * len(targets), errors)
+        for target in targets:
+          with open(os.path.join(TEMP_CLIENT_DIR, destination,
+              target['filepath'].lstrip('/')), 'rb') as fobj:
+            self.assertEqual(target['fileinfo']['hashes']['sha256'],
+                hashlib.sha256(fobj.read()).hexdigest())
+
+      obtain([first_target, second_target, first_target], 'dedup_targets')
+      self.assertEqual(
+          [first_target['filepath'], second_target['filepath']], downloaded)
+      self.assertEqual(sorted([first_target['fileinfo']['hashes']['sha256'],
+          second_target['fileinfo']['hashes']['sha256']]),
+          sorted(os.listdir(cache_dir)))
+
+      # Cached images are not downloaded again, even under other names that
+      # no repository provides.
+      obtain([renamed_target, second_target], 'cached_targets')
+      self.assertEqual([], downloaded)
+
+      # A damaged cached image is replaced. Images are copied out of the
+      # cache, so the damage does not reach the targets already placed.
+      with open(os.path.join(cache_dir,
+          first_target['fileinfo']['hashes']['sha256']), 'ab') as fobj:
+        fobj.write(b'damage')
+      for destination, target in [('dedup_targets', first_target),
+          ('cached_targets', renamed_target)]:
+        with open(os.path.join(TEMP_CLIENT_DIR, destination,
+            target['filepath'].lstrip('/')), 'rb') as fobj:
+          self.assertEqual(target['fileinfo']['hashes']['sha256'],
+              hashlib.sha256(fobj.read()).hexdigest())
+      obtain([first_target], 'recached_targets')
+      self.assertEqual([first_target['filepath']], downloaded)
+
+    finally:
+      instance._download_targets = original_download_targets
+
+
+
+
+
+  def test_59_fetch_only_needed_hashed_bin(self):
+    """
+    Has a second Primary validate an image from an Image Repository whose
+    targets role delegates the images among hashed bins (as the demo Image
+    Repository does with JSON metadata), and checks that it fetches only the
+    bin listing that image.
+    """
+    if tuf.conf.METADATA_FORMAT != 'json':
+      self.skipTest('Hashed bins are not supported with DER metadata.')
+
+    # Write an Image Repository with the demo's keys, delegating the images
+    # among 16 bins.
+    binned_repo_dir = os.path.join(TEMP_CLIENT_DIR, 'binned_imagerepo')
+    repository = rt.create_new_repository(binned_repo_dir)
+    for role, keyname in [(repository.root, 'mainroot'),
+        (repository.timestamp, 'maintimestamp'),
+        (repository.snapshot, 'mainsnapshot'),
+        (repository.targets, 'maintargets')]:
+      role.add_verification_key(demo.import_public_key(keyname))
+      role.load_signing_key(demo.import_private_key(keyname))
+
+    repository.targets.delegate_hashed_bins(
+        [], [demo.import_public_key('mainrole1')], 16)
+    for bin_role in repository.targets.delegations:
+      bin_role.load_signing_key(demo.import_private_key('mainrole1'))
+
+    for fname in sorted(os.listdir(SAMPLE_TARGETS)):
+      target_fname = os.path.join(binned_repo_dir, 'targets', fname)
+      shutil.copy(os.path.join(SAMPLE_TARGETS, fname), target_fname)
+      repository.targets.add_target_to_bin(target_fname)
+
+    repository.write()
+    shutil.copytree(os.path.join(binned_repo_dir, 'metadata.staged'),
+        os.path.join(binned_repo_dir, 'metadata'))
+
+    # The second Primary uses that and the sample Director repository.
+    with open(TEST_PINNING_FNAME) as fobj:
+      pinnings = json.load(fobj)
+    pinnings['repositories']['imagerepo']['mirrors'] = [
+        'file://' + binned_repo_dir]
+    pinnings['repositories']['director']['mirrors'] = [
+        'file://' + TEMP_CLIENT_DIR + '/director']
+    pinning_fname = os.path.join(TEMP_CLIENT_DIR, 'binned_pinned.json')
+    with open(pinning_fname, 'w') as fobj:
+      json.dump(pinnings, fobj)
+
+    client_dir = os.path.join(TEMP_CLIENT_DIR, 'binned_client')
+    uptane.common.create_directory_structure_for_client(client_dir,
+        pinning_fname, {'imagerepo': os.path.join(
+        binned_repo_dir, 'metadata', 'root.' + tuf.conf.METADATA_FORMAT),
+        'director': TEST_DIRECTOR_ROOT_FNAME})
+
+    try:
+      binned_instance = primary.Primary(
+          full_client_dir=client_dir,
+          director_repo_name=demo.DIRECTOR_REPO_NAME,
+          vin=VIN,
+          ecu_serial=PRIMARY_ECU_SERIAL,
+          primary_key=TestPrimary.ecu_key,
+          time=TestPrimary.initial_time,
+          timeserver_public_key=TestPrimary.key_timeserver_pub)
+
+      binned_instance.refresh_toplevel_metadata()
+      target_info = binned_instance.get_validated_target_info('/TCU1.1.txt')
+      self.assertEqual('/TCU1.1.txt', target_info['filepath'])
+
+    finally:
+      # Put the first Primary's client directory back in place.
+      tuf.conf.repository_directory = TEMP_CLIENT_DIR
+
+    # Of the 16 bins, only the one listing the image was fetched.
+    current_dir = os.path.join(
+        client_dir, 'metadata', 'imagerepo', 'current')
+    bin_fnames = [fname for fname in os.listdir(current_dir)
+        if fname[:-len('.' + tuf.conf.METADATA_FORMAT)] not in
+        ['root', 'snapshot', 'targets', 'timestamp']]
+    self.assertEqual(1, len(bin_fnames))
+
+    with open(os.path.join(current_dir, bin_fnames[0])) as fobj:
+      self.assertIn('/TCU1.1.txt', json.load(fobj)['signed']['targets'])
 
 
 
@@ -855,6 +1310,20 @@ class TestPrimary(unittest.TestCase):
         'secondary_without_updates'))
 
 
+    # The same image can be found by its verified hash.
+    sha256 = TestPrimary.instance.assigned_targets['TCUdemocar'][
+        'fileinfo']['hashes']['sha256']
+    self.assertEqual(
+        image_fname, TestPrimary.instance.get_image_fname_for_hash(sha256))
+
+    # No image is assigned with this hash.
+    self.assertIsNone(
+        TestPrimary.instance.get_image_fname_for_hash('0' * 64))
+
+    with self.assertRaises(tuf.FormatError):
+      TestPrimary.instance.get_image_fname_for_hash(5)
+
+
 
 
 
@@ -887,6 +1356,91 @@ class TestPrimary(unittest.TestCase):
 
 
 
+  def test_63_full_metadata_bundle(self):
+    """
+    Has the Primary distribute its metadata as a metadata bundle rather than
+    a zip archive, checking that the bundle holds each role file the Primary
+    has validated, that it is served from memory without being copied, and
+    that it is rebuilt only when a role file changes.
+    """
+    instance = TestPrimary.instance
+
+    for attribute in ['metadata_archive_format',
+        'temp_full_metadata_archive_fname',
+        'distributable_full_metadata_archive_fname']:
+      self.addCleanup(setattr, instance, attribute,
+          getattr(instance, attribute))
+
+    instance.metadata_archive_format = primary.METADATA_ARCHIVE_BUNDLE
+    instance.temp_full_metadata_archive_fname = os.path.join(
+        TEMP_CLIENT_DIR, 'metadata', 'temp_full_metadata_archive.bundle')
+    instance.distributable_full_metadata_archive_fname = os.path.join(
+        TEMP_CLIENT_DIR, 'metadata', 'full_metadata_archive.bundle')
+    bundle_fname = instance.get_full_metadata_archive_fname()
+
+    self.assertIsNone(instance.get_full_metadata_archive_data())
+
+    instance.save_distributable_metadata_files()
+
+    role_fnames = instance._get_metadata_role_fnames()
+    self.assertTrue(role_fnames)
+
+    with metadata_bundle.MetadataBundle(bundle_fname) as bundle:
+      self.assertEqual([(repository, role)
+          for repository, role, role_abs_fname in role_fnames],
+          bundle.roles())
+      for repository, role, role_abs_fname in role_fnames:
+        with open(role_abs_fname, 'rb') as fobj:
+          self.assertEqual(fobj.read(), bundle.get_role(repository, role))
+
+    # The bundle is served as a view of one memory map, not copied each time.
+    data = instance.get_full_metadata_archive_data()
+    self.assertIsInstance(data, memoryview)
+    with open(bundle_fname, 'rb') as fobj:
+      bundle_data = fobj.read()
+    self.assertEqual(bundle_data, data.tobytes())
+    mapping = instance.metadata_archive_mmap
+    magic_length = len(metadata_bundle.BUNDLE_MAGIC)
+    self.assertEqual(metadata_bundle.BUNDLE_MAGIC,
+        instance.get_full_metadata_archive_data()[:magic_length].tobytes())
+    self.assertIs(mapping, instance.metadata_archive_mmap)
+
+    # With no role file changed, the bundle is left in place, even if a role
+    # file has been touched.
+    bundle_inode = os.stat(bundle_fname).st_ino
+    os.utime(role_fnames[0][2], None)
+    instance.save_distributable_metadata_files()
+    self.assertEqual(bundle_inode, os.stat(bundle_fname).st_ino)
+
+    # A changed role file is picked up, and the bundle replaced; the view
+    # already given out still shows the old bundle.
+    repository, role, role_abs_fname = role_fnames[-1]
+    with open(role_abs_fname, 'rb') as fobj:
+      original_role_data = fobj.read()
+
+    def restore_role_file():
+      with open(role_abs_fname, 'wb') as fobj:
+        fobj.write(original_role_data)
+    self.addCleanup(restore_role_file)
+
+    with open(role_abs_fname, 'ab') as fobj:
+      fobj.write(b'changed')
+    instance.save_distributable_metadata_files()
+
+    self.assertNotEqual(bundle_inode, os.stat(bundle_fname).st_ino)
+    self.assertEqual(bundle_data, data.tobytes())
+
+    new_data = instance.get_full_metadata_archive_data()
+    self.assertIsNot(mapping, instance.metadata_archive_mmap)
+    self.assertNotEqual(bundle_data, new_data.tobytes())
+    with metadata_bundle.MetadataBundle(bundle_fname) as bundle:
+      self.assertEqual(original_role_data + b'changed',
+          bundle.get_role(repository, role))
+
+
+
+
+
   def test_65_get_metadata_for_ecu(self):
     pass
 
@@ -895,6 +1449,105 @@ class TestPrimary(unittest.TestCase):
 
 
 
+  def test_66_order_mirrors(self):
+    """
+    Checks that mirrors are ordered by their scores, including mirrors set at
+    runtime rather than listed in pinned.json.
+    """
+    instance = TestPrimary.instance
+    repositories = instance.updater.repositories
+    original_mirrors = dict((repo_name, repositories[repo_name].mirrors)
+        for repo_name in repositories)
+
+    slow = 'http://slow.example.com:30301/imagerepo'
+    fast = 'http://fast.example.com:30301/imagerepo'
+
+    try:
+      instance.mirror_scores = mirror_scores.MirrorScores()
+      repositories['imagerepo'].mirrors = \
+          [slow, fast] + original_mirrors['imagerepo']
+      instance.mirror_scores.record(slow + '/metadata/timestamp.der', 2.0)
+      instance.mirror_scores.record(fast + '/metadata/timestamp.der', 0.1)
+
+      instance._order_mirrors()
+
+      # Mirrors not yet scored come first, then the rest by score.
+      self.assertEqual(original_mirrors['imagerepo'] + [fast, slow],
+          repositories['imagerepo'].mirrors)
+      self.assertEqual(original_mirrors['director'],
+          repositories['director'].mirrors)
+
+    finally:
+      for repo_name in original_mirrors:
+        repositories[repo_name].mirrors = original_mirrors[repo_name]
+      instance.mirror_scores = None
+
+
+
+
+
+  def test_67_race_mirrors(self):
+    """
+    Checks that the two best mirrors of a repository are raced for a large
+    enough image only if the score of either is stale, and are then ordered
+    by their scores.
+    """
+    instance = TestPrimary.instance
+    repositories = instance.updater.repositories
+    original_mirrors = repositories['imagerepo'].mirrors
+    original_max_age = primary.MIRROR_SCORES_MAX_AGE
+
+    first = 'http://first.example.com:30301/imagerepo'
+    second = 'http://second.example.com:30301/imagerepo'
+    raced = []
+
+    def race(urls):
+      # The second mirror answers faster.
+      raced.append(urls)
+      scores.record(urls[0], 1.0)
+      scores.record(urls[1], 0.1)
+      return urls[1]
+
+    scores = mirror_scores.MirrorScores()
+    scores.race = race
+    target = repositories['imagerepo'].targets_of_role('targets')[0]
+
+    try:
+      instance.mirror_scores = scores
+      instance.mirror_race_threshold = 0
+      repositories['imagerepo'].mirrors = [first, second]
+
+      instance._race_mirrors([target])
+
+      self.assertEqual([[mirror + '/targets/' + target['filepath'].lstrip('/')
+          for mirror in [first, second]]], raced)
+      self.assertEqual([second, first], repositories['imagerepo'].mirrors)
+
+      # Scores just measured are not stale, so there is no new race.
+      instance._race_mirrors([target])
+      self.assertEqual(1, len(raced))
+
+      # Once they are, the mirrors are raced again.
+      primary.MIRROR_SCORES_MAX_AGE = -1
+      instance._race_mirrors([target])
+      self.assertEqual(2, len(raced))
+
+      # Images smaller than the threshold are not worth a race.
+      instance.mirror_race_threshold = target['fileinfo']['length'] + 1
+      instance._race_mirrors([target])
+      self.assertEqual(2, len(raced))
+
+    finally:
+      primary.MIRROR_SCORES_MAX_AGE = original_max_age
+      repositories['imagerepo'].mirrors = original_mirrors
+      instance.mirror_scores = None
+      instance.mirror_race_threshold = None
+
+
+
+
+
+
   def test_70_get_last_timeserver_attestation(self):
 
     # get_last_timeserver_attestation is tested in more detail in a previous
@@ -15,6 +15,7 @@ import uptane # Import before TUF modules; may change tuf.conf values.
 
 import unittest
 import os.path
+import io
 import time
 import shutil
 import hashlib
@@ -28,9 +29,11 @@ import tuf.conf
 import tuf.client.updater
 
 import uptane.formats
+import uptane.delta
 import uptane.clients.secondary as secondary
 import uptane.common # verify sigs, create client dir structure, convert key
 import uptane.encoding.asn1_codec as asn1_codec
+import uptane.encoding.metadata_bundle as metadata_bundle
 
 from uptane.encoding.asn1_codec import DATATYPE_TIME_ATTESTATION
 from uptane.encoding.asn1_codec import DATATYPE_ECU_MANIFEST
@@ -727,6 +730,59 @@ class TestSecondary(unittest.TestCase):
 
 
 
+  def test_41_process_metadata_bundle(self):
+    """
+    Tests uptane.clients.secondary.Secondary::process_metadata() given a
+    metadata bundle, as a Primary distributes in bundle mode, instead of a zip
+    archive: the Secondary should validate the same targets from it.
+    """
+    client_dir = TEMP_CLIENT_DIRS[0]
+    instance = secondary_instances[0]
+    tuf.conf.repository_directory = client_dir
+
+    # Bundle the same sample metadata test_40 used, as the Primary would.
+    sample_metadata_dir = os.path.join(
+        uptane.WORKING_DIR, 'samples', 'metadata_samples_long_expiry',
+        'update_to_one_ecu', 'full_metadata_archive')
+    role_files = []
+    for repo in ['director', 'imagerepo']:
+      role_dir = os.path.join(sample_metadata_dir, repo, 'metadata')
+      for role_fname in sorted(os.listdir(role_dir)):
+        if role_fname.endswith('.' + tuf.conf.METADATA_FORMAT):
+          with open(os.path.join(role_dir, role_fname), 'rb') as fobj:
+            role_files.append((repo, role_fname, fobj.read()))
+
+    bundle_fname = os.path.join(client_dir, 'full_metadata_archive.bundle')
+    with open(bundle_fname, 'wb') as fobj:
+      metadata_bundle.write_metadata_bundle(fobj, role_files)
+
+    # Start from no unverified metadata, so that it all comes from the bundle.
+    shutil.rmtree(os.path.join(client_dir, 'unverified'), ignore_errors=True)
+    instance.validated_targets_for_this_ecu = []
+
+    instance.process_metadata(bundle_fname)
+
+    for repo, role_fname, data in role_files:
+      with open(os.path.join(client_dir, 'unverified', repo, 'metadata',
+          role_fname), 'rb') as fobj:
+        self.assertEqual(data, fobj.read())
+
+    self.assertEqual(
+        [expected_updated_fileinfo], instance.validated_targets_for_this_ecu)
+
+    # A corrupted bundle is rejected before anything in it is validated.
+    with open(bundle_fname, 'rb') as fobj:
+      bundle_data = fobj.read()
+    with open(bundle_fname, 'wb') as fobj:
+      fobj.write(bundle_data[:-1] + b'X')
+
+    with self.assertRaises(tuf.BadHashError):
+      instance.process_metadata(bundle_fname)
+
+
+
+
+
   def test_50_validate_image(self):
 
     image_fname = 'TCU1.1.txt'
@@ -752,6 +808,236 @@ class TestSecondary(unittest.TestCase):
 
 
 
+  def test_60_image_block_transfer(self):
+
+    image_fname = 'TCU1.1.txt'
+    with open(os.path.join(demo.DEMO_DIR, 'images', image_fname), 'rb') as f:
+      image_data = f.read()
+    client_unverified_targets_dir = TEMP_CLIENT_DIRS[0] + '/unverified_targets'
+    full_image_fname = os.path.join(client_unverified_targets_dir, image_fname)
+
+    if os.path.exists(client_unverified_targets_dir):
+      shutil.rmtree(client_unverified_targets_dir)
+
+    instance = secondary_instances[0]
+
+    # The image is 17 bytes long: four blocks of 4 bytes, and one of 1 byte.
+    block_size = 4
+    image_file = {
+        'filename': image_fname, 'number_of_blocks': 5,
+        'block_size': block_size}
+
+    def block(block_number, data=image_data):
+      return {
+          'filename': image_fname,
+          'block_number': block_number,
+          'block': data[(block_number - 1) * block_size:
+              block_number * block_size]}
+
+    # The number of blocks must be consistent with the validated length.
+    with self.assertRaises(uptane.Error):
+      instance.begin_image_block_transfer({
+          'filename': image_fname, 'number_of_blocks': 4,
+          'block_size': block_size})
+
+    # Only images validated for this ECU are accepted.
+    with self.assertRaises(uptane.Error):
+      secondary_instances[1].begin_image_block_transfer(image_file)
+
+    self.assertEqual(1, instance.begin_image_block_transfer(image_file))
+    self.assertFalse(instance.receive_image_block(block(1)))
+
+    # Blocks must arrive in order, and be the size of a block.
+    with self.assertRaises(uptane.Error):
+      instance.receive_image_block(block(3))
+    with self.assertRaises(uptane.Error):
+      instance.receive_image_block(
+          {'filename': image_fname, 'block_number': 2, 'block': b'ab'})
+
+    self.assertFalse(instance.receive_image_block(block(2)))
+
+    # Interrupt the transfer once what it received is written out, leaving
+    # part of the next block behind, and resume it: the whole blocks already
+    # received are kept.
+    instance.image_stream['fobj'].flush()
+    with open(instance.image_stream['partial_fname'], 'ab') as fobj:
+      fobj.write(image_data[8:10])
+    self.assertEqual(3, instance.begin_image_block_transfer(image_file))
+
+    self.assertFalse(instance.receive_image_block(block(3)))
+    self.assertFalse(instance.receive_image_block(block(4)))
+    self.assertTrue(instance.receive_image_block(block(5)))
+    self.assertIsNone(instance.image_block_transfer)
+
+    with open(full_image_fname, 'rb') as fobj:
+      self.assertEqual(image_data, fobj.read())
+    instance.validate_image(image_fname)
+
+    # An image with the wrong contents is rejected and discarded once
+    # complete, and the next transfer starts over.
+    os.remove(full_image_fname)
+    bad_data = b'X' + image_data[1:]
+    self.assertEqual(1, instance.begin_image_block_transfer(image_file))
+    for block_number in range(1, 5):
+      instance.receive_image_block(block(block_number, bad_data))
+    with self.assertRaises(tuf.BadHashError):
+      instance.receive_image_block(block(5, bad_data))
+    self.assertFalse(os.path.exists(full_image_fname))
+    self.assertEqual(1, instance.begin_image_block_transfer(image_file))
+
+    # An image that is too long is rejected as soon as it is.
+    for block_number in range(1, 5):
+      instance.receive_image_block(block(block_number))
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      instance.receive_image_block(
+          {'filename': image_fname, 'block_number': 5, 'block': b'ab'})
+    self.assertIsNone(instance.image_block_transfer)
+
+
+
+
+
+  def test_65_image_stream(self):
+
+    image_fname = 'TCU1.1.txt'
+    with open(os.path.join(demo.DEMO_DIR, 'images', image_fname), 'rb') as f:
+      image_data = f.read()
+    client_unverified_targets_dir = TEMP_CLIENT_DIRS[0] + '/unverified_targets'
+    full_image_fname = os.path.join(client_unverified_targets_dir, image_fname)
+
+    if os.path.exists(client_unverified_targets_dir):
+      shutil.rmtree(client_unverified_targets_dir)
+
+    instance = secondary_instances[0]
+
+    # Nothing can be received before a stream begins.
+    with self.assertRaises(uptane.Error):
+      instance.receive_image_chunk(image_data)
+    with self.assertRaises(uptane.Error):
+      instance.finish_image_stream()
+
+    # Only images validated for this ECU are accepted.
+    with self.assertRaises(uptane.Error):
+      secondary_instances[1].begin_image_stream(image_fname)
+
+    self.assertEqual(0, instance.begin_image_stream(image_fname))
+    instance.receive_image_chunk(image_data[:5])
+    instance.receive_image_chunk(b'')
+    instance.receive_image_chunk(image_data[5:10])
+
+    # One partial file is kept open for the whole stream.
+    partial_fobj = instance.image_stream['fobj']
+    self.assertFalse(partial_fobj.closed)
+
+    # Nothing appears under the image's filename until it is validated.
+    self.assertFalse(os.path.exists(full_image_fname))
+
+    # Resume after an interruption, where the stream stopped. The interrupted
+    # stream's partial file is closed, and reopened.
+    self.assertEqual(10, instance.begin_image_stream(image_fname, resume=True))
+    self.assertTrue(partial_fobj.closed)
+    partial_fobj = instance.image_stream['fobj']
+    instance.receive_image_chunk(image_data[10:])
+    instance.finish_image_stream()
+    self.assertIsNone(instance.image_stream)
+    self.assertTrue(partial_fobj.closed)
+
+    with open(full_image_fname, 'rb') as fobj:
+      self.assertEqual(image_data, fobj.read())
+    instance.validate_image(image_fname)
+
+    # Without resuming, the stream starts over.
+    self.assertEqual(0, instance.begin_image_stream(image_fname))
+
+    # An image that is too long is rejected as soon as it is, and discarded.
+    instance.receive_image_chunk(image_data[:10])
+    partial_fobj = instance.image_stream['fobj']
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      instance.receive_image_chunk(image_data[10:] + b'X')
+    self.assertIsNone(instance.image_stream)
+    self.assertTrue(partial_fobj.closed)
+    self.assertEqual(0, instance.begin_image_stream(image_fname, resume=True))
+
+    # An image that is too short or has the wrong contents fails when
+    # finished.
+    instance.receive_image_chunk(image_data[:-1])
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      instance.finish_image_stream()
+
+    instance.begin_image_stream(image_fname)
+    instance.receive_image_chunk(b'X' + image_data[1:])
+    with self.assertRaises(tuf.BadHashError):
+      instance.finish_image_stream()
+
+    # validate_image() also rejects a file that is too long.
+    with open(full_image_fname, 'ab') as fobj:
+      fobj.write(b'X')
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      instance.validate_image(image_fname)
+
+
+
+
+
+  def test_67_apply_image_delta(self):
+
+    image_fname = 'TCU1.1.txt'
+    with open(os.path.join(demo.DEMO_DIR, 'images', image_fname), 'rb') as f:
+      image_data = f.read()
+    base_fname = os.path.join(demo.DEMO_DIR, 'images', 'TCU1.0.txt')
+    with open(base_fname, 'rb') as f:
+      base_data = f.read()
+    full_image_fname = os.path.join(
+        TEMP_CLIENT_DIRS[0], 'unverified_targets', image_fname)
+
+    if os.path.exists(full_image_fname):
+      os.remove(full_image_fname)
+
+    instance = secondary_instances[0]
+
+    instance.apply_image_delta(image_fname, base_fname,
+        io.BytesIO(uptane.delta.create_delta(base_data, image_data)))
+    self.assertIsNone(instance.image_stream)
+
+    with open(full_image_fname, 'rb') as fobj:
+      self.assertEqual(image_data, fobj.read())
+    instance.validate_image(image_fname)
+    os.remove(full_image_fname)
+
+    # A delta for a different base image, or a malformed delta, is rejected
+    # before anything is produced.
+    for bad_delta in [
+        uptane.delta.create_delta(image_data, image_data), b'not a delta']:
+      with self.assertRaises(uptane.Error):
+        instance.apply_image_delta(
+            image_fname, base_fname, io.BytesIO(bad_delta))
+      self.assertIsNone(instance.image_stream)
+      self.assertFalse(os.path.exists(full_image_fname))
+
+    # A delta that declares that it produces some other image is rejected
+    # before anything is produced, too.
+    other_delta = uptane.delta.create_delta(base_data, b'X' + image_data[1:])
+    with self.assertRaises(uptane.Error):
+      instance.apply_image_delta(
+          image_fname, base_fname, io.BytesIO(other_delta))
+    self.assertIsNone(instance.image_stream)
+    self.assertFalse(os.path.exists(full_image_fname))
+
+    # A delta that declares the right image but produces some other image
+    # fails validation, as that image would.
+    header_length = len(uptane.delta.DELTA_MAGIC) + 80
+    lying_delta = uptane.delta.create_delta(base_data, image_data)[
+        :header_length] + other_delta[header_length:]
+    with self.assertRaises(tuf.BadHashError):
+      instance.apply_image_delta(
+          image_fname, base_fname, io.BytesIO(lying_delta))
+    self.assertIsNone(instance.image_stream)
+    self.assertFalse(os.path.exists(full_image_fname))
+
+
+
+
+
 # Run unit tests.
 if __name__ == '__main__':
   unittest.main()
@@ -14,11 +14,14 @@ import uptane # Import before TUF modules; may change tuf.conf values.
 
 import unittest
 import time
+import copy
+import threading
 
 import tuf
 import tuf.formats
 
 import uptane.formats
+import uptane.common
 import uptane.encoding.asn1_codec as asn1_codec
 import uptane.services.timeserver as timeserver
 
@@ -98,6 +101,93 @@ class TestTimeserver(unittest.TestCase):
 
 
 
+  def test_get_signed_time_batched(self):
+
+    basic_time_tests(
+        timeserver.get_signed_time_batched,
+        uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA, self)
+
+    key_pub = uptane.common.public_key_from_canonical(
+        TestTimeserver.timeserver_key)
+
+    attestation = timeserver.get_signed_time_batched([1, 2])
+    self.assertEqual([1, 2], attestation['attestation']['nonces'])
+    self.assertEqual(attestation['attestation'],
+        uptane.common.verify_batched_time_attestation(
+        attestation, key_pub, metadata_format='json'))
+
+    # Tamper with the nonces, expecting the inclusion proof to fail.
+    tampered = copy.deepcopy(attestation)
+    tampered['attestation']['nonces'] = [1, 3]
+    with self.assertRaises(uptane.BadTimeAttestation):
+      uptane.common.verify_batched_time_attestation(
+          tampered, key_pub, metadata_format='json')
+
+    # Tamper with the signed root, expecting the signature check to fail.
+    tampered = copy.deepcopy(attestation)
+    tampered['signed']['number_of_leaves'] += 1
+    with self.assertRaises(tuf.BadSignatureError):
+      uptane.common.verify_batched_time_attestation(
+          tampered, key_pub, metadata_format='json')
+
+    # Concurrent requests within one window should share one signature.
+    timeserver.set_batch_window(0.5)
+    results = {}
+    def request(nonce):
+      results[nonce] = timeserver.get_signed_time_batched([nonce])
+    threads = [threading.Thread(target=request, args=(n,)) for n in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    timeserver.set_batch_window(timeserver.DEFAULT_BATCH_WINDOW)
+
+    self.assertEqual(5, len(results))
+    signatures = set(r['signatures'][0]['sig'] for r in results.values())
+    self.assertEqual(1, len(signatures))
+    for nonce, attestation in results.items():
+      self.assertEqual(5, attestation['signed']['number_of_leaves'])
+      self.assertEqual([nonce], uptane.common.verify_batched_time_attestation(
+          attestation, key_pub, metadata_format='json')['nonces'])
+
+    with self.assertRaises(tuf.FormatError):
+      timeserver.set_batch_window(-1)
+
+
+
+
+
+  def test_get_signed_time_batched_der(self):
+
+    basic_time_tests(timeserver.get_signed_time_batched_der,
+        uptane.formats.DER_DATA_SCHEMA, self)
+
+    key_pub = uptane.common.public_key_from_canonical(
+        TestTimeserver.timeserver_key)
+
+    der_attestation = timeserver.get_signed_time_batched_der([7, 8])
+    attestation = \
+        asn1_codec.convert_signed_der_time_attestation_to_dersigned_json(
+        der_attestation)
+    self.assertIn('merkle_proof', attestation)
+    self.assertEqual([7, 8], uptane.common.verify_batched_time_attestation(
+        attestation, key_pub, metadata_format='der')['nonces'])
+
+    # Ordinary DER time attestations are still decoded as such.
+    self.assertNotIn('merkle_proof',
+        asn1_codec.convert_signed_der_time_attestation_to_dersigned_json(
+        timeserver.get_signed_time_der([7, 8])))
+
+    if timeserver.PYASN1_EXISTS:
+      timeserver.PYASN1_EXISTS = False
+      with self.assertRaises(uptane.Error):
+        timeserver.get_signed_time_batched_der([5])
+      timeserver.PYASN1_EXISTS = True
+
+
+
+
+
   def test_set_timeserver_key(self):
 
     new_key_pub = demo.import_public_key('directorsnapshot')
@@ -75,6 +75,14 @@ class FailedToEncodeASN1DER(Error):
   """
   pass
 
+class BadRPCMessage(Error):
+  """
+  Received a message over binary RPC (see uptane/binary_rpc.py) that is not
+  properly framed or encoded, or is too long, or tried to send a value that
+  cannot be encoded.
+  """
+  pass
+
 
 # Logging configuration
 
@@ -0,0 +1,698 @@
+"""
+<Program Name>
+  uptane/binary_rpc.py
+
+<Purpose>
+  Provides a compact binary RPC protocol, an alternative to XML-RPC for the
+  messages exchanged between Secondaries, Primaries, the Director and the
+  Timeserver. XML-RPC must base64-encode binary data (e.g. DER-encoded
+  manifests and time attestations, wrapped in xmlrpc_client.Binary), growing
+  it by a third, and marshals every value as XML text, which is slow to
+  produce and to parse. Here, binary data is carried as is, and every value
+  in a few bytes of fixed-size fields.
+
+  Calls are made over a stream socket (TCP, or a Unix domain socket), on
+  which any number of calls may be made, one after another. Each call is a
+  request message from the client, answered by a response message from the
+  server. Each message is framed as a 4-byte big-endian unsigned length,
+  followed by that many bytes: the byte PROTOCOL_VERSION, then a single
+  encoded value:
+    - for a request, the list [method name, list of parameters]
+    - for a response, the list [True, result] if the call succeeded, or
+      [False, fault code, fault string] if it failed (as an XML-RPC fault)
+
+  Values are encoded as a one-byte type tag, followed by:
+    b'N' None, b'T' True, b'F' False: nothing
+    b'i' an integer: 8 bytes, big-endian, signed
+    b'd' a float: 8 bytes, big-endian IEEE 754
+    b's' a (unicode) string: a 4-byte length and that many bytes of UTF-8
+    b'b' binary data: a 4-byte length and that many bytes
+    b'l' a list (or tuple): a 4-byte count, then that many values
+    b'm' a dictionary: a 4-byte count, then that many pairs of a string key
+         (a 4-byte length and UTF-8, without a tag) and a value
+  All lengths and counts are big-endian unsigned integers.
+
+  Binary data can be given as bytes or as an xmlrpc_client.Binary, and is
+  always received as an xmlrpc_client.Binary, and failed calls raise
+  xmlrpc_client.Fault, so that the functions called, and the code calling
+  them, need not know which of the two protocols is used. The same values
+  can be sent as over XML-RPC (with allow_none), but integers may be 64-bit
+  and the keys of dictionaries must be strings.
+
+  Servers for this protocol are in demo/rpc_server.py.
+
+<Classes>
+  ServerProxy(address, timeout, max_idle_connections, max_idle_time)
+
+<Functions>
+  encode_value(value)
+  decode_value(data)
+  encode_request(method, params)
+  decode_request(message)
+  encode_response(result)
+  encode_fault(fault_code, fault_string)
+  decode_response(message)
+  handle_request(dispatch, message)
+  read_message(sock, max_length)
+  write_message(sock, message)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import tuf
+import tuf.formats
+
+import socket
+import select
+import struct
+import threading
+import time
+
+import six
+from six.moves import xmlrpc_client
+
+# The first byte of every message. Messages of any other version are
+# rejected.
+PROTOCOL_VERSION = 1
+
+# The longest message accepted, in bytes. Large enough for the images and
+# metadata archives a Primary may send its Secondaries.
+MAX_MESSAGE_LENGTH = 64 * 1024 * 1024
+
+# The deepest nesting of lists and dictionaries accepted in a value.
+MAX_DEPTH = 32
+
+# The fault code sent when a request cannot be decoded, as in XML-RPC.
+PARSE_ERROR_FAULT_CODE = -32700
+
+# Defaults for ServerProxy: the socket timeout, in seconds, the number of
+# idle connections kept for further calls, and the number of seconds for
+# which an idle connection is kept. The last should be less than the time
+# for which the servers keep idle connections open
+# (demo.rpc_server.DEFAULT_REQUEST_TIMEOUT).
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_IDLE_CONNECTIONS = 2
+DEFAULT_MAX_IDLE_TIME = 10
+
+# Messages shorter than this are sent with their length in a single write.
+# Longer ones are sent in two writes rather than copied.
+_COALESCE_LENGTH = 64 * 1024
+
+_LENGTH = struct.Struct('>I')
+_INT = struct.Struct('>q')
+_FLOAT = struct.Struct('>d')
+
+_NONE = b'N'
+_TRUE = b'T'
+_FALSE = b'F'
+_INTEGER = b'i'
+_FLOAT_TAG = b'd'
+_STRING = b's'
+_BINARY = b'b'
+_LIST = b'l'
+_DICT = b'm'
+
+_MIN_INT = -2 ** 63
+_MAX_INT = 2 ** 63 - 1
+
+
+
+def encode_value(value):
+  """
+  <Purpose>
+    Returns the binary encoding (see above) of the given value.
+
+  <Exceptions>
+    uptane.BadRPCMessage, if the value, or any value it contains, is of a
+    type that cannot be encoded, an integer that does not fit in 64 bits, or
+    nested too deeply.
+  """
+  chunks = []
+  _encode(value, chunks, 0)
+  return b''.join(chunks)
+
+
+
+
+
+def _encode(value, chunks, depth):
+  if value is None:
+    chunks.append(_NONE)
+
+  # (bool is a subclass of int, so this must come first.)
+  elif value is True:
+    chunks.append(_TRUE)
+
+  elif value is False:
+    chunks.append(_FALSE)
+
+  elif isinstance(value, six.integer_types):
+    if not _MIN_INT <= value <= _MAX_INT:
+      raise uptane.BadRPCMessage('Integer too large to send: ' + repr(value))
+    chunks.append(_INTEGER + _INT.pack(value))
+
+  elif isinstance(value, float):
+    chunks.append(_FLOAT_TAG + _FLOAT.pack(value))
+
+  elif isinstance(value, xmlrpc_client.Binary):
+    _encode_bytes(_BINARY, value.data, chunks)
+
+  elif isinstance(value, six.text_type) or (
+      six.PY2 and isinstance(value, str)):
+    _encode_bytes(_STRING, _to_utf8(value), chunks)
+
+  elif isinstance(value, (bytes, bytearray)):
+    _encode_bytes(_BINARY, bytes(value), chunks)
+
+  elif isinstance(value, (list, tuple)):
+    _check_depth(depth)
+    chunks.append(_LIST + _LENGTH.pack(len(value)))
+    for item in value:
+      _encode(item, chunks, depth + 1)
+
+  elif isinstance(value, dict):
+    _check_depth(depth)
+    chunks.append(_DICT + _LENGTH.pack(len(value)))
+    for key in value:
+      if not isinstance(key, six.string_types):
+        raise uptane.BadRPCMessage(
+            'Dictionary keys must be strings, not ' + repr(key))
+      key_data = _to_utf8(key)
+      chunks.append(_LENGTH.pack(len(key_data)))
+      chunks.append(key_data)
+      _encode(value[key], chunks, depth + 1)
+
+  else:
+    raise uptane.BadRPCMessage('Cannot send a value of type ' +
+        repr(type(value).__name__) + ': ' + repr(value))
+
+
+
+
+
+def _encode_bytes(tag, data, chunks):
+  if len(data) > MAX_MESSAGE_LENGTH:
+    raise uptane.BadRPCMessage('Value too long to send: ' +
+        str(len(data)) + ' bytes')
+  chunks.append(tag + _LENGTH.pack(len(data)))
+  chunks.append(data)
+
+
+
+
+
+def _to_utf8(string):
+  if isinstance(string, bytes): # Python 2 str
+    return string
+  return string.encode('utf-8')
+
+
+
+
+
+def _check_depth(depth):
+  if depth >= MAX_DEPTH:
+    raise uptane.BadRPCMessage('Value nested too deeply')
+
+
+
+
+
+def decode_value(data):
+  """
+  <Purpose>
+    Returns the value encoded (see above) in the given bytes or bytearray,
+    which must contain nothing else.
+
+  <Exceptions>
+    uptane.BadRPCMessage, if the data is not a single properly encoded value.
+  """
+  view = memoryview(data)
+  value, offset = _decode(data, view, 0, 0)
+  if offset != len(data):
+    raise uptane.BadRPCMessage('Unexpected data after value, at offset ' +
+        str(offset))
+  return value
+
+
+
+
+
+def _decode(data, view, offset, depth):
+  """
+  Returns the value encoded in data at the given offset, and the offset of
+  whatever follows it. view is a memoryview of data, from which to copy
+  binary data and strings.
+  """
+  _check_length(data, offset, 1)
+  tag = view[offset:offset + 1].tobytes()
+  offset += 1
+
+  if tag == _NONE:
+    return None, offset
+
+  elif tag == _TRUE:
+    return True, offset
+
+  elif tag == _FALSE:
+    return False, offset
+
+  elif tag == _INTEGER:
+    _check_length(data, offset, _INT.size)
+    return _INT.unpack_from(data, offset)[0], offset + _INT.size
+
+  elif tag == _FLOAT_TAG:
+    _check_length(data, offset, _FLOAT.size)
+    return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+
+  elif tag == _STRING:
+    return _decode_string(data, view, offset)
+
+  elif tag == _BINARY:
+    length, offset = _decode_length(data, offset)
+    _check_length(data, offset, length)
+    return xmlrpc_client.Binary(view[offset:offset + length].tobytes()), \
+        offset + length
+
+  elif tag == _LIST:
+    _check_depth(depth)
+    count, offset = _decode_count(data, offset)
+    items = []
+    for i in range(count):
+      item, offset = _decode(data, view, offset, depth + 1)
+      items.append(item)
+    return items, offset
+
+  elif tag == _DICT:
+    _check_depth(depth)
+    count, offset = _decode_count(data, offset)
+    dictionary = {}
+    for i in range(count):
+      key, offset = _decode_string(data, view, offset)
+      dictionary[key], offset = _decode(data, view, offset, depth + 1)
+    return dictionary, offset
+
+  raise uptane.BadRPCMessage('Unknown type tag ' + repr(tag) +
+      ' at offset ' + str(offset - 1))
+
+
+
+
+
+def _decode_string(data, view, offset):
+  length, offset = _decode_length(data, offset)
+  _check_length(data, offset, length)
+  try:
+    string = view[offset:offset + length].tobytes().decode('utf-8')
+  except UnicodeDecodeError:
+    raise uptane.BadRPCMessage('String is not UTF-8, at offset ' +
+        str(offset))
+  return string, offset + length
+
+
+
+
+
+def _decode_length(data, offset):
+  _check_length(data, offset, _LENGTH.size)
+  return _LENGTH.unpack_from(data, offset)[0], offset + _LENGTH.size
+
+
+
+
+
+def _decode_count(data, offset):
+  # Every item takes at least a byte, so a count larger than the data left
+  # is bad, and is caught before any time is spent on it.
+  count, offset = _decode_length(data, offset)
+  _check_length(data, offset, count)
+  return count, offset
+
+
+
+
+
+def _check_length(data, offset, length):
+  if offset + length > len(data):
+    raise uptane.BadRPCMessage('Value truncated at offset ' + str(offset))
+
+
+
+
+
+def encode_request(method, params):
+  """Returns the message for a call to the given method with the given
+  parameters (a list or tuple)."""
+  return six.int2byte(PROTOCOL_VERSION) + encode_value([method, list(params)])
+
+
+
+
+
+def decode_request(message):
+  """
+  <Purpose>
+    Returns the method name and list of parameters of the given request
+    message.
+
+  <Exceptions>
+    uptane.BadRPCMessage, if the message is not a request of this version.
+  """
+  request = decode_value(_strip_version(message))
+
+  if not isinstance(request, list) or len(request) != 2 or \
+      not isinstance(request[0], six.text_type) or \
+      not isinstance(request[1], list):
+    raise uptane.BadRPCMessage('Not a request: ' + repr(request))
+
+  return request[0], request[1]
+
+
+
+
+
+def encode_response(result):
+  """Returns the response message for a call that returned result."""
+  return six.int2byte(PROTOCOL_VERSION) + encode_value([True, result])
+
+
+
+
+
+def encode_fault(fault_code, fault_string):
+  """Returns the response message for a call that failed."""
+  return six.int2byte(PROTOCOL_VERSION) + \
+      encode_value([False, fault_code, fault_string])
+
+
+
+
+
+def decode_response(message):
+  """
+  <Purpose>
+    Returns the result in the given response message, or raises the fault it
+    contains.
+
+  <Exceptions>
+    xmlrpc_client.Fault, if the response is a fault: the call failed.
+
+    uptane.BadRPCMessage, if the message is not a response of this version.
+  """
+  response = decode_value(_strip_version(message))
+
+  if isinstance(response, list) and len(response) == 2 and \
+      response[0] is True:
+    return response[1]
+
+  if isinstance(response, list) and len(response) == 3 and \
+      response[0] is False and isinstance(response[1], six.integer_types) \
+      and isinstance(response[2], six.text_type):
+    raise xmlrpc_client.Fault(response[1], response[2])
+
+  raise uptane.BadRPCMessage('Not a response: ' + repr(response))
+
+
+
+
+
+def _strip_version(message):
+  if not message or six.indexbytes(message, 0) != PROTOCOL_VERSION:
+    raise uptane.BadRPCMessage('Not a message of protocol version ' +
+        str(PROTOCOL_VERSION))
+  return memoryview(message)[1:]
+
+
+
+
+
+def handle_request(dispatch, message):
+  """
+  <Purpose>
+    Makes the call in the given request message and returns the response
+    message, as an XML-RPC server does.
+
+  <Arguments>
+    dispatch
+      a function, called with a method name and a list of parameters, that
+      calls the method and returns its result, e.g. the _dispatch() of an
+      xmlrpc_server.SimpleXMLRPCServer, to provide the functions registered
+      with it
+
+    message
+      the request message
+
+  <Returns>
+    The response message: the result, or a fault if the request could not be
+    decoded, or the call raised an exception (xmlrpc_client.Fault, as is, or
+    otherwise code 1 and 'type:value', as SimpleXMLRPCServer reports it), or
+    its result could not be encoded.
+  """
+  try:
+    method, params = decode_request(message)
+  except uptane.BadRPCMessage as e:
+    return encode_fault(PARSE_ERROR_FAULT_CODE, str(e))
+
+  try:
+    return encode_response(dispatch(method, params))
+
+  except xmlrpc_client.Fault as fault:
+    return encode_fault(fault.faultCode, str(fault.faultString))
+
+  except Exception as e:
+    return encode_fault(1, '%s:%s' % (type(e), e))
+
+
+
+
+
+def read_message(sock, max_length=MAX_MESSAGE_LENGTH):
+  """
+  <Purpose>
+    Reads one framed message from the given socket.
+
+  <Exceptions>
+    uptane.BadRPCMessage, if the message is longer than max_length bytes.
+
+    socket.error, if the connection fails or is closed partway through the
+    message.
+
+  <Returns>
+    The message, as a bytearray, or None if the connection was closed
+    before any of it arrived.
+  """
+  header = _recv_exactly(sock, _LENGTH.size, allow_eof=True)
+  if header is None:
+    return None
+
+  length = _LENGTH.unpack_from(header)[0]
+  if length > max_length:
+    raise uptane.BadRPCMessage('Message too long: ' + str(length) +
+        ' bytes, more than ' + str(max_length))
+
+  return _recv_exactly(sock, length)
+
+
+
+
+
+def write_message(sock, message):
+  """Writes the given message, framed, to the given socket."""
+  header = _LENGTH.pack(len(message))
+  if len(message) < _COALESCE_LENGTH:
+    sock.sendall(header + bytes(message))
+  else:
+    sock.sendall(header)
+    sock.sendall(message)
+
+
+
+
+
+def _is_open(sock):
+  """
+  Returns True if the given idle connection is still open: nothing can be
+  read from it yet, neither data (which it should not have) nor the end of
+  the connection (if the server closed it).
+  """
+  try:
+    return not select.select([sock], [], [], 0)[0]
+  except (ValueError, socket.error, select.error): # Closed on this side.
+    return False
+
+
+
+
+
+def _recv_exactly(sock, length, allow_eof=False):
+  buf = bytearray(length)
+  view = memoryview(buf)
+  received = 0
+  while received < length:
+    n = sock.recv_into(view[received:])
+    if not n:
+      if allow_eof and not received:
+        return None
+      raise socket.error('Connection closed partway through a message')
+    received += n
+  return buf
+
+
+
+
+
+class ServerProxy(object):
+  """
+  <Purpose>
+    Calls the functions of a binary RPC server, as
+    xmlrpc_client.ServerProxy does those of an XML-RPC server:
+      proxy = binary_rpc.ServerProxy(('localhost', 31601))
+      attestation = proxy.get_signed_time_der([nonce]).data
+
+    Connections are kept open between calls, and may be used by several
+    threads at once (each call taking its own connection). An idle
+    connection that the server has closed is found before it is reused, and
+    a call that cannot be sent on a reused connection is sent again, on a
+    new one. A call that was sent is never sent again, since the server may
+    already have handled it.
+
+  <Arguments>
+    address
+      the server's address: a (host, port) tuple for TCP, or the filename of
+      a Unix domain socket
+
+    timeout (optional)
+      the socket timeout, in seconds
+
+    max_idle_connections (optional)
+      the largest number of idle connections to keep
+
+    max_idle_time (optional)
+      the number of seconds for which to keep an idle connection
+
+  <Exceptions>
+    tuf.FormatError, if an argument is improperly formatted.
+
+    Calls raise xmlrpc_client.Fault if the call fails on the server,
+    socket.error if the connection fails, and uptane.BadRPCMessage if a
+    parameter cannot be sent or the response is malformed.
+  """
+  def __init__(self, address, timeout=DEFAULT_TIMEOUT,
+      max_idle_connections=DEFAULT_MAX_IDLE_CONNECTIONS,
+      max_idle_time=DEFAULT_MAX_IDLE_TIME):
+
+    if isinstance(address, tuple):
+      if len(address) != 2:
+        raise tuf.FormatError('Expected a (host, port) tuple; got ' +
+            repr(address))
+      tuf.formats.LENGTH_SCHEMA.check_match(address[1])
+    else:
+      tuf.formats.PATH_SCHEMA.check_match(address)
+    tuf.formats.LENGTH_SCHEMA.check_match(timeout)
+    tuf.formats.LENGTH_SCHEMA.check_match(max_idle_connections)
+    tuf.formats.LENGTH_SCHEMA.check_match(max_idle_time)
+
+    self._address = address
+    self._timeout = timeout
+    self._max_idle_connections = max_idle_connections
+    self._max_idle_time = max_idle_time
+
+    # A list of (socket, time it became idle), most recently idle last.
+    self._idle = []
+    self._lock = threading.Lock()
+
+
+
+  def __getattr__(self, name):
+    if name.startswith('_'):
+      raise AttributeError(name)
+    return lambda *params: self._call(name, params)
+
+
+
+  def _call(self, method, params):
+    message = encode_request(method, params)
+
+    while True:
+      sock, reused = self._get_connection()
+      try:
+        write_message(sock, message)
+
+      except socket.timeout:
+        sock.close()
+        raise
+
+      except socket.error:
+        sock.close()
+        if reused:
+          continue
+        raise
+
+      try:
+        response = read_message(sock)
+        if response is None:
+          raise socket.error('Connection closed before the response')
+
+      except (socket.error, uptane.BadRPCMessage):
+        sock.close()
+        raise
+
+      self._release_connection(sock)
+      return decode_response(response)
+
+
+
+  def close(self):
+    """Closes all idle connections."""
+    with self._lock:
+      idle = self._idle
+      self._idle = []
+
+    for sock, idle_since in idle:
+      sock.close()
+
+
+
+  def _get_connection(self):
+    """
+    Returns a tuple (socket, reused): an idle connection, if there is one
+    still open, or else a new one.
+    """
+    now = time.time()
+
+    while True:
+      with self._lock:
+        if not self._idle:
+          break
+        sock, idle_since = self._idle.pop()
+
+      if now - idle_since <= self._max_idle_time and _is_open(sock):
+        return sock, True
+      sock.close()
+
+    if isinstance(self._address, tuple):
+      sock = socket.create_connection(self._address, self._timeout)
+      # Each message is written whole; don't hold back its last packet.
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    else:
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      sock.settimeout(self._timeout)
+      try:
+        sock.connect(self._address)
+      except socket.error:
+        sock.close()
+        raise
+
+    return sock, False
+
+
+
+  def _release_connection(self, sock):
+    with self._lock:
+      if len(self._idle) < self._max_idle_connections:
+        self._idle.append((sock, time.time()))
+        return
+
+    sock.close()
@@ -24,8 +24,17 @@ import os # For paths and makedirs
 import shutil # For copyfile
 import random # for nonces
 import zipfile
+import tempfile # to stage image downloads
+import mmap # to serve the distributable metadata archive from memory
 import hashlib # if we're using DER encoding
+import io # to read the headers of image deltas
 import iso8601
+import threading # for locks shared with concurrent Secondaries
+import fnmatch # to find the repositories delegated a target in pinned.json
+import multiprocessing.pool # for parallel image downloads
+
+from six.moves.urllib.request import urlopen # to fetch image deltas
+from six.moves.urllib.error import URLError
 
 import tuf.formats
 import tuf.conf
@@ -38,10 +47,15 @@ import uptane.common
 import uptane.services.director as director
 import uptane.services.timeserver as timeserver
 import uptane.encoding.asn1_codec as asn1_codec
+import uptane.encoding.ecu_manifest_asn1_coder as ecu_manifest_asn1_coder
+import uptane.encoding.metadata_bundle as metadata_bundle
+import uptane.delta
+import uptane.connection_pool
 
 from uptane.encoding.asn1_codec import DATATYPE_TIME_ATTESTATION
 from uptane.encoding.asn1_codec import DATATYPE_ECU_MANIFEST
 from uptane.encoding.asn1_codec import DATATYPE_VEHICLE_MANIFEST
+from uptane.encoding.asn1_codec import DATATYPE_BATCHED_TIME_ATTESTATION
 
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 
@@ -58,6 +72,36 @@ log.addHandler(uptane.file_handler)
 log.addHandler(uptane.console_handler)
 log.setLevel(uptane.logging.DEBUG)
 
+# The default number of images a Primary downloads at once, and the default
+# number of downloads that may be made from any single server (the host and
+# port of a mirror) at once, where a connection pool is used.
+DEFAULT_MAX_PARALLEL_DOWNLOADS = 4
+DEFAULT_MAX_DOWNLOADS_PER_MIRROR = 2
+
+# Forms in which the full metadata archive for Full Verification Secondaries
+# can be produced. See save_distributable_metadata_files().
+METADATA_ARCHIVE_ZIP = 'zip'
+METADATA_ARCHIVE_BUNDLE = 'bundle'
+
+# The default size of the blocks in which images are provided to Secondaries
+# that fetch them a block at a time. See get_image_file_info().
+DEFAULT_IMAGE_BLOCK_SIZE = 4096
+
+# The subdirectory of the client directory in which verified images are kept,
+# named by their SHA-256 hashes, so that no image need be downloaded twice.
+# See _obtain_targets().
+IMAGE_CACHE_DIRNAME = 'image_cache'
+
+# The time (in seconds) a mirror may take to respond to a request for an image
+# delta, or to send more of it, before the Primary gives up on that mirror and
+# tries the next. See _fetch_image_deltas().
+DELTA_FETCH_TIMEOUT = 10
+
+# The time (in seconds) after which a mirror's score (see
+# uptane/mirror_scores.py), if not updated by requests made of the mirror,
+# is stale, so that the mirror is raced again. See _race_mirrors().
+MIRROR_SCORES_MAX_AGE = 600
+
 
 
 class Primary(object): # Consider inheriting from Secondary and refactoring.
@@ -123,6 +167,11 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       Director of some historical and error/attack data. (Future ECU Manifests
       will provide current information, but useful diagnostic information may
       be lost.)
+      Each entry maps an ECU Serial to a list of that ECU's manifests. In
+      ASN.1/DER mode, the manifests are kept as DER, exactly as received, so
+      that they can be spliced into the Vehicle Manifest without being
+      decoded and encoded again; otherwise, they are Python dictionaries
+      conforming to uptane.formats.SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA.
 
     self.my_secondaries:
       This is a list of all ECU Serials belonging to Secondaries of this
@@ -132,6 +181,29 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       A dict mapping ECU Serial to the target file info that the Director has
       instructed that ECU to install.
 
+    self.max_parallel_downloads:
+      The number of images that primary_update_cycle() will download at once.
+      Conforms to uptane.formats.CONCURRENCY_LIMIT_SCHEMA.
+
+    self.max_downloads_per_mirror:
+      The number of TUF downloads that may be in progress at once from any
+      single server (the scheme, host and port of a mirror), whichever
+      repository or mirror they are for. This is enforced where connections
+      are used, so only if there is a connection pool (see
+      self.connection_pool); otherwise only self.max_parallel_downloads
+      limits downloads. Conforms to uptane.formats.CONCURRENCY_LIMIT_SCHEMA.
+
+    self.concurrent_metadata_refresh:
+      If True, refresh_toplevel_metadata() refreshes repositories other than
+      the Director at the same time as the Director. See
+      uptane.common.refresh_repositories().
+
+    self.last_update_cycle_state:
+      The state (see _get_update_cycle_state()) in which primary_update_cycle()
+      last completed fully, with every target downloaded successfully, or None
+      if it has not. If a later cycle finds the same state, nothing has
+      changed, and it stops early.
+
     self.nonces_to_send:
       The list of nonces sent to us from Secondaries and not yet sent to the
       Timeserver.
@@ -141,6 +213,11 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       have already sent to the Timeserver. Will be checked against the
       Timeserver's response.
 
+    self.secondary_reports_lock:
+      A lock guarding what Secondaries report to the Primary (ECU Manifests,
+      installed images, and nonces), since Secondaries may be served
+      concurrently with each other and with the update cycle.
+
     # TODO: Rename these two variables, valid -> verified, along with the
     #       verification functions.  Do likewise in Secondary.
     self.all_valid_timeserver_attestations:
@@ -159,11 +236,59 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       moved into place (renamed) after it has been fully written, to avoid
       race conditions.
 
+    self.metadata_archive_format:
+      The form of the full metadata archive: METADATA_ARCHIVE_ZIP (a zip
+      archive, the default) or METADATA_ARCHIVE_BUNDLE (an indexed metadata
+      bundle that can be read in place; see
+      uptane/encoding/metadata_bundle.py). Conforms to
+      uptane.formats.METADATA_ARCHIVE_FORMAT_SCHEMA.
+
     self.distributable_partial_metadata_fname:
       The filename at which the Director's targets metadata file is stored after
       each update cycle, once it is safe to use. This is atomically moved into
       place (renamed) after it has been fully written, to avoid race conditions.
 
+    self.fetch_image_deltas:
+      If True, primary_update_cycle() also fetches, where available, deltas
+      (see uptane/delta.py) from the image each Secondary last reported having
+      installed to the image assigned to it, for Secondaries to use in place
+      of the full image. See _fetch_image_deltas().
+
+    self.discarded_image_deltas:
+      The filenames (see uptane.delta.get_delta_fname()) of the image deltas
+      that a Secondary could not use (see discard_image_delta()), which are
+      not fetched again while they are needed.
+
+    self.installed_images:
+      A dict mapping ECU Serial to the target file info of the image that ECU
+      reported having installed in the last ECU Manifest it sent. This is not
+      validated (see register_ecu_manifest()), and is used only to choose
+      image deltas, which cannot affect the validity of the images
+      Secondaries arrive at.
+
+    self.mirror_scores:
+      An uptane.mirror_scores.MirrorScores object, or None. If given, the
+      mirrors of each repository are tried in the order of their scores
+      (fastest first) rather than in the order listed in pinned.json. The
+      scores are kept up to date by whoever makes the requests (e.g. an
+      uptane.connection_pool.ConnectionPool with the scores as its
+      observer), and by mirror races. See _order_mirrors().
+
+    self.mirror_race_threshold:
+      If not None (and there are mirror scores), before any image at least
+      this many bytes long is downloaded, the two best mirrors of each
+      repository providing it are raced for its first bytes if the score of
+      either is stale (see MIRROR_SCORES_MAX_AGE), updating their scores, so
+      that the download is made from the faster. See _race_mirrors().
+
+    self.connection_pool:
+      An uptane.connection_pool.ConnectionPool, or None. If given, TUF's
+      downloads of metadata and images over http:// are made on the pool's
+      persistent connections rather than on a new connection each. TUF has no
+      option for this, so the Primary installs the pool through the hook
+      uptane.connection_pool.use_for_tuf_downloads() when created, which
+      applies to every TUF download in the process.
+
 
   Methods organized by purpose: ("self" arguments excluded)
 
@@ -172,6 +297,7 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       primary_update_cycle()
       generate_signed_vehicle_manifest()
       get_nonces_to_send_and_rotate()
+      get_metadata_versions(repo_name)
       save_distributable_metadata_files()
       update_time(timeserver_attestation)
 
@@ -186,12 +312,31 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       get_last_timeserver_attestation()
       update_exists_for_ecu(ecu_serial)
       get_image_fname_for_ecu(ecu_serial)
+      get_image_fname_for_hash(sha256_hash)
+      get_image_file_info(ecu_serial, block_size)
+      get_image_block(ecu_serial, filename, block_number, block_size)
+      get_image_delta_fname(base_sha256, target_sha256)
+      discard_image_delta(base_sha256, target_sha256)
       get_full_metadata_archive_fname()
+      get_full_metadata_archive_data()
       get_partial_metadata_fname()
       register_new_secondary(ecu_serial)
 
     Private methods:
       _check_ecu_serial(ecu_serial)
+      _get_update_cycle_state()
+      _expand_metadata_bundle(repo_name, bundle_data)
+      _download_targets(targets, destination_directory)
+      _obtain_targets(targets, destination_directory)
+      _get_cached_image_fname(target)
+      _get_target_repositories(target)
+      _order_mirrors()
+      _race_mirrors(targets)
+      _fetch_image_deltas()
+      _discard_ecu_manifests(ecu_manifests)
+      _get_metadata_role_fnames()
+      _save_full_metadata_zip()
+      _save_full_metadata_bundle()
 
 
   Use:
@@ -230,7 +375,15 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     primary_key,
     time,
     timeserver_public_key,
-    my_secondaries=None):
+    my_secondaries=None,
+    max_parallel_downloads=DEFAULT_MAX_PARALLEL_DOWNLOADS,
+    max_downloads_per_mirror=DEFAULT_MAX_DOWNLOADS_PER_MIRROR,
+    concurrent_metadata_refresh=False,
+    metadata_archive_format=METADATA_ARCHIVE_ZIP,
+    fetch_image_deltas=False,
+    mirror_scores=None,
+    mirror_race_threshold=None,
+    connection_pool=None):
 
     """
     <Purpose>
@@ -252,6 +405,22 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
       my_secondaries        See class docstring above. (optional)
 
+      max_parallel_downloads    See class docstring above. (optional)
+
+      max_downloads_per_mirror  See class docstring above. (optional)
+
+      concurrent_metadata_refresh See class docstring above. (optional)
+
+      metadata_archive_format   See class docstring above. (optional)
+
+      fetch_image_deltas    See class docstring above. (optional)
+
+      mirror_scores         See class docstring above. (optional)
+
+      mirror_race_threshold See class docstring above. (optional)
+
+      connection_pool       See class docstring above. (optional)
+
       time
         An initial time to set the Primary's "clock" to, conforming to
         tuf.formats.ISO8601_DATETIME_SCHEMA.
@@ -278,6 +447,15 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     uptane.formats.ECU_SERIAL_SCHEMA.check_match(ecu_serial)
     tuf.formats.ANYKEY_SCHEMA.check_match(timeserver_public_key)
     tuf.formats.ANYKEY_SCHEMA.check_match(primary_key)
+    uptane.formats.CONCURRENCY_LIMIT_SCHEMA.check_match(max_parallel_downloads)
+    uptane.formats.CONCURRENCY_LIMIT_SCHEMA.check_match(
+        max_downloads_per_mirror)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(concurrent_metadata_refresh)
+    uptane.formats.METADATA_ARCHIVE_FORMAT_SCHEMA.check_match(
+        metadata_archive_format)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(fetch_image_deltas)
+    if mirror_race_threshold is not None:
+      tuf.formats.LENGTH_SCHEMA.check_match(mirror_race_threshold)
     # TODO: Should also check that primary_key is a private key, not a
     # public key.
 
@@ -294,11 +472,38 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     if self.my_secondaries is None:
       self.my_secondaries = [] # (because must not use mutable as default value)
     self.director_repo_name = director_repo_name
-
+    self.max_parallel_downloads = max_parallel_downloads
+    self.max_downloads_per_mirror = max_downloads_per_mirror
+    self.concurrent_metadata_refresh = concurrent_metadata_refresh
+    self.metadata_archive_format = metadata_archive_format
+    self.fetch_image_deltas = fetch_image_deltas
+    self.discarded_image_deltas = set()
+    self.mirror_scores = mirror_scores
+    self.mirror_race_threshold = mirror_race_threshold
+    self.connection_pool = connection_pool
+
+    archive_extension = '.zip' \
+        if metadata_archive_format == METADATA_ARCHIVE_ZIP else '.bundle'
     self.temp_full_metadata_archive_fname = os.path.join(
-        full_client_dir, 'metadata', 'temp_full_metadata_archive.zip')
+        full_client_dir, 'metadata',
+        'temp_full_metadata_archive' + archive_extension)
     self.distributable_full_metadata_archive_fname = os.path.join(
-        full_client_dir, 'metadata', 'full_metadata_archive.zip')
+        full_client_dir, 'metadata',
+        'full_metadata_archive' + archive_extension)
+
+    # For building metadata bundles from changed role files only: maps
+    # (repository name, role filename) to ((inode, modification time, size),
+    # file data, SHA-256 hash) as of the last bundle built, and the index of
+    # that bundle.
+    self.metadata_bundle_role_cache = {}
+    self.metadata_bundle_index = None
+
+    # A memory map of the distributable full metadata archive, the
+    # (device, inode) of the file mapped, and a lock guarding both. See
+    # get_full_metadata_archive_data().
+    self.metadata_archive_mmap = None
+    self.metadata_archive_mmap_file_id = None
+    self.metadata_archive_mmap_lock = threading.Lock()
 
     # TODO: Some of these assumptions are unseemly. Reconsider.
     self.temp_partial_metadata_fname = os.path.join(
@@ -311,12 +516,19 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     # Initializations not directly related to arguments.
     self.nonces_to_send = []
     self.nonces_sent = []
+
+    # Secondaries may report to the Primary concurrently with each other and
+    # with the update cycle (e.g. through a threaded server), so the ECU
+    # Manifests and nonces they provide are guarded by this lock.
+    self.secondary_reports_lock = threading.Lock()
     self.assigned_targets = dict()
+    self.last_update_cycle_state = None
 
     # Initialize the dictionary of manifests. This is a dictionary indexed
     # by ECU serial and with value being a list of manifests from that ECU, to
     # support the case in which multiple manifests have come from that ECU.
     self.ecu_manifests = {}
+    self.installed_images = {}
 
 
     # Create a TUF-TAP-4-compliant updater object. This will read pinning.json
@@ -324,6 +536,12 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     # each repository.
     self.updater = tuf.client.updater.Updater('updater')
 
+    # Have TUF make its downloads on the pool's connections (see the class
+    # docstring).
+    if connection_pool is not None:
+      uptane.connection_pool.use_for_tuf_downloads(
+          connection_pool, max_downloads_per_mirror)
+
     if director_repo_name not in self.updater.pinned_metadata['repositories']:
       raise uptane.Error('Given name for the Director repository is not a '
           'known repository, according to the pinned metadata from pinned.json')
@@ -332,7 +550,7 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
-  def refresh_toplevel_metadata(self):
+  def refresh_toplevel_metadata(self, metadata_bundles=None):
     """
     Refreshes client's metadata for the top-level roles:
       root, targets, snapshot, and timestamp
@@ -349,18 +567,82 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
           whatever currently trusted Root metadata we ended up with was expired.
       - tuf.NoWorkingMirrorError:
           if we could not obtain and verify all necessary metadata
+
+    If self.concurrent_metadata_refresh is True, repositories other than the
+    Director are refreshed concurrently with it. See
+    uptane.common.refresh_repositories().
+
+    metadata_bundles, if given, is a dictionary mapping the names of some or
+    all of the repositories to metadata bundles (see
+    uptane/encoding/metadata_bundle.py), as bytes, obtained from those
+    repositories in a single request each, holding the role files newer than
+    the versions this Primary has (see get_metadata_versions()). For the
+    duration of the refresh, the role files in each bundle are offered to TUF
+    as the repository's first mirror, so that TUF fetches from the repository
+    itself only what the bundle lacks, or what fails validation. Every role
+    file is validated exactly as if it had been fetched on its own. A bundle
+    that cannot be read is ignored.
     """
+    if metadata_bundles is None:
+      metadata_bundles = {}
+
+    self._order_mirrors()
 
-    # Refresh the Director first, per the Uptane Standard.
-    self.updater.refresh(repo_name=self.director_repo_name)
+    original_mirrors = {}
+    for repo_name in metadata_bundles:
+      if repo_name not in self.updater.repositories:
+        raise uptane.Error('Received a metadata bundle for an unknown '
+            'repository: ' + repr(repo_name))
 
-    # Now that we've dealt with the Director repository, deal with any and all
-    # other repositories, presumably Image Repositories.
-    for repository_name in self.updater.repositories:
-      if repository_name == self.director_repo_name:
+      try:
+        bundle_dir = self._expand_metadata_bundle(
+            repo_name, metadata_bundles[repo_name])
+      except (uptane.Error, tuf.BadHashError) as e:
+        log.warning('Ignoring unreadable metadata bundle from repository ' +
+            repr(repo_name) + ': ' + repr(e))
         continue
 
-      self.updater.refresh(repo_name=repository_name)
+      repository = self.updater.repositories[repo_name]
+      original_mirrors[repo_name] = repository.mirrors
+      repository.mirrors = ['file://' + bundle_dir] + list(repository.mirrors)
+
+    try:
+      # Refresh the Director first, per the Uptane Standard, and then any and
+      # all other repositories, presumably Image Repositories. If configured
+      # to, refresh the others at the same time as the Director; errors are
+      # still reported as if the Director had been refreshed first.
+      uptane.common.refresh_repositories(self.updater, self.director_repo_name,
+          concurrent=self.concurrent_metadata_refresh)
+
+    finally:
+      for repo_name in original_mirrors:
+        self.updater.repositories[repo_name].mirrors = \
+            original_mirrors[repo_name]
+
+
+
+
+
+  def get_metadata_versions(self, repo_name):
+    """
+    Returns the version of each role's metadata currently trusted from the
+    given repository, conforming to uptane.formats.METADATA_VERSIONS_SCHEMA,
+    for the repository to send only newer role files in a metadata bundle
+    (see refresh_toplevel_metadata()).
+
+    <Exceptions>
+      uptane.Error
+        if the repository is not known to this Primary's updater
+    """
+    tuf.formats.REPOSITORY_NAME_SCHEMA.check_match(repo_name)
+
+    if repo_name not in self.updater.repositories:
+      raise uptane.Error('Unknown repository: ' + repr(repo_name))
+
+    current_metadata = self.updater.repositories[repo_name].metadata['current']
+
+    return dict((role, current_metadata[role]['version'])
+        for role in current_metadata)
 
 
 
@@ -485,7 +767,7 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
-  def primary_update_cycle(self):
+  def primary_update_cycle(self, metadata_bundles=None):
     """
     Download fresh metadata and images for this vehicle, as instructed by the
     Director and validated by the Image Repository.
@@ -501,6 +783,14 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     reference implementation, but in this case, it is the most convenient way
     to maintain the existing interfaces with TUF and with demonstration code.)
 
+    If, after the metadata is refreshed, the trusted timestamp and snapshot
+    versions of every repository and the list of known Secondaries are the
+    same as when this last completed successfully, then nothing can have
+    changed: target validation, downloads, and the packaging of metadata are
+    all skipped. Image deltas are still fetched (see _fetch_image_deltas()),
+    since Secondaries may since have reported installing other images.
+
+    metadata_bundles, if given, is as for refresh_toplevel_metadata().
 
     <Exceptions>
       uptane.Error
@@ -509,9 +799,21 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         - If a file exists in the metadata directory in which validated files
           are deposited by TUF that does not have an extension that befits a
           file of type tuf.conf.METADATA_FORMAT.
+
+    <Returns>
+      False if nothing had changed since the last successful update cycle, so
+      that no further work was done, else True.
     """
     log.debug('Refreshing top level metadata from all repositories.')
-    self.refresh_toplevel_metadata()
+    self.refresh_toplevel_metadata(metadata_bundles)
+
+    update_cycle_state = self._get_update_cycle_state()
+    if update_cycle_state == self.last_update_cycle_state:
+      log.debug('No change in metadata from any repository or in known '
+          'Secondaries since the last update cycle. Nothing to do.')
+      if self.fetch_image_deltas:
+        self._fetch_image_deltas()
+      return False
 
     # Get the list of targets the director expects us to download and update to.
     # Note that at this line, this target info is not yet validated with the
@@ -593,6 +895,16 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         repr(verified_target_filepaths))
 
 
+    # Make sure the resulting filenames are actually in the client directory.
+    # (In other words, enforce a jail.)
+    # TODO: Do a proper review of this, and determine if it's necessary and
+    # how to do it properly.
+    full_targets_directory = os.path.abspath(os.path.join(
+        self.full_client_dir, 'targets'))
+
+    # The targets to download, in the order the Director listed them.
+    targets_to_download = []
+
     # For each target for which we have verified metadata:
     for target in verified_targets:
 
@@ -617,38 +929,41 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       # Save the target info as an update assigned to that ECU.
       self.assigned_targets[assigned_ecu_serial] = target
 
-
-      # Make sure the resulting filename is actually in the client directory.
-      # (In other words, enforce a jail.)
-      # TODO: Do a proper review of this, and determine if it's necessary and
-      # how to do it properly.
-      full_targets_directory = os.path.abspath(os.path.join(
-          self.full_client_dir, 'targets'))
       filepath = target['filepath']
       if filepath[0] == '/':
         filepath = filepath[1:]
-      full_fname = os.path.join(full_targets_directory, filepath)
       enforce_jail(filepath, full_targets_directory)
 
-      # Download each target.
-      # Now that we have fileinfo for all targets listed by both the Director and
-      # the Image Repository -- which should include file2.txt in this test --
-      # we can download the target files and only keep each if it matches the
-      # verified fileinfo. This call will try every mirror on every repository
-      # within the appropriate delegation in pinned.json until one of them works.
-      # In this case, both the Director and Image Repo are hosting the
-      # file, just for my convenience in setup. If you remove the file from the
-      # Director before calling this, it will still work (assuming Image Repo
-      # still has it). (The second argument here is just where to put the
-      # files.)
-      try:
-        self.updater.download_target(target, full_targets_directory)
+      targets_to_download.append(target)
 
-      except tuf.NoWorkingMirrorError as e:
+
+    # Download the targets, several at once and each distinct image only once,
+    # skipping images already in the image cache (see _obtain_targets()).
+    # Now that we have fileinfo for all targets listed by both the Director and
+    # the Image Repository -- which should include file2.txt in this test --
+    # we can download the target files and only keep each if it matches the
+    # verified fileinfo. Each download will try every mirror on every
+    # repository within the appropriate delegation in pinned.json until one of
+    # them works. In this case, both the Director and Image Repo are hosting
+    # the file, just for my convenience in setup. If you remove the file from
+    # the Director before calling this, it will still work (assuming Image Repo
+    # still has it). (The second argument here is just where to put the
+    # files.)
+    download_errors = self._obtain_targets(
+        targets_to_download, full_targets_directory)
+
+    for target, error in zip(targets_to_download, download_errors):
+
+      filepath = target['filepath']
+      if filepath[0] == '/':
+        filepath = filepath[1:]
+      full_fname = os.path.join(full_targets_directory, filepath)
+
+      if error is not None:
         error_report = ''
-        for mirror in e.mirror_errors:
-          error_report += \
-              type(e.mirror_errors[mirror]).__name__ + ' from ' + mirror + '; '
+        for mirror in error.mirror_errors:
+          error_report += type(error.mirror_errors[mirror]).__name__ + \
+              ' from ' + mirror + '; '
         log.info(YELLOW + 'In downloading target ' + repr(filepath) +
             ', am unable to find a mirror providing a trustworthy file. '
             'Checking the mirrors resulted in these errors:  ' + error_report +
@@ -661,7 +976,7 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
           print_banner(BANNER_DEFENDED, color=WHITE+DARK_BLUE_BG,
               text='No image was found that exactly matches the signed metadata '
               'from the Director and Image Repositories. Not keeping '
-              'untrustworthy files. ' + repr(target_filepath), sound=TADA)
+              'untrustworthy files. ' + repr(target['filepath']), sound=TADA)
           time.sleep(3)
 
 
@@ -698,8 +1013,8 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         # fileinfo at the last moment, before we send it on to the Secondary.
         # That should provide some prophylaxis?
 
-
-
+    if self.fetch_image_deltas:
+      self._fetch_image_deltas()
 
     # Package the consistent and validated metadata we have now into two
     # locations for Secondaries that will request it.
@@ -721,6 +1036,15 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     # may be requesting these files live.
     self.save_distributable_metadata_files()
 
+    # Only if every image was obtained can a later cycle with the same state
+    # safely skip its work; otherwise, the next cycle tries again.
+    if all(error is None for error in download_errors):
+      self.last_update_cycle_state = update_cycle_state
+    else:
+      self.last_update_cycle_state = None
+
+    return True
+
 
 
 
@@ -748,6 +1072,212 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def get_image_fname_for_hash(self, sha256_hash):
+    """
+    Given the SHA-256 hash (hex digest) of an image, returns:
+      - None if no image with that hash is assigned to any Secondary
+      - Else, a filename for the image file with that hash, which was
+        downloaded and verified against the same fileinfo
+
+    This allows images to be distributed to Secondaries by hash, for example
+    from a content-addressed file server, without reference to filenames
+    provided by the requester.
+
+    <Exceptions>
+      tuf.FormatError
+        if sha256_hash is not a hex digest
+    """
+    tuf.formats.HASH_SCHEMA.check_match(sha256_hash)
+
+    for ecu_serial in list(self.assigned_targets):
+      target = self.assigned_targets[ecu_serial]
+      if target['fileinfo']['hashes'].get('sha256') == sha256_hash:
+        return self.get_image_fname_for_ecu(ecu_serial)
+
+    return None
+
+
+
+
+
+  def get_image_file_info(
+      self, ecu_serial, block_size=DEFAULT_IMAGE_BLOCK_SIZE):
+    """
+    <Purpose>
+      For Secondaries that fetch their images a block at a time (for example,
+      because they cannot hold a whole image in memory, or because the
+      connection to the Primary is slow or unreliable), describes the image
+      to be distributed to the given ECU, as an ImageFile: its filename
+      (relative to the targets directory), the number of blocks in it, and
+      the size of each block. Every block but the last is block_size bytes
+      long. The blocks are then retrieved with get_image_block().
+
+    <Arguments>
+      ecu_serial
+        the serial of the (Secondary) ECU requesting an image
+
+      block_size (optional)
+        the size of the blocks the image is to be split into
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the ecu_serial specified is not one known to this Primary
+
+      tuf.FormatError
+        if the arguments are not correctly formatted
+
+    <Returns>
+      None if there is no image to be distributed to the given ECU, else a
+      dictionary conforming to uptane.formats.IMAGE_FILE_SCHEMA.
+    """
+    uptane.formats.IMAGE_BLOCK_SIZE_SCHEMA.check_match(block_size)
+
+    image_fname = self.get_image_fname_for_ecu(ecu_serial)
+
+    if image_fname is None:
+      return None
+
+    length = os.path.getsize(image_fname)
+
+    return {
+        'filename': os.path.relpath(
+            image_fname, os.path.join(self.full_client_dir, 'targets')),
+        'number_of_blocks': (length + block_size - 1) // block_size,
+        'block_size': block_size}
+
+
+
+
+
+  def get_image_block(self, ecu_serial, filename, block_number,
+      block_size=DEFAULT_IMAGE_BLOCK_SIZE):
+    """
+    <Purpose>
+      Returns one block of the image to be distributed to the given ECU, as an
+      ImageBlock. See get_image_file_info(). Only the requested block is read
+      from disk.
+
+    <Arguments>
+      ecu_serial
+        the serial of the (Secondary) ECU requesting an image
+
+      filename
+        the filename of the image, as provided by get_image_file_info()
+
+      block_number
+        the number of the block to return, counting from 1
+
+      block_size (optional)
+        the size of the blocks the image is split into, as provided to
+        get_image_file_info()
+
+    <Exceptions>
+      uptane.Error
+        if the given filename is not that of the image to be distributed to
+        the given ECU, or the image has no block with the given number
+
+      uptane.UnknownECU
+        if the ecu_serial specified is not one known to this Primary
+
+      tuf.FormatError
+        if the arguments are not correctly formatted
+
+    <Returns>
+      A dictionary conforming to uptane.formats.IMAGE_BLOCK_SCHEMA.
+    """
+    tuf.formats.RELPATH_SCHEMA.check_match(filename)
+    uptane.formats.IMAGE_BLOCK_NUMBER_SCHEMA.check_match(block_number)
+
+    image_file = self.get_image_file_info(ecu_serial, block_size)
+
+    if image_file is None or image_file['filename'] != filename:
+      raise uptane.Error('ECU ' + repr(ecu_serial) + ' requested a block of '
+          'image ' + repr(filename) + ', which is not the image this Primary '
+          'has to distribute to it.')
+
+    if block_number > image_file['number_of_blocks']:
+      raise uptane.Error('ECU ' + repr(ecu_serial) + ' requested block ' +
+          repr(block_number) + ' of image ' + repr(filename) + ', which has ' +
+          repr(image_file['number_of_blocks']) + ' blocks.')
+
+    with open(self.get_image_fname_for_ecu(ecu_serial), 'rb') as fobj:
+      fobj.seek((block_number - 1) * block_size)
+      block = fobj.read(block_size)
+
+    return {
+        'filename': filename,
+        'block_number': block_number,
+        'block': block}
+
+
+
+
+
+  def get_image_delta_fname(self, base_sha256, target_sha256):
+    """
+    Given the SHA-256 hashes (hex digests) of two images, returns:
+      - None if this Primary has no delta from the first image to the second
+        (see _fetch_image_deltas()), or the second image is not assigned to
+        any Secondary
+      - Else, the filename of the delta
+
+    The delta is not validated: a Secondary must validate the image it
+    produces, just as it would the full image.
+
+    <Exceptions>
+      tuf.FormatError
+        if either hash is not a hex digest
+    """
+    tuf.formats.HASH_SCHEMA.check_match(base_sha256)
+    tuf.formats.HASH_SCHEMA.check_match(target_sha256)
+
+    if self.get_image_fname_for_hash(target_sha256) is None:
+      return None
+
+    delta_fname = os.path.join(self.full_client_dir,
+        uptane.delta.DELTAS_DIRNAME,
+        uptane.delta.get_delta_fname(base_sha256, target_sha256))
+
+    if not os.path.exists(delta_fname):
+      return None
+
+    return delta_fname
+
+
+
+
+
+  def discard_image_delta(self, base_sha256, target_sha256):
+    """
+    Given the SHA-256 hashes (hex digests) of two images, removes this
+    Primary's delta from the first image to the second, if it has one, and
+    does not fetch it again while it is needed (see _fetch_image_deltas()).
+    Called when a Secondary could not use the delta (e.g. because the image
+    it produced did not validate), so that the Secondary receives the full
+    image instead, rather than the same bad delta on every update cycle.
+
+    <Exceptions>
+      tuf.FormatError
+        if either hash is not a hex digest
+    """
+    tuf.formats.HASH_SCHEMA.check_match(base_sha256)
+    tuf.formats.HASH_SCHEMA.check_match(target_sha256)
+
+    delta_basename = uptane.delta.get_delta_fname(base_sha256, target_sha256)
+    self.discarded_image_deltas.add(delta_basename)
+
+    delta_fname = os.path.join(self.full_client_dir,
+        uptane.delta.DELTAS_DIRNAME, delta_basename)
+
+    if os.path.exists(delta_fname):
+      log.info('Discarding image delta a Secondary could not use: ' +
+          repr(delta_basename))
+      os.remove(delta_fname)
+
+
+
+
+
   def get_full_metadata_archive_fname(self):
     """
     Returns the absolute-path filename of an archive file (currently zip)
@@ -763,6 +1293,9 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     the data itself, in memory, but for the time being, it is more convenient in
     maintaining the interfaces with TUF and demonstration code to do this with
     an archive file.
+
+    The file is a zip archive or a metadata bundle, depending on
+    self.metadata_archive_format.
     """
     return self.distributable_full_metadata_archive_fname
 
@@ -770,6 +1303,51 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def get_full_metadata_archive_data(self):
+    """
+    Returns the contents of the distributable full metadata archive (see
+    get_full_metadata_archive_fname()) as a read-only memoryview, or None if
+    there is none yet.
+
+    The file is memory-mapped, and the mapping is reused until the file is
+    replaced, so that serving many Secondaries neither reads nor copies the
+    file for each one: callers slice the view as they send it, and copy it
+    (e.g. with tobytes()) only where their transport requires bytes.
+
+    A view remains valid after the file is replaced; the mapping it views is
+    released once the last view of it is.
+    """
+    fname = self.distributable_full_metadata_archive_fname
+
+    with self.metadata_archive_mmap_lock:
+      try:
+        fobj = open(fname, 'rb')
+      except IOError:
+        return None
+
+      with fobj:
+        stat = os.fstat(fobj.fileno())
+        file_id = (stat.st_dev, stat.st_ino)
+
+        if file_id != self.metadata_archive_mmap_file_id:
+          # The old mapping is not closed here: views of it may still be in
+          # use, and it is unmapped when the last of them is released.
+          self.metadata_archive_mmap = None
+          self.metadata_archive_mmap_file_id = None
+
+          if stat.st_size == 0: # An empty file cannot be mapped.
+            return memoryview(b'')
+
+          self.metadata_archive_mmap = mmap.mmap(
+              fobj.fileno(), 0, access=mmap.ACCESS_READ)
+          self.metadata_archive_mmap_file_id = file_id
+
+      return memoryview(self.metadata_archive_mmap)
+
+
+
+
+
   def get_partial_metadata_fname(self):
     """
     Returns the absolute-path filename of the Director's targets.json metadata
@@ -841,15 +1419,23 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     # dictionary. If the format of transfered metadata is expected to be
     # ASN.1/DER, we convert the time attestation back to DER and return it in
     # that form.
+    # The attestation may be an ordinary or a batched time attestation; it is
+    # passed on to Secondaries in the same form it was received.
+    if 'merkle_proof' in most_recent_attestation:
+      datatype = DATATYPE_BATCHED_TIME_ATTESTATION
+      schema = uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA
+    else:
+      datatype = DATATYPE_TIME_ATTESTATION
+      schema = uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA
+
     if tuf.conf.METADATA_FORMAT == 'der':
       converted_attestation = asn1_codec.convert_signed_metadata_to_der(
-          most_recent_attestation, DATATYPE_TIME_ATTESTATION)
+          most_recent_attestation, datatype)
       uptane.formats.DER_DATA_SCHEMA.check_match(converted_attestation)
       return converted_attestation
 
     elif tuf.conf.METADATA_FORMAT == 'json':
-      uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
-          most_recent_attestation)
+      schema.check_match(most_recent_attestation)
       return most_recent_attestation
 
     # An unrecognized value in the setting tuf.conf.METADATA_FORMAT should not
@@ -870,13 +1456,35 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     Put ECU manifests into a vehicle manifest and sign it.
     Support multiple manifests from the same ECU.
     Output will comply with uptane.formats.VEHICLE_VERSION_MANIFEST_SCHEMA.
+
+    In ASN.1/DER mode, the DER ECU Manifests are spliced into the DER Vehicle
+    Manifest as they are, ordered by ECU Serial, so that only the Vehicle
+    Manifest's own fields need be encoded.
+
+    ECU Manifests that arrive while the Vehicle Manifest is being produced are
+    kept for the next one.
     """
+    with self.secondary_reports_lock:
+      ecu_manifests = dict((ecu_serial, list(manifests))
+          for ecu_serial, manifests in self.ecu_manifests.items())
+
+    if tuf.conf.METADATA_FORMAT == 'der':
+      der_ecu_manifests = []
+      for ecu_serial in sorted(ecu_manifests):
+        der_ecu_manifests.extend(ecu_manifests[ecu_serial])
+
+      signable_vehicle_manifest = asn1_codec.make_signed_der_vehicle_manifest(
+          self.vin, self.ecu_serial, der_ecu_manifests, self.primary_key)
+
+      self._discard_ecu_manifests(ecu_manifests)
+
+      return signable_vehicle_manifest
 
     # Create the vv manifest:
     vehicle_manifest = {
         'vin': self.vin,
         'primary_ecu_serial': self.ecu_serial,
-        'ecu_version_manifests': self.ecu_manifests
+        'ecu_version_manifests': ecu_manifests
     }
 
     uptane.formats.VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(vehicle_manifest)
@@ -891,27 +1499,20 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
         signable_vehicle_manifest)
 
-    if tuf.conf.METADATA_FORMAT == 'der':
-      # Convert to DER and sign, replacing the Python dictionary.
-      signable_vehicle_manifest = asn1_codec.convert_signed_metadata_to_der(
-          signable_vehicle_manifest, DATATYPE_VEHICLE_MANIFEST,
-          private_key=self.primary_key, resign=True)
-
-    else:
-      # If we're not using ASN.1, sign the Python dictionary in a JSON encoding.
-      uptane.common.sign_signable(
-          signable_vehicle_manifest,
-          [self.primary_key],
-          DATATYPE_VEHICLE_MANIFEST)
+    # Sign the Python dictionary in a JSON encoding.
+    uptane.common.sign_signable(
+        signable_vehicle_manifest,
+        [self.primary_key],
+        DATATYPE_VEHICLE_MANIFEST)
 
-      uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
-          signable_vehicle_manifest)
+    uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
+        signable_vehicle_manifest)
 
 
     # Now that the ECU manifests have been incorporated into a vehicle manifest,
     # discard the ECU manifests.
 
-    self.ecu_manifests = dict()
+    self._discard_ecu_manifests(ecu_manifests)
 
     return signable_vehicle_manifest
 
@@ -919,6 +1520,26 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def _discard_ecu_manifests(self, ecu_manifests):
+    """
+    Removes the given ECU Manifests (a dictionary like self.ecu_manifests,
+    copied from it earlier) from self.ecu_manifests, keeping any that have
+    arrived since. (Manifests are only ever appended, so those given are
+    still first in each list.)
+    """
+    with self.secondary_reports_lock:
+      for ecu_serial in ecu_manifests:
+        remaining = self.ecu_manifests[ecu_serial][
+            len(ecu_manifests[ecu_serial]):]
+        if remaining:
+          self.ecu_manifests[ecu_serial] = remaining
+        else:
+          del self.ecu_manifests[ecu_serial]
+
+
+
+
+
   def register_new_secondary(self, ecu_serial):
     """
     Currently called by Secondaries, but one would expect that this would happen
@@ -963,6 +1584,465 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+
+  def _get_update_cycle_state(self):
+    """
+    Returns a summary of everything that determines the outcome of
+    primary_update_cycle() once metadata has been refreshed: the version
+    numbers of the currently trusted timestamp and snapshot metadata from each
+    repository, and the ECU Serials of the Secondaries known to this Primary.
+    (Any change to a repository's targets or root metadata requires new
+    snapshot and timestamp metadata.)
+    """
+    metadata_versions = {}
+    for repo_name, repository in self.updater.repositories.items():
+      current_metadata = repository.metadata['current']
+      metadata_versions[repo_name] = tuple(
+          current_metadata[role]['version'] if role in current_metadata
+          else None for role in ('timestamp', 'snapshot'))
+
+    return {
+        'metadata_versions': metadata_versions,
+        'secondaries': sorted(self.my_secondaries)}
+
+
+
+
+
+  def _expand_metadata_bundle(self, repo_name, bundle_data):
+    """
+    <Purpose>
+      Writes the role files from the given repository in the given metadata
+      bundle (bytes) to a directory laid out as a repository, replacing
+      whatever that directory held, for use as a mirror by TUF (see
+      refresh_toplevel_metadata()). Role files in the bundle from other
+      repositories are ignored.
+
+    <Exceptions>
+      uptane.Error
+        if bundle_data is not a well-formed metadata bundle
+
+      tuf.BadHashError
+        if a role file in the bundle does not match its hash in the index
+
+    <Returns>
+      The absolute path of the directory, which contains a 'metadata'
+      subdirectory holding the role files.
+    """
+    tuf.formats.REPOSITORY_NAME_SCHEMA.check_match(repo_name)
+    uptane.formats.DER_DATA_SCHEMA.check_match(bundle_data)
+
+    bundles_dir = os.path.abspath(os.path.join(
+        self.full_client_dir, 'metadata_bundles'))
+    bundle_dir = os.path.join(bundles_dir, repo_name)
+    bundle_fname = bundle_dir + '.bundle'
+
+    if not os.path.exists(bundles_dir):
+      os.makedirs(bundles_dir)
+
+    if os.path.exists(bundle_dir):
+      shutil.rmtree(bundle_dir)
+    os.makedirs(os.path.join(bundle_dir, 'metadata'))
+
+    with open(bundle_fname, 'wb') as fobj:
+      fobj.write(bundle_data)
+
+    try:
+      with metadata_bundle.MetadataBundle(bundle_fname) as bundle:
+        for repository, role in bundle.roles():
+          if repository != repo_name:
+            continue
+          with open(os.path.join(bundle_dir, 'metadata', role), 'wb') as fobj:
+            fobj.write(bundle.get_role(repository, role))
+
+    finally:
+      os.remove(bundle_fname)
+
+    # If the repository publishes consistent snapshots, TUF will look for
+    # version-prefixed role files.
+    metadata_bundle.add_versioned_role_fnames(
+        os.path.join(bundle_dir, 'metadata'))
+
+    return bundle_dir
+
+
+
+
+
+  def _download_targets(self, targets, destination_directory):
+    """
+    <Purpose>
+      Downloads the given targets (verified target info conforming to
+      tuf.formats.TARGETFILE_SCHEMA) into destination_directory, as
+      self.updater.download_target would, but up to self.max_parallel_downloads
+      of them at a time (and, with a connection pool, no more than
+      self.max_downloads_per_mirror at a time from any one server). The total
+      time taken is thus closer to that of the longest download than to the
+      sum of them all.
+
+    <Exceptions>
+      Any exception other than tuf.NoWorkingMirrorError raised in the download
+      of any target.
+
+    <Returns>
+      A list with one entry per target, in the same order: None if the target
+      was downloaded successfully, or the tuf.NoWorkingMirrorError raised if
+      no mirror provided a trustworthy file.
+    """
+
+    def download(target):
+      try:
+        self.updater.download_target(target, destination_directory)
+      except tuf.NoWorkingMirrorError as e:
+        return e
+      return None
+
+    if self.mirror_race_threshold is not None:
+      self._race_mirrors(targets)
+
+    n_workers = min(self.max_parallel_downloads, len(targets))
+
+    if n_workers <= 1:
+      return [download(target) for target in targets]
+
+    pool = multiprocessing.pool.ThreadPool(n_workers)
+    try:
+      # map() returns results in the order of the targets given, and re-raises
+      # in this thread any unexpected exception from a download.
+      return pool.map(download, targets, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+
+
+
+
+  def _obtain_targets(self, targets, destination_directory):
+    """
+    <Purpose>
+      Places the given targets (verified target info conforming to
+      tuf.formats.TARGETFILE_SCHEMA) in destination_directory, as
+      _download_targets() would, but downloads each distinct image (each
+      distinct combination of hashes and length) at most once, however many
+      targets share it (e.g. when several identical ECUs are assigned the
+      same image), and not at all if it is already in the image cache.
+
+      The image cache is the IMAGE_CACHE_DIRNAME subdirectory of the client
+      directory. It keeps each image downloaded and verified, named by its
+      SHA-256 hash, from one update cycle to the next. A cached image is
+      checked against the verified target info again before it is used, so a
+      damaged cache costs no more than a download. Images are copied from
+      the cache into destination_directory, never linked, so that writing to
+      a file in one cannot alter the other. Nothing is evicted from the
+      cache, which may be emptied at any time. Targets without a SHA-256 hash
+      are shared among the targets listing the same image, but not cached.
+
+    <Exceptions>
+      As for _download_targets().
+
+    <Returns>
+      As for _download_targets(): a list with one entry per target, in the
+      same order: None if the target is in place, or the
+      tuf.NoWorkingMirrorError raised if no mirror provided a trustworthy file
+      for its image.
+    """
+    cache_dir = os.path.join(self.full_client_dir, IMAGE_CACHE_DIRNAME)
+    if not os.path.exists(cache_dir):
+      os.makedirs(cache_dir)
+
+    def get_image(target):
+      fileinfo = target['fileinfo']
+      return tuple(sorted(fileinfo['hashes'].items())), fileinfo['length']
+
+    def get_fname(directory, target):
+      return os.path.join(directory, target['filepath'].lstrip('/'))
+
+    # For each distinct image, the file it is placed from: its entry in the
+    # cache or, for an image that cannot be cached, its download.
+    image_sources = {}
+    to_download = []
+    for target in targets:
+      image = get_image(target)
+      if image in image_sources:
+        continue
+
+      image_sources[image] = self._get_cached_image_fname(target)
+      if image_sources[image] is None:
+        to_download.append(target)
+
+      else:
+        log.debug('Image for target ' + repr(target['filepath']) + ' found '
+            'in the image cache. Not downloading it.')
+
+    # Downloads are made to a staging directory, from which those to be
+    # cached are moved into the cache.
+    staging_dir = tempfile.mkdtemp(dir=self.full_client_dir)
+    try:
+      image_errors = {}
+      download_errors = self._download_targets(to_download, staging_dir)
+
+      for target, error in zip(to_download, download_errors):
+        image = get_image(target)
+        image_errors[image] = error
+        if error is not None:
+          continue
+
+        image_sources[image] = get_fname(staging_dir, target)
+        sha256_hash = target['fileinfo']['hashes'].get('sha256')
+        if sha256_hash is not None:
+          cached_fname = os.path.join(cache_dir, sha256_hash)
+          # This happens atomically on POSIX-compliant systems and replaces
+          # any existing file.
+          os.rename(image_sources[image], cached_fname)
+          image_sources[image] = cached_fname
+
+      errors = []
+      for target in targets:
+        image = get_image(target)
+        error = image_errors.get(image)
+        if error is None:
+          _copy_into_place(
+              image_sources[image], get_fname(destination_directory, target))
+        errors.append(error)
+
+    finally:
+      shutil.rmtree(staging_dir)
+
+    return errors
+
+
+
+
+
+  def _get_cached_image_fname(self, target):
+    """
+    Returns the filename of the image for the given target (verified target
+    info) in the image cache (see _obtain_targets()), or None if it is not
+    there. A cached file that does not match the target info is removed.
+    """
+    fileinfo = target['fileinfo']
+
+    if 'sha256' not in fileinfo['hashes']:
+      return None
+
+    cached_fname = os.path.join(self.full_client_dir, IMAGE_CACHE_DIRNAME,
+        fileinfo['hashes']['sha256'])
+
+    if not os.path.exists(cached_fname):
+      return None
+
+    hashers = dict((algorithm, hashlib.new(algorithm))
+        for algorithm in fileinfo['hashes'])
+    with open(cached_fname, 'rb') as fobj:
+      for chunk in iter(lambda: fobj.read(DEFAULT_IMAGE_BLOCK_SIZE * 16), b''):
+        for hasher in hashers.values():
+          hasher.update(chunk)
+
+    if os.path.getsize(cached_fname) == fileinfo['length'] and all(
+        hashers[algorithm].hexdigest() == fileinfo['hashes'][algorithm]
+        for algorithm in hashers):
+      return cached_fname
+
+    log.warning(YELLOW + 'Cached image ' + repr(cached_fname) + ' does not '
+        'match its verified target info. Discarding it.' + ENDCOLORS)
+    os.remove(cached_fname)
+    return None
+
+
+
+
+
+  def _fetch_image_deltas(self):
+    """
+    For each Secondary that has an image assigned to it, and has reported
+    (in its last ECU Manifest) having a different image installed, tries to
+    fetch a delta from the installed image to the assigned image (see
+    uptane/delta.py) from the mirrors of the repositories other than the
+    Director, which precompute deltas between common pairs of images.
+    Deltas are kept in the 'deltas' subdirectory of the client directory,
+    named by uptane.delta.get_delta_fname().
+
+    Deltas are not listed in TUF metadata and cannot be fully validated
+    here: they are an optimization, and a Secondary validates the image it
+    produces from a delta against the full image's target info. To limit the
+    damage a bad mirror can do, a delta is kept only if it is smaller than
+    the full image and its header declares the length and SHA-256 hash of
+    both the installed image and the assigned image's verified target info.
+    Failure to obtain a delta is not an error: the Secondary will receive
+    the full image. A mirror that stalls for more than DELTA_FETCH_TIMEOUT
+    seconds is given up on. Deltas discarded because a Secondary could not
+    use them (see discard_image_delta()) are not fetched again.
+
+    Deltas that no Secondary needs any longer (because it has installed the
+    image, or been assigned another) are removed.
+    """
+    deltas_dir = os.path.join(self.full_client_dir, uptane.delta.DELTAS_DIRNAME)
+    if not os.path.exists(deltas_dir):
+      os.makedirs(deltas_dir)
+
+    # The filenames of the deltas still needed, to be kept when pruning.
+    needed_delta_basenames = set()
+
+    mirrors = []
+    for repo_name in sorted(self.updater.repositories):
+      if repo_name != self.director_repo_name:
+        mirrors.extend(self.updater.repositories[repo_name].mirrors)
+
+    if self.mirror_scores is not None:
+      mirrors = self.mirror_scores.sort_mirrors(mirrors)
+
+    for ecu_serial in sorted(self.assigned_targets):
+      if ecu_serial not in self.installed_images:
+        continue
+
+      base_fileinfo = self.installed_images[ecu_serial]['fileinfo']
+      base_hashes = base_fileinfo['hashes']
+      target_fileinfo = self.assigned_targets[ecu_serial]['fileinfo']
+
+      if 'sha256' not in base_hashes or \
+          'sha256' not in target_fileinfo['hashes'] or \
+          base_hashes['sha256'] == target_fileinfo['hashes']['sha256']:
+        continue
+
+      delta_basename = uptane.delta.get_delta_fname(
+          base_hashes['sha256'], target_fileinfo['hashes']['sha256'])
+      delta_fname = os.path.join(deltas_dir, delta_basename)
+      needed_delta_basenames.add(delta_basename)
+
+      if os.path.exists(delta_fname) or \
+          delta_basename in self.discarded_image_deltas:
+        continue
+
+      expected_header = (base_fileinfo['length'], base_hashes['sha256'],
+          target_fileinfo['length'], target_fileinfo['hashes']['sha256'])
+
+      for mirror in mirrors:
+        url = mirror.rstrip('/') + '/' + uptane.delta.DELTAS_DIRNAME + '/' + \
+            delta_basename
+        try:
+          response = urlopen(url, timeout=DELTA_FETCH_TIMEOUT)
+          try:
+            delta = response.read(target_fileinfo['length'])
+          finally:
+            response.close()
+        except (URLError, IOError):
+          continue
+
+        if len(delta) >= target_fileinfo['length']:
+          continue
+
+        try:
+          header = uptane.delta.read_delta_header(io.BytesIO(delta))
+        except uptane.Error:
+          header = None
+        if header != expected_header:
+          log.debug('Ignoring image delta from ' + repr(url) + ' that is '
+              'not for the installed and assigned images.')
+          continue
+
+        # Write the delta beside its final name and move it into place, since
+        # Secondaries may request deltas at any time.
+        with open(delta_fname + '.tmp', 'wb') as fobj:
+          fobj.write(delta)
+        os.rename(delta_fname + '.tmp', delta_fname)
+
+        log.debug('Fetched image delta for ECU ' + repr(ecu_serial) + ' from ' +
+            repr(url))
+        break
+
+    self.discarded_image_deltas &= needed_delta_basenames
+
+    for delta_basename in os.listdir(deltas_dir):
+      if delta_basename not in needed_delta_basenames:
+        log.debug('Removing image delta no longer needed: ' +
+            repr(delta_basename))
+        os.remove(os.path.join(deltas_dir, delta_basename))
+
+
+
+
+
+  def _get_target_repositories(self, target):
+    """
+    Returns the names of the repositories in the first delegation in
+    pinned.json matching the given target's filepath (an empty list if none
+    match).
+    """
+    for delegation in self.updater.pinned_metadata['delegations']:
+      if any(fnmatch.fnmatch(target['filepath'], pattern) or
+          fnmatch.fnmatch(target['filepath'].lstrip('/'), pattern)
+          for pattern in delegation['paths']):
+        return delegation['repositories']
+
+    return []
+
+
+
+
+
+  def _order_mirrors(self):
+    """
+    If there are mirror scores (self.mirror_scores), has TUF try the mirrors
+    of each repository in the order of their scores, best first. The mirrors
+    are those TUF has now (from pinned.json, or as since set), so that none
+    set at runtime are lost. Which mirror provides a file makes no
+    difference to how it is validated.
+    """
+    if self.mirror_scores is None:
+      return
+
+    for repository in self.updater.repositories.values():
+      repository.mirrors = self.mirror_scores.sort_mirrors(repository.mirrors)
+
+
+
+
+
+  def _race_mirrors(self, targets):
+    """
+    For each repository providing any of the given targets (verified target
+    info) that is at least self.mirror_race_threshold bytes long, races the
+    two best mirrors of the repository for the first bytes of the first such
+    target (see uptane.mirror_scores.MirrorScores.race()), and then orders
+    the mirrors by their updated scores (see _order_mirrors()). Nothing
+    fetched in a race is used.
+
+    Mirrors are raced only if the score of either is stale (older than
+    MIRROR_SCORES_MAX_AGE): the scores of the mirrors in use are kept up to
+    date by the requests made of them, so a race is needed only now and then
+    to measure a mirror that is not.
+    """
+    if self.mirror_scores is None:
+      return
+
+    raced = set()
+
+    for target in targets:
+      if target['fileinfo']['length'] < self.mirror_race_threshold:
+        continue
+
+      for repo_name in self._get_target_repositories(target):
+        if repo_name in raced or repo_name not in self.updater.repositories:
+          continue
+        mirrors = self.mirror_scores.sort_mirrors(
+            self.updater.repositories[repo_name].mirrors)[:2]
+        if len(mirrors) < 2 or not any(
+            self.mirror_scores.is_stale(mirror, MIRROR_SCORES_MAX_AGE)
+            for mirror in mirrors):
+          continue
+        raced.add(repo_name)
+
+        winner = self.mirror_scores.race([mirror.rstrip('/') + '/targets/' +
+            target['filepath'].lstrip('/') for mirror in mirrors])
+        log.debug('Raced mirrors ' + repr(mirrors) + ' of repository ' +
+            repr(repo_name) + '; the first to answer was ' + repr(winner))
+
+    self._order_mirrors()
+
+
+
+
   def register_ecu_manifest(
       self, vin, ecu_serial, nonce, signed_ecu_manifest, force_pydict=False):
     """
@@ -1031,11 +2111,19 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       tuf.FormatError
           if any of the arguments are not in the expected formats.
 
+      uptane.FailedToDecodeASN1DER
+          if, in ASN.1/DER mode, signed_ecu_manifest is not a DER-encoded ECU
+          Manifest. (Only its structure and the fields the Primary uses are
+          decoded; the Director decodes and checks the rest.)
+
     <Returns>
       None
 
     <Side Effects>
-      self.ecu_manifests[ecu_serial] will contain signed_ecu_manifest
+      self.ecu_manifests[ecu_serial] will contain signed_ecu_manifest (as DER
+          in ASN.1/DER mode; see class docstring)
+      self.installed_images[ecu_serial] will be the installed image it lists
+          (in ASN.1/DER mode, only if self.fetch_image_deltas is True)
       nonce will be added to self.nonces_to_send
 
     """
@@ -1052,45 +2140,59 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
     if tuf.conf.METADATA_FORMAT == 'der' and not force_pydict:
       uptane.formats.DER_DATA_SCHEMA.check_match(signed_ecu_manifest)
-      # If we're working with ASN.1/DER, convert it into the format specified in
-      # uptane.formats.SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA.
-      signed_ecu_manifest = asn1_codec.convert_signed_der_to_dersigned_json(
-          signed_ecu_manifest, DATATYPE_ECU_MANIFEST)
+      # If we're working with ASN.1/DER, read only the fields we check from
+      # the DER, and keep the DER itself to be spliced into the Vehicle
+      # Manifest. (We only need the installed image if we're to fetch image
+      # deltas.)
+      manifest_header = ecu_manifest_asn1_coder.get_json_header_from_der(
+          signed_ecu_manifest,
+          include_installed_image=self.fetch_image_deltas)
 
     # Else, we're working with standard Python dictionaries and no conversion
     # is necessary, but we'll still validate the signed_ecu_manifest argument.
     else:
       uptane.formats.SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA.check_match(
           signed_ecu_manifest)
+      manifest_header = signed_ecu_manifest['signed']
 
-    if ecu_serial != signed_ecu_manifest['signed']['ecu_serial']:
+      # In ASN.1/DER mode, keep all ECU Manifests as DER (see class
+      # docstring), preserving their signatures.
+      if tuf.conf.METADATA_FORMAT == 'der':
+        signed_ecu_manifest = asn1_codec.convert_signed_metadata_to_der(
+            signed_ecu_manifest, DATATYPE_ECU_MANIFEST)
+
+    if ecu_serial != manifest_header['ecu_serial']:
       # TODO: Choose an exception class.
       raise uptane.Spoofing('Received a spoofed or mistaken manifest: supposed '
           'origin ECU (' + repr(ecu_serial) + ') is not the same as what is '
           'signed in the manifest itself (' +
-          repr(signed_ecu_manifest['signed']['ecu_serial']) + ').')
+          repr(manifest_header['ecu_serial']) + ').')
 
-    # If we haven't errored out above, then the format is correct, so save
-    # the manifest to the Primary's dictionary of manifests.
-    if ecu_serial in self.ecu_manifests:
-      self.ecu_manifests[ecu_serial].append(signed_ecu_manifest)
-    else:
-      self.ecu_manifests[ecu_serial] = [signed_ecu_manifest]
+    with self.secondary_reports_lock:
+      # If we haven't errored out above, then the format is correct, so save
+      # the manifest to the Primary's dictionary of manifests.
+      if ecu_serial in self.ecu_manifests:
+        self.ecu_manifests[ecu_serial].append(signed_ecu_manifest)
+      else:
+        self.ecu_manifests[ecu_serial] = [signed_ecu_manifest]
+
+      if 'installed_image' in manifest_header:
+        self.installed_images[ecu_serial] = manifest_header['installed_image']
 
-    # And add the nonce the Secondary provided to the list of nonces to send
-    # in the next Timeserver request.
-    if nonce not in self.nonces_to_send:
-      self.nonces_to_send.append(nonce)
+      # And add the nonce the Secondary provided to the list of nonces to send
+      # in the next Timeserver request.
+      if nonce not in self.nonces_to_send:
+        self.nonces_to_send.append(nonce)
 
 
     log.debug(GREEN + ' Primary received an ECU manifest from ECU ' +
         repr(ecu_serial) + ', along with nonce ' + repr(nonce) + ENDCOLORS)
 
     # Alert if there's been a detected attack.
-    if signed_ecu_manifest['signed']['attacks_detected']:
+    if manifest_header['attacks_detected']:
       log.warning(YELLOW + ' Attacks have been reported by the Secondary! \n '
           'Attacks listed by ECU ' + repr(ecu_serial) + ':\n ' +
-          signed_ecu_manifest['signed']['attacks_detected'] + ENDCOLORS)
+          manifest_header['attacks_detected'] + ENDCOLORS)
 
 
 
@@ -1106,9 +2208,10 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
      - empties self.nonces_to_send, to be populated from new messages from
        Secondaries.
     """
-    self.nonces_sent = self.nonces_to_send
-    self.nonces_to_send = []
-    return self.nonces_sent
+    with self.secondary_reports_lock:
+      self.nonces_sent = self.nonces_to_send
+      self.nonces_to_send = []
+      return self.nonces_sent
 
 
 
@@ -1133,37 +2236,55 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     expected to be in that format, as a byte string.
     Otherwise, we're using simple Python dictionaries and timeserver_attestation
     conforms to uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.
+
+    A batched time attestation from a Timeserver in batched mode (conforming
+    to uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA, or its
+    DER equivalent) is also accepted. Its Merkle inclusion proof is checked
+    in addition to the signature over the Merkle root.
     """
 
     # If we're using DER format, convert the attestation into something
     # comprehensible instead.
     if tuf.conf.METADATA_FORMAT == 'der':
-      timeserver_attestation = asn1_codec.convert_signed_der_to_dersigned_json(
-          timeserver_attestation, DATATYPE_TIME_ATTESTATION)
+      timeserver_attestation = \
+          asn1_codec.convert_signed_der_time_attestation_to_dersigned_json(
+          timeserver_attestation)
+
+    if isinstance(timeserver_attestation, dict) and \
+        'merkle_proof' in timeserver_attestation:
+      # This is a batched time attestation: the Timeserver signed a Merkle
+      # root covering this attestation and those for other requests. This
+      # checks the format, the signature over the root, and the proof that our
+      # attestation is included in the tree.
+      verified_attestation = uptane.common.verify_batched_time_attestation(
+          timeserver_attestation, self.timeserver_public_key)
+
+    else:
+      # Check format.
+      uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+          timeserver_attestation)
 
-    # Check format.
-    uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
-        timeserver_attestation)
 
+      # Assume there's only one signature. This assumption is made for
+      # simplicity in this reference implementation. If the Timeserver needs
+      # to sign with multiple keys for some reason, that can be accomodated.
+      assert len(timeserver_attestation['signatures']) == 1
 
-    # Assume there's only one signature. This assumption is made for simplicity
-    # in this reference implementation. If the Timeserver needs to sign with
-    # multiple keys for some reason, that can be accomodated.
-    assert len(timeserver_attestation['signatures']) == 1
+      valid = uptane.common.verify_signature_over_metadata(
+          self.timeserver_public_key,
+          timeserver_attestation['signatures'][0],
+          timeserver_attestation['signed'],
+          DATATYPE_TIME_ATTESTATION)
 
-    valid = uptane.common.verify_signature_over_metadata(
-        self.timeserver_public_key,
-        timeserver_attestation['signatures'][0],
-        timeserver_attestation['signed'],
-        DATATYPE_TIME_ATTESTATION)
+      if not valid:
+        raise tuf.BadSignatureError('Timeserver returned an invalid signature. '
+            'Time is questionable, so not saved. If you see this persistently, '
+            'it is possible that there is a Man in the Middle attack underway.')
 
-    if not valid:
-      raise tuf.BadSignatureError('Timeserver returned an invalid signature. '
-          'Time is questionable, so not saved. If you see this persistently, '
-          'it is possible that there is a Man in the Middle attack underway.')
+      verified_attestation = timeserver_attestation['signed']
 
     for nonce in self.nonces_sent:
-      if nonce not in timeserver_attestation['signed']['nonces']:
+      if nonce not in verified_attestation['nonces']:
         # TODO: Determine whether or not to add something to self.attacks_detected
         # to indicate this problem. It's probably not certain enough? But perhaps
         # we should err on the side of reporting.
@@ -1176,7 +2297,7 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
     # Extract actual time from the timeserver's signed attestation.
-    new_timeserver_time = timeserver_attestation['signed']['time']
+    new_timeserver_time = verified_attestation['time']
 
     # Make sure the format is understandable to us before saving the
     # attestation and time.  Convert to a UNIX timestamp.
@@ -1204,8 +2325,9 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     in the expected locations available for distribution to Secondaries:
 
       - self.distributable_full_metadata_archive_fname
-          a zip archive of all the metadata files, from all repositories,
-          validated by this Primary, for use by Full Verification Secondaries.
+          a zip archive or metadata bundle (per self.metadata_archive_format)
+          of all the metadata files, from all repositories, validated by this
+          Primary, for use by Full Verification Secondaries.
 
       - self.distributable_partial_metadata_fname
           the Director Targets role file alone, for use by Partial Verification
@@ -1220,47 +2342,11 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     conditions.
     """
 
-    metadata_base_dir = os.path.join(self.full_client_dir, 'metadata')
-
     # Full Verification Metadata Preparation
-
-    # Save a zipped version of all of the metadata.
-    # Note that some stale metadata may be retained, but should never affect
-    # security. Worth confirming.
-    # What we want here, basically, is:
-    #  <full_client_dir>/metadata/*/current/*.json or *.der
-    with zipfile.ZipFile(self.temp_full_metadata_archive_fname, 'w') \
-        as archive:
-      # For each repository directory within the client metadata directory
-      for repo_dir in os.listdir(metadata_base_dir):
-        # Construct path to "current" metadata directory for that repository in
-        # the client metadata directory, relative to Uptane working directory.
-        abs_repo_dir = os.path.join(metadata_base_dir, repo_dir, 'current')
-        if not os.path.isdir(abs_repo_dir):
-          continue
-
-        # Add each role metadata file to the archive.
-        for role_fname in os.listdir(abs_repo_dir):
-          # Reconstruct file path relative to Uptane working directory.
-          role_abs_fname = os.path.join(abs_repo_dir, role_fname)
-
-          # Make sure it's the right type of file. Should be a file, not a
-          # directory. Symlinks are OK. Should end in an extension matching
-          # tuf.conf.METADATA_FORMAT (presumably .json or .der, depending on
-          # that setting).
-          if not os.path.isfile(role_abs_fname) or not role_abs_fname.endswith(
-              '.' + tuf.conf.METADATA_FORMAT):
-            # Consider special error type.
-            raise uptane.Error('Unexpected file type in a metadata '
-                'directory: ' + repr(role_abs_fname) + ' Expecting only ' +
-                tuf.conf.METADATA_FORMAT + 'files.')
-
-          # Write the file to the archive, adjusting the path in the archive so
-          # that when expanded, it resembles repository structure rather than
-          # a client directory structure.
-          archive.write(
-              role_abs_fname,
-              os.path.join(repo_dir, 'metadata', role_fname))
+    if self.metadata_archive_format == METADATA_ARCHIVE_BUNDLE:
+      self._save_full_metadata_bundle()
+    else:
+      self._save_full_metadata_zip()
 
 
     # Partial Verification Metadata Preparation
@@ -1278,16 +2364,149 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     shutil.copyfile(director_targets_file, self.temp_partial_metadata_fname)
 
 
-    # Now move both Full and Partial metadata files into place. For each file,
-    # this happens atomically on POSIX-compliant systems and replaces any
-    # existing file.
+    # Now move the Partial metadata file into place. (The Full metadata
+    # archive has already been moved into place, if it changed.) This happens
+    # atomically on POSIX-compliant systems and replaces any existing file.
     os.rename(
         self.temp_partial_metadata_fname,
         self.distributable_partial_metadata_fname)
+
+
+
+
+
+  def _get_metadata_role_fnames(self):
+    """
+    Returns a list of (repository name, role filename, absolute path) for
+    each current role metadata file from each repository, i.e.
+      <full_client_dir>/metadata/*/current/*.json or *.der
+
+    Raises uptane.Error if a metadata directory contains a file that does not
+    have an extension that befits a file of type tuf.conf.METADATA_FORMAT.
+    """
+    metadata_base_dir = os.path.join(self.full_client_dir, 'metadata')
+
+    role_fnames = []
+
+    # For each repository directory within the client metadata directory
+    for repo_dir in sorted(os.listdir(metadata_base_dir)):
+      # Construct path to "current" metadata directory for that repository in
+      # the client metadata directory, relative to Uptane working directory.
+      abs_repo_dir = os.path.join(metadata_base_dir, repo_dir, 'current')
+      if not os.path.isdir(abs_repo_dir):
+        continue
+
+      for role_fname in sorted(os.listdir(abs_repo_dir)):
+        # Reconstruct file path relative to Uptane working directory.
+        role_abs_fname = os.path.join(abs_repo_dir, role_fname)
+
+        # Make sure it's the right type of file. Should be a file, not a
+        # directory. Symlinks are OK. Should end in an extension matching
+        # tuf.conf.METADATA_FORMAT (presumably .json or .der, depending on
+        # that setting).
+        if not os.path.isfile(role_abs_fname) or not role_abs_fname.endswith(
+            '.' + tuf.conf.METADATA_FORMAT):
+          # Consider special error type.
+          raise uptane.Error('Unexpected file type in a metadata '
+              'directory: ' + repr(role_abs_fname) + ' Expecting only ' +
+              tuf.conf.METADATA_FORMAT + 'files.')
+
+        role_fnames.append((repo_dir, role_fname, role_abs_fname))
+
+    return role_fnames
+
+
+
+
+
+  def _save_full_metadata_zip(self):
+    """
+    Saves a zipped version of all of the metadata, moving it into place as the
+    distributable full metadata archive.
+    Note that some stale metadata may be retained, but should never affect
+    security. Worth confirming.
+    """
+    with zipfile.ZipFile(self.temp_full_metadata_archive_fname, 'w') \
+        as archive:
+      for repo_dir, role_fname, role_abs_fname in \
+          self._get_metadata_role_fnames():
+        # Write the file to the archive, adjusting the path in the archive so
+        # that when expanded, it resembles repository structure rather than
+        # a client directory structure.
+        archive.write(
+            role_abs_fname,
+            os.path.join(repo_dir, 'metadata', role_fname))
+
+    # This happens atomically on POSIX-compliant systems and replaces any
+    # existing file.
+    os.rename(
+        self.temp_full_metadata_archive_fname,
+        self.distributable_full_metadata_archive_fname)
+
+
+
+
+
+  def _save_full_metadata_bundle(self):
+    """
+    Saves a metadata bundle (see uptane/encoding/metadata_bundle.py) of all of
+    the metadata, moving it into place as the distributable full metadata
+    archive.
+
+    Only role files that have changed (by inode, modification time, or size)
+    since the last bundle was built are read and hashed again; the others
+    come from memory. If no role file has changed, the existing bundle is
+    left in place rather than rewritten.
+
+    When some role file has changed, a new bundle is written beside the old
+    one and moved into place, never written over the old one in place: the
+    old bundle may be memory-mapped and partway through being sent to a
+    Secondary (see get_full_metadata_archive_data()).
+    """
+    role_files = []
+    role_hashes = {}
+    role_cache = {}
+
+    for repo_dir, role_fname, role_abs_fname in \
+        self._get_metadata_role_fnames():
+      stat = os.stat(role_abs_fname)
+      key = (repo_dir, role_fname)
+      cached = self.metadata_bundle_role_cache.get(key)
+
+      file_state = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+      if cached is not None and cached[0] == file_state:
+        data, data_hash = cached[1], cached[2]
+      else:
+        with open(role_abs_fname, 'rb') as fobj:
+          data = fobj.read()
+        data_hash = hashlib.sha256(data).hexdigest()
+
+      role_cache[key] = (file_state, data, data_hash)
+      role_hashes[key] = data_hash
+      role_files.append((repo_dir, role_fname, data))
+
+    self.metadata_bundle_role_cache = role_cache
+
+    index = metadata_bundle.build_metadata_bundle_index(
+        role_files, role_hashes)
+
+    if index == self.metadata_bundle_index and \
+        os.path.exists(self.distributable_full_metadata_archive_fname):
+      log.debug('Metadata unchanged; keeping existing metadata bundle.')
+      return
+
+    with open(self.temp_full_metadata_archive_fname, 'wb') as fobj:
+      metadata_bundle.write_metadata_bundle(fobj, role_files, index)
+
+    # This happens atomically on POSIX-compliant systems and replaces any
+    # existing file.
     os.rename(
         self.temp_full_metadata_archive_fname,
         self.distributable_full_metadata_archive_fname)
 
+    self.metadata_bundle_index = index
+
 
 
 
@@ -1305,3 +2524,24 @@ def enforce_jail(fname, expected_containing_dir):
 
   else:
     return abs_fname
+
+
+
+
+
+def _copy_into_place(source_fname, destination_fname):
+  """
+  Copies the file at source_fname to destination_fname, replacing any file
+  there atomically (on POSIX-compliant systems), since Secondaries may be
+  reading it.
+  """
+  destination_dir = os.path.dirname(destination_fname)
+  if not os.path.exists(destination_dir):
+    os.makedirs(destination_dir)
+
+  temp_fname = destination_fname + '.tmp'
+  if os.path.exists(temp_fname):
+    os.remove(temp_fname)
+
+  shutil.copyfile(source_fname, temp_fname)
+  os.rename(temp_fname, destination_fname)
@@ -32,13 +32,16 @@ import hashlib
 import iso8601
 
 import tuf.formats
+import tuf.schema as SCHEMA
 import tuf.keys
 import tuf.client.updater
 import tuf.repository_tool as rt
 
 import uptane.formats
+import uptane.delta
 import uptane.common
 import uptane.encoding.asn1_codec as asn1_codec
+import uptane.encoding.metadata_bundle as metadata_bundle
 
 from uptane.encoding.asn1_codec import DATATYPE_TIME_ATTESTATION
 from uptane.encoding.asn1_codec import DATATYPE_ECU_MANIFEST
@@ -52,6 +55,9 @@ log.addHandler(uptane.file_handler)
 log.addHandler(uptane.console_handler)
 log.setLevel(uptane.logging.DEBUG)
 
+# The amount of an image file read at once when validating it.
+IMAGE_CHUNK_SIZE = 64 * 1024
+
 
 
 class Secondary(object):
@@ -119,6 +125,11 @@ class Secondary(object):
       None in this field. If provided, this conforms to
       tuf.formats.ANYKEY_SCHEMA.
 
+    self.concurrent_metadata_refresh:
+      If True, refresh_toplevel_metadata() refreshes repositories other than
+      the Director at the same time as the Director. See
+      uptane.common.refresh_repositories().
+
     self.firmware_fileinfo:
       The target file info for the image this Secondary ECU is currently using
       (has currently "installed"). This is generally filename, hash, and
@@ -143,6 +154,15 @@ class Secondary(object):
       # TODO: Since this is now expected to always be one target, this should
       # just be a single value rather than a list....
 
+    self.image_stream:
+      The state of the image being received and validated a chunk at a time
+      (see begin_image_stream()), or None if no image is being received.
+
+    self.image_block_transfer:
+      The state of the image being received a block at a time (see
+      begin_image_block_transfer()), or None if there is no such transfer in
+      progress.
+
 
   Methods, as called: ("self" arguments excluded):
 
@@ -160,9 +180,20 @@ class Secondary(object):
       update_time(timeserver_attestation)
       process_metadata(metadata_archive_fname)
       _expand_metadata_archive(metadata_archive_fname)
+      _expand_metadata_bundle(metadata_bundle_fname)
       fully_validate_metadata()
       get_validated_target_info(target_filepath)
       validate_image(image_fname)
+      begin_image_stream(image_fname, resume, alignment)
+      receive_image_chunk(chunk)
+      finish_image_stream()
+      begin_image_block_transfer(image_file)
+      receive_image_block(image_block)
+      apply_image_delta(image_fname, base_fname, delta_fobj)
+      _get_image_hashers(target_info)
+      _check_image_length_and_hashes(target_info, observed_length, hashers)
+      _abandon_image_stream()
+      _get_validated_target_info_for_image(image_fname)
 
 
 
@@ -179,7 +210,8 @@ class Secondary(object):
     timeserver_public_key,
     firmware_fileinfo=None,
     director_public_key=None,
-    partial_verifying=False):
+    partial_verifying=False,
+    concurrent_metadata_refresh=False):
 
     """
     <Purpose>
@@ -203,6 +235,8 @@ class Secondary(object):
 
       partial_verifying     See class docstring above. (optional)
 
+      concurrent_metadata_refresh See class docstring above. (optional)
+
       time
         An initial time to set the Secondary's "clock" to, conforming to
         tuf.formats.ISO8601_DATETIME_SCHEMA.
@@ -239,6 +273,7 @@ class Secondary(object):
     tuf.formats.ANYKEY_SCHEMA.check_match(ecu_key)
     if director_public_key is not None:
         tuf.formats.ANYKEY_SCHEMA.check_match(director_public_key)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(concurrent_metadata_refresh)
 
     self.director_repo_name = director_repo_name
     self.ecu_key = ecu_key
@@ -250,6 +285,7 @@ class Secondary(object):
     self.director_public_key = director_public_key
     self.partial_verifying = partial_verifying
     self.firmware_fileinfo = firmware_fileinfo
+    self.concurrent_metadata_refresh = concurrent_metadata_refresh
 
     if not self.partial_verifying and self.director_public_key is not None:
       raise uptane.Error('Secondary not set as partial verifying, but a director ' # TODO: Choose error class.
@@ -277,6 +313,8 @@ class Secondary(object):
     self.last_nonce_sent = None
     self.nonce_next = self._create_nonce()
     self.validated_targets_for_this_ecu = []
+    self.image_stream = None
+    self.image_block_transfer = None
 
 
 
@@ -398,31 +436,49 @@ class Secondary(object):
     Otherwise, we're using simple Python dictionaries and timeserver_attestation
     conforms to uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.
 
+    A batched time attestation from a Timeserver in batched mode (conforming
+    to uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA, or its
+    DER equivalent) is also accepted. Its Merkle inclusion proof is checked
+    in addition to the signature over the Merkle root.
+
     If verification is successful, switch to a new nonce for next time.
     """
     # If we're using ASN.1/DER format, convert the attestation into something
     # comprehensible (JSON-compatible dictionary) instead.
     if tuf.conf.METADATA_FORMAT == 'der':
-      timeserver_attestation = asn1_codec.convert_signed_der_to_dersigned_json(
-          timeserver_attestation, DATATYPE_TIME_ATTESTATION)
+      timeserver_attestation = \
+          asn1_codec.convert_signed_der_time_attestation_to_dersigned_json(
+          timeserver_attestation)
+
+    if isinstance(timeserver_attestation, dict) and \
+        'merkle_proof' in timeserver_attestation:
+      # This is a batched time attestation: the Timeserver signed a Merkle
+      # root covering this attestation and those for other requests. This
+      # checks the format, the signature over the root, and the proof that the
+      # attestation is included in the tree.
+      verified_attestation = uptane.common.verify_batched_time_attestation(
+          timeserver_attestation, self.timeserver_public_key)
 
-    # Check format.
-    uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
-        timeserver_attestation)
+    else:
+      # Check format.
+      uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+          timeserver_attestation)
 
-    # Assume there's only one signature.
-    assert len(timeserver_attestation['signatures']) == 1
+      # Assume there's only one signature.
+      assert len(timeserver_attestation['signatures']) == 1
 
-    verified = uptane.common.verify_signature_over_metadata(
-        self.timeserver_public_key,
-        timeserver_attestation['signatures'][0],
-        timeserver_attestation['signed'],
-        DATATYPE_TIME_ATTESTATION)
+      verified = uptane.common.verify_signature_over_metadata(
+          self.timeserver_public_key,
+          timeserver_attestation['signatures'][0],
+          timeserver_attestation['signed'],
+          DATATYPE_TIME_ATTESTATION)
 
-    if not verified:
-      raise tuf.BadSignatureError('Timeserver returned an invalid signature. '
-          'Time is questionable, so not saved. If you see this persistently, '
-          'it is possible that there is a Man in the Middle attack underway.')
+      if not verified:
+        raise tuf.BadSignatureError('Timeserver returned an invalid signature. '
+            'Time is questionable, so not saved. If you see this persistently, '
+            'it is possible that there is a Man in the Middle attack underway.')
+
+      verified_attestation = timeserver_attestation['signed']
 
 
     # If the most recent nonce we sent is not in the timeserver attestation,
@@ -435,7 +491,7 @@ class Secondary(object):
           'Version Manifest to the Primary.' + ENDCOLORS)
       return
 
-    elif self.last_nonce_sent not in timeserver_attestation['signed']['nonces']:
+    elif self.last_nonce_sent not in verified_attestation['nonces']:
       # TODO: Create a new class for this Exception in this file.
       raise uptane.BadTimeAttestation('Primary provided a time attestation '
           'that did not include any of the nonces this Secondary has sent '
@@ -448,7 +504,7 @@ class Secondary(object):
           'vehicle.')
 
     # Extract actual time from the timeserver's signed attestation.
-    new_timeserver_time = timeserver_attestation['signed']['time']
+    new_timeserver_time = verified_attestation['time']
 
     # Make sure the format is understandable to us before saving the
     # time.  Convert to a UNIX timestamp.
@@ -487,18 +543,18 @@ class Secondary(object):
           whatever currently trusted Root metadata we ended up with was expired.
       - tuf.NoWorkingMirrorError:
           if we could not obtain and verify all necessary metadata
-    """
 
-    # Refresh the Director first, per the Uptane Standard.
-    self.updater.refresh(repo_name=self.director_repo_name)
-
-    # Now that we've dealt with the Director repository, deal with any and all
-    # other repositories, presumably Image Repositories.
-    for repository_name in self.updater.repositories:
-      if repository_name == self.director_repo_name:
-        continue
+    If self.concurrent_metadata_refresh is True, repositories other than the
+    Director are refreshed concurrently with it. See
+    uptane.common.refresh_repositories().
+    """
 
-      self.updater.refresh(repo_name=repository_name)
+    # Refresh the Director first, per the Uptane Standard, and then any and
+    # all other repositories, presumably Image Repositories. If configured to,
+    # refresh the others at the same time as the Director; errors are still
+    # reported as if the Director had been refreshed first.
+    uptane.common.refresh_repositories(self.updater, self.director_repo_name,
+        concurrent=self.concurrent_metadata_refresh)
 
 
 
@@ -602,7 +658,8 @@ class Secondary(object):
 
   def process_metadata(self, metadata_archive_fname):
     """
-    Expand the metadata archive using _expand_metadata_archive()
+    Expand the metadata archive using _expand_metadata_archive(), or, if it is
+      a metadata bundle rather than a zip archive, _expand_metadata_bundle()
     Validate metadata files using fully_validate_metadata()
     Select the Director targets.json file
     Pick out the target file(s) with our ECU serial listed
@@ -610,7 +667,11 @@ class Secondary(object):
     """
     tuf.formats.RELPATH_SCHEMA.check_match(metadata_archive_fname)
 
-    self._expand_metadata_archive(metadata_archive_fname)
+    if os.path.exists(metadata_archive_fname) and \
+        metadata_bundle.is_metadata_bundle(metadata_archive_fname):
+      self._expand_metadata_bundle(metadata_archive_fname)
+    else:
+      self._expand_metadata_archive(metadata_archive_fname)
 
     # This entails using the local metadata files as a repository.
     self.fully_validate_metadata()
@@ -642,6 +703,86 @@ class Secondary(object):
 
     z.extractall(os.path.join(self.full_client_dir, 'unverified'))
 
+    self._add_versioned_role_fnames()
+
+
+
+
+
+  def _expand_metadata_bundle(self, metadata_bundle_fname):
+    """
+    Given the filename of a metadata bundle (see
+    uptane/encoding/metadata_bundle.py) of metadata files validated by
+    primary.py, places the contained metadata files where
+    _expand_metadata_archive() would, to be used as a local repository and
+    validated by this Secondary.
+
+    Role files are read in place from the memory-mapped bundle, and only those
+    that differ from the copy already on disk are written, so a bundle with
+    few changes costs few writes. The hashes in the bundle's index are
+    checked, but they only detect corruption of the bundle: the metadata must
+    still be fully validated.
+
+    <Exceptions>
+      uptane.Error
+        if the file does not exist or is not a well-formed metadata bundle
+
+      tuf.BadHashError
+        if a role file in the bundle does not match its hash in the index
+    """
+    tuf.formats.RELPATH_SCHEMA.check_match(metadata_bundle_fname)
+    if not os.path.exists(metadata_bundle_fname):
+      raise uptane.Error('Indicated metadata bundle does not exist. '
+          'Filename: ' + repr(metadata_bundle_fname))
+
+    unverified_dir = os.path.join(self.full_client_dir, 'unverified')
+
+    with metadata_bundle.MetadataBundle(metadata_bundle_fname) as bundle:
+      for repository, role in bundle.roles():
+        data = bundle.get_role(repository, role)
+
+        role_dir = os.path.join(unverified_dir, repository, 'metadata')
+        role_fname = os.path.join(role_dir, role)
+
+        if os.path.isfile(role_fname) and \
+            os.path.getsize(role_fname) == len(data):
+          with open(role_fname, 'rb') as fobj:
+            if fobj.read() == data:
+              continue
+
+        if not os.path.isdir(role_dir):
+          os.makedirs(role_dir)
+
+        # Write the new file beside the old and move it into place.
+        temp_role_fname = role_fname + '.tmp'
+        with open(temp_role_fname, 'wb') as fobj:
+          fobj.write(data)
+        os.rename(temp_role_fname, role_fname)
+
+    self._add_versioned_role_fnames()
+
+
+
+
+
+  def _add_versioned_role_fnames(self):
+    """
+    The Primary distributes role files under their plain names (e.g.
+    'snapshot.der'), but for a repository that publishes consistent
+    snapshots, TUF looks for all but timestamp metadata under version-prefixed
+    names (e.g. '3.snapshot.der'). This gives the expanded role files of each
+    repository those names as well. See
+    uptane.encoding.metadata_bundle.add_versioned_role_fnames().
+    """
+    unverified_dir = os.path.join(self.full_client_dir, 'unverified')
+    if not os.path.isdir(unverified_dir):
+      return
+
+    for repository in sorted(os.listdir(unverified_dir)):
+      role_dir = os.path.join(unverified_dir, repository, 'metadata')
+      if os.path.isdir(role_dir):
+        metadata_bundle.add_versioned_role_fnames(role_dir)
+
 
 
 
@@ -696,6 +837,542 @@ class Secondary(object):
     full_image_fname = os.path.join(
         self.full_client_dir, 'unverified_targets', image_fname)
 
+    relevant_targetinfo = self._get_validated_target_info_for_image(
+        image_fname)
+
+    expected_length = relevant_targetinfo['fileinfo']['length']
+    hashers = self._get_image_hashers(relevant_targetinfo)
+    observed_length = 0
+
+    # Read the file once, a chunk at a time, checking its length as we go and
+    # updating all of its hashes together.
+    with open(full_image_fname, 'rb') as fobj:
+      while True:
+        chunk = fobj.read(IMAGE_CHUNK_SIZE)
+        if not chunk:
+          break
+
+        observed_length += len(chunk)
+        if observed_length > expected_length:
+          raise tuf.DownloadLengthMismatchError(
+              expected_length, os.fstat(fobj.fileno()).st_size)
+
+        for hasher in hashers.values():
+          hasher.update(chunk)
+
+    self._check_image_length_and_hashes(
+        relevant_targetinfo, observed_length, hashers)
+
+
+    # If no error has been raised at this point, the image file is fully
+    # validated and we can return.
+    log.debug('Delivered target file has been fully validated: ' +
+        repr(full_image_fname))
+
+
+
+
+
+  def begin_image_stream(self, image_fname, resume=False, alignment=1):
+    """
+    <Purpose>
+      Begins receiving the given image as a stream of chunks of any size,
+      which are provided to receive_image_chunk() as they arrive, followed by
+      a call to finish_image_stream().
+
+      Chunks are validated as they arrive, rather than after the image has
+      been written: the length of the image so far is checked against its
+      validated length, so that an image that is too long is rejected as soon
+      as it is, and all of its validated hashes are updated together. Chunks
+      are then written to a partial file in the 'unverified_targets'
+      subdirectory of the client directory, named for the image and its
+      expected hash, so that nothing but a fully validated image ever
+      appears there under the image's filename. The image is therefore read
+      only once, and need never be held in memory. The partial file is kept
+      open for the whole stream, and closed when the stream is finished or
+      abandoned.
+
+      If another stream is in progress, it is stopped, and its partial file
+      kept, so that it can be resumed later.
+
+    <Arguments>
+      image_fname
+        the filename of the image, as in validate_image()
+
+      resume (optional)
+        If True and the partial file remains from an earlier, interrupted
+        stream of the same image, the data in it is kept, and the stream
+        resumes where it stopped. (The data kept is read once to bring the
+        image's hashes up to date.) Otherwise, the stream starts from the
+        beginning of the image.
+
+      alignment (optional)
+        When resuming, the amount of data kept is rounded down to a multiple
+        of this (e.g. a block size). Some data always remains to be received.
+
+    <Exceptions>
+      uptane.Error
+        if the given filename does not match a filepath in the list of
+        validated targets for this ECU (see validate_image())
+
+      tuf.FormatError
+        if the arguments are not correctly formatted
+
+    <Returns>
+      The offset in the image at which the stream begins (0 unless resuming):
+      the amount of data already received.
+    """
+    tuf.formats.RELPATH_SCHEMA.check_match(image_fname)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(resume)
+    uptane.formats.IMAGE_BLOCK_SIZE_SCHEMA.check_match(alignment)
+
+    target_info = self._get_validated_target_info_for_image(image_fname)
+    expected_length = target_info['fileinfo']['length']
+    expected_hashes = target_info['fileinfo']['hashes']
+
+    # The partial file is named for one of the image's hashes, so that data
+    # for one image is never taken to be the start of another.
+    partial_fname = os.path.join(self.full_client_dir, 'unverified_targets',
+        image_fname + '.' + expected_hashes[sorted(expected_hashes)[0]] +
+        '.partial')
+
+    if not os.path.isdir(os.path.dirname(partial_fname)):
+      os.makedirs(os.path.dirname(partial_fname))
+
+    # Close the partial file of any stream already in progress, writing out
+    # what it has received, in case it is the same image being resumed.
+    if self.image_stream is not None:
+      self.image_stream['fobj'].close()
+      self.image_stream = None
+      self.image_block_transfer = None
+
+    # Keep no more than all but the last byte, so that the stream always
+    # finishes by receiving data.
+    offset = 0
+    if resume and os.path.exists(partial_fname) and expected_length:
+      offset = min(os.path.getsize(partial_fname), expected_length - 1)
+      offset -= offset % alignment
+
+    hashers = self._get_image_hashers(target_info)
+
+    # Opened for appending, the file is written only at its end, but the data
+    # kept from an earlier stream can still be read back from the start.
+    fobj = open(partial_fname, 'a+b')
+    fobj.truncate(offset)
+    fobj.seek(0)
+
+    remaining = offset
+    while remaining:
+      chunk = fobj.read(min(IMAGE_CHUNK_SIZE, remaining))
+      remaining -= len(chunk)
+      for hasher in hashers.values():
+        hasher.update(chunk)
+
+    # (A file must be repositioned between reading it and writing it.)
+    fobj.seek(offset)
+
+    self.image_stream = {
+        'filename': image_fname,
+        'target_info': target_info,
+        'received_length': offset,
+        'hashers': hashers,
+        'partial_fname': partial_fname,
+        'fobj': fobj}
+
+    if offset:
+      log.debug('Resuming receipt of image ' + repr(image_fname) + ' after ' +
+          repr(offset) + ' of ' + repr(expected_length) + ' bytes')
+
+    return offset
+
+
+
+
+
+  def receive_image_chunk(self, chunk):
+    """
+    <Purpose>
+      Validates the length of the image so far with the given chunk, updates
+      the image's hashes with it, and writes it to the partial image file, for
+      the stream begun by begin_image_stream().
+
+    <Arguments>
+      chunk
+        the next bytes of the image
+
+    <Exceptions>
+      uptane.Error
+        if no image stream is in progress
+
+      tuf.DownloadLengthMismatchError
+        if the image is now longer than its validated length. The data
+        received is discarded, and the stream must begin again.
+
+      tuf.FormatError
+        if chunk is not bytes
+
+    <Returns>
+      None.
+    """
+    SCHEMA.AnyBytes().check_match(chunk)
+
+    stream = self.image_stream
+
+    if stream is None:
+      raise uptane.Error('Received part of an image, but no image is being '
+          'received.')
+
+    expected_length = stream['target_info']['fileinfo']['length']
+
+    # Reject an image that is too long as soon as it is.
+    if stream['received_length'] + len(chunk) > expected_length:
+      self._abandon_image_stream()
+      raise tuf.DownloadLengthMismatchError(
+          expected_length, stream['received_length'] + len(chunk))
+
+    for hasher in stream['hashers'].values():
+      hasher.update(chunk)
+
+    stream['fobj'].write(chunk)
+
+    stream['received_length'] += len(chunk)
+
+
+
+
+
+  def finish_image_stream(self):
+    """
+    <Purpose>
+      Completes the image stream begun by begin_image_stream(): validates the
+      length and hashes of the image received against the validated target
+      info for it, as validate_image() would, and if they are as expected,
+      moves it into the 'unverified_targets' subdirectory of the client
+      directory under its filename. (It need not then be validated again.)
+      If validation fails, the data received is discarded.
+
+    <Exceptions>
+      uptane.Error
+        if no image stream is in progress
+
+      tuf.DownloadLengthMismatchError
+        if the image does not have the expected length based on validated
+        target info
+
+      tuf.BadHashError
+        if the image does not have the expected hashes based on validated
+        target info
+
+    <Returns>
+      None.
+    """
+    stream = self.image_stream
+
+    if stream is None:
+      raise uptane.Error('No image is being received.')
+
+    try:
+      self._check_image_length_and_hashes(stream['target_info'],
+          stream['received_length'], stream['hashers'])
+    except (tuf.DownloadLengthMismatchError, tuf.BadHashError):
+      self._abandon_image_stream()
+      raise
+
+    stream['fobj'].close()
+
+    full_image_fname = os.path.join(
+        self.full_client_dir, 'unverified_targets', stream['filename'])
+
+    if os.path.exists(full_image_fname):
+      os.remove(full_image_fname)
+    os.rename(stream['partial_fname'], full_image_fname)
+
+    self.image_stream = None
+    self.image_block_transfer = None
+
+    log.debug('Received target file has been fully validated: ' +
+        repr(full_image_fname))
+
+
+
+
+
+  def begin_image_block_transfer(self, image_file):
+    """
+    <Purpose>
+      Begins receiving, a block at a time, the image described by the given
+      ImageFile (see Primary.get_image_file_info()), or resumes receiving it
+      after an interruption. The blocks are then provided, in order, to
+      receive_image_block().
+
+      Blocks are written to a partial file in the 'unverified_targets'
+      subdirectory of the client directory, named for the image and its
+      expected hash. If that file remains from an earlier transfer of the
+      same image, the transfer resumes after the whole blocks already in it,
+      which are read once to bring the image's hashes up to date. As blocks
+      arrive, they are hashed and the length of the image so far is checked,
+      so the image never has to be read again to be validated. (The image is
+      received as an image stream: see begin_image_stream().)
+
+    <Arguments>
+      image_file
+        a dictionary conforming to uptane.formats.IMAGE_FILE_SCHEMA
+
+    <Exceptions>
+      uptane.Error
+        if the image's filename does not match a filepath in the list of
+        validated targets for this ECU (see validate_image()), or the number
+        of blocks described is inconsistent with the image's validated length
+
+      tuf.FormatError
+        if image_file is not correctly formatted
+
+    <Returns>
+      The number of the next block to request and provide to
+      receive_image_block(), or None if the image has no blocks (it is empty)
+      and has already been validated and placed in 'unverified_targets'.
+    """
+    uptane.formats.IMAGE_FILE_SCHEMA.check_match(image_file)
+
+    image_fname = image_file['filename']
+    block_size = image_file['block_size']
+    expected_length = self._get_validated_target_info_for_image(
+        image_fname)['fileinfo']['length']
+
+    if image_file['number_of_blocks'] != \
+        (expected_length + block_size - 1) // block_size:
+      raise uptane.Error('Primary describes image ' + repr(image_fname) +
+          ' as ' + repr(image_file['number_of_blocks']) + ' blocks of ' +
+          repr(block_size) + ' bytes, but its validated length is ' +
+          repr(expected_length) + ' bytes.')
+
+    blocks_kept = self.begin_image_stream(
+        image_fname, resume=True, alignment=block_size) // block_size
+
+    self.image_block_transfer = {
+        'filename': image_fname,
+        'block_size': block_size,
+        'number_of_blocks': image_file['number_of_blocks'],
+        'next_block_number': blocks_kept + 1}
+
+    if blocks_kept:
+      log.debug('Resuming transfer of image ' + repr(image_fname) + ' at '
+          'block ' + repr(blocks_kept + 1) + ' of ' +
+          repr(image_file['number_of_blocks']))
+
+    if image_file['number_of_blocks'] == 0:
+      self.finish_image_stream()
+      return None
+
+    return blocks_kept + 1
+
+
+
+
+
+  def receive_image_block(self, image_block):
+    """
+    <Purpose>
+      Writes the given ImageBlock (see Primary.get_image_block()) to the
+      partial image file of the transfer begun by begin_image_block_transfer(),
+      updating the image's hashes. Blocks must be provided in order.
+
+      Once the last block is received, the image is validated against the
+      validated target info for it, as validate_image() would, and moved into
+      the 'unverified_targets' subdirectory of the client directory under its
+      filename. If validation fails, the data received is discarded and the
+      transfer must begin again. (See receive_image_chunk() and
+      finish_image_stream().)
+
+    <Arguments>
+      image_block
+        a dictionary conforming to uptane.formats.IMAGE_BLOCK_SCHEMA
+
+    <Exceptions>
+      uptane.Error
+        if no transfer is in progress, or the block is not the next one
+        expected in it, or is not the size of a block (the transfer can
+        continue with the correct block)
+
+      tuf.DownloadLengthMismatchError
+        if the image is longer than, or (once complete) not the same length
+        as, its validated length
+
+      tuf.BadHashError
+        if the complete image does not have the expected hashes based on
+        validated target info
+
+      tuf.FormatError
+        if image_block is not correctly formatted
+
+    <Returns>
+      True if the image is complete and has been validated, else False.
+    """
+    uptane.formats.IMAGE_BLOCK_SCHEMA.check_match(image_block)
+
+    transfer = self.image_block_transfer
+
+    if transfer is None:
+      raise uptane.Error('Received an image block, but no image transfer is '
+          'in progress.')
+
+    if image_block['filename'] != transfer['filename'] or \
+        image_block['block_number'] != transfer['next_block_number']:
+      raise uptane.Error('Expected block ' +
+          repr(transfer['next_block_number']) + ' of image ' +
+          repr(transfer['filename']) + '; received block ' +
+          repr(image_block['block_number']) + ' of image ' +
+          repr(image_block['filename']))
+
+    block = image_block['block']
+    is_last_block = \
+        image_block['block_number'] == transfer['number_of_blocks']
+
+    if len(block) > transfer['block_size'] or \
+        (not is_last_block and len(block) != transfer['block_size']):
+      raise uptane.Error('Block ' + repr(image_block['block_number']) +
+          ' of image ' + repr(transfer['filename']) + ' is ' +
+          repr(len(block)) + ' bytes long; blocks are ' +
+          repr(transfer['block_size']) + ' bytes long.')
+
+    self.receive_image_chunk(block)
+    transfer['next_block_number'] += 1
+
+    if not is_last_block:
+      return False
+
+    self.finish_image_stream()
+    return True
+
+
+
+
+
+  def apply_image_delta(self, image_fname, base_fname, delta_fobj):
+    """
+    <Purpose>
+      Produces the given image by applying a delta (see uptane/delta.py) to
+      an image this Secondary already has, such as the one installed, rather
+      than receiving the image in full. The image produced is received as an
+      image stream (see begin_image_stream()), so it is validated against the
+      validated target info for the image as it is produced, exactly as the
+      full image would be, and the delta itself need not be trusted. A delta
+      that does not declare that it produces the image the validated target
+      info describes is rejected before anything is produced.
+
+      On success, the image is in the 'unverified_targets' subdirectory of the
+      client directory, fully validated.
+
+    <Arguments>
+      image_fname
+        the filename of the image to produce, as in validate_image()
+
+      base_fname
+        the full path of the image to apply the delta to
+
+      delta_fobj
+        a file object, opened for binary reading, from which to read the
+        delta, which is not held in memory
+
+    <Exceptions>
+      uptane.Error
+        if the delta is malformed, was not made for the given base image or
+        for the image with the given filename, or if the given filename does
+        not match a filepath in the list of validated targets for this ECU.
+        Nothing is left of the image.
+
+      tuf.DownloadLengthMismatchError
+        if the image produced does not have the expected length based on
+        validated target info
+
+      tuf.BadHashError
+        if the image produced does not have the expected hashes based on
+        validated target info
+
+      tuf.FormatError
+        if the arguments are not correctly formatted
+
+    <Returns>
+      None.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(base_fname)
+
+    target_info = self._get_validated_target_info_for_image(image_fname)
+
+    self.begin_image_stream(image_fname)
+
+    try:
+      uptane.delta.apply_delta(base_fname, delta_fobj, self.receive_image_chunk,
+          target_info['fileinfo'])
+    except uptane.Error:
+      if self.image_stream is not None:
+        self._abandon_image_stream()
+      raise
+
+    self.finish_image_stream()
+
+
+
+
+
+  def _get_image_hashers(self, target_info):
+    """
+    Returns a dictionary mapping each hash algorithm listed in the given
+    target info to a new hash object for it.
+    """
+    return dict((algorithm, hashlib.new(algorithm))
+        for algorithm in target_info['fileinfo']['hashes'])
+
+
+
+
+
+  def _check_image_length_and_hashes(
+      self, target_info, observed_length, hashers):
+    """
+    Raises tuf.DownloadLengthMismatchError or tuf.BadHashError unless the
+    given length and hash objects (see _get_image_hashers()) of an image match
+    the given target info.
+    """
+    fileinfo = target_info['fileinfo']
+
+    if observed_length != fileinfo['length']:
+      raise tuf.DownloadLengthMismatchError(
+          fileinfo['length'], observed_length)
+
+    for algorithm, hasher in hashers.items():
+      if hasher.hexdigest() != fileinfo['hashes'][algorithm]:
+        raise tuf.BadHashError(
+            fileinfo['hashes'][algorithm], hasher.hexdigest())
+
+
+
+
+
+  def _abandon_image_stream(self):
+    """
+    Discards the data received in the current image stream (and any block
+    transfer it belongs to), so that receipt of the same image begins again
+    from the start.
+    """
+    self.image_stream['fobj'].close()
+
+    if os.path.exists(self.image_stream['partial_fname']):
+      os.remove(self.image_stream['partial_fname'])
+
+    self.image_stream = None
+    self.image_block_transfer = None
+
+
+
+
+
+  def _get_validated_target_info_for_image(self, image_fname):
+    """
+    Returns the validated target info for the given image filename (see
+    validate_image()) from self.validated_targets_for_this_ecu, or raises
+    uptane.Error if there is none.
+    """
     # Get target info by looking up fname (filepath).
 
     relevant_targetinfo = None
@@ -717,23 +1394,4 @@ class Secondary(object):
           'for this is extremely small between two individually-atomic '
           'renames), or there has been a programming error....')
 
-
-    # Check file length against trusted target info.
-    with open(full_image_fname, 'rb') as fobj:
-      tuf.client.updater.hard_check_file_length(
-          fobj,
-          relevant_targetinfo['fileinfo']['length'])
-
-    # Check file hashes against trusted target info.
-    with open(full_image_fname, 'rb') as fobj:
-      tuf.client.updater.check_hashes(
-          fobj, # FIX
-          relevant_targetinfo['fileinfo']['hashes'],
-          reset_fpointer=True) # Important for multiple hashes
-
-
-    # If no error has been raised at this point, the image file is fully
-    # validated and we can return.
-    log.debug('Delivered target file has been fully validated: ' +
-        repr(full_image_fname))
-
+    return relevant_targetinfo
@@ -13,6 +13,10 @@ import os
 import shutil
 import copy
 import hashlib
+import binascii
+import sys # for exc_info, to re-raise refresh errors from other threads
+import threading
+import six
 
 # TODO: This import is not ideal at this level. Common should probably not
 # import anything from other Uptane modules. Consider putting the
@@ -524,6 +528,83 @@ def create_directory_structure_for_client(
 
 
 
+def refresh_repositories(updater, director_repo_name, concurrent=False):
+  """
+  <Purpose>
+    Refreshes the top-level metadata of every repository known to the given
+    TAP-4 updater (tuf.client.updater.Updater), Director first.
+
+    If concurrent is False, the repositories are refreshed one after another,
+    starting with the Director, and the first error raised stops the
+    process.
+
+    If concurrent is True, the other repositories (e.g. the Image Repository)
+    are refreshed in separate threads while the Director is refreshed in this
+    one. Each repository's metadata is validated independently of the others,
+    so this does not change what is trusted; it only saves waiting for each
+    repository's network round trips in turn. Errors are reported as if the
+    refreshes had happened in order: an error refreshing the Director is
+    raised in preference to any other, and otherwise the error from the first
+    failing repository (in the updater's order) is raised. Nothing is raised
+    until all refreshes have finished.
+
+  <Arguments>
+    updater
+      a tuf.client.updater.Updater (TAP-4 multi-repository updater)
+
+    director_repo_name
+      the name of the Director repository in the updater's pinned metadata
+
+    concurrent
+      whether or not to refresh repositories other than the Director
+      concurrently with it
+
+  <Exceptions>
+    Any exception raised by updater.refresh(), e.g. tuf.NoWorkingMirrorError
+    or tuf.ExpiredMetadataError.
+
+  <Returns>
+    None
+  """
+  tuf.formats.REPOSITORY_NAME_SCHEMA.check_match(director_repo_name)
+
+  other_repo_names = [repo_name for repo_name in updater.repositories
+      if repo_name != director_repo_name]
+
+  if not concurrent:
+    updater.refresh(repo_name=director_repo_name)
+    for repo_name in other_repo_names:
+      updater.refresh(repo_name=repo_name)
+    return
+
+  # Maps repository name to the exc_info of any error refreshing it.
+  errors = {}
+
+  def refresh(repo_name):
+    try:
+      updater.refresh(repo_name=repo_name)
+    except Exception:
+      errors[repo_name] = sys.exc_info()
+
+  threads = []
+  for repo_name in other_repo_names:
+    thread = threading.Thread(target=refresh, args=(repo_name,))
+    thread.start()
+    threads.append(thread)
+
+  refresh(director_repo_name)
+
+  for thread in threads:
+    thread.join()
+
+  for repo_name in [director_repo_name] + other_repo_names:
+    if repo_name in errors:
+      six.reraise(*errors[repo_name])
+
+
+
+
+
 def scrub_filename(fname, expected_containing_dir):
   """
   DO NOT ASSUME THAT THIS TEMPORARY FUNCTION IS SECURE.
@@ -551,3 +632,217 @@ def scrub_filename(fname, expected_containing_dir):
         'Filename was: ' + fname)
 
   return abs_fname
+
+
+
+
+
+def get_merkle_leaf_data(time_attestation,
+    metadata_format=tuf.conf.METADATA_FORMAT):
+  """
+  Returns the bytes that are hashed to produce the Merkle tree leaf for the
+  given time attestation (conforming to
+  uptane.formats.TIMESERVER_ATTESTATION_SCHEMA) in a batched time attestation:
+  the DER encoding of the attestation if metadata_format is 'der', else its
+  canonical JSON encoding.
+  """
+  uptane.formats.TIMESERVER_ATTESTATION_SCHEMA.check_match(time_attestation)
+
+  if metadata_format == 'json':
+    return tuf.formats.encode_canonical(time_attestation).encode('utf-8')
+
+  elif metadata_format == 'der':
+    return asn1_codec.convert_signed_metadata_to_der(
+        {'signed': time_attestation, 'signatures': []},
+        asn1_codec.DATATYPE_TIME_ATTESTATION, only_signed=True)
+
+  else: # pragma: no cover
+    raise uptane.Error('Unsupported metadata format: ' + repr(metadata_format) +
+        '; the supported formats are: "der" and "json".')
+
+
+
+
+
+def _merkle_leaf_hash(leaf_data):
+  # Leaves and interior nodes are hashed with different prefixes so that an
+  # interior node can never be passed off as a leaf (RFC 6962, section 2.1).
+  return hashlib.sha256(b'\x00' + leaf_data).digest()
+
+
+
+
+
+def _merkle_node_hash(left, right):
+  return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+
+
+
+def compute_merkle_tree(leaves_data):
+  """
+  <Purpose>
+    Builds a Merkle tree over the given leaves, returning its root and an
+    inclusion proof for each leaf.
+
+    An unpaired node at the end of a level is promoted to the next level
+    unchanged (rather than being paired with itself), as in RFC 6962.
+
+  <Arguments>
+    leaves_data
+      A non-empty list of byte strings, one per leaf (see
+      get_merkle_leaf_data).
+
+  <Returns>
+    A tuple (root, proofs), where root is the hex string of the root hash,
+    and proofs is a list with, for each leaf, a proof conforming to
+    uptane.formats.MERKLE_PROOF_SCHEMA.
+  """
+  if not leaves_data:
+    raise uptane.Error('Cannot build a Merkle tree with no leaves.')
+
+  level = [_merkle_leaf_hash(leaf_data) for leaf_data in leaves_data]
+  siblings = [[] for _ in leaves_data]
+
+  # Position of each leaf's ancestor in the current level.
+  positions = list(range(len(leaves_data)))
+
+  while len(level) > 1:
+
+    for leaf, position in enumerate(positions):
+      if position % 2 == 1:
+        siblings[leaf].append({'side': 'left',
+            'hash': binascii.hexlify(level[position - 1]).decode('utf-8')})
+      elif position + 1 < len(level):
+        siblings[leaf].append({'side': 'right',
+            'hash': binascii.hexlify(level[position + 1]).decode('utf-8')})
+      positions[leaf] = position // 2
+
+    next_level = []
+    for i in range(0, len(level) - 1, 2):
+      next_level.append(_merkle_node_hash(level[i], level[i + 1]))
+    if len(level) % 2 == 1:
+      next_level.append(level[-1])
+    level = next_level
+
+  proofs = [{'leaf_index': i, 'siblings': leaf_siblings}
+      for i, leaf_siblings in enumerate(siblings)]
+
+  return binascii.hexlify(level[0]).decode('utf-8'), proofs
+
+
+
+
+
+def verify_merkle_inclusion(leaf_data, proof, merkle_root):
+  """
+  Returns True if the given inclusion proof (conforming to
+  uptane.formats.MERKLE_PROOF_SCHEMA) shows that a leaf with the given data
+  is in the Merkle tree with the given root (a hex string), else False.
+  """
+  uptane.formats.MERKLE_PROOF_SCHEMA.check_match(proof)
+  tuf.formats.HASH_SCHEMA.check_match(merkle_root)
+
+  node = _merkle_leaf_hash(leaf_data)
+
+  for sibling in proof['siblings']:
+    sibling_hash = binascii.unhexlify(sibling['hash'])
+    if sibling['side'] == 'left':
+      node = _merkle_node_hash(sibling_hash, node)
+    else:
+      node = _merkle_node_hash(node, sibling_hash)
+
+  return binascii.hexlify(node).decode('utf-8') == merkle_root.lower()
+
+
+
+
+
+def verify_batched_time_attestation(
+    batched_attestation, timeserver_public_key,
+    metadata_format=tuf.conf.METADATA_FORMAT):
+  """
+  <Purpose>
+    Verifies a batched time attestation from the Timeserver: that the Merkle
+    root it contains is signed by the given Timeserver key, and that the
+    time attestation it contains is included in the tree with that root and
+    bears the same time.
+
+    Nonces are not checked here; the caller should check the nonces in
+    batched_attestation['attestation'] just as it would check those in the
+    'signed' portion of an ordinary time attestation.
+
+  <Arguments>
+    batched_attestation
+      A batched time attestation conforming to
+      uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA (that is,
+      already converted from DER if DER is in use).
+
+    timeserver_public_key
+      The key expected to have signed the Merkle root, conforming to
+      tuf.formats.ANYKEY_SCHEMA.
+
+    metadata_format (optional; default tuf.conf.METADATA_FORMAT)
+      'json' or 'der'. Determines the encoding of the signed root and leaves.
+
+  <Exceptions>
+    tuf.FormatError
+      if batched_attestation is not correctly formatted
+
+    tuf.BadSignatureError
+      if the Merkle root is not signed by timeserver_public_key
+
+    uptane.BadTimeAttestation
+      if the attestation is not included in the signed tree or its time does
+      not match the time in the signed root
+
+  <Returns>
+    The verified attestation, batched_attestation['attestation'], conforming
+    to uptane.formats.TIMESERVER_ATTESTATION_SCHEMA.
+  """
+  uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+      batched_attestation)
+  tuf.formats.ANYKEY_SCHEMA.check_match(timeserver_public_key)
+
+  # As for ordinary time attestations, assume there's only one signature.
+  if len(batched_attestation['signatures']) != 1:
+    raise tuf.BadSignatureError('Expected exactly one signature over the '
+        'batched time attestation; found ' +
+        repr(len(batched_attestation['signatures'])))
+
+  if not verify_signature_over_metadata(
+      timeserver_public_key,
+      batched_attestation['signatures'][0],
+      batched_attestation['signed'],
+      asn1_codec.DATATYPE_BATCHED_TIME_ATTESTATION,
+      metadata_format=metadata_format):
+    raise tuf.BadSignatureError('Timeserver returned an invalid signature '
+        'over a batched time attestation. Time is questionable, so not saved. '
+        'If you see this persistently, it is possible that there is a Man in '
+        'the Middle attack underway.')
+
+  attestation = batched_attestation['attestation']
+  signed_root = batched_attestation['signed']
+
+  if attestation['time'] != signed_root['time']:
+    raise uptane.BadTimeAttestation('Batched time attestation lists a time ('
+        + repr(attestation['time']) + ') that does not match the time in the '
+        'signed Merkle root (' + repr(signed_root['time']) + ').')
+
+  proof = batched_attestation['merkle_proof']
+  if proof['leaf_index'] >= signed_root['number_of_leaves'] or \
+      len(proof['siblings']) > signed_root['number_of_leaves']:
+    raise uptane.BadTimeAttestation('Batched time attestation contains a '
+        'Merkle proof inconsistent with the size of the signed tree.')
+
+  if not verify_merkle_inclusion(
+      get_merkle_leaf_data(attestation, metadata_format),
+      proof, signed_root['merkle_root']):
+    raise uptane.BadTimeAttestation('Batched time attestation is not included '
+        'in the Merkle tree signed by the Timeserver. This time is '
+        'questionable and will not be registered. If you see this '
+        'persistently, it is possible that there is a Man in the Middle '
+        'attack underway.')
+
+  return attestation
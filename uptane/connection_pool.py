@@ -0,0 +1,495 @@
+"""
+<Program Name>
+  uptane/connection_pool.py
+
+<Purpose>
+  Provides a pool of persistent ("keep-alive") HTTP connections, so that a
+  client making many requests of the same servers (e.g. a Primary fetching
+  metadata and images from the repositories, and calling the Director and
+  Timeserver over XML-RPC, every update cycle) does not pay for a new
+  connection (a TCP handshake, and slow start) for every one of them.
+
+  Connections are kept per server (scheme, host and port). A request takes an
+  idle connection to its server from the pool, or opens a new one if there
+  are none, and the connection is returned to the pool once the response has
+  been read in full. No more than max_idle_connections idle connections are
+  kept for each server (there may be more in use at once), and none that
+  have been idle for longer than max_idle_time seconds, since servers close
+  idle connections in their own time. A request that fails on a reused
+  connection before any response arrives (e.g. because the server has just
+  closed it) is sent again, on another connection.
+
+  A ConnectionPool can be used:
+    - by TUF, for its downloads of metadata and target files over HTTP (see
+      use_for_tuf_downloads(), called by a Primary given a pool), optionally
+      limiting how many TUF downloads are made from each server at once
+    - for XML-RPC, as the transport of a ServerProxy (see PooledTransport)
+    - directly, to fetch a URL (see ConnectionPool.urlopen())
+
+  Pooling changes nothing about what is trusted: everything fetched is
+  validated exactly as it would be if fetched on a new connection.
+
+<Classes>
+  ConnectionPool(max_idle_connections, max_idle_time, timeout)
+  PooledResponse
+  PooledTransport(pool)
+
+<Functions>
+  use_for_tuf_downloads(pool, max_downloads_per_server)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import tuf
+import tuf.formats
+import tuf.download
+
+import socket
+import threading
+import time
+
+from six.moves import http_client
+from six.moves import xmlrpc_client
+from six.moves.urllib.parse import urlsplit
+from six.moves.urllib.error import HTTPError
+
+# The number of idle connections kept for each server.
+DEFAULT_MAX_IDLE_CONNECTIONS = 4
+
+# The number of seconds for which an idle connection is kept. This should be
+# less than the time for which the servers used keep idle connections open
+# (e.g. demo.file_server.KEEP_ALIVE_TIMEOUT).
+DEFAULT_MAX_IDLE_TIME = 10
+
+# The number of seconds for which a connection may wait to send or receive
+# data before the request fails.
+DEFAULT_TIMEOUT = 60
+
+# An error response no longer than this is read, so that its connection can
+# be reused; a longer one is abandoned, with its connection.
+_MAX_ERROR_BODY_LENGTH = 64 * 1024
+
+# The tuf.download._open_connection() that use_for_tuf_downloads() replaces.
+_tuf_open_connection = None
+
+
+
+class ConnectionPool(object):
+  """
+  <Purpose>
+    Keeps idle HTTP (or HTTPS) connections, per server, for reuse by later
+    requests. Safe to use from several threads.
+
+  <Arguments>
+    max_idle_connections (optional)
+      the largest number of idle connections to keep for each server; 0 keeps
+      none, so that every request uses a new connection
+
+    max_idle_time (optional)
+      the number of seconds for which to keep an idle connection
+
+    timeout (optional)
+      the socket timeout, in seconds, for the pool's connections
+
+    observer (optional)
+      a function called with the URL and outcome of each urlopen() request:
+      the number of seconds until the response began, or None if the request
+      failed or the server reported an error (a 5xx status), e.g.
+      uptane.mirror_scores.MirrorScores.record
+
+  <Exceptions>
+    tuf.FormatError, if an argument is not an integer of at least 0.
+  """
+  def __init__(self, max_idle_connections=DEFAULT_MAX_IDLE_CONNECTIONS,
+      max_idle_time=DEFAULT_MAX_IDLE_TIME, timeout=DEFAULT_TIMEOUT,
+      observer=None):
+
+    tuf.formats.LENGTH_SCHEMA.check_match(max_idle_connections)
+    tuf.formats.LENGTH_SCHEMA.check_match(max_idle_time)
+    tuf.formats.LENGTH_SCHEMA.check_match(timeout)
+
+    self.max_idle_connections = max_idle_connections
+    self.max_idle_time = max_idle_time
+    self.timeout = timeout
+    self.observer = observer
+
+    # For each server (scheme, netloc), a list of (connection, time it became
+    # idle), most recently idle last.
+    self._idle = {}
+    self._lock = threading.Lock()
+
+
+
+  def urlopen(self, url, headers=None):
+    """
+    <Purpose>
+      Makes a GET request for the given http:// or https:// URL on a pooled
+      connection, and returns the response, a file-like PooledResponse, which
+      must be closed once read (returning its connection to the pool if it
+      was read in full).
+
+    <Arguments>
+      url
+        the URL to fetch
+
+      headers (optional)
+        a dictionary of additional request headers
+
+    <Exceptions>
+      ValueError, if the URL is not an http:// or https:// URL.
+
+      six.moves.urllib.error.HTTPError, if the response status is not 200.
+
+      socket.error or six.moves.http_client.HTTPException, if the request
+      fails.
+
+    <Returns>
+      A PooledResponse.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+      raise ValueError('Not an HTTP URL: ' + repr(url))
+
+    path = parts.path or '/'
+    if parts.query:
+      path += '?' + parts.query
+
+    request_headers = {'Accept-Encoding': 'identity'}
+    request_headers.update(headers or {})
+
+    start = time.time()
+    try:
+      response = self.request(
+          parts.scheme, parts.netloc, 'GET', path, None, request_headers)
+    except Exception:
+      if self.observer is not None:
+        self.observer(url, None)
+      raise
+
+    if self.observer is not None:
+      self.observer(url, None if response.status >= 500 else
+          time.time() - start)
+
+    if response.status != 200:
+      response.discard()
+      raise HTTPError(
+          url, response.status, response.reason, response.msg, None)
+
+    response.url = url
+    return response
+
+
+
+  def request(self, scheme, netloc, method, path, body=None, headers=None):
+    """
+    <Purpose>
+      Sends an HTTP request to the server at netloc ('host:port') on a pooled
+      connection and returns the response (of any status), a PooledResponse,
+      which must be closed once read. If the request fails on a reused
+      connection before any response arrives, it is sent again, on another
+      connection (and finally on a new one): only use this for requests that
+      may safely be repeated.
+
+    <Exceptions>
+      socket.error or six.moves.http_client.HTTPException, if the request
+      fails.
+
+    <Returns>
+      A PooledResponse.
+    """
+    while True:
+      connection, reused = self._get_connection(scheme, netloc)
+      try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+
+      except socket.timeout:
+        connection.close()
+        raise
+
+      except (socket.error, http_client.HTTPException):
+        connection.close()
+        if reused:
+          continue
+        raise
+
+      return PooledResponse(self, (scheme, netloc), connection, response)
+
+
+
+  def close(self):
+    """Closes all idle connections. Connections in use are not affected."""
+    with self._lock:
+      idle = self._idle
+      self._idle = {}
+
+    for connections in idle.values():
+      for connection, idle_since in connections:
+        connection.close()
+
+
+
+  def _get_connection(self, scheme, netloc):
+    """
+    Returns a tuple (connection, reused): an idle connection to the given
+    server, if there is one, or else a new one.
+    """
+    now = time.time()
+    stale = []
+    connection = None
+
+    with self._lock:
+      idle = self._idle.get((scheme, netloc), [])
+      while idle and connection is None:
+        candidate, idle_since = idle.pop()
+        if now - idle_since <= self.max_idle_time:
+          connection = candidate
+        else:
+          stale.append(candidate)
+
+    for candidate in stale:
+      candidate.close()
+
+    if connection is not None:
+      return connection, True
+
+    if scheme == 'https':
+      return http_client.HTTPSConnection(netloc, timeout=self.timeout), False
+    return http_client.HTTPConnection(netloc, timeout=self.timeout), False
+
+
+
+  def _release_connection(self, server, connection):
+    """Returns a connection, no longer in use, to the pool, or closes it."""
+    with self._lock:
+      idle = self._idle.setdefault(server, [])
+      if len(idle) < self.max_idle_connections:
+        idle.append((connection, time.time()))
+        return
+
+    connection.close()
+
+
+
+
+
+class PooledResponse(object):
+  """
+  A response received on a connection from a ConnectionPool: a file-like
+  object, with the status, reason, headers (msg) and methods (e.g.
+  getheader()) of the underlying six.moves.http_client.HTTPResponse, and
+  info() and getcode(), as for a response from urlopen(). Closing it returns
+  its connection to the pool if the response has been read in full, and
+  otherwise closes the connection, and then calls on_close, if set, once.
+  """
+  def __init__(self, pool, server, connection, response):
+    self._pool = pool
+    self._server = server
+    self._connection = connection
+    self._response = response
+    self.url = None
+    self.on_close = None
+
+
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+
+
+  def read(self, amount=None):
+    if amount is None:
+      return self._response.read()
+    return self._response.read(amount)
+
+
+
+  def info(self):
+    return self._response.msg
+
+
+
+  def getcode(self):
+    return self._response.status
+
+
+
+  def geturl(self):
+    return self.url
+
+
+
+  def discard(self):
+    """
+    Reads and discards the rest of a short response (e.g. an error page) so
+    that its connection can be reused, and closes the response.
+    """
+    length = self._response.length
+    if length is not None and length <= _MAX_ERROR_BODY_LENGTH:
+      try:
+        self._response.read()
+      except (socket.error, http_client.HTTPException):
+        pass
+    self.close()
+
+
+
+  def close(self):
+    connection = self._connection
+    if connection is None:
+      return
+    self._connection = None
+
+    # A response read in full has released its hold on the connection, which
+    # can be used again unless the server said it will close it.
+    if self._response.isclosed() and not self._response.will_close:
+      self._pool._release_connection(self._server, connection)
+
+    else:
+      self._response.close()
+      connection.close()
+
+    if self.on_close is not None:
+      self.on_close()
+
+
+
+  def __enter__(self):
+    return self
+
+
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+
+
+
+class PooledTransport(xmlrpc_client.Transport):
+  """
+  An XML-RPC transport (for six.moves.xmlrpc_client.ServerProxy) that sends
+  each call on a connection from the given ConnectionPool. Unlike the default
+  transport, which keeps a single connection, it may be used by several
+  threads at once (e.g. for a long poll and other calls to the same server).
+
+  The server must keep connections alive (i.e. speak HTTP/1.1, as
+  demo.rpc_server.KeepAliveRequestHandler does) for them to be reused.
+  A call that fails on a reused connection before any response arrives is
+  sent again, on another connection, as the default transport does.
+
+  Use:
+    proxy = xmlrpc_client.ServerProxy(url, transport=PooledTransport(pool))
+  """
+  scheme = 'http'
+
+  def __init__(self, pool, use_datetime=False):
+    xmlrpc_client.Transport.__init__(self, use_datetime)
+    self.pool = pool
+
+
+
+  def request(self, host, handler, request_body, verbose=False):
+    if not isinstance(request_body, bytes):
+      request_body = request_body.encode('utf-8')
+
+    response = self.pool.request(self.scheme, host, 'POST', handler,
+        request_body, {'Content-Type': 'text/xml',
+        'User-Agent': self.user_agent})
+
+    try:
+      if response.status != 200:
+        response.discard()
+        raise xmlrpc_client.ProtocolError(host + handler, response.status,
+            response.reason, response.msg)
+
+      self.verbose = verbose
+      # Read from the underlying response, which parse_response() expects.
+      return self.parse_response(response._response)
+
+    finally:
+      response.close()
+
+
+
+
+
+def use_for_tuf_downloads(pool, max_downloads_per_server=None):
+  """
+  <Purpose>
+    Has TUF (tuf.download) fetch http:// URLs (metadata and target files from
+    repository mirrors) through the given ConnectionPool, or, if pool is
+    None, on a new connection each, as before. Other URLs (e.g. https://, for
+    which TUF uses its own verified connections, or file://) are unaffected.
+
+    If max_downloads_per_server is given, no more than that many of these
+    downloads are made from any one server (scheme, host and port) at once;
+    others wait for one to finish. The limit applies where each connection
+    is used, so it does not matter which of a repository's mirrors TUF tries,
+    nor how many repositories a server hosts.
+
+    This applies to all TUF downloads in this process. TUF has no option for
+    the connections it uses, so this is done by replacing the function that
+    opens them, tuf.download._open_connection(url), which must return a
+    file-like response; it is the only place TUF is changed so. A Primary
+    given a pool (see uptane.clients.primary.Primary) calls this itself.
+
+  <Arguments>
+    pool
+      a ConnectionPool, or None
+
+    max_downloads_per_server (optional)
+      the largest number of downloads to make from each server at once, or
+      None for no limit
+
+  <Exceptions>
+    tuf.FormatError, if max_downloads_per_server is not a positive integer.
+
+  <Returns>
+    None
+  """
+  global _tuf_open_connection
+
+  if max_downloads_per_server is not None:
+    tuf.formats.LENGTH_SCHEMA.check_match(max_downloads_per_server)
+    if max_downloads_per_server < 1:
+      raise tuf.FormatError('At least one download per server must be '
+          'allowed; got ' + repr(max_downloads_per_server))
+
+  if _tuf_open_connection is None:
+    _tuf_open_connection = tuf.download._open_connection
+
+  if pool is None:
+    tuf.download._open_connection = _tuf_open_connection
+    return
+
+  # A semaphore for each server (scheme, netloc), limiting the downloads made
+  # from it at once.
+  download_slots = {}
+  download_slots_lock = threading.Lock()
+
+  def open_connection(url):
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+      return _tuf_open_connection(url)
+
+    if max_downloads_per_server is None:
+      return pool.urlopen(url)
+
+    with download_slots_lock:
+      slot = download_slots.setdefault((parts.scheme, parts.netloc),
+          threading.BoundedSemaphore(max_downloads_per_server))
+
+    # The slot is held until TUF closes the response.
+    slot.acquire()
+    try:
+      response = pool.urlopen(url)
+    except Exception:
+      slot.release()
+      raise
+
+    response.on_close = slot.release
+    return response
+
+  tuf.download._open_connection = open_connection
@@ -0,0 +1,354 @@
+"""
+<Program Name>
+  uptane/delta.py
+
+<Purpose>
+  Provides a simple binary delta format, allowing an image to be delivered to
+  an ECU as the differences between it and the image the ECU already has
+  installed, rather than in full.
+
+  A delta consists of:
+    - the 8 bytes in DELTA_MAGIC
+    - the length and SHA-256 digest of the base image (the image installed),
+      as an 8-byte big-endian unsigned integer and 32 bytes
+    - the length and SHA-256 digest of the image the delta produces, likewise
+    - a series of instructions, each of which is either:
+        - COPY: b'C', then an offset and a length in the base image (each an
+          8-byte big-endian unsigned integer), to be copied to the output
+        - ADD: b'A', then a length (a 4-byte big-endian unsigned integer) and
+          that many bytes of data, to be written to the output
+
+  Deltas are not signed and are not listed in TUF metadata: they may come from
+  anywhere. A delta can only be an efficient way to arrive at an image, which
+  must then be fully validated against its target info, as an image delivered
+  in full would be.
+
+<Functions>
+  create_delta(base_data, target_data, block_size)
+  read_delta_header(delta_fobj)
+  apply_delta(base_fname, delta_fobj, write, target_fileinfo)
+  get_delta_fname(base_sha256, target_sha256)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import uptane.formats
+import tuf
+import tuf.formats
+import tuf.schema as SCHEMA
+
+import struct
+import hashlib
+import binascii
+
+DELTA_MAGIC = b'UPTDLT01'
+
+# The name of the directory, under a repository's hosted directory, from
+# which deltas between the repository's images are available, and under a
+# Primary's client directory, in which deltas fetched are kept.
+DELTAS_DIRNAME = 'deltas'
+
+# The length of the runs of bytes matched between the base image and the
+# target image when creating a delta. Shorter runs find more matches in
+# images that differ in many small ways, at the cost of speed.
+DEFAULT_DELTA_BLOCK_SIZE = 32
+
+_IMAGE_INFO_FORMAT = '>Q32s'
+_COPY_FORMAT = '>QQ'
+_ADD_FORMAT = '>I'
+_COPY = b'C'
+_ADD = b'A'
+
+# The largest amount of data in a single ADD instruction.
+_MAX_ADD_LENGTH = 1024 * 1024
+
+# How much of an image to read at once.
+_CHUNK_SIZE = 64 * 1024
+
+
+
+def create_delta(
+    base_data, target_data, block_size=DEFAULT_DELTA_BLOCK_SIZE):
+  """
+  <Purpose>
+    Returns a delta (bytes) that produces target_data from base_data.
+
+    Every block_size-byte block of the base image is indexed, and the target
+    image is scanned for runs of bytes matching any of those blocks. Each
+    match is extended as far as it goes in both directions and becomes a COPY
+    instruction; everything between matches becomes an ADD instruction.
+
+  <Arguments>
+    base_data
+      the contents (bytes) of the image the delta is to be applied to
+
+    target_data
+      the contents (bytes) of the image the delta is to produce
+
+    block_size (optional)
+      the length of the runs of bytes to look for in both images
+
+  <Exceptions>
+    tuf.FormatError
+      if the arguments are not correctly formatted
+  """
+  SCHEMA.AnyBytes().check_match(base_data)
+  SCHEMA.AnyBytes().check_match(target_data)
+  uptane.formats.IMAGE_BLOCK_SIZE_SCHEMA.check_match(block_size)
+
+  parts = [
+      DELTA_MAGIC,
+      struct.pack(_IMAGE_INFO_FORMAT,
+          len(base_data), hashlib.sha256(base_data).digest()),
+      struct.pack(_IMAGE_INFO_FORMAT,
+          len(target_data), hashlib.sha256(target_data).digest())]
+
+  # The offset of the first instance of each block of the base image.
+  index = {}
+  for offset in range(len(base_data) - block_size, -1, -block_size):
+    index[base_data[offset:offset + block_size]] = offset
+
+  unmatched_start = 0
+  position = 0
+
+  while position + block_size <= len(target_data):
+    base_offset = index.get(target_data[position:position + block_size])
+
+    if base_offset is None:
+      position += 1
+      continue
+
+    length = block_size + _common_prefix_length(
+        base_data, base_offset + block_size,
+        target_data, position + block_size)
+
+    # Extend the match backwards over the unmatched data before it.
+    while position > unmatched_start and base_offset > 0 and \
+        base_data[base_offset - 1] == target_data[position - 1]:
+      base_offset -= 1
+      position -= 1
+      length += 1
+
+    _add_data(parts, target_data[unmatched_start:position])
+    parts.append(_COPY + struct.pack(_COPY_FORMAT, base_offset, length))
+
+    position += length
+    unmatched_start = position
+
+  _add_data(parts, target_data[unmatched_start:])
+
+  return b''.join(parts)
+
+
+
+
+
+def read_delta_header(delta_fobj):
+  """
+  <Purpose>
+    Reads the header of the delta read from the given file object, leaving
+    the file object at the first instruction.
+
+  <Arguments>
+    delta_fobj
+      a file object, opened for binary reading, from which to read the delta
+
+  <Exceptions>
+    uptane.Error
+      if the data is not a delta, or is truncated
+
+  <Returns>
+    A tuple (base_length, base_sha256, target_length, target_sha256) of the
+    length and SHA-256 hash (hex digest) of the image the delta is to be
+    applied to and of the image it declares it produces.
+  """
+  if _read_exactly(delta_fobj, len(DELTA_MAGIC)) != DELTA_MAGIC:
+    raise uptane.Error('Data is not a delta.')
+
+  base_length, base_digest = _read_struct(delta_fobj, _IMAGE_INFO_FORMAT)
+  target_length, target_digest = _read_struct(delta_fobj, _IMAGE_INFO_FORMAT)
+
+  return (base_length, binascii.hexlify(base_digest).decode('ascii'),
+      target_length, binascii.hexlify(target_digest).decode('ascii'))
+
+
+
+
+
+def apply_delta(base_fname, delta_fobj, write, target_fileinfo=None):
+  """
+  <Purpose>
+    Applies the delta read from the given file object to the base image in
+    the given file, passing the image produced, a chunk at a time, to the
+    given function, so that neither it nor the delta need be held in memory.
+
+    Before anything is produced, the base image is checked against the length
+    and hash the delta expects, and the image the delta declares it produces
+    against target_fileinfo, if given. As the delta is applied, it is checked
+    for consistency: copies must lie within the base image, and the output
+    must be the length the delta declares. The output is not otherwise
+    checked; it must be validated against trusted target info (as
+    uptane.clients.secondary.Secondary::apply_image_delta() does).
+
+  <Arguments>
+    base_fname
+      the filename of the image the delta is to be applied to
+
+    delta_fobj
+      a file object, opened for binary reading, from which to read the delta
+
+    write
+      a function to call with each chunk (bytes) of the image produced
+
+    target_fileinfo (optional)
+      the fileinfo (length and hashes) of the image the delta should
+      produce, as in target info
+
+  <Exceptions>
+    uptane.Error
+      if the delta is malformed, was not made for the given base image, or
+      does not declare that it produces the image target_fileinfo describes
+
+    tuf.FormatError
+      if the arguments are not correctly formatted
+  """
+  tuf.formats.PATH_SCHEMA.check_match(base_fname)
+  if target_fileinfo is not None:
+    tuf.formats.FILEINFO_SCHEMA.check_match(target_fileinfo)
+
+  base_length, base_sha256, target_length, target_sha256 = \
+      read_delta_header(delta_fobj)
+
+  if target_fileinfo is not None and (
+      target_length != target_fileinfo['length'] or
+      target_fileinfo['hashes'].get('sha256', target_sha256) != target_sha256):
+    raise uptane.Error('Delta does not produce the expected image.')
+
+  with open(base_fname, 'rb') as base_fobj:
+    base_hash = hashlib.sha256()
+    observed_base_length = 0
+    for chunk in iter(lambda: base_fobj.read(_CHUNK_SIZE), b''):
+      base_hash.update(chunk)
+      observed_base_length += len(chunk)
+
+    if observed_base_length != base_length or \
+        base_hash.hexdigest() != base_sha256:
+      raise uptane.Error('Delta was not made for the base image ' +
+          repr(base_fname))
+
+    output_length = 0
+
+    while True:
+      instruction = delta_fobj.read(1)
+
+      if not instruction:
+        break
+
+      elif instruction == _COPY:
+        offset, length = _read_struct(delta_fobj, _COPY_FORMAT)
+        if offset + length > base_length:
+          raise uptane.Error('Delta copies data from beyond the end of the '
+              'base image.')
+        _check_output_length(output_length + length, target_length)
+
+        base_fobj.seek(offset)
+        remaining = length
+        while remaining:
+          chunk = base_fobj.read(min(_CHUNK_SIZE, remaining))
+          remaining -= len(chunk)
+          write(chunk)
+
+      elif instruction == _ADD:
+        length = _read_struct(delta_fobj, _ADD_FORMAT)[0]
+        _check_output_length(output_length + length, target_length)
+
+        # The length is not trusted, so the data is read a chunk at a time.
+        remaining = length
+        while remaining:
+          chunk = _read_exactly(delta_fobj, min(_CHUNK_SIZE, remaining))
+          remaining -= len(chunk)
+          write(chunk)
+
+      else:
+        raise uptane.Error('Unrecognized instruction in delta: ' +
+            repr(instruction))
+
+      output_length += length
+
+  if output_length != target_length:
+    raise uptane.Error('Delta produced ' + repr(output_length) + ' bytes; '
+        'it declares ' + repr(target_length) + '.')
+
+
+
+
+
+def get_delta_fname(base_sha256, target_sha256):
+  """
+  Returns the filename under which the delta from the image with the first
+  given SHA-256 hash (hex digest) to the image with the second is kept.
+  """
+  tuf.formats.HASH_SCHEMA.check_match(base_sha256)
+  tuf.formats.HASH_SCHEMA.check_match(target_sha256)
+
+  return base_sha256 + '-' + target_sha256 + '.delta'
+
+
+
+
+
+def _common_prefix_length(data1, offset1, data2, offset2):
+  """
+  Returns the number of bytes that data1 and data2 have in common, starting at
+  the given offsets in each.
+  """
+  limit = min(len(data1) - offset1, len(data2) - offset2)
+  length = 0
+
+  # Compare in large steps while the data matches, then byte by byte.
+  step = 4096
+  while step:
+    while length + step <= limit and \
+        data1[offset1 + length:offset1 + length + step] == \
+        data2[offset2 + length:offset2 + length + step]:
+      length += step
+    step //= 8
+
+  return length
+
+
+
+
+
+def _add_data(parts, data):
+  for start in range(0, len(data), _MAX_ADD_LENGTH):
+    chunk = data[start:start + _MAX_ADD_LENGTH]
+    parts.append(_ADD + struct.pack(_ADD_FORMAT, len(chunk)) + chunk)
+
+
+
+
+
+def _check_output_length(output_length, target_length):
+  if output_length > target_length:
+    raise uptane.Error('Delta produces more than the ' + repr(target_length) +
+        ' bytes it declares.')
+
+
+
+
+
+def _read_exactly(fobj, length):
+  data = fobj.read(length)
+  if len(data) != length:
+    raise uptane.Error('Delta is truncated.')
+  return data
+
+
+
+
+
+def _read_struct(fobj, struct_format):
+  return struct.unpack(
+      struct_format, _read_exactly(fobj, struct.calcsize(struct_format)))
@@ -30,6 +30,7 @@ logger = logging.getLogger('uptane.asn1_codec')
 DATATYPE_TIME_ATTESTATION = 'type__time_attestation'
 DATATYPE_ECU_MANIFEST = 'type__ecu_manifest'
 DATATYPE_VEHICLE_MANIFEST = 'type__vehicle_manifest'
+DATATYPE_BATCHED_TIME_ATTESTATION = 'type__batched_time_attestation'
 
 try:
   # pyasn1 modules
@@ -41,14 +42,18 @@ try:
   import uptane.encoding.timeserver_asn1_coder as timeserver_asn1_coder
   import uptane.encoding.ecu_manifest_asn1_coder as ecu_manifest_asn1_coder
   import uptane.encoding.vehicle_manifest_asn1_coder as vehicle_manifest_asn1_coder
+  import uptane.encoding.batched_timeserver_asn1_coder as \
+      batched_timeserver_asn1_coder
   import uptane.encoding.asn1_definitions as asn1_spec
+  import uptane.encoding.der_splice as der_splice
 
   # This maps metadata type to the module that lays out the
   # ASN.1 format for that type.
   SUPPORTED_ASN1_METADATA_MODULES = {
       DATATYPE_TIME_ATTESTATION: timeserver_asn1_coder,
       DATATYPE_ECU_MANIFEST: ecu_manifest_asn1_coder,
-      DATATYPE_VEHICLE_MANIFEST: vehicle_manifest_asn1_coder}
+      DATATYPE_VEHICLE_MANIFEST: vehicle_manifest_asn1_coder,
+      DATATYPE_BATCHED_TIME_ATTESTATION: batched_timeserver_asn1_coder}
 
 
 # This warning is provided in order to be helpful; behavior is not prescribed
@@ -167,6 +172,8 @@ def convert_signed_der_to_dersigned_json(der_data, datatype):
     exemplar_object = asn1_spec.ECUVersionManifest()
   elif datatype == DATATYPE_VEHICLE_MANIFEST:
     exemplar_object = asn1_spec.VehicleVersionManifest()
+  elif datatype == DATATYPE_BATCHED_TIME_ATTESTATION:
+    exemplar_object = asn1_spec.BatchedTokensAndTimestampSignable()
 
   # TODO: Determine if there are any other error types to add to the except
   # clause below to cover whatever errors we expect pyasn1 to raise when trying
@@ -219,7 +226,45 @@ def convert_signed_der_to_dersigned_json(der_data, datatype):
   asn_signatures = asn_metadata[2]
   json_signatures = convert_signatures_to_json(asn_signatures)
 
-  return {'signatures': json_signatures, 'signed': json_signed}
+  json_metadata = {'signatures': json_signatures, 'signed': json_signed}
+
+  # Some datatypes (e.g. batched time attestations) carry additional data
+  # outside of the signed portion and signatures. Their modules provide
+  # get_json_unsigned to extract it.
+  if hasattr(relevant_asn_module, 'get_json_unsigned'):
+    json_metadata.update(relevant_asn_module.get_json_unsigned(asn_metadata))
+
+  return json_metadata
+
+
+
+
+
+def convert_signed_der_time_attestation_to_dersigned_json(der_data):
+  """
+  Same as convert_signed_der_to_dersigned_json, for a time attestation from
+  the Timeserver that may be either an ordinary time attestation
+  (DATATYPE_TIME_ATTESTATION) or a batched time attestation
+  (DATATYPE_BATCHED_TIME_ATTESTATION). The two ASN.1 structures are not
+  compatible, so der_data is decoded as the former and, failing that, as the
+  latter. A batched time attestation can be recognized in the result by the
+  presence of key 'merkle_proof'.
+
+  <Exceptions>
+    As for convert_signed_der_to_dersigned_json. If der_data can be decoded as
+    neither type, the error from decoding it as an ordinary time attestation
+    is raised.
+  """
+  try:
+    return convert_signed_der_to_dersigned_json(
+        der_data, DATATYPE_TIME_ATTESTATION)
+
+  except uptane.FailedToDecodeASN1DER as e:
+    try:
+      return convert_signed_der_to_dersigned_json(
+          der_data, DATATYPE_BATCHED_TIME_ATTESTATION)
+    except uptane.FailedToDecodeASN1DER:
+      raise e
 
 
 
@@ -399,10 +444,17 @@ def convert_signed_metadata_to_der(signed_metadata, datatype,
     metadata = asn1_spec.ECUVersionManifest()
   elif datatype == DATATYPE_VEHICLE_MANIFEST:
     metadata = asn1_spec.VehicleVersionManifest()
+  elif datatype == DATATYPE_BATCHED_TIME_ATTESTATION:
+    metadata = asn1_spec.BatchedTokensAndTimestampSignable()
   metadata['signed'] = asn_signed #considering using der_signed instead - requires changes
   metadata['signatures'] = asn_signatures_list # TODO: Support multiple sigs, or integrate with TUF.
   metadata['numberOfSignatures'] = len(asn_signatures_list)
 
+  # Populate any data carried outside of the signed portion and signatures.
+  # See get_json_unsigned in convert_signed_der_to_dersigned_json.
+  if hasattr(relevant_asn_module, 'get_asn_unsigned'):
+    relevant_asn_module.get_asn_unsigned(signed_metadata, metadata)
+
   # Encode our new (py)ASN.1 object as DER (Distinguished Encoding Rules).
   return p_der_encoder.encode(metadata)
 
@@ -410,6 +462,75 @@ def convert_signed_metadata_to_der(signed_metadata, datatype,
 
 
 
+def make_signed_der_vehicle_manifest(
+    vin, primary_ecu_serial, der_ecu_manifests, private_key):
+  """
+  Produces a signed, DER-encoded Vehicle Manifest listing the given ECU
+  Manifests, which are already DER-encoded, as received from Secondaries.
+
+  The result is the same as that of convert_signed_metadata_to_der() with
+  resign=True and DATATYPE_VEHICLE_MANIFEST, given the same ECU Manifests as
+  Python dictionaries, but the ECU Manifests are never decoded or encoded
+  again: their DER is spliced into the Vehicle Manifest as it is, so that
+  producing a Vehicle Manifest costs little more than encoding its own few
+  fields and signing it.
+
+  <Arguments>
+    vin
+      the VIN of the vehicle, conforming to uptane.formats.VIN_SCHEMA
+
+    primary_ecu_serial
+      the Primary's ECU Serial, conforming to uptane.formats.ECU_SERIAL_SCHEMA
+
+    der_ecu_manifests
+      a list of DER-encoded signed ECU Manifests (each conforming to
+      uptane.formats.DER_DATA_SCHEMA), in the order they are to be listed
+
+    private_key
+      the key with which to sign the Vehicle Manifest, conforming to
+      tuf.formats.ANYKEY_SCHEMA
+
+  <Returns>
+    The DER encoding of the signed Vehicle Manifest.
+
+  <Exceptions>
+    tuf.FormatError
+      if the arguments are not correctly formatted
+
+    uptane.FailedToEncodeASN1DER
+      if the Vehicle Manifest cannot be encoded
+  """
+  uptane.formats.VIN_SCHEMA.check_match(vin)
+  uptane.formats.ECU_SERIAL_SCHEMA.check_match(primary_ecu_serial)
+  for der_ecu_manifest in der_ecu_manifests:
+    uptane.formats.DER_DATA_SCHEMA.check_match(der_ecu_manifest)
+  tuf.formats.ANYKEY_SCHEMA.check_match(private_key)
+
+  der_signed = \
+      vehicle_manifest_asn1_coder.get_der_signed_from_der_ecu_manifests(
+      vin, primary_ecu_serial, der_ecu_manifests)
+
+  # As in convert_signed_metadata_to_der(), sign a hash of the DER encoding
+  # of the signed portion.
+  hash_of_der = hashlib.sha256(der_signed).digest()
+  asn_signatures_list = convert_signatures_to_asn(
+      [tuf.keys.create_signature(private_key, hash_of_der)])
+
+  try:
+    der_signatures = p_der_encoder.encode(
+        asn1_spec.Length(len(asn_signatures_list))) + \
+        p_der_encoder.encode(asn_signatures_list)
+  except pyasn1.error.PyAsn1Error as e:
+    raise uptane.FailedToEncodeASN1DER('Unable to encode the signatures on '
+        'the Vehicle Manifest. The pyasn1-raised error follows: ' + repr(e))
+
+  return der_splice.encode_tlv(
+      der_splice.TAG_SEQUENCE, der_signed + der_signatures)
+
+
+
+
+
 def convert_signatures_to_json(asn_signatures):
   """
   Given an object compliant with uptane.encoding.asn1_definitions.Signatures()
@@ -158,6 +158,69 @@ TokensAndTimestampSignable.componentType = namedtype.NamedTypes(
 )
 
 
+class MerkleTimeRoot(univ.Sequence):
+    pass
+
+
+MerkleTimeRoot.componentType = namedtype.NamedTypes(
+    namedtype.NamedType('timestamp', UTCDateTime()),
+    namedtype.NamedType('numberOfLeaves', Positive()),
+    namedtype.NamedType('rootHash', OctetString())
+)
+
+
+class MerkleSide(univ.Enumerated):
+    pass
+
+
+MerkleSide.namedValues = namedval.NamedValues(
+    ('left', 0),
+    ('right', 1)
+)
+
+
+class MerkleSibling(univ.Sequence):
+    pass
+
+
+MerkleSibling.componentType = namedtype.NamedTypes(
+    namedtype.NamedType('side', MerkleSide()),
+    namedtype.NamedType('hash', OctetString())
+)
+
+
+class MerkleSiblings(univ.SequenceOf):
+    pass
+
+
+MerkleSiblings.componentType = MerkleSibling()
+MerkleSiblings.subtypeSpec=constraint.ValueSizeConstraint(1, 64)
+
+
+class MerkleProof(univ.Sequence):
+    pass
+
+
+MerkleProof.componentType = namedtype.NamedTypes(
+    namedtype.NamedType('leafIndex', Natural()),
+    namedtype.NamedType('numberOfSiblings', Natural()),
+    namedtype.OptionalNamedType('siblings', MerkleSiblings())
+)
+
+
+class BatchedTokensAndTimestampSignable(univ.Sequence):
+    pass
+
+
+BatchedTokensAndTimestampSignable.componentType = namedtype.NamedTypes(
+    namedtype.NamedType('signed', MerkleTimeRoot()),
+    namedtype.NamedType('numberOfSignatures', Length()),
+    namedtype.NamedType('signatures', Signatures()),
+    namedtype.NamedType('tokensAndTimestamp', TokensAndTimestamp()),
+    namedtype.NamedType('proof', MerkleProof())
+)
+
+
 class EncryptedSymmetricKeyType(univ.Enumerated):
     pass
 
@@ -308,7 +371,8 @@ class ImageRequest(univ.Sequence):
 
 
 ImageRequest.componentType = namedtype.NamedTypes(
-    namedtype.NamedType('filename', Filename())
+    namedtype.NamedType('filename', Filename()),
+    namedtype.OptionalNamedType('blockNumber', Positive())
 )
 
 
@@ -0,0 +1,107 @@
+"""
+<Name>
+  uptane/encoding/batched_timeserver_asn1_coder.py
+
+<Purpose>
+  This module contains conversion functions (get_asn_signed and get_json_signed)
+  for converting batched Timeserver time attestations to and from Uptane's
+  standard Python dictionary metadata format (usually serialized as JSON) and
+  an ASN.1 format that conforms to pyasn1 specifications and Uptane's ASN.1
+  definitions.
+
+  A batched time attestation carries, outside of its signed portion (the
+  Merkle root), the caller's own time attestation and a Merkle inclusion
+  proof. These are handled by get_asn_unsigned and get_json_unsigned, which
+  asn1_codec calls for datatypes whose modules provide them.
+
+<Functions>
+  get_asn_signed(pydict_signed)
+  get_json_signed(asn_signed)    # TODO: Rename to get_pydict_signed in all mods
+  get_asn_unsigned(pydict_metadata, asn_metadata)
+  get_json_unsigned(asn_metadata)
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from uptane.encoding.asn1_definitions import *
+
+import uptane.encoding.timeserver_asn1_coder as timeserver_asn1_coder
+
+import binascii
+import calendar
+from datetime import datetime
+
+
+def get_asn_signed(json_signed):
+  signed = MerkleTimeRoot()
+  signed['timestamp'] = calendar.timegm(datetime.strptime(
+      json_signed['time'], "%Y-%m-%dT%H:%M:%SZ").timetuple())
+  signed['numberOfLeaves'] = json_signed['number_of_leaves']
+  signed['rootHash'] = OctetString(hexValue=json_signed['merkle_root'])
+
+  return signed
+
+
+def get_json_signed(asn_metadata):
+  asn_signed = asn_metadata['signed']
+
+  return {
+      'time': datetime.utcfromtimestamp(
+          asn_signed['timestamp']).isoformat() + 'Z',
+      'number_of_leaves': int(asn_signed['numberOfLeaves']),
+      'merkle_root': _hex(asn_signed['rootHash'])}
+
+
+def get_asn_unsigned(json_metadata, asn_metadata):
+  """
+  Populates the components of asn_metadata (a
+  BatchedTokensAndTimestampSignable) that are not covered by the signature:
+  the caller's time attestation and its Merkle inclusion proof.
+  """
+  asn_metadata['tokensAndTimestamp'] = timeserver_asn1_coder.get_asn_signed(
+      json_metadata['attestation'])
+
+  json_proof = json_metadata['merkle_proof']
+  proof = MerkleProof()
+  proof['leafIndex'] = json_proof['leaf_index']
+  proof['numberOfSiblings'] = len(json_proof['siblings'])
+
+  if json_proof['siblings']:
+    siblings = MerkleSiblings()
+    for i, json_sibling in enumerate(json_proof['siblings']):
+      sibling = MerkleSibling()
+      sibling['side'] = int(MerkleSide(json_sibling['side']))
+      sibling['hash'] = OctetString(hexValue=json_sibling['hash'])
+      siblings[i] = sibling
+    proof['siblings'] = siblings
+
+  asn_metadata['proof'] = proof
+
+
+def get_json_unsigned(asn_metadata):
+  """
+  Returns a dictionary with the 'attestation' and 'merkle_proof' entries of a
+  batched time attestation, from asn_metadata (a
+  BatchedTokensAndTimestampSignable).
+  """
+  attestation = timeserver_asn1_coder.get_json_signed(
+      {'signed': asn_metadata['tokensAndTimestamp']})
+
+  asn_proof = asn_metadata['proof']
+  json_siblings = []
+  for i in range(int(asn_proof['numberOfSiblings'])):
+    sibling = asn_proof['siblings'][i]
+    json_siblings.append({
+        'side': str(sibling['side'].namedValues[sibling['side']._value]),
+        'hash': _hex(sibling['hash'])})
+
+  return {
+      'attestation': attestation,
+      'merkle_proof': {
+          'leaf_index': int(asn_proof['leafIndex']),
+          'siblings': json_siblings}}
+
+
+def _hex(asn_octet_string):
+  return binascii.hexlify(asn_octet_string.asOctets()).decode('utf-8')
@@ -0,0 +1,141 @@
+"""
+<Program Name>
+  uptane/encoding/der_splice.py
+
+<Purpose>
+  Provides minimal reading and writing of the DER tag-length-value (TLV)
+  structure, so that DER-encoded data (e.g. ECU Manifests received from
+  Secondaries) can be inspected and spliced whole into larger DER structures
+  (e.g. Vehicle Manifests) without being decoded into pyasn1 objects and
+  encoded again.
+
+  Only single-byte (low-number) tags are supported, which covers every type in
+  asn1_definitions.asn1. Lengths must be in their minimal (DER) form.
+
+<Functions>
+  read_tlv(der_data, offset, end)
+  read_children(der_data, offset, end)
+  encode_tlv(tag, contents)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+
+import struct
+
+# Tag bytes for the universal types spliced by this package.
+TAG_INTEGER = 0x02
+TAG_VISIBLE_STRING = 0x1a
+TAG_SEQUENCE = 0x30
+
+# The largest number of bytes used to encode a length: lengths are limited to
+# 4 GiB.
+_MAX_LENGTH_BYTES = 4
+
+
+
+def read_tlv(der_data, offset=0, end=None):
+  """
+  <Purpose>
+    Reads the header of the DER TLV that starts at the given offset in
+    der_data, and must end at or before the given end (by default, the end of
+    der_data).
+
+  <Exceptions>
+    uptane.FailedToDecodeASN1DER
+      if there is not a well-formed TLV at the given offset that ends within
+      the given bounds
+
+  <Returns>
+    A tuple (tag, contents_offset, tlv_end): the tag byte, the offset in
+    der_data of the value, and the offset just past the end of the value.
+  """
+  if end is None:
+    end = len(der_data)
+
+  if offset + 2 > end:
+    raise uptane.FailedToDecodeASN1DER('DER data ends unexpectedly.')
+
+  tag, first_length_byte = struct.unpack('>BB', der_data[offset:offset + 2])
+  offset += 2
+
+  if tag & 0x1f == 0x1f:
+    raise uptane.FailedToDecodeASN1DER('Multi-byte DER tags are not supported.')
+
+  if first_length_byte < 0x80:
+    length = first_length_byte
+
+  else:
+    n_length_bytes = first_length_byte & 0x7f
+    if not 1 <= n_length_bytes <= _MAX_LENGTH_BYTES or \
+        offset + n_length_bytes > end:
+      raise uptane.FailedToDecodeASN1DER('Invalid DER length.')
+
+    length = 0
+    for byte in bytearray(der_data[offset:offset + n_length_bytes]):
+      length = (length << 8) | byte
+    offset += n_length_bytes
+
+    # DER requires the shortest form of each length.
+    if length < 0x80 or length >> (8 * (n_length_bytes - 1)) == 0:
+      raise uptane.FailedToDecodeASN1DER('DER length is not in minimal form.')
+
+  if offset + length > end:
+    raise uptane.FailedToDecodeASN1DER('DER data ends unexpectedly.')
+
+  return tag, offset, offset + length
+
+
+
+
+
+def read_children(der_data, offset=0, end=None):
+  """
+  <Purpose>
+    Reads the headers of the consecutive DER TLVs that exactly fill der_data
+    from offset to end (by default, the end of der_data), e.g. the contents of
+    a SEQUENCE.
+
+  <Exceptions>
+    uptane.FailedToDecodeASN1DER
+      if the data is not a series of well-formed TLVs that exactly fills the
+      given bounds
+
+  <Returns>
+    A list of tuples (tag, tlv_offset, contents_offset, tlv_end), one for each
+    TLV, where tlv_offset is the offset in der_data at which the TLV starts,
+    and the rest are as returned by read_tlv().
+  """
+  if end is None:
+    end = len(der_data)
+
+  children = []
+  while offset < end:
+    tag, contents_offset, tlv_end = read_tlv(der_data, offset, end)
+    children.append((tag, offset, contents_offset, tlv_end))
+    offset = tlv_end
+
+  return children
+
+
+
+
+
+def encode_tlv(tag, contents):
+  """
+  Returns the DER encoding of a TLV with the given tag byte and contents
+  (bytes, e.g. the concatenated DER encodings of the elements of a SEQUENCE).
+  """
+  length = len(contents)
+
+  if length < 0x80:
+    header = struct.pack('>BB', tag, length)
+
+  else:
+    length_bytes = struct.pack('>Q', length).lstrip(b'\x00')
+    if len(length_bytes) > _MAX_LENGTH_BYTES:
+      raise uptane.FailedToEncodeASN1DER('Data is too long to encode as DER.')
+    header = struct.pack('>BB', tag, 0x80 | len(length_bytes)) + length_bytes
+
+  return header + contents
@@ -8,17 +8,27 @@
   Python dictionary metadata format (usually serialized as JSON) and an ASN.1
   format that conforms to pyasn1 specifications and Uptane's ASN.1 definitions.
 
+  It also reads the few fields a Primary needs directly from the DER encoding
+  of an ECU Manifest (get_json_header_from_der), so that the Primary can keep
+  the DER it receives and splice it into the Vehicle Manifest unchanged.
+
 <Functions>
   get_asn_signed(pydict_signed)
   get_json_signed(asn_signed)    # TODO: Rename to get_pydict_signed in all mods
+  get_json_header_from_der(der_data, include_installed_image)
 
 """
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import uptane
+
 from pyasn1.type import tag
+import pyasn1.codec.der.decoder as p_der_decoder
+import pyasn1.error
 
 from uptane.encoding.asn1_definitions import *
+import uptane.encoding.der_splice as der_splice
 
 import calendar
 from datetime import datetime
@@ -78,7 +88,88 @@ def get_json_signed(asn_metadata):
       asn_signed['previousTime']).isoformat() + 'Z'
   ecu_serial = str(asn_signed['ecuIdentifier'])
 
-  target = asn_signed['installedImage']
+  installed_image = _get_json_target(asn_signed['installedImage'])
+
+  json_signed = {
+    'ecu_serial': ecu_serial,
+    'installed_image': installed_image,
+    'previous_timeserver_time': previous_timeserver_time,
+    'timeserver_time': timeserver_time,
+    'attacks_detected': ''
+  }
+
+  # Optional bit.
+  if 'securityAttack' in asn_signed and asn_signed['securityAttack'].hasValue():
+    json_signed['attacks_detected'] = str(asn_signed['securityAttack'])
+
+  return json_signed
+
+
+def get_json_header_from_der(der_data, include_installed_image=False):
+  """
+  Reads the ECU Serial and attack report (and, if include_installed_image is
+  True, the installed image) from the DER encoding of a signed ECU Manifest,
+  decoding only those fields. The structure of the rest of the ECU Manifest
+  is checked, but its contents are not decoded, and its signatures are not
+  checked: that is for the Director, to which the DER is passed on intact.
+
+  Returns a dictionary with keys 'ecu_serial' and 'attacks_detected' (and
+  'installed_image'), with values as in get_json_signed().
+
+  Raises uptane.FailedToDecodeASN1DER if der_data is not a DER-encoded ECU
+  Manifest.
+  """
+  # ECUVersionManifest: signed, numberOfSignatures, signatures
+  outer_tag, contents_offset, end = der_splice.read_tlv(der_data)
+  if outer_tag != der_splice.TAG_SEQUENCE or end != len(der_data):
+    raise uptane.FailedToDecodeASN1DER('Data is not a single DER SEQUENCE.')
+
+  manifest_parts = der_splice.read_children(der_data, contents_offset, end)
+  if [part[0] for part in manifest_parts] != [der_splice.TAG_SEQUENCE,
+      der_splice.TAG_INTEGER, der_splice.TAG_SEQUENCE]:
+    raise uptane.FailedToDecodeASN1DER('Data is not an ECU Manifest.')
+
+  # ECUVersionManifestSigned: ecuIdentifier, previousTime, currentTime,
+  # securityAttack (optional), installedImage
+  signed_parts = der_splice.read_children(
+      der_data, manifest_parts[0][2], manifest_parts[0][3])
+  signed_tags = [part[0] for part in signed_parts]
+  if signed_tags[:3] != [der_splice.TAG_VISIBLE_STRING,
+      der_splice.TAG_INTEGER, der_splice.TAG_INTEGER] or \
+      signed_tags[3:] not in ([der_splice.TAG_SEQUENCE],
+      [der_splice.TAG_VISIBLE_STRING, der_splice.TAG_SEQUENCE]):
+    raise uptane.FailedToDecodeASN1DER('Data is not an ECU Manifest.')
+
+  header = {
+      'ecu_serial': str(_decode_part(der_data, signed_parts[0], Identifier())),
+      'attacks_detected': ''}
+
+  if len(signed_parts) == 5:
+    header['attacks_detected'] = str(_decode_part(der_data, signed_parts[3],
+        ECUVersionManifestSigned.componentType['securityAttack'].asn1Object))
+
+  if include_installed_image:
+    header['installed_image'] = _get_json_target(
+        _decode_part(der_data, signed_parts[-1], Target()))
+
+  return header
+
+
+def _decode_part(der_data, part, exemplar_object):
+  """
+  Decodes the TLV in der_data described by part (as returned by
+  der_splice.read_children()) as the type of exemplar_object.
+  """
+  try:
+    return p_der_decoder.decode(
+        der_data[part[1]:part[3]], asn1Spec=exemplar_object)[0]
+  except pyasn1.error.PyAsn1Error as e:
+    raise uptane.FailedToDecodeASN1DER('Unable to decode the provided '
+        'der_data as an ECU Manifest. The pyasn1-raised error follows: ' +
+        repr(e))
+
+
+def _get_json_target(target):
   filepath = str(target['filename'])
   fileinfo = {'length': int(target['length'])}
 
@@ -99,21 +190,7 @@ def get_json_signed(asn_metadata):
     json_hashes[hash_function] = hash_value
   fileinfo['hashes'] = json_hashes
 
-  installed_image = {
+  return {
     'filepath': filepath,
     'fileinfo': fileinfo
   }
-
-  json_signed = {
-    'ecu_serial': ecu_serial,
-    'installed_image': installed_image,
-    'previous_timeserver_time': previous_timeserver_time,
-    'timeserver_time': timeserver_time,
-    'attacks_detected': ''
-  }
-
-  # Optional bit.
-  if 'securityAttack' in asn_signed and asn_signed['securityAttack'].hasValue():
-    json_signed['attacks_detected'] = str(asn_signed['securityAttack'])
-
-  return json_signed
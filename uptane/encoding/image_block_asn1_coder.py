@@ -0,0 +1,188 @@
+"""
+<Program Name>
+  uptane/encoding/image_block_asn1_coder.py
+
+<Purpose>
+  This module contains conversion functions for the messages of the
+  block-based image transfer between a Primary and a Secondary (ImageRequest,
+  ImageFile, and ImageBlock in asn1_definitions.asn1), converting them to and
+  from DER-encoded ASN.1 and Python dictionaries conforming to
+  uptane.formats.IMAGE_REQUEST_SCHEMA, IMAGE_FILE_SCHEMA, and
+  IMAGE_BLOCK_SCHEMA respectively.
+
+  Unlike the other coders in this package, these messages are not signed
+  metadata, so they are encoded directly rather than through asn1_codec.
+  Images transferred this way are validated by the Secondary against the
+  metadata it has validated, as images transferred any other way are.
+
+<Functions>
+  encode_image_request(image_request)
+  decode_image_request(der_data)
+  encode_image_file(image_file)
+  decode_image_file(der_data)
+  encode_image_block(image_block)
+  decode_image_block(der_data)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import uptane.formats
+import tuf
+
+import pyasn1.codec.der.encoder as p_der_encoder
+import pyasn1.codec.der.decoder as p_der_decoder
+import pyasn1.error
+
+from uptane.encoding.asn1_definitions import *
+
+
+
+def encode_image_request(image_request):
+  """
+  Returns the DER encoding of an ImageRequest, given a dictionary conforming to
+  uptane.formats.IMAGE_REQUEST_SCHEMA.
+  """
+  uptane.formats.IMAGE_REQUEST_SCHEMA.check_match(image_request)
+
+  asn_request = ImageRequest()
+  asn_request['filename'] = image_request['filename']
+  if 'block_number' in image_request:
+    asn_request['blockNumber'] = image_request['block_number']
+
+  return _encode(asn_request)
+
+
+
+
+
+def decode_image_request(der_data):
+  """
+  Returns a dictionary conforming to uptane.formats.IMAGE_REQUEST_SCHEMA,
+  given the DER encoding of an ImageRequest.
+  """
+  asn_request = _decode(der_data, ImageRequest())
+
+  image_request = {'filename': str(asn_request['filename'])}
+  if 'blockNumber' in asn_request and asn_request['blockNumber'].hasValue():
+    image_request['block_number'] = int(asn_request['blockNumber'])
+
+  return _check(image_request, uptane.formats.IMAGE_REQUEST_SCHEMA)
+
+
+
+
+
+def encode_image_file(image_file):
+  """
+  Returns the DER encoding of an ImageFile, given a dictionary conforming to
+  uptane.formats.IMAGE_FILE_SCHEMA.
+  """
+  uptane.formats.IMAGE_FILE_SCHEMA.check_match(image_file)
+
+  asn_file = ImageFile()
+  asn_file['filename'] = image_file['filename']
+  asn_file['numberOfBlocks'] = image_file['number_of_blocks']
+  asn_file['blockSize'] = image_file['block_size']
+
+  return _encode(asn_file)
+
+
+
+
+
+def decode_image_file(der_data):
+  """
+  Returns a dictionary conforming to uptane.formats.IMAGE_FILE_SCHEMA, given
+  the DER encoding of an ImageFile.
+  """
+  asn_file = _decode(der_data, ImageFile())
+
+  return _check({
+      'filename': str(asn_file['filename']),
+      'number_of_blocks': int(asn_file['numberOfBlocks']),
+      'block_size': int(asn_file['blockSize'])},
+      uptane.formats.IMAGE_FILE_SCHEMA)
+
+
+
+
+
+def encode_image_block(image_block):
+  """
+  Returns the DER encoding of an ImageBlock, given a dictionary conforming to
+  uptane.formats.IMAGE_BLOCK_SCHEMA.
+  """
+  uptane.formats.IMAGE_BLOCK_SCHEMA.check_match(image_block)
+
+  asn_block = ImageBlock()
+  asn_block['filename'] = image_block['filename']
+  asn_block['blockNumber'] = image_block['block_number']
+  asn_block['block'] = OctetString(image_block['block'])
+
+  return _encode(asn_block)
+
+
+
+
+
+def decode_image_block(der_data):
+  """
+  Returns a dictionary conforming to uptane.formats.IMAGE_BLOCK_SCHEMA, given
+  the DER encoding of an ImageBlock.
+  """
+  asn_block = _decode(der_data, ImageBlock())
+
+  return _check({
+      'filename': str(asn_block['filename']),
+      'block_number': int(asn_block['blockNumber']),
+      'block': asn_block['block'].asOctets()},
+      uptane.formats.IMAGE_BLOCK_SCHEMA)
+
+
+
+
+
+def _encode(asn_object):
+  try:
+    return p_der_encoder.encode(asn_object)
+  except pyasn1.error.PyAsn1Error as e:
+    raise uptane.FailedToEncodeASN1DER('Unable to encode the provided data '
+        'as ' + type(asn_object).__name__ + '. The pyasn1-raised error '
+        'follows: ' + repr(e))
+
+
+
+
+
+def _decode(der_data, exemplar_object):
+  try:
+    asn_object, remainder = p_der_decoder.decode(
+        der_data, asn1Spec=exemplar_object)
+  except pyasn1.error.PyAsn1Error as e:
+    raise uptane.FailedToDecodeASN1DER('Unable to decode the provided '
+        'der_data as ' + type(exemplar_object).__name__ + '. The '
+        'pyasn1-raised error follows: ' + repr(e))
+
+  if remainder:
+    raise uptane.FailedToDecodeASN1DER('Unexpected data follows the encoded ' +
+        type(exemplar_object).__name__ + ' in the provided der_data.')
+
+  return asn_object
+
+
+
+
+
+def _check(pydict, schema):
+  """
+  Returns the given dictionary decoded from DER if it conforms to the given
+  schema, else raises uptane.FailedToDecodeASN1DER. (The ASN.1 definitions do
+  not constrain everything the schemas do, e.g. that filenames are relative.)
+  """
+  try:
+    schema.check_match(pydict)
+  except tuf.FormatError as e:
+    raise uptane.FailedToDecodeASN1DER('Decoded data is not valid: ' + str(e))
+
+  return pydict
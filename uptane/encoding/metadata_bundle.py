@@ -0,0 +1,530 @@
+"""
+<Program Name>
+  uptane/encoding/metadata_bundle.py
+
+<Purpose>
+  Provides a simple indexed format in which a Primary can package all of the
+  role metadata files it has validated, from all repositories, for
+  distribution to Full Verification Secondaries. This is an alternative to a
+  zip archive that can be read in place (e.g. memory-mapped) without
+  decompressing or extracting anything.
+
+  A metadata bundle consists of:
+    - the 8 bytes in BUNDLE_MAGIC
+    - the length of the index, as a 4-byte big-endian unsigned integer
+    - the index: canonical JSON conforming to
+      uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA, listing for each role file
+      its repository, filename (e.g. 'targets.der'), offset (from the end of
+      the index), length, and SHA-256 hash
+    - the role files themselves, unaltered, one after another
+
+  Note that the hashes in the index only protect against corruption of the
+  bundle; as with the zip archive, the contents must still be fully validated
+  as TUF metadata by the Secondary.
+
+  Repositories can also use metadata bundles to send a client (e.g. a
+  Primary) all of the role files it needs in a single response, rather than
+  one request per role file: see get_role_files_newer_than().
+
+  Bundles (and zip archives) hold each role file under its plain name (e.g.
+  'snapshot.der'). A client of a repository that publishes consistent
+  snapshots fetches all but timestamp metadata by version-prefixed names
+  (e.g. '3.snapshot.der') instead, so a client using an expanded bundle as a
+  repository should first call add_versioned_role_fnames().
+
+<Functions>
+  write_metadata_bundle(fobj, role_files, index=None)
+  build_metadata_bundle_index(role_files, hashes=None)
+  is_metadata_bundle(fname)
+  get_role_files_newer_than(repository, metadata_dir, known_versions)
+  get_role_version(role_data)
+  add_versioned_role_fnames(metadata_dir)
+
+<Classes>
+  MetadataBundle(fname)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import uptane.formats
+import uptane.encoding.der_splice as der_splice
+import tuf
+import tuf.conf
+import tuf.formats
+import tuf.schema as SCHEMA
+
+import os
+import json
+import shutil
+import mmap
+import struct
+import hashlib
+
+BUNDLE_MAGIC = b'UPTMDB01'
+
+# Big-endian, unsigned 4-byte integer: the length of the index.
+_INDEX_LENGTH_FORMAT = '>I'
+_HEADER_LENGTH = len(BUNDLE_MAGIC) + struct.calcsize(_INDEX_LENGTH_FORMAT)
+
+# The roles every repository has, whose role files a client always needs.
+_TOP_LEVEL_ROLES = ['root', 'snapshot', 'targets', 'timestamp']
+
+# In DER-encoded TUF metadata, the tags of the 'signed' element of the outer
+# SEQUENCE, and of the 'version' element within it.
+_DER_TAG_SIGNED = 0xa0
+_DER_TAG_VERSION = 0x82
+
+
+
+def write_metadata_bundle(fobj, role_files, index=None):
+  """
+  <Purpose>
+    Writes a metadata bundle to the given binary file object.
+
+  <Arguments>
+    fobj
+      a file object opened for binary writing
+
+    role_files
+      a list of (repository name, role filename, role file data (bytes))
+      tuples, in the order the role files should appear in the bundle
+
+    index (optional)
+      the index of role_files, as build_metadata_bundle_index() returns it,
+      if the caller has already built it; if not given, it is built here
+
+  <Exceptions>
+    tuf.FormatError
+      if the repository names or role filenames are not plain file names, or
+      the role file data is not bytes, or the index given is malformed or
+      lists a different number of role files
+
+  <Returns>
+    The index written, conforming to
+    uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA.
+  """
+  if index is None:
+    index = build_metadata_bundle_index(role_files)
+  else:
+    uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA.check_match(index)
+    if len(index['roles']) != len(role_files):
+      raise tuf.FormatError('The index given does not list the role files '
+          'given: ' + repr(len(index['roles'])) + ' entries for ' +
+          repr(len(role_files)) + ' role files')
+
+  index_bytes = tuf.formats.encode_canonical(index).encode('utf-8')
+
+  fobj.write(BUNDLE_MAGIC)
+  fobj.write(struct.pack(_INDEX_LENGTH_FORMAT, len(index_bytes)))
+  fobj.write(index_bytes)
+  for repository, role, data in role_files:
+    fobj.write(data)
+
+  return index
+
+
+
+
+
+def build_metadata_bundle_index(role_files, hashes=None):
+  """
+  Returns the index (conforming to uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA)
+  of a metadata bundle containing the given role files. role_files is as in
+  write_metadata_bundle(). hashes, if given, maps (repository name, role
+  filename) to the SHA-256 hash (hex digest) of role files the caller has
+  already hashed, e.g. because they are unchanged since the last bundle was
+  built; only the rest are hashed here.
+  """
+  if hashes is None:
+    hashes = {}
+
+  entries = []
+  offset = 0
+
+  for repository, role, data in role_files:
+    _check_plain_filename(repository)
+    _check_plain_filename(role)
+    SCHEMA.AnyBytes().check_match(data)
+
+    data_hash = hashes.get((repository, role))
+    if data_hash is None:
+      data_hash = hashlib.sha256(data).hexdigest()
+
+    entries.append({
+        'repository': repository,
+        'role': role,
+        'offset': offset,
+        'length': len(data),
+        'hash': data_hash})
+
+    offset += len(data)
+
+  index = {'roles': entries}
+  uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA.check_match(index)
+
+  return index
+
+
+
+
+
+def is_metadata_bundle(fname):
+  """
+  Returns True if the file with the given name starts like a metadata bundle,
+  else False.
+  """
+  with open(fname, 'rb') as fobj:
+    return fobj.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+
+
+
+def get_role_files_newer_than(repository, metadata_dir, known_versions):
+  """
+  <Purpose>
+    For a repository serving the role files in metadata_dir, returns the role
+    files that a client with the given versions of each role's metadata does
+    not have yet, as write_metadata_bundle() takes them: every role file
+    whose version is greater than the client's version of that role, or that
+    the client has no version of, and always the timestamp role file, which a
+    client checks afresh each time it refreshes its metadata.
+
+    Delegated role files (e.g. the hashed bins among which a large targets
+    catalog is delegated) are provided only if the client already has some
+    version of them: a client fetches only the delegated roles it needs to
+    validate the targets it is interested in, so it is not sent the rest.
+
+    Role files are provided under their plain names: the version-prefixed
+    copies kept by a repository that publishes consistent snapshots are left
+    out (see add_versioned_role_fnames()).
+
+    Role file versions are read without the files being validated in any way:
+    the client must still fully validate whatever it receives.
+
+  <Arguments>
+    repository
+      the name by which clients know the repository, e.g. 'director'
+
+    metadata_dir
+      the directory from which the repository serves its role files, in
+      tuf.conf.METADATA_FORMAT
+
+    known_versions
+      the version of each role's metadata the client has, conforming to
+      uptane.formats.METADATA_VERSIONS_SCHEMA
+
+  <Exceptions>
+    tuf.FormatError
+      if the arguments are malformed
+
+    uptane.Error
+      if the version of a role file cannot be read
+
+  <Returns>
+    A list of (repository name, role filename, role file data) tuples.
+  """
+  _check_plain_filename(repository)
+  tuf.formats.PATH_SCHEMA.check_match(metadata_dir)
+  uptane.formats.METADATA_VERSIONS_SCHEMA.check_match(known_versions)
+
+  extension = '.' + tuf.conf.METADATA_FORMAT
+  role_files = []
+
+  for role_fname in sorted(os.listdir(metadata_dir)):
+    full_role_fname = os.path.join(metadata_dir, role_fname)
+    if not role_fname.endswith(extension) or \
+        _is_versioned_role_fname(role_fname) or \
+        not os.path.isfile(full_role_fname):
+      continue
+
+    role = role_fname[:-len(extension)]
+    if role not in known_versions and role not in _TOP_LEVEL_ROLES:
+      continue
+
+    with open(full_role_fname, 'rb') as fobj:
+      data = fobj.read()
+
+    if role == 'timestamp' or role not in known_versions or \
+        get_role_version(data) > known_versions[role]:
+      role_files.append((repository, role_fname, data))
+
+  return role_files
+
+
+
+
+
+def get_role_version(role_data):
+  """
+  Returns the version number in the given role file (bytes) in
+  tuf.conf.METADATA_FORMAT, read without validating the file in any way.
+  Raises uptane.Error if there is no version to be read.
+  """
+  if tuf.conf.METADATA_FORMAT == 'der':
+    # The outer SEQUENCE starts with the signed element, which starts with
+    # the role type, expiration, and version, each tagged by its position.
+    try:
+      tag, contents_offset, end = der_splice.read_tlv(role_data)
+      signed = der_splice.read_children(role_data, contents_offset, end)[0]
+      if tag != der_splice.TAG_SEQUENCE or signed[0] != _DER_TAG_SIGNED:
+        raise uptane.Error('Role file is not DER-encoded TUF metadata.')
+
+      for tag, tlv_offset, contents_offset, end in der_splice.read_children(
+          role_data, signed[2], signed[3]):
+        if tag == _DER_TAG_VERSION:
+          version = 0
+          for byte in bytearray(role_data[contents_offset:end]):
+            version = (version << 8) | byte
+          return version
+
+    except (uptane.FailedToDecodeASN1DER, IndexError) as e:
+      raise uptane.Error('Unable to read role file: ' + str(e))
+
+  else:
+    try:
+      return json.loads(role_data.decode('utf-8'))['signed']['version']
+    except (ValueError, TypeError, KeyError) as e:
+      raise uptane.Error('Unable to read role file: ' + repr(e))
+
+  raise uptane.Error('Role file has no version.')
+
+
+
+
+
+def add_versioned_role_fnames(metadata_dir):
+  """
+  <Purpose>
+    Gives each role file in metadata_dir other than the timestamp role file
+    (e.g. 'snapshot.der', of version 3) a second name prefixed with its
+    version (e.g. '3.snapshot.der'), as a repository that publishes consistent
+    snapshots does, so that the directory (e.g. expanded from a metadata
+    bundle) can serve as such a repository for a TUF client.
+
+    Role file versions are read without the files being validated in any
+    way; role files whose version cannot be read are left alone.
+
+  <Arguments>
+    metadata_dir
+      a directory of role files in tuf.conf.METADATA_FORMAT, under their plain
+      names
+
+  <Exceptions>
+    tuf.FormatError
+      if metadata_dir is not a path
+
+  <Returns>
+    None
+  """
+  tuf.formats.PATH_SCHEMA.check_match(metadata_dir)
+
+  extension = '.' + tuf.conf.METADATA_FORMAT
+
+  for role_fname in sorted(os.listdir(metadata_dir)):
+    full_role_fname = os.path.join(metadata_dir, role_fname)
+    if not role_fname.endswith(extension) or \
+        _is_versioned_role_fname(role_fname) or \
+        role_fname == 'timestamp' + extension or \
+        not os.path.isfile(full_role_fname):
+      continue
+
+    with open(full_role_fname, 'rb') as fobj:
+      data = fobj.read()
+
+    try:
+      version = get_role_version(data)
+    except uptane.Error:
+      continue
+
+    versioned_fname = os.path.join(
+        metadata_dir, str(version) + '.' + role_fname)
+
+    if os.path.isfile(versioned_fname) and \
+        os.path.getsize(versioned_fname) == len(data):
+      with open(versioned_fname, 'rb') as fobj:
+        if fobj.read() == data:
+          continue
+
+    # Link (or, failing that, copy) the file beside the versioned name and
+    # move it into place.
+    temp_fname = versioned_fname + '.tmp'
+    if os.path.exists(temp_fname):
+      os.remove(temp_fname)
+    try:
+      os.link(full_role_fname, temp_fname)
+    except (OSError, AttributeError):
+      shutil.copyfile(full_role_fname, temp_fname)
+    os.rename(temp_fname, versioned_fname)
+
+
+
+
+
+def _is_versioned_role_fname(role_fname):
+  """
+  Returns True if the given role filename is prefixed with a version, as in a
+  repository that publishes consistent snapshots (e.g. '3.snapshot.der', but
+  not '3.der', the role file of a hashed bin named '3').
+  """
+  parts = role_fname.split('.')
+  return len(parts) > 2 and parts[0].isdigit()
+
+
+
+
+
+def _check_plain_filename(name):
+  """
+  Raises tuf.FormatError unless the given name is a string that can be used
+  as a single file or directory name, without reaching into other directories.
+  (Names in a bundle become paths when a Secondary writes out the role files.)
+  """
+  tuf.formats.PATH_SCHEMA.check_match(name)
+
+  if not name or name in ('.', '..') or '/' in name or '\\' in name or \
+      os.path.basename(name) != name:
+    raise tuf.FormatError('Expected a plain file or directory name in a '
+        'metadata bundle; received ' + repr(name))
+
+
+
+
+
+class MetadataBundle(object):
+  """
+  <Purpose>
+    Read-only, memory-mapped access to a metadata bundle file, allowing
+    individual role files to be read in place.
+
+    Usable as a context manager, which closes the bundle on exit.
+
+  <Fields>
+    self.fname
+      the filename of the bundle
+
+    self.index
+      the bundle's index, conforming to
+      uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA
+
+  <Use>
+    with MetadataBundle(fname) as bundle:
+      for repository, role in bundle.roles():
+        data = bundle.get_role(repository, role)
+  """
+  def __init__(self, fname):
+    """
+    <Exceptions>
+      uptane.Error
+        if the file is not a well-formed metadata bundle
+    """
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+
+    self.fname = fname
+
+    with open(fname, 'rb') as fobj:
+      if os.fstat(fobj.fileno()).st_size < _HEADER_LENGTH:
+        raise uptane.Error('File is too short to be a metadata bundle: ' +
+            repr(fname))
+      self._mmap = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+      self.index = self._read_index()
+    except:
+      self._mmap.close()
+      raise
+
+    self._entries = dict(((entry['repository'], entry['role']), entry)
+        for entry in self.index['roles'])
+
+
+
+  def _read_index(self):
+    if self._mmap[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+      raise uptane.Error('File is not a metadata bundle: ' + repr(self.fname))
+
+    index_length = struct.unpack(_INDEX_LENGTH_FORMAT,
+        self._mmap[len(BUNDLE_MAGIC):_HEADER_LENGTH])[0]
+    self._data_start = _HEADER_LENGTH + index_length
+
+    if self._data_start > len(self._mmap):
+      raise uptane.Error('Metadata bundle index extends past the end of the '
+          'bundle: ' + repr(self.fname))
+
+    try:
+      index = json.loads(
+          self._mmap[_HEADER_LENGTH:self._data_start].decode('utf-8'))
+      uptane.formats.METADATA_BUNDLE_INDEX_SCHEMA.check_match(index)
+      for entry in index['roles']:
+        _check_plain_filename(entry['repository'])
+        _check_plain_filename(entry['role'])
+
+    except (ValueError, tuf.FormatError) as e:
+      raise uptane.Error('Metadata bundle index is malformed in ' +
+          repr(self.fname) + ': ' + str(e))
+
+    for entry in index['roles']:
+      if self._data_start + entry['offset'] + entry['length'] > \
+          len(self._mmap):
+        raise uptane.Error('Metadata bundle entry for ' +
+            repr(entry['repository']) + ' ' + repr(entry['role']) +
+            ' extends past the end of the bundle: ' + repr(self.fname))
+
+    return index
+
+
+
+  def roles(self):
+    """
+    Returns a list of (repository name, role filename) pairs, one for each
+    role file in the bundle, in bundle order.
+    """
+    return [(entry['repository'], entry['role'])
+        for entry in self.index['roles']]
+
+
+
+  def get_role(self, repository, role):
+    """
+    <Purpose>
+      Returns the data (bytes) of the given role file from the given
+      repository, read directly from the mapped bundle, after checking it
+      against the hash in the index.
+
+    <Exceptions>
+      uptane.Error
+        if there is no such role file in the bundle
+
+      tuf.BadHashError
+        if the data does not match the hash listed in the index
+    """
+    if (repository, role) not in self._entries:
+      raise uptane.Error('Metadata bundle ' + repr(self.fname) + ' contains '
+          'no role file ' + repr(role) + ' from repository ' +
+          repr(repository))
+
+    entry = self._entries[(repository, role)]
+    start = self._data_start + entry['offset']
+    data = self._mmap[start:start + entry['length']]
+
+    observed_hash = hashlib.sha256(data).hexdigest()
+    if observed_hash != entry['hash']:
+      raise tuf.BadHashError(entry['hash'], observed_hash)
+
+    return data
+
+
+
+  def close(self):
+    self._mmap.close()
+
+
+
+  def __enter__(self):
+    return self
+
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
@@ -8,19 +8,30 @@
   Python dictionary metadata format (usually serialized as JSON) and an ASN.1
   format that conforms to pyasn1 specifications and Uptane's ASN.1 definitions.
 
+  It also builds the DER encoding of the signed portion of a vehicle manifest
+  directly from the DER encodings of the ECU Manifests in it
+  (get_der_signed_from_der_ecu_manifests), without decoding them.
+
 <Functions>
   get_asn_signed(pydict_signed)
   get_json_signed(asn_signed)    # TODO: Rename to get_pydict_signed in all mods
+  get_der_signed_from_der_ecu_manifests(vin, primary_ecu_serial,
+      der_ecu_manifests)
 
 """
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import uptane
+
 from pyasn1.type import univ, tag
+import pyasn1.codec.der.encoder as p_der_encoder
+import pyasn1.error
 
 from uptane.encoding.asn1_definitions import *
 
 import uptane.encoding.ecu_manifest_asn1_coder as ecu_manifest_asn1_coder
+import uptane.encoding.der_splice as der_splice
 
 
 def get_asn_signed(json_signed):
@@ -115,3 +126,27 @@ def get_json_signed(asn_metadata):
   json_signed['ecu_version_manifests'] = json_manifests
 
   return json_signed
+
+
+def get_der_signed_from_der_ecu_manifests(
+    vin, primary_ecu_serial, der_ecu_manifests):
+  """
+  Returns the DER encoding of a VehicleVersionManifestSigned for the given VIN
+  and Primary ECU Serial, listing the given ECU Manifests, which are already
+  DER-encoded (each as a full ECUVersionManifest, signatures included).
+
+  Only the few fields of the vehicle manifest itself are encoded; the ECU
+  Manifests are spliced in as they are, in the order given. The result is
+  the same as encoding the output of get_asn_signed() for the same data.
+  """
+  try:
+    der_header = p_der_encoder.encode(Identifier(vin)) + \
+        p_der_encoder.encode(Identifier(primary_ecu_serial)) + \
+        p_der_encoder.encode(Length(len(der_ecu_manifests)))
+  except pyasn1.error.PyAsn1Error as e:
+    raise uptane.FailedToEncodeASN1DER('Unable to encode the provided data '
+        'as a Vehicle Manifest. The pyasn1-raised error follows: ' + repr(e))
+
+  return der_splice.encode_tlv(der_splice.TAG_SEQUENCE, der_header +
+      der_splice.encode_tlv(
+      der_splice.TAG_SEQUENCE, b''.join(der_ecu_manifests)))
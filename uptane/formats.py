@@ -35,6 +35,10 @@ VIN_SCHEMA = SCHEMA.AnyString()
 #     vin = VIN_SCHEMA)
 ECU_SERIAL_SCHEMA = SCHEMA.AnyString() # Instead, for now, we'll go with an ecu serial number.
 
+# A limit on the number of operations (e.g. image downloads) to perform at
+# once.
+CONCURRENCY_LIMIT_SCHEMA = SCHEMA.Integer(lo=1)
+
 
 # Information specifying the target(s) installed on a given ECU.
 # This object corresponds to not "ECUVersionManifest" in the Uptane
@@ -114,14 +118,100 @@ SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA = SCHEMA.Object(
     signed = TIMESERVER_ATTESTATION_SCHEMA,
     signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA))
 
+# When the Timeserver batches requests, it signs only once per batch, over the
+# root of a Merkle tree whose leaves are the individual time attestations
+# (TIMESERVER_ATTESTATION_SCHEMA) for each request in the batch. Each caller
+# receives the signed root, its own attestation, and a proof that the latter
+# is included in the tree.
+MERKLE_TIME_ROOT_SCHEMA = SCHEMA.Object(
+    time = ISO8601_DATETIME_SCHEMA,
+    number_of_leaves = SCHEMA.Integer(lo=1),
+    merkle_root = HASH_SCHEMA)
+
+MERKLE_SIBLING_SCHEMA = SCHEMA.Object(
+    side = SCHEMA.OneOf([SCHEMA.String('left'), SCHEMA.String('right')]),
+    hash = HASH_SCHEMA)
+
+MERKLE_PROOF_SCHEMA = SCHEMA.Object(
+    leaf_index = SCHEMA.Integer(lo=0),
+    siblings = SCHEMA.ListOf(MERKLE_SIBLING_SCHEMA))
+
+# The signed Merkle root alone, without the per-caller data below.
+SIGNABLE_MERKLE_TIME_ROOT_SCHEMA = SCHEMA.Object(
+    object_name = 'SIGNABLE_MERKLE_TIME_ROOT_SCHEMA',
+    signed = MERKLE_TIME_ROOT_SCHEMA,
+    signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA))
+
+SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA = SCHEMA.Object(
+    object_name = 'SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA',
+    signed = MERKLE_TIME_ROOT_SCHEMA,
+    signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA),
+    attestation = TIMESERVER_ATTESTATION_SCHEMA,
+    merkle_proof = MERKLE_PROOF_SCHEMA)
+
+
+# The index at the start of a metadata bundle (see
+# uptane/encoding/metadata_bundle.py), locating each role metadata file
+# (e.g. 'targets.der') from each repository in the bundle. Offsets are
+# relative to the end of the index.
+METADATA_BUNDLE_ENTRY_SCHEMA = SCHEMA.Object(
+    object_name = 'METADATA_BUNDLE_ENTRY_SCHEMA',
+    repository = SCHEMA.AnyString(),
+    role = SCHEMA.AnyString(),
+    offset = LENGTH_SCHEMA,
+    length = LENGTH_SCHEMA,
+    hash = HASH_SCHEMA)
+
+METADATA_BUNDLE_INDEX_SCHEMA = SCHEMA.Object(
+    object_name = 'METADATA_BUNDLE_INDEX_SCHEMA',
+    roles = SCHEMA.ListOf(METADATA_BUNDLE_ENTRY_SCHEMA))
+
+# The version of each role's metadata that a client already has from a
+# repository, so that the repository can send it only newer role files, in a
+# metadata bundle. Maps role name (e.g. 'targets') to version number.
+METADATA_VERSIONS_SCHEMA = SCHEMA.DictOf(
+    key_schema = ROLENAME_SCHEMA,
+    value_schema = METADATAVERSION_SCHEMA)
+
+# The forms in which a Primary can package all of its validated metadata for
+# Full Verification Secondaries: a zip archive, or a metadata bundle.
+METADATA_ARCHIVE_FORMAT_SCHEMA = SCHEMA.OneOf(
+    [SCHEMA.String('zip'), SCHEMA.String('bundle')])
+
+# Block-based transfer of an image from a Primary to a Secondary, in the form
+# of the ImageRequest, ImageFile, and ImageBlock types in
+# uptane/encoding/asn1_definitions.asn1. A Secondary requests a description of
+# an image (an ImageFile) and then each of its blocks in turn. Blocks are
+# numbered from 1, and every block but the last is block_size bytes long.
+IMAGE_BLOCK_NUMBER_SCHEMA = SCHEMA.Integer(lo=1)
+IMAGE_BLOCK_SIZE_SCHEMA = SCHEMA.Integer(lo=1)
+
+IMAGE_REQUEST_SCHEMA = SCHEMA.Object(
+    object_name = 'IMAGE_REQUEST_SCHEMA',
+    filename = RELPATH_SCHEMA,
+    block_number = SCHEMA.Optional(IMAGE_BLOCK_NUMBER_SCHEMA))
+
+IMAGE_FILE_SCHEMA = SCHEMA.Object(
+    object_name = 'IMAGE_FILE_SCHEMA',
+    filename = RELPATH_SCHEMA,
+    number_of_blocks = LENGTH_SCHEMA,
+    block_size = IMAGE_BLOCK_SIZE_SCHEMA)
+
+IMAGE_BLOCK_SCHEMA = SCHEMA.Object(
+    object_name = 'IMAGE_BLOCK_SCHEMA',
+    filename = RELPATH_SCHEMA,
+    block_number = IMAGE_BLOCK_NUMBER_SCHEMA,
+    block = SCHEMA.AnyBytes())
 
 ANY_UPTANE_METADATA_SCHEMA = SCHEMA.OneOf([
     TIMESERVER_ATTESTATION_SCHEMA,
+    MERKLE_TIME_ROOT_SCHEMA,
     VEHICLE_VERSION_MANIFEST_SCHEMA,
     ECU_VERSION_MANIFEST_SCHEMA])
 
 ANY_SIGNABLE_UPTANE_METADATA_SCHEMA = SCHEMA.OneOf([
     SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA,
+    SIGNABLE_MERKLE_TIME_ROOT_SCHEMA,
     SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA,
     SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA])
 
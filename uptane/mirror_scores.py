@@ -0,0 +1,284 @@
+"""
+<Program Name>
+  uptane/mirror_scores.py
+
+<Purpose>
+  Keeps rolling statistics of the latency and failures of requests to
+  repository mirrors, so that a client (e.g. a Primary) can try first the
+  mirrors most likely to respond quickly, rather than always the first listed
+  in pinned.json, which may be slow without failing.
+
+  Statistics are kept per server (the scheme, host and port of a URL), as
+  exponentially weighted moving averages of the time to the first byte of
+  each response and of the rate of failures (errors connecting, timeouts and
+  server errors). A mirror's score is its average latency plus a penalty in
+  proportion to its failure rate; mirrors are tried in order of score, lowest
+  first, and mirrors with no statistics yet (in their pinned order) before
+  any others, so that they are measured too. Statistics can be saved to a
+  JSON file and loaded again, so that they are not lost when the client
+  restarts.
+
+  Before a large download, two mirrors can also be raced: each is asked for
+  the first bytes of the same file at once, and the statistics of both are
+  updated as they answer (see MirrorScores.race()). A client need only race
+  mirrors whose statistics are stale (see MirrorScores.is_stale()), since
+  those of the mirrors it uses are kept up to date by its requests.
+
+  The order in which mirrors are tried affects only how quickly files
+  arrive: every file is validated exactly as it would be from any mirror.
+
+<Classes>
+  MirrorScores(fname, smoothing, failure_penalty)
+
+<Functions>
+  get_server(url)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import tuf
+import tuf.formats
+
+import os
+import json
+import time
+import threading
+
+from six.moves.urllib.parse import urlsplit
+from six.moves.urllib.request import Request, urlopen
+
+log = uptane.logging.getLogger('mirror_scores')
+
+# The weight of each new sample in the moving averages.
+DEFAULT_SMOOTHING = 0.3
+
+# The number of seconds added to a mirror's score for a failure rate of 1
+# (every request failing).
+DEFAULT_FAILURE_PENALTY = 10
+
+# The number of bytes requested from each mirror in a race, and the number of
+# seconds to wait for a mirror to provide them.
+DEFAULT_RACE_LENGTH = 16 * 1024
+DEFAULT_RACE_TIMEOUT = 10
+
+
+
+class MirrorScores(object):
+  """
+  <Purpose>
+    Rolling latency and failure statistics for the servers a client fetches
+    files from, by which to order mirrors. Safe to use from several threads.
+
+  <Arguments>
+    fname (optional)
+      the file in which the statistics are saved (see save()), and from which
+      they are loaded, if it exists
+
+    smoothing (optional)
+      the weight, between 0 and 1, of each new sample in the moving averages
+
+    failure_penalty (optional)
+      the number of seconds added to a mirror's score for a failure rate of 1
+
+  <Exceptions>
+    tuf.FormatError, if an argument is improperly formatted.
+  """
+  def __init__(self, fname=None, smoothing=DEFAULT_SMOOTHING,
+      failure_penalty=DEFAULT_FAILURE_PENALTY):
+
+    if fname is not None:
+      tuf.formats.PATH_SCHEMA.check_match(fname)
+    if not 0 < smoothing <= 1:
+      raise tuf.FormatError('Smoothing must be between 0 and 1, not ' +
+          repr(smoothing))
+    tuf.formats.LENGTH_SCHEMA.check_match(failure_penalty)
+
+    self.fname = fname
+    self.smoothing = smoothing
+    self.failure_penalty = failure_penalty
+
+    # Maps each server (see get_server()) to a dictionary of its average
+    # 'latency' in seconds, its average 'failure_rate', the number of
+    # 'samples' taken, and the time the last was taken ('updated').
+    self._stats = {}
+    self._lock = threading.Lock()
+
+    if fname is not None and os.path.exists(fname):
+      self.load()
+
+
+
+  def record(self, url, latency):
+    """
+    Records the outcome of a request for the given URL: the number of seconds
+    it took for the response to begin, or None if the request failed. May be
+    given to uptane.connection_pool.ConnectionPool as its observer.
+    """
+    server = get_server(url)
+    failed = latency is None
+    now = time.time()
+
+    with self._lock:
+      stats = self._stats.get(server)
+
+      if stats is None:
+        self._stats[server] = {'latency': latency or 0.0,
+            'failure_rate': 1.0 if failed else 0.0, 'samples': 1,
+            'updated': now}
+        return
+
+      if not failed:
+        stats['latency'] += self.smoothing * (latency - stats['latency'])
+      stats['failure_rate'] += \
+          self.smoothing * ((1.0 if failed else 0.0) - stats['failure_rate'])
+      stats['samples'] += 1
+      stats['updated'] = now
+
+
+
+  def get_score(self, mirror):
+    """
+    Returns the score of the given mirror (URL), lower being better, or None
+    if nothing has been recorded for its server.
+    """
+    with self._lock:
+      stats = self._stats.get(get_server(mirror))
+      if stats is None:
+        return None
+      return stats['latency'] + stats['failure_rate'] * self.failure_penalty
+
+
+
+  def is_stale(self, mirror, max_age):
+    """
+    Returns True if nothing has been recorded for the given mirror's (URL's)
+    server in the last max_age seconds, e.g. because the client has not used
+    it since then.
+    """
+    with self._lock:
+      stats = self._stats.get(get_server(mirror))
+      return stats is None or time.time() - stats['updated'] > max_age
+
+
+
+  def sort_mirrors(self, mirrors):
+    """
+    Returns the given mirrors (URLs) in the order in which to try them: those
+    not yet scored first, then the rest by score, each in their given order
+    where otherwise equal.
+    """
+    scores = [self.get_score(mirror) for mirror in mirrors]
+    order = sorted(range(len(mirrors)), key=lambda i:
+        (scores[i] is not None, scores[i] or 0, i))
+    return [mirrors[i] for i in order]
+
+
+
+  def race(self, urls, length=DEFAULT_RACE_LENGTH,
+      timeout=DEFAULT_RACE_TIMEOUT):
+    """
+    <Purpose>
+      Asks each of the given URLs (e.g. the same file on two mirrors) at once
+      for the first length bytes of its file, recording the latency of each,
+      and returns the URL that provides them first. The other requests are
+      left to finish in the background, recording their latency when they
+      do. Nothing fetched is used, so nothing need be validated.
+
+    <Returns>
+      The URL that won the race, or None if none answered within timeout
+      seconds.
+    """
+    finished = threading.Event()
+    winners = []
+
+    def fetch(url):
+      start = time.time()
+      try:
+        response = urlopen(Request(url,
+            headers={'Range': 'bytes=0-' + str(length - 1)}), timeout=timeout)
+        try:
+          response.read(length)
+        finally:
+          response.close()
+
+      except Exception as e:
+        log.debug('Mirror race request for ' + repr(url) + ' failed: ' +
+            repr(e))
+        self.record(url, None)
+        return
+
+      self.record(url, time.time() - start)
+      winners.append(url)
+      finished.set()
+
+    threads = [threading.Thread(target=fetch, args=(url,)) for url in urls]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    # Return as soon as any request succeeds, or all have failed.
+    deadline = time.time() + timeout
+    while not finished.is_set() and time.time() < deadline and \
+        any(thread.is_alive() for thread in threads):
+      finished.wait(min(0.1, deadline - time.time()))
+
+    return winners[0] if winners else None
+
+
+
+  def load(self):
+    """
+    Loads the statistics saved in self.fname, replacing any recorded. A file
+    that cannot be read or parsed is ignored, with a warning.
+    """
+    try:
+      with open(self.fname, 'r') as fobj:
+        saved = json.load(fobj)
+
+      stats = {}
+      for server in saved:
+        stats[server] = {
+            'latency': float(saved[server]['latency']),
+            'failure_rate': float(saved[server]['failure_rate']),
+            'samples': int(saved[server]['samples']),
+            # Scores saved before this was kept are taken to be stale.
+            'updated': float(saved[server].get('updated', 0))}
+
+    except (IOError, OSError, ValueError, TypeError, KeyError) as e:
+      log.warning('Ignoring unreadable mirror scores file ' +
+          repr(self.fname) + ': ' + repr(e))
+      return
+
+    with self._lock:
+      self._stats = stats
+
+
+
+  def save(self):
+    """
+    Saves the statistics to self.fname, atomically replacing the file, so
+    that they can be loaded after a restart. Does nothing if there is no
+    fname.
+    """
+    if self.fname is None:
+      return
+
+    with self._lock:
+      data = json.dumps(self._stats, sort_keys=True, indent=1)
+
+    with open(self.fname + '.tmp', 'w') as fobj:
+      fobj.write(data)
+    os.rename(self.fname + '.tmp', self.fname)
+
+
+
+
+
+def get_server(url):
+  """
+  Returns the server (scheme, host and port) of the given URL, e.g.
+  'http://localhost:30301' for 'http://localhost:30301/targets/image.img'.
+  """
+  parts = urlsplit(url)
+  return parts.scheme + '://' + parts.netloc
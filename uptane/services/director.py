@@ -80,6 +80,15 @@ class Director:
     director_repos_dir
       The root directory in which the repositories for each vehicle reside.
 
+    consistent_snapshot
+      Whether the vehicle repositories are written (by
+      write_vehicle_repository()) as consistent snapshots: every role file but
+      timestamp's also under a name prefixed with its version, and every
+      target file also under names prefixed with its hashes. Files under those
+      names never change, so they can be cached indefinitely by clients and
+      intermediate caches, and clients fetch them whenever the root metadata
+      says the repository publishes consistent snapshots. True by default.
+
   """
 
 
@@ -92,12 +101,14 @@ class Director:
     key_snapshot_pri,
     key_snapshot_pub,
     key_targets_pri,
-    key_targets_pub):
+    key_targets_pub,
+    consistent_snapshot=True):
 
     """
     """
 
     tuf.formats.RELPATH_SCHEMA.check_match(director_repos_dir)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(consistent_snapshot)
 
     for key in [
         key_root_pri, key_root_pub, key_timestamp_pri, key_timestamp_pub,
@@ -115,6 +126,8 @@ class Director:
     self.key_dirtarg_pri = key_targets_pri
     self.key_dirtarg_pub = key_targets_pub
 
+    self.consistent_snapshot = consistent_snapshot
+
     self.vehicle_repositories = dict()
 
 
@@ -483,9 +496,8 @@ class Director:
       d.add_target_for_ecu(vin, ecu, target_filepath)
 
     These repository objects can be manipulated as described in TUF
-    documentation; for example, to produce metadata files afterwards for that
-    vehicle:
-      d.vehicle_repositories[vin].write()
+    documentation. To produce metadata files afterwards for that vehicle:
+      d.write_vehicle_repository(vin)
 
 
     # TODO: This may be outside of the scope of the reference implementation,
@@ -526,6 +538,42 @@ class Director:
 
 
 
+  def write_vehicle_repository(self, vin, write_partial=False):
+    """
+    <Purpose>
+      Writes the metadata of the repository for the given vehicle to its
+      metadata.staged directory, as consistent snapshots if
+      self.consistent_snapshot is True (see the class docstring).
+
+    <Arguments>
+      vin
+        the identifier of a vehicle known to this Director
+
+      write_partial (optional)
+        as for tuf.repository_tool.Repository.write(): if True, metadata
+        that is not signed by a threshold of keys is written anyway
+
+    <Exceptions>
+      uptane.UnknownVehicle
+        if the vehicle is not known to this Director
+
+    <Returns>
+      None
+    """
+    uptane.formats.VIN_SCHEMA.check_match(vin)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(write_partial)
+
+    if vin not in self.vehicle_repositories:
+      raise uptane.UnknownVehicle('The VIN provided, ' + repr(vin) + ' is not '
+          'that of a vehicle known to this Director.')
+
+    self.vehicle_repositories[vin].write(write_partial=write_partial,
+        consistent_snapshot=self.consistent_snapshot)
+
+
+
+
+
   def add_target_for_ecu(self, vin, ecu_serial, target_filepath):
     """
     Add a target to the repository for a vehicle, marked as being for a
@@ -0,0 +1,506 @@
+"""
+<Program Name>
+  fleetanalytics.py
+
+<Purpose>
+  Provides fleet-wide analytics over the software state saved by the Director
+  in inventorydb, for use by e.g. rollout dashboards.
+
+  inventorydb stores manifests as lists of nested dictionaries indexed by VIN
+  and ECU Serial, which is convenient for handling one vehicle at a time but
+  slow to aggregate over a whole fleet. FleetSnapshot instead maintains a
+  columnar view of the latest ECU Manifest from every known ECU: one NumPy
+  array per field, with strings (VINs, ECU Serials, ECU types, images)
+  interned as small integer ids. Aggregates are then computed with vectorized
+  operations over those arrays.
+
+  The snapshot is refreshed incrementally: only ECUs that have submitted new
+  ECU Manifests since the previous refresh are re-read from inventorydb.
+  Refreshes can also be run periodically in a background thread.
+
+  NumPy is an optional dependency of this package (extra "analytics"). If it
+  is not installed, the rest of the reference implementation works normally,
+  but constructing a FleetSnapshot raises uptane.Error.
+
+  Note that inventorydb does not record when a manifest was received. The
+  snapshot therefore records, for each ECU, the time of the refresh at which
+  its latest manifest was first observed ("last seen"). The finer the refresh
+  interval, the closer this is to the time of receipt.
+
+<Columns>
+  For row i (one row per known ECU):
+    ecu_ids[i]          interned ECU Serial
+    vin_ids[i]          interned VIN of the vehicle the ECU belongs to, or -1
+    type_ids[i]         interned ECU type (see ecu_types argument)
+    image_ids[i]        interned installed image (sha256 hash if provided,
+                        else filepath), or -1 if no manifest has been received
+    timeserver_times[i] epoch time of 'timeserver_time' in the latest
+                        manifest, or NaN
+    last_seen_times[i]  epoch time at which the latest manifest was first
+                        observed by the snapshot, or NaN
+    attack_flags[i]     True if the latest manifest reports an attack
+    manifest_counts[i]  number of manifests received from the ECU
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane # Import before TUF modules; may change tuf.conf values.
+import uptane.formats
+import uptane.services.inventorydb as inventorydb
+import tuf
+import tuf.formats
+
+import threading
+import time
+import iso8601
+
+try:
+  import numpy
+except ImportError: # pragma: no cover
+  uptane.logger.warning('Minor: numpy library not found. Fleet analytics are '
+      'unavailable.')
+  NUMPY_EXISTS = False
+else:
+  NUMPY_EXISTS = True
+
+log = uptane.logging.getLogger('fleetanalytics')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# ECU type assigned to ECUs for which no type is known.
+UNKNOWN_ECU_TYPE = 'unknown'
+
+# Initial number of rows to allocate in each column; columns double in size
+# as necessary.
+INITIAL_CAPACITY = 1024
+
+
+
+
+
+class _Interner(object):
+  """
+  Maps strings to small consecutive integer ids and back.
+  """
+  def __init__(self):
+    self.ids = {}
+    self.values = []
+
+
+
+  def intern(self, value):
+    try:
+      return self.ids[value]
+    except KeyError:
+      self.ids[value] = len(self.values)
+      self.values.append(value)
+      return self.ids[value]
+
+
+
+  def lookup(self, value_id):
+    return self.values[value_id]
+
+
+
+
+
+class FleetSnapshot(object):
+  """
+  <Purpose>
+    A columnar snapshot of the latest software state of every ECU known to
+    inventorydb, supporting incremental refresh and vectorized fleet-wide
+    aggregates. See the module docstring for the columns maintained.
+
+  <Fields>
+    ecu_types
+      Dictionary mapping ECU Serial to ECU type (any string), used to group
+      aggregates by ECU type. ECUs not listed have type UNKNOWN_ECU_TYPE.
+
+    n_rows
+      The number of ECUs (rows) currently in the snapshot.
+
+    last_refresh_time
+      Epoch time of the last refresh, or None.
+
+  <Methods>
+    refresh(now=None, full=False)
+    start_periodic_refresh(interval)
+    stop_periodic_refresh()
+    image_distribution()
+    report_ages(now=None)
+    timeserver_lags()
+    attack_report_rates()
+    summary(now=None, percentiles=(50, 90, 99))
+  """
+
+  def __init__(self, ecu_types=None):
+    """
+    <Arguments>
+      ecu_types (optional)
+        Dictionary mapping ECU Serial to ECU type. May be updated later via
+        set_ecu_type().
+
+    <Exceptions>
+      uptane.Error if NumPy is not available
+      tuf.FormatError if ecu_types is not correctly formatted
+    """
+    if not NUMPY_EXISTS:
+      raise uptane.Error('Fleet analytics require the numpy library, which '
+          'is not installed.')
+
+    if ecu_types is None:
+      ecu_types = {}
+    else:
+      uptane.formats.SCHEMA.DictOf(
+          key_schema=uptane.formats.ECU_SERIAL_SCHEMA,
+          value_schema=uptane.formats.SCHEMA.AnyString()).check_match(
+          ecu_types)
+
+    self.ecu_types = dict(ecu_types)
+
+    self._ecus = _Interner()
+    self._vins = _Interner()
+    self._types = _Interner()
+    self._images = _Interner()
+
+    # Row number in the columns for each interned ECU id. Since ECUs are
+    # appended in the order they are interned, row == ECU id.
+    self.n_rows = 0
+    self.last_refresh_time = None
+
+    # Number of manifests from each ECU as of the last refresh, used to detect
+    # ECUs that have reported since.
+    self._seen_counts = {}
+
+    self._allocate(INITIAL_CAPACITY)
+
+    # Serializes refreshes and reads, since refreshes may run in a background
+    # thread.
+    self._lock = threading.Lock()
+    self._refresh_thread = None
+    self._stop_refreshing = threading.Event()
+
+
+
+
+
+  def _allocate(self, capacity):
+    """
+    Allocates (or grows, preserving existing rows) the column arrays.
+    """
+    columns = {
+        'ecu_ids': (numpy.int32, -1),
+        'vin_ids': (numpy.int32, -1),
+        'type_ids': (numpy.int32, -1),
+        'image_ids': (numpy.int32, -1),
+        'timeserver_times': (numpy.float64, numpy.nan),
+        'last_seen_times': (numpy.float64, numpy.nan),
+        'attack_flags': (numpy.bool_, False),
+        'manifest_counts': (numpy.int64, 0)}
+
+    for name, (dtype, fill) in columns.items():
+      new_column = numpy.full(capacity, fill, dtype=dtype)
+      old_column = getattr(self, '_' + name, None)
+      if old_column is not None:
+        new_column[:self.n_rows] = old_column[:self.n_rows]
+      setattr(self, '_' + name, new_column)
+
+    self._capacity = capacity
+
+
+
+
+
+  def __getattr__(self, name):
+    """
+    Expose read-only views of the filled portion of each column, e.g.
+    snapshot.image_ids.
+    """
+    if name in ('ecu_ids', 'vin_ids', 'type_ids', 'image_ids',
+        'timeserver_times', 'last_seen_times', 'attack_flags',
+        'manifest_counts'):
+      column = self.__dict__['_' + name][:self.__dict__['n_rows']]
+      column.flags.writeable = False
+      return column
+    raise AttributeError(name)
+
+
+
+
+
+  def set_ecu_type(self, ecu_serial, ecu_type):
+    """
+    Sets the type of the given ECU, for grouping in aggregates. Takes effect
+    immediately if the ECU is already in the snapshot.
+    """
+    uptane.formats.ECU_SERIAL_SCHEMA.check_match(ecu_serial)
+    uptane.formats.SCHEMA.AnyString().check_match(ecu_type)
+
+    with self._lock:
+      self.ecu_types[ecu_serial] = ecu_type
+      if ecu_serial in self._ecus.ids:
+        self._type_ids[self._ecus.ids[ecu_serial]] = \
+            self._types.intern(ecu_type)
+
+
+
+
+
+  def refresh(self, now=None, full=False):
+    """
+    <Purpose>
+      Brings the snapshot up to date with inventorydb. Only ECUs that are new
+      or that have submitted ECU Manifests since the last refresh are read.
+
+    <Arguments>
+      now (optional)
+        Epoch time to record as the time at which new manifests were observed.
+        Defaults to the current time.
+
+      full (optional)
+        If True, also re-derive the vehicle association of every ECU, not
+        just of new or updated ECUs. This is only needed if ECUs are moved
+        between vehicles without submitting new manifests.
+
+    <Returns>
+      The number of rows added or updated.
+    """
+    if now is None:
+      now = time.time()
+
+    vins_by_ecu = None
+    n_updated = 0
+
+    with self._lock:
+
+      for ecu_serial, manifests in list(inventorydb.ecu_manifests.items()):
+
+        n_manifests = len(manifests)
+
+        # Fast path: a plain dictionary comparison, with no NumPy access, for
+        # the common case of an ECU that has not reported since last time.
+        if self._seen_counts.get(ecu_serial) == n_manifests and not full:
+          continue
+
+        if vins_by_ecu is None:
+          # Map ECU Serial to VIN, once per refresh and only if needed. This is
+          # a flat pass over the registrations, not over manifests.
+          vins_by_ecu = {}
+          for vin, ecu_serials in list(inventorydb.ecus_by_vin.items()):
+            for serial in ecu_serials:
+              vins_by_ecu[serial] = vin
+
+        row = self._ecus.ids.get(ecu_serial)
+
+        if row is None:
+          # New ECU: append a row.
+          if self.n_rows == self._capacity:
+            self._allocate(self._capacity * 2)
+          row = self._ecus.intern(ecu_serial)
+          assert row == self.n_rows, 'Programming error: row mismatch.'
+          self.n_rows += 1
+          self._ecu_ids[row] = row
+          self._type_ids[row] = self._types.intern(
+              self.ecu_types.get(ecu_serial, UNKNOWN_ECU_TYPE))
+
+        vin = vins_by_ecu.get(ecu_serial)
+        self._vin_ids[row] = -1 if vin is None else self._vins.intern(vin)
+
+        if self._seen_counts.get(ecu_serial) != n_manifests:
+          self._seen_counts[ecu_serial] = n_manifests
+          self._manifest_counts[row] = n_manifests
+          if manifests:
+            self._load_manifest(row, manifests[-1]['signed'], now)
+          else:
+            # The ECU was (re-)registered and has no manifests.
+            self._image_ids[row] = -1
+            self._timeserver_times[row] = numpy.nan
+            self._last_seen_times[row] = numpy.nan
+            self._attack_flags[row] = False
+
+        n_updated += 1
+
+      self.last_refresh_time = now
+
+    log.debug('Fleet snapshot refreshed: ' + repr(n_updated) + ' of ' +
+        repr(self.n_rows) + ' ECUs updated.')
+
+    return n_updated
+
+
+
+
+
+  def _load_manifest(self, row, signed_ecu_manifest, now):
+    """
+    Fills in the columns for one row from the 'signed' portion of an ECU
+    Manifest.
+    """
+    installed_image = signed_ecu_manifest['installed_image']
+    hashes = installed_image['fileinfo'].get('hashes', {})
+    image_key = hashes.get('sha256', installed_image['filepath'])
+
+    self._image_ids[row] = self._images.intern(image_key)
+    self._timeserver_times[row] = tuf.formats.datetime_to_unix_timestamp(
+        iso8601.parse_date(signed_ecu_manifest['timeserver_time']))
+    self._last_seen_times[row] = now
+    self._attack_flags[row] = bool(signed_ecu_manifest['attacks_detected'])
+
+
+
+
+
+  def start_periodic_refresh(self, interval):
+    """
+    Starts a daemon thread that calls refresh() every interval seconds, until
+    stop_periodic_refresh() is called.
+    """
+    uptane.formats.SCHEMA.Integer(lo=1).check_match(interval)
+
+    if self._refresh_thread is not None:
+      raise uptane.Error('Periodic refresh is already running.')
+
+    self._stop_refreshing.clear()
+
+    def refresh_loop():
+      while not self._stop_refreshing.is_set():
+        self.refresh()
+        self._stop_refreshing.wait(interval)
+
+    self._refresh_thread = threading.Thread(target=refresh_loop)
+    self._refresh_thread.setDaemon(True)
+    self._refresh_thread.start()
+
+
+
+
+
+  def stop_periodic_refresh(self):
+    if self._refresh_thread is None:
+      return
+    self._stop_refreshing.set()
+    self._refresh_thread.join()
+    self._refresh_thread = None
+
+
+
+
+
+  def image_distribution(self):
+    """
+    Returns the number of ECUs with each installed image, per ECU type:
+      {<ecu type>: {<image hash or filepath>: <count>, ...}, ...}
+    ECUs that have not yet reported are not counted.
+    """
+    with self._lock:
+      reported = self._image_ids[:self.n_rows] != -1
+      type_ids = self._type_ids[:self.n_rows][reported].astype(numpy.int64)
+      image_ids = self._image_ids[:self.n_rows][reported].astype(numpy.int64)
+
+      # Combine the two ids into a single key so that one numpy.unique call
+      # counts every (type, image) pair.
+      n_images = max(len(self._images.values), 1)
+      pairs, counts = numpy.unique(
+          type_ids * n_images + image_ids, return_counts=True)
+
+      distribution = {}
+      for pair, count in zip(pairs.tolist(), counts.tolist()):
+        ecu_type = self._types.lookup(pair // n_images)
+        image = self._images.lookup(pair % n_images)
+        distribution.setdefault(ecu_type, {})[image] = count
+
+    return distribution
+
+
+
+
+
+  def report_ages(self, now=None):
+    """
+    Returns an array of the number of seconds since each ECU's latest manifest
+    was first observed, for ECUs that have reported.
+    """
+    if now is None:
+      now = time.time()
+    with self._lock:
+      last_seen = self._last_seen_times[:self.n_rows]
+      return now - last_seen[~numpy.isnan(last_seen)]
+
+
+
+
+
+  def timeserver_lags(self):
+    """
+    Returns an array of the number of seconds by which the 'timeserver_time'
+    in each ECU's latest manifest lags the time that manifest was first
+    observed, for ECUs that have reported. Large lags suggest ECUs that are
+    unable to obtain fresh time attestations.
+    """
+    with self._lock:
+      lags = (self._last_seen_times[:self.n_rows] -
+          self._timeserver_times[:self.n_rows])
+      return lags[~numpy.isnan(lags)]
+
+
+
+
+
+  def attack_report_rates(self):
+    """
+    Returns the fraction of reporting ECUs whose latest manifest reports an
+    attack, per ECU type: {<ecu type>: <rate>, ...}
+    """
+    with self._lock:
+      reported = self._image_ids[:self.n_rows] != -1
+      type_ids = self._type_ids[:self.n_rows][reported]
+      flags = self._attack_flags[:self.n_rows][reported]
+
+      n_types = len(self._types.values)
+      totals = numpy.bincount(type_ids, minlength=n_types)
+      attacks = numpy.bincount(type_ids, weights=flags, minlength=n_types)
+
+      rates = (attacks / numpy.maximum(totals, 1)).tolist()
+
+      return {self._types.lookup(type_id): rates[type_id]
+          for type_id in numpy.nonzero(totals)[0].tolist()}
+
+
+
+
+
+  def summary(self, now=None, percentiles=(50, 90, 99)):
+    """
+    Returns a dictionary of fleet-wide aggregates suitable for a dashboard:
+      'n_ecus', 'n_reporting_ecus', 'n_vehicles', 'image_distribution',
+      'attack_report_rates', and, for each of 'report_age' and
+      'timeserver_lag', a dictionary mapping each requested percentile to
+      its value in seconds (empty if no ECU has reported).
+    """
+    if now is None:
+      now = time.time()
+
+    ages = self.report_ages(now)
+    lags = self.timeserver_lags()
+
+    def percentile_dict(values):
+      if not len(values):
+        return {}
+      return dict(zip(percentiles,
+          numpy.percentile(values, percentiles).tolist()))
+
+    with self._lock:
+      n_ecus = self.n_rows
+      vin_ids = self._vin_ids[:self.n_rows]
+      n_vehicles = len(numpy.unique(vin_ids[vin_ids != -1]))
+
+    return {
+        'n_ecus': n_ecus,
+        'n_reporting_ecus': len(ages),
+        'n_vehicles': n_vehicles,
+        'image_distribution': self.image_distribution(),
+        'attack_report_rates': self.attack_report_rates(),
+        'report_age': percentile_dict(ages),
+        'timeserver_lag': percentile_dict(lags)}
@@ -110,6 +110,11 @@
     get_last_ecu_manifest(ecu_serial)
     get_all_ecu_manifests_from_vehicle(vin)
 
+  Export Manifests (streaming, for offline analysis):
+    iter_manifests(manifest_type, keys=None, cursor=None)
+    export_manifests(output_fobj, manifest_type, keys=None, cursor=None,
+        encoding='json', index_fobj=None, limit=None)
+
 """
 from __future__ import print_function
 from __future__ import unicode_literals
@@ -117,7 +122,19 @@ from io import open
 
 import uptane # Import before TUF modules; may change tuf.conf values.
 import uptane.formats
+import uptane.encoding.asn1_codec as asn1_codec
 import tuf
+import json
+
+# Types of manifest that can be exported by iter_manifests and
+# export_manifests.
+MANIFEST_TYPE_VEHICLE = 'vehicle'
+MANIFEST_TYPE_ECU = 'ecu'
+
+# Encodings supported by export_manifests: newline-delimited canonical JSON,
+# or concatenated DER records (optionally with a separate index).
+EXPORT_ENCODING_JSON = 'json'
+EXPORT_ENCODING_DER = 'der'
 
 # Global dictionaries
 vehicle_manifests = {}
@@ -393,3 +410,224 @@ def check_ecu_registered(ecu_serial):
   if ecu_serial not in ecu_public_keys:
     raise uptane.UnknownECU('The given ECU serial, ' + repr(ecu_serial) +
         ', is not known.')
+
+
+
+
+
+def _manifest_store_for_type(manifest_type):
+  """
+  Returns the global dictionary holding manifests of the given type, the
+  schema its keys conform to, and the asn1_codec datatype used to encode the
+  manifests as DER.
+  """
+  if manifest_type == MANIFEST_TYPE_VEHICLE:
+    return (vehicle_manifests, uptane.formats.VIN_SCHEMA,
+        asn1_codec.DATATYPE_VEHICLE_MANIFEST)
+  elif manifest_type == MANIFEST_TYPE_ECU:
+    return (ecu_manifests, uptane.formats.ECU_SERIAL_SCHEMA,
+        asn1_codec.DATATYPE_ECU_MANIFEST)
+  else:
+    raise uptane.Error('Unknown manifest type: ' + repr(manifest_type) +
+        '. Expected ' + repr(MANIFEST_TYPE_VEHICLE) + ' or ' +
+        repr(MANIFEST_TYPE_ECU) + '.')
+
+
+
+
+
+def _encode_cursor(key, index):
+  return tuf.formats.encode_canonical([key, index])
+
+
+
+
+
+def _decode_cursor(cursor, key_schema):
+  """
+  Returns the (key, index) pair encoded in a cursor string produced by
+  _encode_cursor, raising tuf.FormatError if the cursor is not valid.
+  """
+  try:
+    key, index = json.loads(cursor)
+  except (TypeError, ValueError):
+    raise tuf.FormatError('Invalid export cursor: ' + repr(cursor))
+
+  key_schema.check_match(key)
+  tuf.formats.LENGTH_SCHEMA.check_match(index)
+
+  return key, index
+
+
+
+
+
+def iter_manifests(manifest_type, keys=None, cursor=None):
+  """
+  <Purpose>
+    Generator yielding every saved manifest of the given type, one at a time,
+    in a stable order (sorted by VIN or ECU Serial, then in the order in
+    which manifests were received). Because manifests are only ever appended
+    to the per-vehicle and per-ECU lists, iteration can be resumed from the
+    cursor yielded with any manifest, picking up immediately after it, even
+    if new manifests have arrived in the meantime.
+
+    No copy of the stored manifests is made, so memory use does not grow with
+    the number of manifests stored.
+
+  <Arguments>
+    manifest_type
+      MANIFEST_TYPE_VEHICLE to iterate over Vehicle Manifests (keyed by VIN),
+      or MANIFEST_TYPE_ECU to iterate over ECU Manifests (keyed by ECU
+      Serial).
+
+    keys (optional)
+      A list of VINs (or ECU Serials, for ECU Manifests) to restrict the
+      export to. If not provided, all known vehicles (or ECUs) are included.
+      Unknown keys are skipped.
+
+    cursor (optional)
+      A cursor previously yielded by this generator. If provided, iteration
+      begins with the manifest following the one the cursor was yielded with.
+
+  <Exceptions>
+    uptane.Error if manifest_type is not a known manifest type
+    tuf.FormatError if keys or cursor are not correctly formatted
+
+  <Returns>
+    A generator of (cursor, key, index, manifest) tuples, where key is the
+    VIN or ECU Serial, index is the position of the manifest in that
+    vehicle's or ECU's list of manifests, and manifest is the stored signable
+    manifest itself.
+  """
+  store, key_schema, _ = _manifest_store_for_type(manifest_type)
+
+  if keys is None:
+    keys = list(store)
+  else:
+    uptane.formats.SCHEMA.ListOf(key_schema).check_match(keys)
+
+  resume_key = None
+  resume_index = -1
+  if cursor is not None:
+    resume_key, resume_index = _decode_cursor(cursor, key_schema)
+
+  # Sorting the keys (not the manifests) fixes the iteration order so that a
+  # cursor remains meaningful across calls.
+  for key in sorted(set(keys)):
+
+    if resume_key is not None and key < resume_key:
+      continue
+
+    # Look the list up again for each key rather than holding references to
+    # all of them, and tolerate keys that have since disappeared.
+    manifests = store.get(key)
+    if manifests is None:
+      continue
+
+    index = resume_index + 1 if key == resume_key else 0
+
+    # The list may grow while we iterate; always check its current length.
+    while index < len(manifests):
+      yield _encode_cursor(key, index), key, index, manifests[index]
+      index += 1
+
+
+
+
+
+def export_manifests(output_fobj, manifest_type, keys=None, cursor=None,
+    encoding=EXPORT_ENCODING_JSON, index_fobj=None, limit=None):
+  """
+  <Purpose>
+    Writes manifests of the given type to a binary file-like object, one
+    record at a time, for offline analysis. See iter_manifests for ordering,
+    filtering, and cursor behavior.
+
+    With encoding EXPORT_ENCODING_JSON, each record is written as one line of
+    canonical JSON (newline-delimited JSON), an object with keys 'cursor',
+    'key', 'index', and 'manifest'.
+
+    With encoding EXPORT_ENCODING_DER, the DER encoding of each manifest is
+    written, back to back. DER is self-delimiting, but to allow random access,
+    if index_fobj is provided, one line of canonical JSON is written to it per
+    record, with keys 'cursor', 'key', 'index', 'offset', and 'length', where
+    offset is the position of the record among the bytes written to
+    output_fobj by this call. (output_fobj need not be seekable: it may be a
+    pipe, for example.)
+
+  <Arguments>
+    output_fobj
+      A file-like object opened for writing bytes.
+
+    manifest_type, keys, cursor
+      See iter_manifests.
+
+    encoding
+      EXPORT_ENCODING_JSON (default) or EXPORT_ENCODING_DER.
+
+    index_fobj (optional)
+      A file-like object opened for writing bytes, to which an index is
+      written. Only used with EXPORT_ENCODING_DER.
+
+    limit (optional)
+      The maximum number of records to write. If not provided, all remaining
+      records are written.
+
+  <Exceptions>
+    uptane.Error
+      if manifest_type or encoding is not supported, or if DER is requested
+      and pyasn1 is not available
+
+    tuf.FormatError if keys, cursor, or limit are not correctly formatted
+
+  <Returns>
+    The cursor of the last record written, which may be passed back to this
+    function to resume the export, or the given cursor if nothing was written.
+  """
+  _, _, datatype = _manifest_store_for_type(manifest_type)
+
+  if encoding not in [EXPORT_ENCODING_JSON, EXPORT_ENCODING_DER]:
+    raise uptane.Error('Unsupported export encoding: ' + repr(encoding))
+
+  if encoding == EXPORT_ENCODING_DER and not asn1_codec.PYASN1_EXISTS:
+    raise uptane.Error('Unable to export manifests as DER: pyasn1 is not '
+        'available.')
+
+  if limit is not None:
+    tuf.formats.LENGTH_SCHEMA.check_match(limit)
+
+  last_cursor = cursor
+  count = 0
+  offset = 0
+
+  for record_cursor, key, index, manifest in iter_manifests(
+      manifest_type, keys, cursor):
+
+    if limit is not None and count >= limit:
+      break
+
+    if encoding == EXPORT_ENCODING_JSON:
+      record = {'cursor': record_cursor, 'key': key, 'index': index,
+          'manifest': manifest}
+      output_fobj.write(
+          (tuf.formats.encode_canonical(record) + '\n').encode('utf-8'))
+
+    else:
+      der_manifest = asn1_codec.convert_signed_metadata_to_der(
+          manifest, datatype)
+      output_fobj.write(der_manifest)
+
+      if index_fobj is not None:
+        index_record = {'cursor': record_cursor, 'key': key, 'index': index,
+            'offset': offset, 'length': len(der_manifest)}
+        index_fobj.write(
+            (tuf.formats.encode_canonical(index_record) + '\n').encode(
+            'utf-8'))
+
+      offset += len(der_manifest)
+
+    last_cursor = record_cursor
+    count += 1
+
+  return last_cursor
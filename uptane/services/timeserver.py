@@ -7,6 +7,16 @@
   Initialized with a key, the Timeserver will, when given a list of nonces,
   return a signed time attestation that includes those nonces.
 
+  Batched mode (get_signed_time_batched and get_signed_time_batched_der):
+  rather than signing a separate attestation for every request, the
+  Timeserver collects requests arriving within a short window (see
+  set_batch_window), builds a Merkle tree whose leaves are the individual
+  attestations (time and nonces) for each request, and signs only the root.
+  Each caller receives the signed root, its own attestation, and a proof of
+  the attestation's inclusion in the tree. Signing cost is thus one signature
+  per window instead of one per request. Primaries and Secondaries accept
+  either kind of attestation.
+
 """
 from __future__ import unicode_literals
 
@@ -16,6 +26,7 @@ import uptane.common
 import uptane.encoding.asn1_codec as asn1_codec
 
 from uptane.encoding.asn1_codec import DATATYPE_TIME_ATTESTATION
+from uptane.encoding.asn1_codec import DATATYPE_BATCHED_TIME_ATTESTATION
 
 import tuf
 PYASN1_EXISTS = False
@@ -27,10 +38,22 @@ else:
  PYASN1_EXISTS = True
 
 import time
+import threading
 #log = uptane.logging.getLogger('timeserver')
 
 timeserver_key = None
 
+# Length of the window, in seconds, over which requests are collected into a
+# single batch in batched mode. The first request in a batch waits this long
+# for others to arrive before the batch is signed.
+DEFAULT_BATCH_WINDOW = 0.05
+batch_window = DEFAULT_BATCH_WINDOW
+
+# The batch currently collecting requests, per metadata format ('json' or
+# 'der'), or None. Guarded by _batch_lock.
+_current_batches = {'json': None, 'der': None}
+_batch_lock = threading.Lock()
+
 
 
 
@@ -109,3 +132,161 @@ def get_signed_time_der(nonces):
 
 
   return der_attestation
+
+
+
+
+
+def set_batch_window(seconds):
+  """
+  Sets the length of the window, in seconds, over which requests are
+  collected into a single batch in batched mode.
+  """
+  global batch_window
+
+  if not isinstance(seconds, (int, float)) or seconds < 0:
+    raise tuf.FormatError('Batch window must be a non-negative number of '
+        'seconds. Received: ' + repr(seconds))
+
+  batch_window = seconds
+
+
+
+
+
+class _Batch(object):
+  """
+  Requests (lists of nonces) collected for a single signature in batched
+  mode, and, once signed, the resulting attestations.
+  """
+  def __init__(self):
+    self.requests = []
+    self.attestations = None
+    self.error = None
+    self.done = threading.Event()
+
+
+
+
+
+def _get_batched_attestation(nonces, metadata_format):
+  """
+  Adds the given nonces to the batch currently collecting requests for the
+  given metadata format (starting a new batch if there is none), waits for
+  that batch to be signed, and returns this request's attestation.
+
+  The request that starts a batch is responsible for closing it after
+  batch_window seconds and signing it. Other requests simply wait.
+  """
+  uptane.formats.NONCE_LIST_SCHEMA.check_match(nonces)
+
+  with _batch_lock:
+    batch = _current_batches[metadata_format]
+    leader = batch is None
+    if leader:
+      batch = _current_batches[metadata_format] = _Batch()
+    index = len(batch.requests)
+    batch.requests.append(nonces)
+
+  if leader:
+    time.sleep(batch_window)
+
+    # Close the batch: later requests will start a new one.
+    with _batch_lock:
+      _current_batches[metadata_format] = None
+
+    try:
+      batch.attestations = _sign_batch(batch.requests, metadata_format)
+    except Exception as e:
+      batch.error = e
+    finally:
+      batch.done.set()
+
+  else:
+    batch.done.wait()
+
+  if batch.error is not None:
+    raise batch.error
+
+  return batch.attestations[index]
+
+
+
+
+
+def _sign_batch(requests, metadata_format):
+  """
+  Produces one batched time attestation per request (list of nonces) in
+  requests, all sharing a single signature over a Merkle root, conforming to
+  uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA, or
+  DER-encoded if metadata_format is 'der'.
+  """
+  # All attestations in a batch share the same time.
+  clock = get_time([])['time']
+  attestations = [{'time': clock, 'nonces': nonces} for nonces in requests]
+
+  merkle_root, proofs = uptane.common.compute_merkle_tree(
+      [uptane.common.get_merkle_leaf_data(attestation, metadata_format)
+      for attestation in attestations])
+
+  signable_root = tuf.formats.make_signable({
+      'time': clock,
+      'number_of_leaves': len(attestations),
+      'merkle_root': merkle_root})
+  uptane.formats.SIGNABLE_MERKLE_TIME_ROOT_SCHEMA.check_match(signable_root)
+
+  # The only signature made for the whole batch. In 'der' mode, this is over
+  # the hash of the DER encoding of the root.
+  uptane.common.sign_signable(
+      signable_root,
+      [timeserver_key],
+      DATATYPE_BATCHED_TIME_ATTESTATION,
+      metadata_format=metadata_format)
+
+  batched_attestations = []
+  for attestation, proof in zip(attestations, proofs):
+    batched_attestation = {
+        'signed': signable_root['signed'],
+        'signatures': signable_root['signatures'],
+        'attestation': attestation,
+        'merkle_proof': proof}
+    uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+        batched_attestation)
+
+    if metadata_format == 'der':
+      # The signature is already over DER, so there is no re-signing here.
+      batched_attestation = asn1_codec.convert_signed_metadata_to_der(
+          batched_attestation, DATATYPE_BATCHED_TIME_ATTESTATION)
+
+    batched_attestations.append(batched_attestation)
+
+  return batched_attestations
+
+
+
+
+
+def get_signed_time_batched(nonces):
+  """
+  Batched-mode equivalent of get_signed_time: returns a batched time
+  attestation (conforming to
+  uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA) that
+  includes the given nonces. Blocks for up to batch_window seconds while
+  other requests are collected into the same batch.
+  """
+  return _get_batched_attestation(nonces, 'json')
+
+
+
+
+
+def get_signed_time_batched_der(nonces):
+  """
+  Same as get_signed_time_batched, but the attestation returned is encoded
+  as DER, and the signature over the Merkle root is over the hash of the DER
+  encoding of the root.
+  """
+  if not PYASN1_EXISTS:
+    raise uptane.Error('This Timeserver does not support DER: pyasn1 is not '
+        'installed.')
+  return _get_batched_attestation(nonces, 'der')